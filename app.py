@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import secrets
 import logging
 from logging.handlers import RotatingFileHandler
@@ -8,12 +8,12 @@ from werkzeug.exceptions import HTTPException
 from flask import Flask, g, session, request, jsonify
 from flask_mail import Mail
 from config import Config
-from models import db, ActiveSession, Perfil
-from sqlalchemy import func
+from models import db
 from rotas import register_blueprints
+from services.cargas import inicializar_cargas_ativas
+from services.sessao_cache import contar_sessoes_ativas, perfil_do_usuario, sessao_valida
 
 mail = Mail()
-SESSION_TIMEOUT = timedelta(hours=2)
 
 
 def _setup_logging(app: Flask) -> None:
@@ -41,6 +41,10 @@ def create_app():
     # Garante que as tabelas existam quando subir sem migrações
     with app.app_context():
         db.create_all()
+        try:
+            inicializar_cargas_ativas()
+        except Exception as exc:
+            print(f"Aviso: nao foi possivel inicializar as cargas ativas: {exc}")
 
 
     @app.errorhandler(Exception)
@@ -59,7 +63,6 @@ def create_app():
     @app.before_request
     def load_current_user():
         g.user = None
-        g.active_sessions_count = 0
         g.user_perfil_id = None
         g.user_nivel = None
         user = session.get("user")
@@ -68,51 +71,25 @@ def create_app():
             session.clear()
             return
 
-        now = datetime.utcnow()
-        cutoff = now - SESSION_TIMEOUT
-        active = ActiveSession.query.filter_by(email=user.get("email")).first()
-
-        if not active or active.session_token != token:
-            session.clear()
-            return
-
-        last_activity = active.last_activity
-        if isinstance(last_activity, str):
-            try:
-                last_activity = datetime.fromisoformat(last_activity)
-            except ValueError:
-                last_activity = None
-
-        if last_activity and last_activity < cutoff:
-            db.session.delete(active)
-            db.session.commit()
+        # Token conferido no banco a cada requisicao; perfil vem de um cache com TTL
+        # (services.sessao_cache) e last_activity e gravado no maximo uma vez por minuto.
+        if not sessao_valida(user.get("email"), token, datetime.utcnow()):
             session.clear()
             return
 
-        active.last_activity = now
-        db.session.commit()
         g.user = user
-        perfil_row = None
-        perfil_id = user.get("perfil_id")
-        if perfil_id:
-            perfil_row = db.session.get(Perfil, perfil_id)
-        if not perfil_row:
-            perfil_nome = (user.get("perfil") or "").strip()
-            if perfil_nome:
-                normalized = func.lower(func.ltrim(func.rtrim(Perfil.nome)))
-                perfil_row = Perfil.query.filter(normalized == perfil_nome.lower()).first()
-                if not perfil_row:
-                    perfil_row = Perfil.query.filter(Perfil.nome.ilike(perfil_nome)).first()
-        if perfil_row and not perfil_id:
+        perfil = perfil_do_usuario(user)
+        if perfil and not user.get("perfil_id"):
             # atualiza sessao com id resolvido
-            user["perfil_id"] = perfil_row.id
+            user["perfil_id"] = perfil[0]
             session["user"] = user
-        if perfil_row:
-            g.user_perfil_id = perfil_row.id
-            g.user_nivel = perfil_row.nivel
-        g.active_sessions_count = ActiveSession.query.filter(
-            ActiveSession.last_activity >= cutoff
-        ).count()
+        if perfil:
+            g.user_perfil_id, g.user_nivel = perfil
+
+    @app.context_processor
+    def sessoes_ativas():
+        # Contagem feita so quando o template usa (cabecalho da pagina inicial).
+        return {"active_sessions_count": contar_sessoes_ativas}
 
     register_blueprints(app)
     return app
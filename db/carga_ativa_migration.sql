@@ -0,0 +1,60 @@
+-- Cargas versionadas: cada upload grava suas linhas com um carga_id novo e a base
+-- passa a ler a carga apontada por carga_ativa (troca atomica, sem UPDATE ativo = 0).
+-- As tabelas cargas/carga_ativa sao criadas pelo db.create_all(); a carga com ativo = 1
+-- de cada base e registrada como carga ativa na subida da aplicacao.
+
+-- MySQL (ped, emp, fip613)
+CREATE TABLE IF NOT EXISTS cargas (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    dataset VARCHAR(30) NOT NULL,
+    upload_id BIGINT NULL,
+    linhas INT NULL,
+    criada_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    publicada_em DATETIME NULL,
+    INDEX idx_cargas_dataset (dataset, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS carga_ativa (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    dataset VARCHAR(30) NOT NULL UNIQUE,
+    carga_id BIGINT NULL,
+    upload_id BIGINT NULL,
+    publicada_em DATETIME NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+ALTER TABLE ped ADD COLUMN carga_id BIGINT NULL AFTER upload_id;
+CREATE INDEX idx_ped_carga_exercicio_chave_norm ON ped (carga_id, exercicio, chave_norm);
+DROP INDEX idx_ped_ativo_exercicio_chave_norm ON ped;
+
+ALTER TABLE emp ADD COLUMN carga_id BIGINT NULL AFTER upload_id;
+CREATE INDEX idx_emp_carga_exercicio_chave_norm ON emp (carga_id, exercicio, chave_norm);
+DROP INDEX idx_emp_ativo_exercicio_chave_norm ON emp;
+
+ALTER TABLE fip613 ADD COLUMN carga_id BIGINT NULL AFTER upload_id;
+CREATE INDEX idx_fip613_carga ON fip613 (carga_id);
+
+-- SQL Server (est_emp, nob, e as demais bases quando DB_ENGINE=mssql)
+CREATE TABLE cargas (
+    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+    dataset VARCHAR(30) NOT NULL,
+    upload_id BIGINT NULL,
+    linhas INT NULL,
+    criada_em DATETIME NOT NULL DEFAULT GETDATE(),
+    publicada_em DATETIME NULL
+);
+CREATE INDEX idx_cargas_dataset ON cargas (dataset, id);
+
+CREATE TABLE carga_ativa (
+    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+    dataset VARCHAR(30) NOT NULL UNIQUE,
+    carga_id BIGINT NULL,
+    upload_id BIGINT NULL,
+    publicada_em DATETIME NULL
+);
+
+ALTER TABLE est_emp ADD carga_id BIGINT NULL;
+CREATE INDEX idx_est_emp_carga_numero_emp ON est_emp (carga_id, numero_emp);
+DROP INDEX idx_est_emp_ativo_numero_emp ON est_emp;
+
+ALTER TABLE nob ADD carga_id BIGINT NULL;
+CREATE INDEX idx_nob_carga ON nob (carga_id);
@@ -0,0 +1,18 @@
+-- Carga delta: hash do conteudo de cada linha e indice pelo numero do documento,
+-- usados para comparar o upload com a carga ativa (ver CARGA_MODO em services/cargas.py).
+-- A primeira carga depois da migracao e completa e ja grava os hashes.
+
+-- MySQL (ped, emp)
+ALTER TABLE ped ADD COLUMN hash_conteudo VARCHAR(40) NULL AFTER carga_id;
+CREATE INDEX idx_ped_carga_numero_ped ON ped (carga_id, numero_ped);
+
+ALTER TABLE emp ADD COLUMN hash_conteudo VARCHAR(40) NULL AFTER carga_id;
+CREATE INDEX idx_emp_carga_numero_emp ON emp (carga_id, numero_emp);
+
+-- SQL Server (est_emp, nob)
+ALTER TABLE est_emp ADD hash_conteudo VARCHAR(40) NULL;
+CREATE INDEX idx_est_emp_carga_numero_est ON est_emp (carga_id, numero_est);
+
+ALTER TABLE nob ADD hash_conteudo VARCHAR(40) NULL;
+CREATE INDEX idx_nob_carga_numero_nob ON nob (carga_id, numero_nob);
+DROP INDEX idx_nob_carga ON nob;
@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS emp_uploads (
 CREATE TABLE IF NOT EXISTS emp (
     id BIGINT AUTO_INCREMENT PRIMARY KEY,
     upload_id BIGINT NULL,
+    carga_id BIGINT NULL,
+    hash_conteudo VARCHAR(40) NULL,
     chave VARCHAR(255),
     chave_planejamento VARCHAR(255),
     regiao VARCHAR(255),
@@ -56,6 +58,9 @@ CREATE TABLE IF NOT EXISTS emp (
     nome_credor VARCHAR(255),
     cpf_cnpj_credor VARCHAR(50),
     categoria_credor VARCHAR(100),
+    chave_norm VARCHAR(255),
+    ug_norm VARCHAR(100),
+    uo_norm VARCHAR(100),
     raw_payload LONGTEXT,
     data_atualizacao DATETIME NULL,
     data_arquivo DATETIME NULL,
@@ -63,5 +68,7 @@ CREATE TABLE IF NOT EXISTS emp (
     ativo TINYINT(1) NOT NULL DEFAULT 1,
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_emp_upload (upload_id),
-    INDEX idx_emp_ativo (ativo)
+    INDEX idx_emp_ativo (ativo),
+    INDEX idx_emp_carga_exercicio_chave_norm (carga_id, exercicio, chave_norm),
+    INDEX idx_emp_carga_numero_emp (carga_id, numero_emp)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -12,6 +12,8 @@ CREATE TABLE est_emp_uploads (
 CREATE TABLE est_emp (
     id BIGINT IDENTITY(1,1) PRIMARY KEY,
     upload_id BIGINT NULL,
+    carga_id BIGINT NULL,
+    hash_conteudo VARCHAR(40) NULL,
     exercicio VARCHAR(50) NULL,
     numero_est VARCHAR(100) NULL,
     numero_emp VARCHAR(100) NULL,
@@ -35,6 +37,8 @@ CREATE TABLE est_emp (
     cpf_cnpj_credor VARCHAR(50) NULL,
     data_emissao DATETIME NULL,
     data_criacao DATETIME NULL,
+    ug_norm VARCHAR(50) NULL,
+    uo_norm VARCHAR(50) NULL,
     raw_payload NVARCHAR(MAX) NULL,
     data_atualizacao DATETIME NULL,
     data_arquivo DATETIME NULL,
@@ -45,3 +49,5 @@ CREATE TABLE est_emp (
 
 CREATE INDEX idx_est_emp_upload ON est_emp (upload_id);
 CREATE INDEX idx_est_emp_ativo ON est_emp (ativo);
+CREATE INDEX idx_est_emp_carga_numero_emp ON est_emp (carga_id, numero_emp);
+CREATE INDEX idx_est_emp_carga_numero_est ON est_emp (carga_id, numero_est);
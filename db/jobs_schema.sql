@@ -0,0 +1,34 @@
+-- Fila duravel dos jobs de upload, consumida pelo servico de jobs (worker.py --servico).
+-- A tabela e criada pelo db.create_all(); o script serve para criar a mao.
+
+-- MySQL
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL,
+    upload_id BIGINT NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendente',
+    tentativas INT NOT NULL DEFAULT 0,
+    proxima_execucao DATETIME NOT NULL,
+    criado_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    iniciado_em DATETIME NULL,
+    finalizado_em DATETIME NULL,
+    worker VARCHAR(100) NULL,
+    erro TEXT NULL,
+    INDEX idx_jobs_estado (estado, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- SQL Server
+CREATE TABLE jobs (
+    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL,
+    upload_id BIGINT NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendente',
+    tentativas INT NOT NULL DEFAULT 0,
+    proxima_execucao DATETIME NOT NULL,
+    criado_em DATETIME NOT NULL DEFAULT GETDATE(),
+    iniciado_em DATETIME NULL,
+    finalizado_em DATETIME NULL,
+    worker VARCHAR(100) NULL,
+    erro VARCHAR(MAX) NULL
+);
+CREATE INDEX idx_jobs_estado ON jobs (estado, id);
@@ -12,6 +12,8 @@ CREATE TABLE nob_uploads (
 CREATE TABLE nob (
     id BIGINT IDENTITY(1,1) PRIMARY KEY,
     upload_id BIGINT NULL,
+    carga_id BIGINT NULL,
+    hash_conteudo VARCHAR(40) NULL,
     exercicio VARCHAR(50) NULL,
     numero_nob VARCHAR(100) NULL,
     numero_nob_estorno VARCHAR(100) NULL,
@@ -55,3 +57,4 @@ CREATE TABLE nob (
 
 CREATE INDEX idx_nob_upload ON nob (upload_id);
 CREATE INDEX idx_nob_ativo ON nob (ativo);
+CREATE INDEX idx_nob_carga_numero_nob ON nob (carga_id, numero_nob);
@@ -0,0 +1,19 @@
+-- Colunas normalizadas (chave/UG/UO) para bases criadas antes delas.
+-- As linhas existentes sao preenchidas pela aplicacao no proximo recalculo do saldo_execucao.
+
+-- MySQL (ped, emp)
+ALTER TABLE ped
+    ADD COLUMN chave_norm VARCHAR(255) NULL,
+    ADD COLUMN ug_norm VARCHAR(100) NULL,
+    ADD COLUMN uo_norm VARCHAR(100) NULL;
+CREATE INDEX idx_ped_ativo_exercicio_chave_norm ON ped (ativo, exercicio, chave_norm);
+
+ALTER TABLE emp
+    ADD COLUMN chave_norm VARCHAR(255) NULL,
+    ADD COLUMN ug_norm VARCHAR(100) NULL,
+    ADD COLUMN uo_norm VARCHAR(100) NULL;
+CREATE INDEX idx_emp_ativo_exercicio_chave_norm ON emp (ativo, exercicio, chave_norm);
+
+-- SQL Server (est_emp)
+ALTER TABLE est_emp ADD ug_norm VARCHAR(50) NULL, uo_norm VARCHAR(50) NULL;
+CREATE INDEX idx_est_emp_ativo_numero_emp ON est_emp (ativo, numero_emp);
@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS ped_uploads (
 CREATE TABLE IF NOT EXISTS ped (
     id BIGINT AUTO_INCREMENT PRIMARY KEY,
     upload_id BIGINT NULL,
+    carga_id BIGINT NULL,
+    hash_conteudo VARCHAR(40) NULL,
     chave VARCHAR(255),
     regiao VARCHAR(255),
     subfuncao_ug VARCHAR(255),
@@ -79,11 +81,16 @@ CREATE TABLE IF NOT EXISTS ped (
     credor VARCHAR(255),
     nome_credor VARCHAR(255),
     chave_planejamento VARCHAR(255),
+    chave_norm VARCHAR(255),
+    ug_norm VARCHAR(100),
+    uo_norm VARCHAR(100),
     data_atualizacao DATETIME NULL,
     data_arquivo DATETIME NULL,
     user_email VARCHAR(255),
     ativo TINYINT(1) NOT NULL DEFAULT 1,
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_ped_upload (upload_id),
-    INDEX idx_ped_ativo (ativo)
+    INDEX idx_ped_ativo (ativo),
+    INDEX idx_ped_carga_exercicio_chave_norm (carga_id, exercicio, chave_norm),
+    INDEX idx_ped_carga_numero_ped (carga_id, numero_ped)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,11 @@
+-- saldo_execucao passa a guardar so o PED; o EMP liquido fica por empenho em saldo_execucao_emp
+-- (criada pela aplicacao, assim como saldo_execucao_controle e saldo_execucao_pendente).
+-- A montagem completa roda no proximo inicio do servico de jobs.
+
+-- MySQL
+ALTER TABLE saldo_execucao DROP COLUMN valor_emp_liquido, DROP COLUMN emp_count;
+DELETE FROM saldo_execucao_controle;
+
+-- SQL Server
+ALTER TABLE saldo_execucao DROP COLUMN valor_emp_liquido, emp_count;
+DELETE FROM saldo_execucao_controle;
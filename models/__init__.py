@@ -19,4 +19,12 @@ from .user import (
     Plan21Nger,
     Adj,
     Dotacao,
+    SaldoExecucao,
+    SaldoExecucaoEmp,
+    SaldoExecucaoControle,
+    SaldoExecucaoPendente,
+    HistoricoChaveCache,
+    Carga,
+    CargaAtiva,
+    Job,
 )
@@ -91,9 +91,11 @@ class Plan20Upload(db.Model):
 
 class Fip613Registro(db.Model):
     __tablename__ = "fip613"
+    __table_args__ = (db.Index("idx_fip613_carga", "carga_id"),)
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
     uo = db.Column(db.String(50))
     ug = db.Column(db.String(50))
     funcao = db.Column(db.String(255))
@@ -142,9 +144,15 @@ class PedUpload(db.Model):
 
 class PedRegistro(db.Model):
     __tablename__ = "ped"
+    __table_args__ = (
+        db.Index("idx_ped_carga_exercicio_chave_norm", "carga_id", "exercicio", "chave_norm"),
+        db.Index("idx_ped_carga_numero_ped", "carga_id", "numero_ped"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
+    hash_conteudo = db.Column(db.String(40), nullable=True)
     chave = db.Column(db.String(255))
     regiao = db.Column(db.String(255))
     subfuncao_ug = db.Column(db.String(255))
@@ -211,6 +219,9 @@ class PedRegistro(db.Model):
     credor = db.Column(db.String(255))
     nome_credor = db.Column(db.String(255))
     chave_planejamento = db.Column(db.String(255))
+    chave_norm = db.Column(db.String(255))
+    ug_norm = db.Column(db.String(100))
+    uo_norm = db.Column(db.String(100))
     data_atualizacao = db.Column(db.DateTime)
     data_arquivo = db.Column(db.DateTime)
     user_email = db.Column(db.String(255))
@@ -232,9 +243,15 @@ class EmpUpload(db.Model):
 
 class EmpRegistro(db.Model):
     __tablename__ = "emp"
+    __table_args__ = (
+        db.Index("idx_emp_carga_exercicio_chave_norm", "carga_id", "exercicio", "chave_norm"),
+        db.Index("idx_emp_carga_numero_emp", "carga_id", "numero_emp"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
+    hash_conteudo = db.Column(db.String(40), nullable=True)
     chave = db.Column(db.String(255))
     chave_planejamento = db.Column(db.String(255))
     regiao = db.Column(db.String(255))
@@ -278,6 +295,9 @@ class EmpRegistro(db.Model):
     nome_credor = db.Column(db.String(255))
     cpf_cnpj_credor = db.Column(db.String(50))
     categoria_credor = db.Column(db.String(100))
+    chave_norm = db.Column(db.String(255))
+    ug_norm = db.Column(db.String(100))
+    uo_norm = db.Column(db.String(100))
     raw_payload = db.Column(db.Text)
     data_atualizacao = db.Column(db.DateTime)
     data_arquivo = db.Column(db.DateTime)
@@ -300,9 +320,15 @@ class EstEmpUpload(db.Model):
 
 class EstEmpRegistro(db.Model):
     __tablename__ = "est_emp"
+    __table_args__ = (
+        db.Index("idx_est_emp_carga_numero_emp", "carga_id", "numero_emp"),
+        db.Index("idx_est_emp_carga_numero_est", "carga_id", "numero_est"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
+    hash_conteudo = db.Column(db.String(40), nullable=True)
     exercicio = db.Column(db.String(50))
     numero_est = db.Column(db.String(100))
     numero_emp = db.Column(db.String(100))
@@ -326,6 +352,8 @@ class EstEmpRegistro(db.Model):
     cpf_cnpj_credor = db.Column(db.String(50))
     data_emissao = db.Column(db.DateTime)
     data_criacao = db.Column(db.DateTime)
+    ug_norm = db.Column(db.String(50))
+    uo_norm = db.Column(db.String(50))
     raw_payload = db.Column(db.Text)
     data_atualizacao = db.Column(db.DateTime)
     data_arquivo = db.Column(db.DateTime)
@@ -348,9 +376,12 @@ class NobUpload(db.Model):
 
 class NobRegistro(db.Model):
     __tablename__ = "nob"
+    __table_args__ = (db.Index("idx_nob_carga_numero_nob", "carga_id", "numero_nob"),)
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
+    hash_conteudo = db.Column(db.String(40), nullable=True)
     exercicio = db.Column(db.String(50))
     numero_nob = db.Column(db.String(100))
     numero_nob_estorno = db.Column(db.String(100))
@@ -443,3 +474,146 @@ class Dotacao(db.Model):
     valor_dotacao = db.Column(db.Numeric(18, 2))
     justificativa_historico = db.Column(db.Text)
     ativo = db.Column(db.Boolean, nullable=False, default=True, server_default=db.text("1"))
+
+
+# Totais de PED pre-agregados por chave (saldo da dotacao).
+class SaldoExecucao(db.Model):
+    __tablename__ = "saldo_execucao"
+    __table_args__ = (
+        db.Index(
+            "idx_saldo_execucao_chave",
+            "exercicio",
+            "chave_norm",
+            "uo",
+            "ug",
+            "paoe",
+            "fonte",
+            "iduso",
+        ),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    exercicio = db.Column(db.String(50), nullable=False)
+    chave_norm = db.Column(db.String(255), nullable=False)
+    uo = db.Column(db.String(100), nullable=False, default="")
+    ug = db.Column(db.String(100), nullable=False, default="")
+    paoe = db.Column(db.String(100), nullable=False, default="")
+    fonte = db.Column(db.String(50), nullable=False, default="")
+    iduso = db.Column(db.String(50), nullable=False, default="")
+    programa = db.Column(db.String(100), nullable=False, default="")
+    regiao = db.Column(db.String(255), nullable=False, default="")
+    valor_ped = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    ped_count = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+# EMP liquido por empenho e chave: um empenho com linhas em mais de uma combinacao de
+# dimensoes aparece em cada uma, e a consulta deduplica por numero_emp.
+class SaldoExecucaoEmp(db.Model):
+    __tablename__ = "saldo_execucao_emp"
+    __table_args__ = (
+        db.Index(
+            "idx_saldo_execucao_emp_chave",
+            "exercicio",
+            "chave_norm",
+            "uo",
+            "ug",
+            "paoe",
+            "fonte",
+            "iduso",
+        ),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    exercicio = db.Column(db.String(50), nullable=False)
+    chave_norm = db.Column(db.String(255), nullable=False)
+    uo = db.Column(db.String(100), nullable=False, default="")
+    ug = db.Column(db.String(100), nullable=False, default="")
+    paoe = db.Column(db.String(100), nullable=False, default="")
+    fonte = db.Column(db.String(50), nullable=False, default="")
+    iduso = db.Column(db.String(50), nullable=False, default="")
+    programa = db.Column(db.String(100), nullable=False, default="")
+    regiao = db.Column(db.String(255), nullable=False, default="")
+    numero_emp = db.Column(db.String(100), nullable=False)
+    valor_emp_liquido = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+# Linha de controle do recalculo de saldo_execucao: o UPDATE nela serializa os recalculos;
+# concluido_em fica vazio ate a primeira montagem completa.
+class SaldoExecucaoControle(db.Model):
+    __tablename__ = "saldo_execucao_controle"
+
+    chave = db.Column(db.String(50), primary_key=True)
+    origem = db.Column(db.String(50))
+    iniciado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+
+
+# Fatias (exercicio, chave_norm) de documentos removidos por cargas em delta, gravadas na
+# transacao da carga; o proximo recalculo do saldo refaz essas fatias e apaga as linhas.
+class SaldoExecucaoPendente(db.Model):
+    __tablename__ = "saldo_execucao_pendente"
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    exercicio = db.Column(db.String(50), nullable=False)
+    chave_norm = db.Column(db.String(255), nullable=False)
+    criado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+# Cache persistente historico -> chave (classificacao de PED/EMP), com descarte LRU por usado_em.
+class HistoricoChaveCache(db.Model):
+    __tablename__ = "historico_chave_cache"
+    __table_args__ = (
+        db.UniqueConstraint("origem", "versao", "historico_hash", name="uq_historico_chave_cache"),
+        db.Index("idx_historico_chave_cache_usado", "usado_em"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    origem = db.Column(db.String(20), nullable=False)
+    versao = db.Column(db.String(64), nullable=False)
+    historico_hash = db.Column(db.String(64), nullable=False)
+    chave = db.Column(db.String(500), nullable=False)
+    usado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+# Cada carga de uma base (fip613, ped, emp, est_emp, nob); as linhas gravadas levam o carga_id.
+class Carga(db.Model):
+    __tablename__ = "cargas"
+    __table_args__ = (db.Index("idx_cargas_dataset", "dataset", "id"),)
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    dataset = db.Column(db.String(30), nullable=False)
+    upload_id = db.Column(db.BigInteger, nullable=True)
+    linhas = db.Column(db.Integer, nullable=True)
+    criada_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    publicada_em = db.Column(db.DateTime, nullable=True)
+
+
+# Ponteiro da carga visivel por base; publicar uma carga e um UPDATE nesta linha.
+class CargaAtiva(db.Model):
+    __tablename__ = "carga_ativa"
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    dataset = db.Column(db.String(30), nullable=False, unique=True)
+    carga_id = db.Column(db.BigInteger, nullable=True)
+    upload_id = db.Column(db.BigInteger, nullable=True)
+    publicada_em = db.Column(db.DateTime, nullable=True)
+
+
+# Fila duravel dos jobs de upload; o servico de jobs (worker.py --servico) consome em ordem.
+class Job(db.Model):
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("idx_jobs_estado", "estado", "id"),)
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)
+    upload_id = db.Column(db.BigInteger, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default="pendente")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_execucao = db.Column(db.DateTime, nullable=False)
+    criado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    iniciado_em = db.Column(db.DateTime, nullable=True)
+    finalizado_em = db.Column(db.DateTime, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    erro = db.Column(db.Text, nullable=True)
@@ -0,0 +1,105 @@
+const crypto = require("crypto");
+const fs = require("fs");
+const sql = require("mssql");
+const { bulkInsert } = require("./db");
+
+// Espelho de services/cache_chaves.py (tabela historico_chave_cache).
+const CACHE_MAX_ENTRADAS = 200000;
+const LOTE_CONSULTA = 1000;
+const VERSAO_REGRA = "1";
+const CACHE_COLS = ["origem", "versao", "historico_hash", "chave", "usado_em"];
+
+function sha256(data) {
+  return crypto.createHash("sha256").update(data);
+}
+
+function versaoClassificador(origem, arquivos, ...extras) {
+  const h = sha256(`${origem}:${VERSAO_REGRA}`);
+  for (const extra of extras) h.update(`|${extra}`);
+  for (const arquivo of arquivos) {
+    let conteudo;
+    try {
+      conteudo = fs.readFileSync(arquivo);
+    } catch {
+      conteudo = Buffer.alloc(0);
+    }
+    h.update("|");
+    h.update(sha256(conteudo).digest());
+  }
+  return h.digest("hex");
+}
+
+function hashHistorico(texto) {
+  return sha256(Buffer.from(texto, "utf8")).digest("hex");
+}
+
+async function carregarCache(pool, origem, versao, hashes) {
+  const encontrados = new Map();
+  for (let i = 0; i < hashes.length; i += LOTE_CONSULTA) {
+    const lote = hashes.slice(i, i + LOTE_CONSULTA);
+    const request = pool.request();
+    request.input("origem", sql.VarChar(20), origem);
+    request.input("versao", sql.VarChar(64), versao);
+    lote.forEach((h, idx) => request.input(`h${idx}`, sql.VarChar(64), h));
+    const result = await request.query(`
+      SELECT historico_hash, chave
+      FROM historico_chave_cache
+      WHERE origem = @origem AND versao = @versao
+        AND historico_hash IN (${lote.map((_, idx) => `@h${idx}`).join(",")})
+    `);
+    for (const row of result.recordset) encontrados.set(row.historico_hash, row.chave);
+  }
+  return encontrados;
+}
+
+async function descartarAntigos(pool, origem, versao) {
+  await pool
+    .request()
+    .input("origem", sql.VarChar(20), origem)
+    .input("versao", sql.VarChar(64), versao)
+    .query("DELETE FROM historico_chave_cache WHERE origem = @origem AND versao <> @versao");
+  const corte = await pool
+    .request()
+    .input("max", sql.Int, CACHE_MAX_ENTRADAS)
+    .query(
+      "SELECT usado_em FROM historico_chave_cache ORDER BY usado_em DESC OFFSET @max ROWS FETCH NEXT 1 ROWS ONLY"
+    );
+  if (corte.recordset.length) {
+    await pool
+      .request()
+      .input("corte", sql.DateTime, corte.recordset[0].usado_em)
+      .query("DELETE FROM historico_chave_cache WHERE usado_em < @corte");
+  }
+}
+
+async function gravarCache(pool, origem, versao, novos, usados) {
+  const agora = new Date();
+  for (let i = 0; i < usados.length; i += LOTE_CONSULTA) {
+    const lote = usados.slice(i, i + LOTE_CONSULTA);
+    const request = pool.request();
+    request.input("agora", sql.DateTime, agora);
+    request.input("origem", sql.VarChar(20), origem);
+    request.input("versao", sql.VarChar(64), versao);
+    lote.forEach((h, idx) => request.input(`h${idx}`, sql.VarChar(64), h));
+    await request.query(`
+      UPDATE historico_chave_cache SET usado_em = @agora
+      WHERE origem = @origem AND versao = @versao
+        AND historico_hash IN (${lote.map((_, idx) => `@h${idx}`).join(",")})
+    `);
+  }
+  const registros = [];
+  for (const [historicoHash, chave] of novos) {
+    registros.push({ origem, versao, historico_hash: historicoHash, chave, usado_em: agora });
+  }
+  for (let i = 0; i < registros.length; i += LOTE_CONSULTA) {
+    await bulkInsert(pool, "historico_chave_cache", CACHE_COLS, registros.slice(i, i + LOTE_CONSULTA));
+  }
+  await descartarAntigos(pool, origem, versao);
+}
+
+module.exports = {
+  versaoClassificador,
+  hashHistorico,
+  carregarCache,
+  gravarCache,
+};
@@ -1,4 +1,5 @@
 ﻿const sql = require("mssql");
+const crypto = require("crypto");
 const path = require("path");
 const dotenv = require("dotenv");
 
@@ -40,13 +41,37 @@ function buildMssqlConfig() {
   };
 }
 
+// No servidor persistente (server.js) o pool fica aberto entre os jobs.
+let manterPool = false;
+let poolCompartilhado = null;
+
+function manterConexao() {
+  manterPool = true;
+}
+
 async function connect() {
+  if (manterPool && poolCompartilhado && poolCompartilhado.connected) {
+    return poolCompartilhado;
+  }
   loadEnv();
   const config = buildMssqlConfig();
   const pool = await sql.connect(config);
+  if (manterPool) poolCompartilhado = pool;
   return pool;
 }
 
+async function liberarConexao(pool) {
+  if (manterPool && pool === poolCompartilhado) return;
+  await pool.close();
+}
+
+async function encerrarConexao() {
+  if (!poolCompartilhado) return;
+  const pool = poolCompartilhado;
+  poolCompartilhado = null;
+  await pool.close();
+}
+
 function mapSqlType(column) {
   const type = String(column.data_type || "").toLowerCase();
   const charLen = column.character_maximum_length;
@@ -158,7 +183,193 @@ async function bulkInsert(pool, tableName, columns, rows) {
   await pool.request().bulk(table);
 }
 
+// Cada carga grava com um carga_id novo; as linhas so aparecem quando publicarCarga
+// aponta carga_ativa para ela (ver services/cargas.py).
+async function novaCarga(pool, dataset, uploadId) {
+  const result = await pool
+    .request()
+    .input("dataset", sql.VarChar(30), dataset)
+    .input("uploadId", sql.BigInt, uploadId)
+    .query(
+      "INSERT INTO cargas (dataset, upload_id, criada_em) OUTPUT INSERTED.id VALUES (@dataset, @uploadId, GETUTCDATE())"
+    );
+  return Number(result.recordset[0].id);
+}
+
+async function publicarCarga(pool, dataset, cargaId, uploadId, linhas) {
+  await pool
+    .request()
+    .input("dataset", sql.VarChar(30), dataset)
+    .input("cargaId", sql.BigInt, cargaId)
+    .input("uploadId", sql.BigInt, uploadId)
+    .input("linhas", sql.Int, linhas)
+    .query(`
+      SET XACT_ABORT ON;
+      BEGIN TRAN;
+      UPDATE carga_ativa SET carga_id = @cargaId, upload_id = @uploadId, publicada_em = GETUTCDATE()
+        WHERE dataset = @dataset;
+      IF @@ROWCOUNT = 0
+        INSERT INTO carga_ativa (dataset, carga_id, upload_id, publicada_em)
+        VALUES (@dataset, @cargaId, @uploadId, GETUTCDATE());
+      UPDATE cargas SET publicada_em = GETUTCDATE(), linhas = @linhas WHERE id = @cargaId;
+      COMMIT;
+    `);
+}
+
+// Modo das cargas com numero de documento (ver CARGA_MODO em services/cargas.py).
+const CHAVES_DOCUMENTO = { emp: "numero_emp", nob: "numero_nob" };
+const FORA_DO_HASH = new Set([
+  "upload_id",
+  "carga_id",
+  "hash_conteudo",
+  "data_atualizacao",
+  "data_arquivo",
+  "user_email",
+  "raw_payload",
+  "ativo",
+]);
+const LOTE_DOCUMENTOS = 500;
+
+function modoCarga() {
+  return String(process.env.CARGA_MODO || "delta").trim().toLowerCase();
+}
+
+function textoHash(value) {
+  if (value === null || value === undefined) return "";
+  if (typeof value === "number" && Number.isNaN(value)) return "";
+  if (value instanceof Date) return value.toISOString();
+  return String(value);
+}
+
+function documento(value) {
+  return value === null || value === undefined ? "" : String(value);
+}
+
+function marcarHashes(registros, columns) {
+  const campos = columns.filter((col) => !FORA_DO_HASH.has(col));
+  for (const registro of registros) {
+    const conteudo = campos.map((col) => textoHash(registro[col])).join("\x1f");
+    registro.hash_conteudo = crypto.createHash("sha1").update(conteudo, "utf8").digest("hex");
+  }
+}
+
+function assinaturas(pares) {
+  // Um documento pode ter varias linhas: a assinatura e o conjunto ordenado dos hashes.
+  const porDocumento = new Map();
+  for (const [doc, hash] of pares) {
+    if (!porDocumento.has(doc)) porDocumento.set(doc, []);
+    porDocumento.get(doc).push(hash);
+  }
+  const resultado = new Map();
+  for (const [doc, hashes] of porDocumento) resultado.set(doc, hashes.sort().join(""));
+  return resultado;
+}
+
+async function cargaParaDelta(pool, dataset) {
+  // Sem carga ativa, ou com linhas gravadas antes do hash, a carga precisa ser completa.
+  const chave = CHAVES_DOCUMENTO[dataset];
+  if (modoCarga() !== "delta" || !chave) return null;
+  const ativa = await pool
+    .request()
+    .input("dataset", sql.VarChar(30), dataset)
+    .query("SELECT carga_id FROM carga_ativa WHERE dataset = @dataset");
+  const cargaId = ativa.recordset.length ? ativa.recordset[0].carga_id : null;
+  if (cargaId === null || cargaId === undefined) return null;
+  const linhas = await pool
+    .request()
+    .input("cargaId", sql.BigInt, cargaId)
+    .query(`SELECT ${chave} AS documento, hash_conteudo FROM ${dataset} WHERE carga_id = @cargaId`);
+  if (linhas.recordset.some((row) => row.hash_conteudo === null)) return null;
+  return {
+    cargaId: Number(cargaId),
+    existentes: assinaturas(linhas.recordset.map((row) => [documento(row.documento), row.hash_conteudo])),
+  };
+}
+
+// Bases que alimentam o saldo_execucao (espelho de _FATIAS_SALDO em services/cargas.py): as fatias
+// dos documentos removidos vao para saldo_execucao_pendente antes da remocao, na mesma transacao.
+const BASES_SALDO = new Set(["emp"]);
+
+async function removerOnde(transaction, dataset, cargaId, condicao, trecho = []) {
+  const preparar = () => {
+    const request = transaction.request().input("cargaId", sql.BigInt, cargaId);
+    trecho.forEach((doc, idx) => request.input(`d${idx}`, sql.VarChar(100), doc));
+    return request;
+  };
+  const onde = `carga_id = @cargaId AND ${condicao}`;
+  if (BASES_SALDO.has(dataset)) {
+    await preparar().query(
+      `INSERT INTO saldo_execucao_pendente (exercicio, chave_norm, criado_em)
+       SELECT DISTINCT COALESCE(exercicio, ''), chave_norm, GETUTCDATE() FROM ${dataset}
+       WHERE chave_norm <> '' AND ${onde}`
+    );
+  }
+  await preparar().query(`DELETE FROM ${dataset} WHERE ${onde}`);
+}
+
+async function removerDocumentos(transaction, dataset, cargaId, documentos) {
+  const chave = CHAVES_DOCUMENTO[dataset];
+  if (documentos.includes("")) {
+    await removerOnde(transaction, dataset, cargaId, `(${chave} IS NULL OR ${chave} = '')`);
+  }
+  const numeros = documentos.filter((doc) => doc);
+  for (let inicio = 0; inicio < numeros.length; inicio += LOTE_DOCUMENTOS) {
+    const trecho = numeros.slice(inicio, inicio + LOTE_DOCUMENTOS);
+    const marcadores = trecho.map((_, idx) => `@d${idx}`).join(", ");
+    await removerOnde(transaction, dataset, cargaId, `${chave} IN (${marcadores})`, trecho);
+  }
+}
+
+// Aplica o arquivo sobre a carga ativa em uma transacao: insere os documentos novos,
+// regrava os alterados, remove os que sumiram e nao toca nos inalterados.
+async function carregarDelta(pool, dataset, columns, registros, atual, uploadId, batchSize) {
+  const chave = CHAVES_DOCUMENTO[dataset];
+  const { cargaId, existentes } = atual;
+  const recebidos = assinaturas(registros.map((r) => [documento(r[chave]), r.hash_conteudo]));
+  const novos = [];
+  const alterados = [];
+  for (const [doc, assinatura] of recebidos) {
+    if (!existentes.has(doc)) novos.push(doc);
+    else if (existentes.get(doc) !== assinatura) alterados.push(doc);
+  }
+  const removidos = [...existentes.keys()].filter((doc) => !recebidos.has(doc));
+  const gravar = new Set([...novos, ...alterados]);
+  const linhas = registros.filter((r) => gravar.has(documento(r[chave])));
+  for (const registro of linhas) registro.carga_id = cargaId;
+
+  const transaction = new sql.Transaction(pool);
+  await transaction.begin();
+  try {
+    await removerDocumentos(transaction, dataset, cargaId, [...alterados, ...removidos]);
+    for (let inicio = 0; inicio < linhas.length; inicio += batchSize) {
+      await bulkInsert(transaction, dataset, columns, linhas.slice(inicio, inicio + batchSize));
+    }
+    await publicarCarga(transaction, dataset, cargaId, uploadId, registros.length);
+    await transaction.commit();
+  } catch (err) {
+    await transaction.rollback();
+    throw err;
+  }
+  return {
+    modo: "delta",
+    carga_id: cargaId,
+    linhas: linhas.length,
+    novos: novos.length,
+    alterados: alterados.length,
+    removidos: removidos.length,
+    inalterados: recebidos.size - novos.length - alterados.length,
+  };
+}
+
 module.exports = {
   connect,
+  manterConexao,
+  liberarConexao,
+  encerrarConexao,
   bulkInsert,
+  novaCarga,
+  publicarCarga,
+  marcarHashes,
+  cargaParaDelta,
+  carregarDelta,
 };
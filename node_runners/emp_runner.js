@@ -1,7 +1,8 @@
 ﻿
 const path = require("path");
 const ExcelJS = require("exceljs");
-const { connect, bulkInsert } = require("./db");
+const { connect, liberarConexao, bulkInsert, novaCarga, publicarCarga, marcarHashes, cargaParaDelta, carregarDelta } = require("./db");
+const { versaoClassificador, hashHistorico, carregarCache, gravarCache } = require("./cache_chaves");
 const {
   ensureDir,
   readJsonWithBom,
@@ -11,6 +12,10 @@ const {
   normalizeForComparison,
   cleanForEmpSheet,
   canonicalizarChave,
+  normalizarChave,
+  normalizarUo,
+  ugDeSubfuncao,
+  campoChave,
   parseValorDb,
   parseDataDb,
   parseAno,
@@ -322,6 +327,8 @@ const CORRECOES_FORCAR = {
 
 const INSERT_COLS = [
   "upload_id",
+  "carga_id",
+  "hash_conteudo",
   "chave",
   "chave_planejamento",
   "regiao",
@@ -365,6 +372,9 @@ const INSERT_COLS = [
   "nome_credor",
   "cpf_cnpj_credor",
   "categoria_credor",
+  "chave_norm",
+  "ug_norm",
+  "uo_norm",
   "raw_payload",
   "data_atualizacao",
   "data_arquivo",
@@ -571,7 +581,18 @@ function extrairChaveValidaDoHistorico(hist, chaves) {
   return null;
 }
 
-function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath, keyColName, partesChave) {
+function limparHistoricoBusca(hist) {
+  let histLimpo = String(hist).trim();
+  histLimpo = histLimpo.replace(/\*/g, " * ");
+  histLimpo = histLimpo.replace(/\s+\*\s+/g, " * ");
+  histLimpo = histLimpo.replace(/\s+/g, " ").trim();
+  histLimpo = corrigirTermosCorrompidos(histLimpo);
+  if (!histLimpo.startsWith("*")) histLimpo = `* ${histLimpo}`;
+  if (!histLimpo.endsWith("*")) histLimpo = `${histLimpo} *`;
+  return histLimpo.replace(/\s*\*\s*/g, " * ");
+}
+
+function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath, keyColName, partesChave, cache = null) {
   const casosEspecificos = carregarCasosEspecificos(jsonCasosPath);
   const chavesNorm = chavesPlanejamento.map((c) => canonicalizarChave(c));
   const chavesSet = new Set(chavesNorm);
@@ -594,28 +615,32 @@ function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath
       resultados.push("NÃO IDENTIFICADO");
       continue;
     }
-    let histLimpo = String(hist).trim();
-    histLimpo = histLimpo.replace(/\*/g, " * ");
-    histLimpo = histLimpo.replace(/\s+\*\s+/g, " * ");
-    histLimpo = histLimpo.replace(/\s+/g, " ").trim();
-    histLimpo = corrigirTermosCorrompidos(histLimpo);
-    if (!histLimpo.startsWith("*")) histLimpo = `* ${histLimpo}`;
-    if (!histLimpo.endsWith("*")) histLimpo = `${histLimpo} *`;
-    histLimpo = histLimpo.replace(/\s*\*\s*/g, " * ");
+    const histLimpo = limparHistoricoBusca(hist);
+    let historicoHash = null;
+    if (cache) {
+      historicoHash = hashHistorico(histLimpo);
+      if (cache.conhecidos.has(historicoHash)) {
+        cache.usados.add(historicoHash);
+        resultados.push(cache.conhecidos.get(historicoHash));
+        continue;
+      }
+      if (cache.novos.has(historicoHash)) {
+        resultados.push(cache.novos.get(historicoHash));
+        continue;
+      }
+    }
+    const chave = classificarHistorico(histLimpo);
+    if (cache) cache.novos.set(historicoHash, chave);
+    resultados.push(chave);
+  }
 
+  function classificarHistorico(histLimpo) {
     const histPipe = paraPipe(histLimpo);
     const histPipeComp = normalizeForComparison(histPipe);
 
     const chaveDireta = extrairChaveValidaDoHistorico(histLimpo, chavesNorm);
-    if (chaveDireta) {
-      resultados.push(canonicalizarChave(chaveDireta));
-      continue;
-    }
-    if (chavesPipeSet.has(histPipe)) {
-      const chaveStar = canonicalizarChave(histPipe.replace(/\|/g, "*"));
-      resultados.push(chaveStar);
-      continue;
-    }
+    if (chaveDireta) return canonicalizarChave(chaveDireta);
+    if (chavesPipeSet.has(histPipe)) return canonicalizarChave(histPipe.replace(/\|/g, "*"));
 
     let casoEncontrado = null;
     const histComp = normalizeForComparison(histLimpo);
@@ -625,10 +650,7 @@ function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath
         break;
       }
     }
-    if (casoEncontrado) {
-      resultados.push(canonicalizarChave(casoEncontrado));
-      continue;
-    }
+    if (casoEncontrado) return canonicalizarChave(casoEncontrado);
 
     const partes = histLimpo.split("*").map((p) => p.trim()).filter(Boolean);
     let chaveJanela = "NÃO IDENTIFICADO";
@@ -647,7 +669,7 @@ function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath
         }
       }
     }
-    resultados.push(chaveJanela === "NÃO IDENTIFICADO" ? chaveJanela : canonicalizarChave(chaveJanela));
+    return chaveJanela === "NÃO IDENTIFICADO" ? chaveJanela : canonicalizarChave(chaveJanela);
   }
 
   dataset.columns = [keyColName, ...dataset.columns];
@@ -663,6 +685,40 @@ function identificarChavePlanejamento(dataset, chavesPlanejamento, jsonCasosPath
   return dataset;
 }
 
+async function prepararCacheChaves(pool, dataset, partesChave) {
+  const versao = versaoClassificador(
+    "emp",
+    [JSON_CHAVES_PATH, JSON_CASOS_PATH, JSON_FORCAR_PATH],
+    partesChave
+  );
+  const hashes = new Set();
+  for (const row of dataset.rows) {
+    const hist = row["Hist\u00f3rico"] || "";
+    if (hist !== "NÃO INFORMADO") hashes.add(hashHistorico(limparHistoricoBusca(hist)));
+  }
+  let conhecidos = new Map();
+  try {
+    conhecidos = await carregarCache(pool, "emp", versao, Array.from(hashes));
+  } catch (err) {
+    console.error(`Aviso: cache de chaves indisponivel: ${err.message || err}`);
+  }
+  return { versao, conhecidos, usados: new Set(), novos: new Map() };
+}
+
+async function finalizarCacheChaves(pool, cache, linhas) {
+  try {
+    await gravarCache(pool, "emp", cache.versao, cache.novos, Array.from(cache.usados));
+  } catch (err) {
+    console.error(`Aviso: nao foi possivel gravar o cache de chaves: ${err.message || err}`);
+  }
+  return {
+    linhas,
+    distintos: cache.usados.size + cache.novos.size,
+    hits: cache.usados.size,
+    misses: cache.novos.size,
+  };
+}
+
 function forcarChavesManualmente(dataset, keyColName) {
   const substituicoes = carregarForcarChaves(JSON_FORCAR_PATH);
   if (!Object.keys(substituicoes).length) return dataset;
@@ -938,6 +994,9 @@ function montarRegistrosParaDb(dataset, dataArquivo, userEmail, uploadId) {
       payload.chave_planejamento = payload.chave_planejamento || payload.chave || null;
       payload.chave = null;
     }
+    payload.chave_norm = normalizarChave(payload[campoChave(payload.exercicio)]);
+    payload.ug_norm = ugDeSubfuncao(payload.subfuncao_ug);
+    payload.uo_norm = normalizarUo(payload.uo);
 
     for (const col of ["valor_emp", "devolucao_gcv", "valor_emp_devolucao_gcv"]) {
       if (col in payload) payload[col] = parseValorDb(payload[col]);
@@ -1040,7 +1099,11 @@ async function processEmp(filePath, dataArquivo, userEmail, uploadId) {
   const planejamentoAtivo = !novaChave;
 
   const chavesPlanejamento = carregarChavesPlanejamento(JSON_CHAVES_PATH);
-  df = identificarChavePlanejamento(df, chavesPlanejamento, JSON_CASOS_PATH, keyColName, partesChave);
+  const pool = await connect();
+  const cacheChaves = await prepararCacheChaves(pool, df, partesChave);
+  df = identificarChavePlanejamento(df, chavesPlanejamento, JSON_CASOS_PATH, keyColName, partesChave, cacheChaves);
+  const estatisticasCache = await finalizarCacheChaves(pool, cacheChaves, df.rows.length);
+  if (estatisticasCache) updateStatusFields("emp", uploadId, { cache_chaves: estatisticasCache });
   df = forcarChavesManualmente(df, keyColName);
 
   df = adicionarNovasColunas(df, keyColName, planejamentoAtivo);
@@ -1086,10 +1149,25 @@ async function processEmp(filePath, dataArquivo, userEmail, uploadId) {
 
   await workbook.commit();
 
-  const pool = await connect();
-  await pool.request().query("UPDATE emp SET ativo = 0 WHERE ativo = 1");
-
   const registros = montarRegistrosParaDb(dfSaida, dataArquivo, userEmail, uploadId);
+  marcarHashes(registros, INSERT_COLS);
+  const atual = await cargaParaDelta(pool, "emp");
+  if (atual) {
+    if (readCancelFlag("emp", uploadId)) {
+      throw new Error("PROCESSAMENTO_CANCELADO");
+    }
+    const carga = await carregarDelta(pool, "emp", INSERT_COLS, registros, atual, uploadId, BATCH_SIZE);
+    updateStatusFields("emp", uploadId, {
+      progress: 100,
+      message: `Delta gravado: ${carga.novos} novos, ${carga.alterados} alterados, ${carga.removidos} removidos, ${carga.inalterados} inalterados.`,
+      carga,
+    });
+    await liberarConexao(pool);
+    return { total: registros.length, outputPath: outputFile, cacheChaves: estatisticasCache };
+  }
+
+  const cargaId = await novaCarga(pool, "emp", uploadId);
+  for (const registro of registros) registro.carga_id = cargaId;
   let total = 0;
   const batch = [];
   for (const registro of registros) {
@@ -1115,10 +1193,12 @@ async function processEmp(filePath, dataArquivo, userEmail, uploadId) {
       message: `Gravando registros no banco (${total}/${registros.length}).`,
     });
   }
+  await publicarCarga(pool, "emp", cargaId, uploadId, total);
+  updateStatusFields("emp", uploadId, { carga: { modo: "completa", carga_id: cargaId, linhas: total } });
 
-  await pool.close();
+  await liberarConexao(pool);
 
-  return { total, outputPath: outputFile };
+  return { total, outputPath: outputFile, cacheChaves: estatisticasCache };
 }
 
 module.exports = {
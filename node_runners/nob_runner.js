@@ -1,7 +1,7 @@
 ﻿const path = require("path");
 const fs = require("fs");
 const ExcelJS = require("exceljs");
-const { connect, bulkInsert } = require("./db");
+const { connect, liberarConexao, bulkInsert, novaCarga, publicarCarga, marcarHashes, cargaParaDelta, carregarDelta } = require("./db");
 const {
   ensureDir,
   cleanHistorico,
@@ -275,6 +275,8 @@ const COL_MAP = {
 
 const INSERT_COLS = [
   "upload_id",
+  "carga_id",
+  "hash_conteudo",
   "exercicio",
   "numero_nob",
   "numero_nob_estorno",
@@ -499,7 +501,7 @@ function addIduso(row) {
   row["Iduso"] = parts.length > 9 ? parts[9] : "NÃO INFORMADO";
 }
 
-function buildDbPayload(row, uploadId, dataArquivo, userEmail) {
+function buildDbPayload(row, uploadId, cargaId, dataArquivo, userEmail) {
   const payload = {};
   for (const [col, val] of Object.entries(row)) {
     const key = normalizeColName(col);
@@ -517,6 +519,7 @@ function buildDbPayload(row, uploadId, dataArquivo, userEmail) {
 
   payload.raw_payload = JSON.stringify(row);
   payload.upload_id = uploadId;
+  payload.carga_id = cargaId;
   payload.data_atualizacao = new Date();
   payload.data_arquivo = dataArquivo || null;
   payload.user_email = userEmail;
@@ -617,7 +620,10 @@ async function processNob(filePath, dataArquivo, userEmail, uploadId) {
   const sheet = workbook.addWorksheet("nob_tratado");
 
   const pool = await connect();
-  await pool.request().query("UPDATE nob SET ativo = 0 WHERE ativo = 1");
+  // No delta as linhas ficam em memoria ate o fim da leitura; na carga completa vao em lotes.
+  const atual = await cargaParaDelta(pool, "nob");
+  const cargaId = atual ? atual.cargaId : await novaCarga(pool, "nob", uploadId);
+  const registrosDelta = [];
 
   const batch = [];
   let totalInserted = 0;
@@ -737,7 +743,12 @@ async function processNob(filePath, dataArquivo, userEmail, uploadId) {
     const outputRow = outputColumns.map((col) => (col in record ? record[col] : "NÃO INFORMADO"));
     sheet.addRow(outputRow).commit();
 
-    const payload = buildDbPayload(record, uploadId, dataArquivo, userEmail);
+    const payload = buildDbPayload(record, uploadId, cargaId, dataArquivo, userEmail);
+    marcarHashes([payload], INSERT_COLS);
+    if (atual) {
+      registrosDelta.push(payload);
+      return;
+    }
     batch.push(payload);
 
     if (batch.length >= BATCH_SIZE) {
@@ -797,9 +808,24 @@ async function processNob(filePath, dataArquivo, userEmail, uploadId) {
       message: `Gravando registros no banco (${totalInserted}).`,
     });
   }
+  if (atual) {
+    if (readCancelFlag("nob", uploadId)) {
+      throw new Error("PROCESSAMENTO_CANCELADO");
+    }
+    const carga = await carregarDelta(pool, "nob", INSERT_COLS, registrosDelta, atual, uploadId, BATCH_SIZE);
+    totalInserted = registrosDelta.length;
+    updateStatusFields("nob", uploadId, {
+      progress: 100,
+      message: `Delta gravado: ${carga.novos} novos, ${carga.alterados} alterados, ${carga.removidos} removidos, ${carga.inalterados} inalterados.`,
+      carga,
+    });
+  } else {
+    await publicarCarga(pool, "nob", cargaId, uploadId, totalInserted);
+    updateStatusFields("nob", uploadId, { carga: { modo: "completa", carga_id: cargaId, linhas: totalInserted } });
+  }
 
   await workbook.commit();
-  await pool.close();
+  await liberarConexao(pool);
 
   return { total: totalInserted, outputPath: outputFile };
 }
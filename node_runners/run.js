@@ -15,13 +15,13 @@ function parseArgs(argv) {
   return args;
 }
 
-async function main() {
-  const args = parseArgs(process.argv);
-  const kind = args.kind;
-  const filePath = args.file;
-  const uploadId = Number(args["upload-id"] || 0);
-  const userEmail = args["user-email"] || "desconhecido";
-  const dataArquivoRaw = args["data-arquivo"] || "";
+// Pedido: { kind, file, upload_id, user_email, data_arquivo } (linha de comando ou server.js).
+async function runJob(pedido) {
+  const kind = pedido.kind;
+  const filePath = pedido.file;
+  const uploadId = Number(pedido.upload_id || 0);
+  const userEmail = pedido.user_email || "desconhecido";
+  const dataArquivoRaw = pedido.data_arquivo || "";
   const parsedDate = dataArquivoRaw ? new Date(dataArquivoRaw) : null;
   const dataArquivo = parsedDate && !Number.isNaN(parsedDate.getTime()) ? parsedDate : null;
 
@@ -45,18 +45,41 @@ async function main() {
   throw new Error(`Tipo nao suportado: ${kind}`);
 }
 
-main()
-  .then((result) => {
-    const payload = {
-      ok: true,
-      total: result.total,
-      output_filename: path.basename(result.outputPath),
-      output_path: result.outputPath,
-    };
-    process.stdout.write(JSON.stringify(payload));
+function resultPayload(result) {
+  const payload = {
+    ok: true,
+    total: result.total,
+    output_filename: path.basename(result.outputPath),
+    output_path: result.outputPath,
+  };
+  if (result.cacheChaves) payload.cache_chaves = result.cacheChaves;
+  return payload;
+}
+
+function main() {
+  const args = parseArgs(process.argv);
+  runJob({
+    kind: args.kind,
+    file: args.file,
+    upload_id: args["upload-id"],
+    user_email: args["user-email"],
+    data_arquivo: args["data-arquivo"],
   })
-  .catch((err) => {
-    const payload = { ok: false, error: err.message || String(err) };
-    process.stderr.write(JSON.stringify(payload));
-    process.exit(1);
-  });
+    .then((result) => {
+      process.stdout.write(JSON.stringify(resultPayload(result)));
+    })
+    .catch((err) => {
+      const payload = { ok: false, error: err.message || String(err) };
+      process.stderr.write(JSON.stringify(payload));
+      process.exit(1);
+    });
+}
+
+if (require.main === module) {
+  main();
+}
+
+module.exports = {
+  runJob,
+  resultPayload,
+};
@@ -0,0 +1,63 @@
+﻿const readline = require("readline");
+const { runJob, resultPayload } = require("./run");
+const { manterConexao, encerrarConexao } = require("./db");
+const { definirEnvioStatus, marcarCancelado, limparCancelado } = require("./util");
+
+// Servidor persistente: recebe um pedido JSON por linha no stdin e responde no stdout,
+// tambem uma linha JSON por mensagem. Os jobs rodam um de cada vez, com o pool do banco
+// e os modulos ja carregados entre eles.
+//   pedido:   {"id": 1, "kind": "emp", "file": "...", "upload_id": 10, "user_email": "...", "data_arquivo": "..."}
+//   resposta: {"id": 1, "evento": "iniciado"}, {"id": 1, "evento": "status", ...} durante o job
+//             e por fim {"id": 1, "ok": true, ...} ou {"id": 1, "ok": false, "error": "..."}
+//   cancelamento: {"cancelar": true, "kind": "emp", "upload_id": 10}, atendido na hora.
+
+// O stdout e do protocolo; qualquer log vai para o stderr.
+console.log = console.error;
+console.info = console.error;
+
+manterConexao();
+
+function responder(mensagem) {
+  process.stdout.write(`${JSON.stringify(mensagem)}\n`);
+}
+
+let fila = Promise.resolve();
+let pedidoAtual = null;
+
+definirEnvioStatus((mensagem) => responder({ id: pedidoAtual, ...mensagem }));
+
+const entrada = readline.createInterface({ input: process.stdin });
+
+entrada.on("line", (linha) => {
+  if (!linha.trim()) return;
+  let pedido;
+  try {
+    pedido = JSON.parse(linha);
+  } catch (err) {
+    responder({ id: null, ok: false, error: `Pedido invalido: ${err.message}` });
+    return;
+  }
+  if (pedido.cancelar) {
+    marcarCancelado(pedido.kind, pedido.upload_id);
+    return;
+  }
+  fila = fila.then(async () => {
+    pedidoAtual = pedido.id;
+    limparCancelado(pedido.kind, pedido.upload_id);
+    responder({ id: pedido.id, evento: "iniciado" });
+    try {
+      const result = await runJob(pedido);
+      responder({ id: pedido.id, ...resultPayload(result) });
+    } catch (err) {
+      responder({ id: pedido.id, ok: false, error: err.message || String(err) });
+    }
+  });
+});
+
+// stdin fechado: o processo Python encerrou ou reciclou o servidor.
+entrada.on("close", () => {
+  fila
+    .then(() => encerrarConexao())
+    .catch(() => {})
+    .finally(() => process.exit(0));
+});
@@ -1,5 +1,4 @@
 ﻿const fs = require("fs");
-const path = require("path");
 
 const MISSING_INFO = "NÃO INFORMADO";
 const MISSING_ID = "NÃO IDENTIFICADO";
@@ -72,6 +71,40 @@ function canonicalizarChave(value) {
   return `* ${parts.join(" * ")} *`;
 }
 
+// Espelho de services/normalizacao.py: valores gravados em chave_norm/ug_norm/uo_norm.
+function normalizarChave(value) {
+  if (value === null || value === undefined || value === "") return "";
+  let text = sanitizeString(value).normalize("NFKD").replace(/\p{M}/gu, "");
+  text = Array.from(text)
+    .filter((ch) => ch === "*" || /[\p{L}\p{N}]/u.test(ch))
+    .join("");
+  return text.toUpperCase();
+}
+
+function leadingToken(value) {
+  if (value === null || value === undefined || value === "") return "";
+  return String(value).trim().split(" ")[0];
+}
+
+function normalizarUo(value) {
+  const token = leadingToken(value);
+  if (!token) return "";
+  const digits = token.replace(/\D/g, "");
+  return digits || token;
+}
+
+function ugDeSubfuncao(value) {
+  if (value === null || value === undefined) return "";
+  const text = String(value).trim();
+  const idx = text.lastIndexOf(".");
+  return idx === -1 ? "" : text.slice(idx + 1);
+}
+
+function campoChave(exercicio) {
+  const ano = parseAno(exercicio);
+  return ano && ano <= 2025 ? "chave_planejamento" : "chave";
+}
+
 function parseValorDb(value) {
   if (value === null || value === undefined) return null;
   const text = String(value).trim();
@@ -165,56 +198,50 @@ function formatDateIso(value) {
   return `${yyyy}-${mm}-${dd}`;
 }
 
-function statusDir() {
-  return path.resolve(__dirname, "..", "outputs", "status");
-}
+// Status e cancelamento passam pelo processo Python, que grava no banco de status: no
+// server.js as atualizacoes saem como linhas {"evento":"status"} no stdout e os pedidos
+// de cancelamento chegam pelo stdin. Rodando o run.js direto, o status vai para o stderr.
+let enviarStatus = (mensagem) => process.stderr.write(`${JSON.stringify(mensagem)}\n`);
+const cancelados = new Set();
 
-function statusPath(kind, uploadId) {
-  const safeKind = String(kind || "").trim().toLowerCase();
-  return path.join(statusDir(), `${safeKind}_${uploadId}.json`);
+function definirEnvioStatus(fn) {
+  enviarStatus = fn;
 }
 
-function cancelPath(kind, uploadId) {
-  const safeKind = String(kind || "").trim().toLowerCase();
-  return path.join(statusDir(), `${safeKind}_${uploadId}.cancel`);
+function chaveJob(kind, uploadId) {
+  return `${String(kind || "").trim().toLowerCase()}_${Number(uploadId)}`;
 }
 
 function writeStatus(kind, uploadId, payload) {
-  ensureDir(statusDir());
-  const now = new Date().toISOString();
-  const data = {
+  enviarStatus({
+    evento: "status",
     kind: String(kind || "").trim().toLowerCase(),
     upload_id: Number(uploadId),
-    updated_at: now,
-    ...payload,
-  };
-  fs.writeFileSync(statusPath(kind, uploadId), JSON.stringify(data), "utf8");
+    substituir: true,
+    campos: payload,
+  });
 }
 
 function updateStatusFields(kind, uploadId, fields) {
-  ensureDir(statusDir());
-  const pathStatus = statusPath(kind, uploadId);
-  let current = {};
-  if (fs.existsSync(pathStatus)) {
-    try {
-      current = JSON.parse(fs.readFileSync(pathStatus, "utf8"));
-    } catch {
-      current = {};
-    }
-  }
-  const now = new Date().toISOString();
-  const data = {
+  enviarStatus({
+    evento: "status",
     kind: String(kind || "").trim().toLowerCase(),
     upload_id: Number(uploadId),
-    ...current,
-    ...fields,
-    updated_at: now,
-  };
-  fs.writeFileSync(pathStatus, JSON.stringify(data), "utf8");
+    campos: fields,
+  });
+}
+
+function marcarCancelado(kind, uploadId) {
+  cancelados.add(chaveJob(kind, uploadId));
+}
+
+function limparCancelado(kind, uploadId) {
+  cancelados.delete(chaveJob(kind, uploadId));
 }
 
+// Consulta em memoria: barata o bastante para ser feita a cada linha.
 function readCancelFlag(kind, uploadId) {
-  return fs.existsSync(cancelPath(kind, uploadId));
+  return cancelados.has(chaveJob(kind, uploadId));
 }
 
 module.exports = {
@@ -226,6 +253,10 @@ module.exports = {
   normalizeForComparison,
   cleanForEmpSheet,
   canonicalizarChave,
+  normalizarChave,
+  normalizarUo,
+  ugDeSubfuncao,
+  campoChave,
   parseValorDb,
   parseDataDb,
   parseAno,
@@ -236,4 +267,7 @@ module.exports = {
   writeStatus,
   updateStatusFields,
   readCancelFlag,
+  definirEnvioStatus,
+  marcarCancelado,
+  limparCancelado,
 };
@@ -1,15 +1,21 @@
-from flask import Blueprint, jsonify, render_template, request, abort, g, session, send_file, current_app
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    g,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+    session,
+    stream_with_context,
+)
 from functools import wraps
 from datetime import datetime, timedelta
 from decimal import Decimal
 import os
-from io import BytesIO
 import json
-import unicodedata
-import subprocess
-import sys
-import threading
-import pandas as pd
+import time
 from models import (
     Usuario,
     Perfil,
@@ -22,90 +28,90 @@ from models import (
     EmpUpload,
     EmpRegistro,
     EstEmpUpload,
-    EstEmpRegistro,
     NobUpload,
     NobRegistro,
     Plan21Nger,
     Adj,
     Dotacao,
     ActiveSession,
+    Job,
     db,
 )
 from sqlalchemy.exc import ProgrammingError, IntegrityError
 from services.auth import login_required, role_required, current_user
-from services.features import FEATURES, flatten_features, build_parent_map
-from services.fip613_runner import run_fip613, UPLOAD_DIR
-from services.plan20_runner import run_plan20
+from services.features import FEATURES, LOCKED_MASK, flatten_features, mask_features, mask_has
+from services.fip613_runner import UPLOAD_DIR
 from services.ped_runner import (
-    run_ped,
     move_existing_to_tmp,
     INPUT_DIR as PED_UPLOAD_DIR,
     OUTPUT_DIR as PED_OUTPUT_DIR,
 )
 from services.est_emp_runner import (
-    run_est_emp,
     INPUT_DIR as EST_EMP_UPLOAD_DIR,
     OUTPUT_DIR as EST_EMP_OUTPUT_DIR,
     move_existing_to_tmp as move_est_emp_existing_to_tmp,
 )
-from services.job_status import read_status, set_cancel_flag, update_status_fields, write_status
+from services.cargas import condicao_ativos, filtro_ativos
+from services.facetas_plan21 import CAMPOS as FACETAS_CAMPOS, opcoes_dotacao
+from services.normalizacao import (
+    dec_or_zero as _dec_or_zero,
+    leading_token as _leading_token,
+    normalizar_chave as _normalize_chave,
+    normalizar_ug as _normalize_ug,
+    normalizar_uo as _normalize_uo,
+    parse_decimal as _parse_decimal,
+)
+from services.saldo_execucao import consultar_saldo_execucao
+from services.sessao_cache import invalidar_perfis, permissoes_perfil, permissoes_perfis, recarregar_permissoes
+from services.job_status import (
+    ESTADOS_FINAIS,
+    read_status,
+    set_cancel_flag,
+    status_com_versao,
+    update_status_fields,
+    write_status,
+)
+from services.jobs import (
+    EMP_UPLOAD_DIR,
+    NOB_UPLOAD_DIR,
+    PLAN20_OUTPUT_DIR,
+    PLAN20_UPLOAD_DIR,
+    find_upload_path as _find_upload_path,
+)
+from services.fila_jobs import cancelar_pendentes, enfileirar, garantir_servico
+from services.relatorios import (
+    XLSX_MIMETYPE,
+    carregar_colunas,
+    carregar_relatorio,
+    exportar_xlsx,
+    montar_dataframe,
+    registros_json,
+    spec_relatorio,
+)
 from pathlib import Path
-from sqlalchemy import text, func
+from sqlalchemy import func
 
 home_bp = Blueprint("home", __name__)
 
-EMP_UPLOAD_DIR = Path("upload/emp")
 EMP_OUTPUT_DIR = Path("outputs/td_emp")
-NOB_UPLOAD_DIR = Path("upload/nob")
 NOB_OUTPUT_DIR = Path("outputs/td_nob")
-NODE_RUNNER = Path(__file__).resolve().parents[1] / "node_runners" / "run.js"
-NODE_EXE = os.getenv("NODE_EXE", "node")
-
-
-def _find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
-    if not stored_filename:
-        return None
-    candidate = base_dir / stored_filename
-    if candidate.exists():
-        return candidate
-    tmp_dir = base_dir / "tmp"
-    if not tmp_dir.exists():
-        return None
-    stem = Path(stored_filename).stem
-    matches = sorted(tmp_dir.glob(f"{stem}_*.xlsx"), key=lambda p: p.stat().st_mtime, reverse=True)
-    return matches[0] if matches else None
-
-
-def _run_node(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
-    args = [
-        NODE_EXE,
-        str(NODE_RUNNER),
-        "--kind",
-        kind,
-        "--file",
-        str(file_path),
-        "--upload-id",
-        str(upload_id),
-        "--user-email",
-        user_email or "desconhecido",
-    ]
-    if data_arquivo:
-        try:
-            args.extend(["--data-arquivo", data_arquivo.isoformat()])
-        except Exception:
-            args.extend(["--data-arquivo", str(data_arquivo)])
-    proc = subprocess.run(args, capture_output=True, text=True, cwd=str(NODE_RUNNER.parent))
-    if proc.returncode != 0:
-        err = (proc.stderr or proc.stdout or "").strip()
-        raise RuntimeError(f"Node runner falhou: {err or 'erro desconhecido'}")
-    raw = (proc.stdout or "").strip()
-    try:
-        payload = json.loads(raw) if raw else {}
-    except json.JSONDecodeError as exc:
-        raise RuntimeError(f"Resposta invalida do Node: {exc}") from exc
-    if not payload.get("ok"):
-        raise RuntimeError(f"Node runner falhou: {payload.get('error')}")
-    return payload
+# Tela de atualizacao de cada tipo de job (permissao exigida para acompanhar o job).
+FEATURE_DO_JOB = {
+    "fip613": "atualizar/fip613",
+    "ped": "atualizar/ped",
+    "emp": "atualizar/emp",
+    "est_emp": "atualizar/est-emp",
+    "nob": "atualizar/nob",
+    "plan20": "atualizar/plan20-seduc",
+}
+# Eventos do job: o banco de status e consultado a cada SSE_INTERVALO segundos (so a versao),
+# com um comentario de keep-alive a cada SSE_KEEPALIVE. Cada conexao prende um worker do servidor
+# web (sincrono no IIS/wfastcgi) por ate SSE_DURACAO segundos; depois o navegador reconecta pelo
+# retry. JOBS_SSE=0 desliga os eventos e a pagina volta a consultar o status por polling.
+SSE_ATIVO = (os.getenv("JOBS_SSE") or "1").strip().lower() not in ("0", "false", "nao", "no")
+SSE_INTERVALO = 0.5
+SSE_KEEPALIVE = 15
+SSE_DURACAO = max(5, int(os.getenv("JOBS_SSE_DURACAO", "25")))
 
 
 def _move_existing_to_tmp(base_dir: Path) -> None:
@@ -124,108 +130,71 @@ def _next_pk(model) -> int:
     return int(max_id) + 1
 
 
-def _process_emp_upload(upload_id: int) -> None:
-    registro = db.session.get(EmpUpload, upload_id)
-    if not registro:
-        raise RuntimeError(f"Upload EMP nao encontrado: {upload_id}")
-    file_path = _find_upload_path(EMP_UPLOAD_DIR, registro.stored_filename)
-    if not file_path:
-        raise RuntimeError(f"Arquivo EMP nao encontrado: {EMP_UPLOAD_DIR / registro.stored_filename}")
-    payload = _run_node("emp", file_path, registro.user_email, registro.data_arquivo, registro.id)
-    registro.output_filename = str(payload.get("output_filename") or "")
-    db.session.commit()
-    write_status(
-        "emp",
-        upload_id,
-        "processamento finalizado",
-        f"Processado com sucesso. Registros: {payload.get('total')}.",
-        payload.get("output_filename"),
-        progress=100,
-    )
+def _status_job(kind: str, upload_id: int) -> dict:
+    status_data = read_status(kind, upload_id) or {}
+    return {
+        "status": status_data.get("state"),
+        "status_message": status_data.get("message"),
+        "status_updated_at": status_data.get("updated_at"),
+        "status_progress": status_data.get("progress"),
+        "status_pid": status_data.get("pid"),
+    }
 
 
-def _process_nob_upload(upload_id: int) -> None:
-    registro = db.session.get(NobUpload, upload_id)
+def _reprocessar_upload(kind: str, modelo, upload_dir: Path):
+    payload = request.get_json(silent=True) or {}
+    upload_id = payload.get("upload_id")
+    if upload_id:
+        registro = db.session.get(modelo, upload_id)
+    else:
+        registro = modelo.query.order_by(modelo.uploaded_at.desc()).first()
     if not registro:
-        raise RuntimeError(f"Upload NOB nao encontrado: {upload_id}")
-    file_path = _find_upload_path(NOB_UPLOAD_DIR, registro.stored_filename)
-    if not file_path:
-        raise RuntimeError(f"Arquivo NOB nao encontrado: {NOB_UPLOAD_DIR / registro.stored_filename}")
-    payload = _run_node("nob", file_path, registro.user_email, registro.data_arquivo, registro.id)
-    registro.output_filename = str(payload.get("output_filename") or "")
-    db.session.commit()
-    write_status(
-        "nob",
-        upload_id,
-        "processamento finalizado",
-        f"Processado com sucesso. Registros: {payload.get('total')}.",
-        payload.get("output_filename"),
-        progress=100,
-    )
-
+        return jsonify({"error": "Nenhum upload encontrado para reprocessar."}), 404
+    try:
+        file_path = _find_upload_path(upload_dir, registro.stored_filename)
+        if not file_path:
+            return jsonify({"error": "Arquivo do upload nao encontrado."}), 404
+        # garante o caminho correto para o worker
+        if file_path.parent.name == "tmp":
+            registro.stored_filename = f"tmp/{file_path.name}"
+        registro.output_filename = None
+        db.session.commit()
+        write_status(kind, registro.id, "em processamento", "Reprocessamento iniciado.")
+        _start_worker(kind, registro.id)
+        return jsonify({"ok": True, "message": "Reprocessamento iniciado.", "job_id": registro.id})
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao reprocessar: {exc}"}), 500
 
-def _start_thread(kind: str, upload_id: int) -> None:
-    app = current_app._get_current_object()
 
-    def _runner() -> None:
-        with app.app_context():
-            try:
-                write_status(
-                    kind,
-                    upload_id,
-                    "em processamento",
-                    "Processamento iniciado (thread).",
-                    progress=0,
-                )
-                if kind == "emp":
-                    _process_emp_upload(upload_id)
-                else:
-                    _process_nob_upload(upload_id)
-            except Exception as exc:
-                msg = f"{type(exc).__name__}: {exc}"
-                if "PROCESSAMENTO_CANCELADO" in msg:
-                    write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario.")
-                else:
-                    write_status(kind, upload_id, "falha no processamento", msg)
-            finally:
-                db.session.remove()
-
-    thread = threading.Thread(target=_runner, daemon=True)
-    thread.start()
+def _cancelar_upload(kind: str, modelo):
+    payload = request.get_json(silent=True) or {}
+    upload_id = payload.get("upload_id")
+    if upload_id:
+        registro = db.session.get(modelo, upload_id)
+    else:
+        registro = modelo.query.order_by(modelo.uploaded_at.desc()).first()
+    if not registro:
+        return jsonify({"error": "Nenhum upload encontrado para cancelar."}), 404
+    set_cancel_flag(kind, registro.id)
+    if not cancelar_pendentes(kind, registro.id):
+        update_status_fields(kind, registro.id, message="Cancelamento solicitado.")
+    return jsonify({"ok": True, "message": "Cancelamento solicitado.", "job_id": registro.id})
 
 
 def _start_worker(kind: str, upload_id: int) -> None:
-    worker_path = Path(__file__).resolve().parents[1] / "worker.py"
-    creationflags = 0
-    if sys.platform.startswith("win"):
-        creationflags = getattr(subprocess, "DETACHED_PROCESS", 0) | getattr(
-            subprocess, "CREATE_NEW_PROCESS_GROUP", 0
-        )
+    job_id = enfileirar(kind, upload_id)
+    update_status_fields(kind, upload_id, state="na fila", message="Aguardando o servico de jobs.", fila_job_id=job_id)
     try:
-        log_dir = Path("outputs") / "status"
-        log_dir.mkdir(parents=True, exist_ok=True)
-        log_path = log_dir / f"worker_{kind}_{upload_id}.log"
-        log_handle = open(log_path, "a", encoding="utf-8")
-        proc = subprocess.Popen(
-            [sys.executable, str(worker_path), "--kind", kind, "--upload-id", str(upload_id)],
-            cwd=str(worker_path.parent),
-            stdout=log_handle,
-            stderr=log_handle,
-            creationflags=creationflags,
-        )
-        update_status_fields(
-            kind,
-            upload_id,
-            message="Worker externo iniciado.",
-            pid=proc.pid,
-        )
+        pid = garantir_servico()
+        if pid:
+            update_status_fields(kind, upload_id, message=f"Servico de jobs iniciado (pid {pid}).")
     except Exception as exc:
         update_status_fields(
             kind,
             upload_id,
-            message=f"Falha ao iniciar worker externo ({type(exc).__name__}: {exc}). Usando thread.",
+            message=f"Falha ao iniciar o servico de jobs ({type(exc).__name__}: {exc}). O job segue na fila.",
         )
-        _start_thread(kind, upload_id)
 
 
 @home_bp.route("/")
@@ -281,49 +250,15 @@ def has_permission(feature: str) -> bool:
     perfil_id = getattr(g, "user_perfil_id", None)
     if not perfil_id:
         return False
-    try:
-        exists = (
-            db.session.query(PerfilPermissao.id)
-            .filter(PerfilPermissao.perfil_id == perfil_id, PerfilPermissao.feature == feature)
-            .first()
-        )
-        return bool(exists)
-    except ProgrammingError:
-        db.session.rollback()
-        return False
+    concedidas, _ = permissoes_perfil(perfil_id)
+    return mask_has(concedidas, feature)
 
 
 def _permissoes_with_parents(perfil_id: int | None):
-    locked = [f["id"] for f in FEATURES if f.get("locked")]
     if perfil_id is None:
-        return locked
-    parent_map = build_parent_map()
-    try:
-        feats = []
-        for pp in (
-            PerfilPermissao.query.filter(
-                PerfilPermissao.perfil_id == perfil_id,
-                PerfilPermissao.ativo == True,  # noqa: E712
-                PerfilPermissao.feature.isnot(None),
-            ).all()
-            or []
-        ):
-            feat_id = getattr(pp, "feature", None)
-            if feat_id:
-                feats.append(feat_id)
-    except ProgrammingError:
-        db.session.rollback()
-        feats = []
-    # include parents of children
-    for feat in list(feats):
-        parent = parent_map.get(feat)
-        if parent and parent not in feats:
-            feats.append(parent)
-    # add locked always
-    for l in locked:
-        if l not in feats:
-            feats.append(l)
-    return feats
+        return mask_features(LOCKED_MASK)
+    _, com_pais = permissoes_perfil(perfil_id)
+    return mask_features(com_pais)
 
 
 def require_feature(feature_id):
@@ -416,24 +351,10 @@ def partial_painel():
     if not has_permission("painel"):
         abort(403)
     perfis = Perfil.query.order_by(Perfil.nivel, Perfil.nome).all()
-    allowed_map: dict[int, list[str]] = {}
-    try:
-        permissoes = (
-            db.session.query(PerfilPermissao.perfil_id, PerfilPermissao.feature)
-            .filter(PerfilPermissao.feature.isnot(None), PerfilPermissao.ativo == True)  # noqa: E712
-            .all()
-        )
-        for p_id, feat in permissoes:
-            if feat:
-                allowed_map.setdefault(p_id, []).append(feat)
-    except ProgrammingError:
-        db.session.rollback()
     features = FEATURES
-    allowed = {}
-    for perfil in perfis:
-        feats = allowed_map.get(perfil.id) or []
-        # inclui pais e locked
-        allowed[perfil.id] = _permissoes_with_parents(perfil.id)
+    # Uma consulta para todos os perfis (bitsets ja com pais e locked).
+    mascaras = permissoes_perfis([perfil.id for perfil in perfis])
+    allowed = {perfil.id: mask_features(mascaras[perfil.id][1]) for perfil in perfis}
     return render_template(
         "partials/painel.html",
         perfis=perfis,
@@ -632,6 +553,7 @@ def api_permissoes(perfil_id):
         for f in clean_feats:
             db.session.add(PerfilPermissao(perfil_id=perfil_id, feature=f, ativo=True))
         db.session.commit()
+        recarregar_permissoes(perfil_id)
     except ProgrammingError:
         db.session.rollback()
         return jsonify({"error": "Tabela perfil_permissoes inexistente. Crie a tabela antes de salvar."}), 500
@@ -655,118 +577,17 @@ def api_permissoes_current():
     return jsonify({"features": feats})
 
 
-def _parse_decimal(raw_val):
-    if raw_val is None:
-        return None
-    raw = str(raw_val).strip()
-    if not raw:
-        return None
-    cleaned = raw.replace(".", "").replace(",", ".")
-    try:
-        return Decimal(cleaned)
-    except Exception:
-        return None
-
-
-def _dec_or_zero(value):
-    if value is None:
-        return Decimal("0")
-    if isinstance(value, Decimal):
-        return value
-    parsed = _parse_decimal(value)
-    return parsed if parsed is not None else Decimal("0")
-
-
-def _natureza_prefix(value: str) -> str:
-    if not value:
-        return ""
-    parts = [p for p in str(value).split(".") if p]
-    if len(parts) >= 3:
-        return ".".join(parts[:3])
-    return str(value).strip()
-
-
-def _leading_token(value: str) -> str:
-    if not value:
-        return ""
-    return str(value).strip().split(" ", 1)[0]
-
-
-def _normalize_ug(value: str) -> str:
-    token = _leading_token(value)
-    if not token:
-        return ""
-    try:
-        return str(int(token))
-    except ValueError:
-        return token
-
-
-def _normalize_uo(value: str) -> str:
-    if not value:
-        return ""
-    token = _leading_token(value)
-    digits = "".join(ch for ch in token if ch.isdigit())
-    return digits or token
-
-
-def _normalize_chave(value: str) -> str:
-    if not value:
-        return ""
-    value = str(value)
-    value = unicodedata.normalize("NFKD", value)
-    value = "".join(ch for ch in value if not unicodedata.combining(ch))
-    return "".join(ch for ch in value if ch.isalnum() or ch == "*").upper()
-
-
 @home_bp.route("/api/dotacao/options", methods=["GET"])
 @login_required
 @require_feature("cadastrar/dotacao")
 def api_dotacao_options():
-    fields = {
-        "exercicio": Plan21Nger.exercicio,
-        "chave_planejamento": Plan21Nger.chave_planejamento,
-        "uo": Plan21Nger.uo,
-        "programa": Plan21Nger.programa,
-        "acao_paoe": Plan21Nger.acao_paoe,
-        "produto": Plan21Nger.produto,
-        "ug": Plan21Nger.ug,
-        "regiao": Plan21Nger.regiao,
-        "subacao_entrega": Plan21Nger.subacao_entrega,
-        "etapa": Plan21Nger.etapa,
-        "natureza_despesa": Plan21Nger.natureza,
-        "fonte": Plan21Nger.fonte,
-        "iduso": Plan21Nger.idu,
-    }
     selected = {}
-    for key in fields:
+    for key in FACETAS_CAMPOS:
         val = (request.args.get(key) or "").strip()
         if val:
             selected[key] = val
 
-    options = {}
-    for key, col in fields.items():
-        query = db.session.query(col).distinct()
-        for s_key, s_val in selected.items():
-            if s_key == key:
-                continue
-            if s_key == "natureza_despesa":
-                query = query.filter(fields[s_key].like(f"{s_val}%"))
-            else:
-                query = query.filter(fields[s_key] == s_val)
-        rows = query.all()
-        values = []
-        for (val,) in rows:
-            if val is None:
-                continue
-            s = str(val).strip()
-            if s == "":
-                continue
-            if key == "natureza_despesa":
-                s = _natureza_prefix(s)
-            values.append(s)
-        values = sorted(set(values), key=lambda v: v.lower())
-        options[key] = values
+    options = opcoes_dotacao(selected)
 
     adjs = Adj.query.order_by(Adj.abreviacao).all()
     adj_options = [{"id": a.id, "label": a.abreviacao} for a in adjs if a.abreviacao]
@@ -965,98 +786,25 @@ def api_dotacao_saldo():
     acao_paoe_key = _leading_token(acao_paoe)
     ug_norm = _normalize_ug(ug)
     uo_norm = _normalize_uo(uo)
-    try:
-        exercicio_int = int(str(exercicio).split(".")[0])
-    except ValueError:
-        exercicio_int = None
-    chave_field = "chave_planejamento" if exercicio_int and exercicio_int <= 2025 else "chave"
     chave_norm = _normalize_chave(chave_planejamento)
 
-    ped_base = [PedRegistro.ativo == True]  # noqa: E712
-    if exercicio:
-        ped_base.append(PedRegistro.exercicio == exercicio)
-    if programa_key:
-        ped_base.append(PedRegistro.programa_governo == programa_key)
-    if acao_paoe_key:
-        ped_base.append(PedRegistro.paoe == acao_paoe_key)
-    if fonte:
-        ped_base.append(PedRegistro.fonte == fonte)
-    if iduso:
-        ped_base.append(PedRegistro.iduso == iduso)
-    if uo_norm:
-        ped_base.append(PedRegistro.uo == uo_norm)
-    if ug_norm:
-        ped_base.append(PedRegistro.subfuncao_ug.like(f"%.{ug_norm}"))
-    if regiao:
-        ped_base.append(PedRegistro.regiao == regiao)
-    if chave_planejamento:
-        if chave_field == "chave_planejamento":
-            ped_base.append(PedRegistro.chave_planejamento == chave_planejamento)
-        else:
-            ped_base.append(PedRegistro.chave == chave_planejamento)
-    ped_rows = (
-        PedRegistro.query.with_entities(
-            PedRegistro.valor_ped, PedRegistro.chave_planejamento, PedRegistro.chave
-        )
-        .filter(*ped_base)
-        .all()
-    )
-    ped_filtered = []
-    for row in ped_rows:
-        chave_val = row.chave_planejamento if chave_field == "chave_planejamento" else row.chave
-        if _normalize_chave(chave_val) == chave_norm:
-            ped_filtered.append(row)
-    valor_ped = sum((_dec_or_zero(r.valor_ped) for r in ped_filtered), Decimal("0"))
-    ped_count = len(ped_filtered)
-
-    emp_base = [EmpRegistro.ativo == True]  # noqa: E712
-    if exercicio:
-        emp_base.append(EmpRegistro.exercicio == exercicio)
-    if programa_key:
-        emp_base.append(EmpRegistro.programa_governo == programa_key)
-    if acao_paoe_key:
-        emp_base.append(EmpRegistro.paoe == acao_paoe_key)
-    if fonte:
-        emp_base.append(EmpRegistro.fonte == fonte)
-    if iduso:
-        emp_base.append(EmpRegistro.iduso == iduso)
-    if uo_norm:
-        emp_base.append(EmpRegistro.uo == uo_norm)
-    if ug_norm:
-        emp_base.append(EmpRegistro.subfuncao_ug.like(f"%.{ug_norm}"))
-    if regiao:
-        emp_base.append(EmpRegistro.regiao == regiao)
-    if chave_planejamento:
-        if chave_field == "chave_planejamento":
-            emp_base.append(EmpRegistro.chave_planejamento == chave_planejamento)
-        else:
-            emp_base.append(EmpRegistro.chave == chave_planejamento)
-    emp_rows = (
-        EmpRegistro.query.with_entities(
-            EmpRegistro.numero_emp, EmpRegistro.chave_planejamento, EmpRegistro.chave
-        )
-        .filter(*emp_base)
-        .all()
+    # PED e EMP liquido vem pre-agregados por chave normalizada (saldo_execucao/saldo_execucao_emp),
+    # montados pelo servico de jobs; antes disso a consulta soma direto das bases.
+    execucao = consultar_saldo_execucao(
+        exercicio,
+        chave_norm,
+        uo=uo_norm,
+        ug=ug_norm,
+        paoe=acao_paoe_key,
+        fonte=fonte,
+        iduso=iduso,
+        programa=programa_key,
+        regiao=regiao,
     )
-    emp_nums = []
-    for row in emp_rows:
-        chave_val = row.chave_planejamento if chave_field == "chave_planejamento" else row.chave
-        if _normalize_chave(chave_val) == chave_norm and row.numero_emp:
-            emp_nums.append(row.numero_emp)
-    emp_nums = list(dict.fromkeys(emp_nums))
-    emp_count = len(emp_nums)
-    if emp_nums:
-        valor_emp_liquido = (
-            db.session.query(func.coalesce(func.sum(EstEmpRegistro.valor_emp_liquido), 0))
-            .filter(
-                EstEmpRegistro.ativo == True,  # noqa: E712
-                EstEmpRegistro.numero_emp.in_(emp_nums),
-            )
-            .scalar()
-        )
-    else:
-        valor_emp_liquido = Decimal("0")
-    valor_emp_liquido = _dec_or_zero(valor_emp_liquido)
+    valor_ped = execucao["valor_ped"]
+    ped_count = execucao["ped_count"]
+    valor_emp_liquido = execucao["valor_emp_liquido"]
+    emp_count = execucao["emp_count"]
 
     saldo = valor_atual - valor_dotacao - valor_ped - valor_emp_liquido
     return jsonify(
@@ -1091,6 +839,59 @@ def api_dotacao_saldo():
     )
 
 
+def _job_em_andamento(kind: str, upload_id: int) -> bool:
+    # Falha com nova tentativa agendada ainda nao e o fim do job.
+    return (
+        Job.query.filter(
+            Job.kind == kind, Job.upload_id == upload_id, Job.estado.in_(("pendente", "executando"))
+        ).first()
+        is not None
+    )
+
+
+@home_bp.route("/api/jobs/<kind>/<int:upload_id>/events", methods=["GET"])
+@login_required
+def api_job_events(kind, upload_id):
+    feature = FEATURE_DO_JOB.get(kind)
+    if not feature:
+        return jsonify({"error": "Tipo de job invalido."}), 404
+    if getattr(g, "user_nivel", None) != 1 and not has_permission(feature):
+        abort(403)
+    if not SSE_ATIVO:
+        # 204 fecha o EventSource sem reconexao; o front cai no polling do status.
+        return Response(status=204)
+    # Na reconexao o navegador manda o ultimo id recebido: a versao ja vista nao e reenviada.
+    ultima = (request.headers.get("Last-Event-ID") or "").strip()
+
+    def _evento(nome: str, versao: int, dados) -> str:
+        return f"event: {nome}\nid: {versao}\ndata: {json.dumps(dados or {}, ensure_ascii=True, default=str)}\n\n"
+
+    def _gerar():
+        inicio = ultimo_envio = time.monotonic()
+        versao_enviada = int(ultima) if ultima.isdigit() else None
+        yield "retry: 2000\n\n"
+        while time.monotonic() - inicio < SSE_DURACAO:
+            versao, dados = status_com_versao(kind, upload_id)
+            if versao != versao_enviada:
+                versao_enviada = versao
+                ultimo_envio = time.monotonic()
+                yield _evento("status", versao, dados)
+            # Conferido mesmo sem versao nova: o job pode ter terminado entre duas conexoes.
+            if dados and dados.get("state") in ESTADOS_FINAIS and not _job_em_andamento(kind, upload_id):
+                yield _evento("fim", versao, dados)
+                return
+            if time.monotonic() - ultimo_envio >= SSE_KEEPALIVE:
+                ultimo_envio = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(SSE_INTERVALO)
+
+    return Response(
+        stream_with_context(_gerar()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @home_bp.route("/api/fip613/status", methods=["GET"])
 @login_required
 @require_feature("atualizar/fip613")
@@ -1122,6 +923,7 @@ def api_fip613_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_status_job("fip613", last.id),
             },
         }
     )
@@ -1171,16 +973,13 @@ def api_fip613_upload():
         db.session.add(registro)
         db.session.commit()
 
-        total, output_path = run_fip613(save_path, data_arquivo, user_email, registro.id)
-
-        registro.output_filename = str(output_path.name)
-        db.session.commit()
-
+        write_status("fip613", registro.id, "em processamento", "Arquivo recebido. Processamento em background.")
+        _start_worker("fip613", registro.id)
         return jsonify(
             {
                 "ok": True,
-                "message": f"Processado com sucesso. Registros inseridos: {total}.",
-                "output": output_path.name,
+                "message": "Arquivo recebido. O processamento ocorrerá em segundo plano.",
+                "job_id": registro.id,
             }
         )
     except Exception as exc:
@@ -1188,6 +987,27 @@ def api_fip613_upload():
         return jsonify({"error": f"Falha ao processar: {exc}"}), 500
 
 
+@home_bp.route("/api/fip613/reprocess", methods=["POST"])
+@login_required
+@require_feature("atualizar/fip613")
+def api_fip613_reprocess():
+    return _reprocessar_upload("fip613", Fip613Upload, UPLOAD_DIR)
+
+
+@home_bp.route("/api/fip613/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/fip613")
+def api_fip613_cancel():
+    return _cancelar_upload("fip613", Fip613Upload)
+
+
+def _enviar_xlsx(nome: str, df):
+    # Excel gerado em arquivo temporario (xlsxwriter constant_memory) e enviado em streaming.
+    arquivo = exportar_xlsx(nome, df)
+    filename = f"{spec_relatorio(nome)['arquivo']}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return send_file(arquivo, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+
+
 @home_bp.route("/api/relatorios/fip613", methods=["GET"])
 @login_required
 @require_feature("relatorios/fip613")
@@ -1198,55 +1018,29 @@ def api_relatorio_fip613():
         if hasattr(value, "isoformat"):
             return value.isoformat()
         try:
-            from datetime import datetime
-
             return datetime.fromisoformat(str(value)).isoformat()
         except Exception:
             return str(value)
 
     try:
-        rows = Fip613Registro.query.filter_by(ativo=True).all()
+        df = carregar_relatorio("fip613")
         last_upload = (
-            Fip613Registro.query.filter_by(ativo=True)
+            Fip613Registro.query.filter(condicao_ativos(Fip613Registro, "fip613"))
             .order_by(Fip613Registro.created_at.desc())
             .first()
         )
         data_arquivo = _as_iso(last_upload.data_arquivo) if last_upload else None
         uploaded_at = _as_iso(last_upload.created_at) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "uo": r.uo,
-                    "ug": r.ug,
-                    "funcao": r.funcao,
-                    "subfuncao": r.subfuncao,
-                    "programa": r.programa,
-                    "projeto_atividade": r.projeto_atividade,
-                    "regional": r.regional,
-                    "natureza_despesa": str(r.natureza_despesa or ""),
-                    "fonte_recurso": str(r.fonte_recurso or ""),
-                    "iduso": r.iduso,
-                    "tipo_recurso": r.tipo_recurso,
-                    "dotacao_inicial": float(r.dotacao_inicial or 0),
-                    "cred_suplementar": float(r.cred_suplementar or 0),
-                    "cred_especial": float(r.cred_especial or 0),
-                    "cred_extraordinario": float(r.cred_extraordinario or 0),
-                    "reducao": float(r.reducao or 0),
-                    "cred_autorizado": float(r.cred_autorizado or 0),
-                    "bloqueado_conting": float(r.bloqueado_conting or 0),
-                    "reserva_empenho": float(r.reserva_empenho or 0),
-                    "saldo_destaque": float(r.saldo_destaque or 0),
-                    "saldo_dotacao": float(r.saldo_dotacao or 0),
-                    "empenhado": float(r.empenhado or 0),
-                    "liquidado": float(r.liquidado or 0),
-                    "a_liquidar": float(r.a_liquidar or 0),
-                    "valor_pago": float(r.valor_pago or 0),
-                    "valor_a_pagar": float(r.valor_a_pagar or 0),
-                }
-            )
-        return jsonify({"ok": True, "data": data, "data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email})
+        return jsonify(
+            {
+                "ok": True,
+                "data": registros_json(df),
+                "data_arquivo": data_arquivo,
+                "uploaded_at": uploaded_at,
+                "user_email": user_email,
+            }
+        )
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados: {exc}"}), 500
 
@@ -1256,96 +1050,8 @@ def api_relatorio_fip613():
 @require_feature("relatorios/fip613")
 def api_relatorio_fip613_download():
     try:
-        rows = Fip613Registro.query.filter_by(ativo=True).all()
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "UO": r.uo,
-                    "UG": r.ug,
-                    "Função": r.funcao,
-                    "Subfunção": r.subfuncao,
-                    "Programa": r.programa,
-                    "Projeto/Atividade": r.projeto_atividade,
-                    "Regional": r.regional,
-                    "Natureza de Despesa": str(r.natureza_despesa or ""),
-                    "Fonte de Recurso": str(r.fonte_recurso or ""),
-                    "Iduso": r.iduso,
-                    "Tipo de Recurso": r.tipo_recurso,
-                    "Dotação Inicial": float(r.dotacao_inicial or 0),
-                    "Créd. Suplementar": float(r.cred_suplementar or 0),
-                    "Créd. Especial": float(r.cred_especial or 0),
-                    "Créd. Extraordinário": float(r.cred_extraordinario or 0),
-                    "Redução": float(r.reducao or 0),
-                    "Créd. Autorizado": float(r.cred_autorizado or 0),
-                    "Bloqueado/Conting.": float(r.bloqueado_conting or 0),
-                    "Reserva Empenho": float(r.reserva_empenho or 0),
-                    "Saldo de Destaque": float(r.saldo_destaque or 0),
-                    "Saldo Dotação": float(r.saldo_dotacao or 0),
-                    "Empenhado": float(r.empenhado or 0),
-                    "Liquidado": float(r.liquidado or 0),
-                    "A liquidar": float(r.a_liquidar or 0),
-                    "Valor Pago": float(r.valor_pago or 0),
-                    "Valor a Pagar": float(r.valor_a_pagar or 0),
-                }
-            )
-        df = None
-        try:
-            import pandas as pd
-            from io import BytesIO
-            from flask import send_file
-            from openpyxl import load_workbook
-            from openpyxl.styles import Font
-            import unicodedata
-
-            df = pd.DataFrame(data)
-
-            invert_targets = {"reducao", "bloqueadoconting", "reservaempenho", "empenhado"}
-
-            def _norm_col(name: str) -> str:
-                base = unicodedata.normalize("NFKD", str(name or ""))
-                ascii_only = "".join(ch for ch in base if not unicodedata.combining(ch))
-                return (
-                    ascii_only.lower()
-                    .replace(" ", "")
-                    .replace(".", "")
-                    .replace("/", "")
-                    .replace("_", "")
-                )
-
-            for col in list(df.columns):
-                if _norm_col(col) in invert_targets:
-                    df[col] = df[col].apply(lambda x: -(x or 0))
-            output = BytesIO()
-            df.to_excel(output, index=False)
-            output.seek(0)
-
-            # aplica fonte e formato numérico no Excel
-            wb = load_workbook(output)
-            ws = wb.active
-            font = Font(name="Helvetica", size=8)
-            number_format = "[Blue]#,##0.00;[Red]-#,##0.00;0"
-            # colunas numéricas começam em 12 (1-based) até o final
-            numeric_cols = set(range(12, ws.max_column + 1))
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.font = font
-                    if cell.col_idx in numeric_cols and isinstance(cell.value, (int, float)):
-                        cell.number_format = number_format
-
-            styled = BytesIO()
-            wb.save(styled)
-            styled.seek(0)
-
-            filename = f"fip613_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            return send_file(
-                styled,
-                as_attachment=True,
-                download_name=filename,
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
-        except Exception as exc:
-            return jsonify({"error": f"Falha ao preparar planilha: {exc}"}), 500
+        df = carregar_relatorio("fip613")
+        return _enviar_xlsx("fip613", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
@@ -1388,6 +1094,7 @@ def api_ped_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_status_job("ped", last.id),
             },
         }
     )
@@ -1431,16 +1138,13 @@ def api_ped_upload():
         db.session.add(registro)
         db.session.commit()
 
-        total, output_path = run_ped(save_path, data_arquivo, user_email, registro.id)
-
-        registro.output_filename = str(output_path.name)
-        db.session.commit()
-
+        write_status("ped", registro.id, "em processamento", "Arquivo recebido. Processamento em background.")
+        _start_worker("ped", registro.id)
         return jsonify(
             {
                 "ok": True,
-                "message": f"Processado com sucesso. Registros inseridos: {total}.",
-                "output": output_path.name,
+                "message": "Arquivo recebido. O processamento ocorrerá em segundo plano.",
+                "job_id": registro.id,
             }
         )
     except Exception as exc:
@@ -1448,6 +1152,20 @@ def api_ped_upload():
         return jsonify({"error": f"Falha ao processar: {exc}"}), 500
 
 
+@home_bp.route("/api/ped/reprocess", methods=["POST"])
+@login_required
+@require_feature("atualizar/ped")
+def api_ped_reprocess():
+    return _reprocessar_upload("ped", PedUpload, PED_UPLOAD_DIR)
+
+
+@home_bp.route("/api/ped/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/ped")
+def api_ped_cancel():
+    return _cancelar_upload("ped", PedUpload)
+
+
 # EMP
 
 
@@ -1538,6 +1256,7 @@ def api_est_emp_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_status_job("est_emp", last.id),
             },
         }
     )
@@ -1651,46 +1370,14 @@ def api_emp_upload():
 @login_required
 @require_feature("atualizar/emp")
 def api_emp_reprocess():
-    payload = request.get_json(silent=True) or {}
-    upload_id = payload.get("upload_id")
-    if upload_id:
-        registro = db.session.get(EmpUpload, upload_id)
-    else:
-        registro = EmpUpload.query.order_by(EmpUpload.uploaded_at.desc()).first()
-    if not registro:
-        return jsonify({"error": "Nenhum upload encontrado para reprocessar."}), 404
-    try:
-        file_path = _find_upload_path(EMP_UPLOAD_DIR, registro.stored_filename)
-        if not file_path:
-            return jsonify({"error": "Arquivo do upload nao encontrado."}), 404
-        # garante o caminho correto para o worker
-        if file_path.parent.name == "tmp":
-            registro.stored_filename = f"tmp/{file_path.name}"
-        registro.output_filename = None
-        db.session.commit()
-        write_status("emp", registro.id, "em processamento", "Reprocessamento iniciado.")
-        _start_worker("emp", registro.id)
-        return jsonify({"ok": True, "message": "Reprocessamento iniciado.", "job_id": registro.id})
-    except Exception as exc:
-        db.session.rollback()
-        return jsonify({"error": f"Falha ao reprocessar: {exc}"}), 500
+    return _reprocessar_upload("emp", EmpUpload, EMP_UPLOAD_DIR)
 
 
 @home_bp.route("/api/emp/cancel", methods=["POST"])
 @login_required
 @require_feature("atualizar/emp")
 def api_emp_cancel():
-    payload = request.get_json(silent=True) or {}
-    upload_id = payload.get("upload_id")
-    if upload_id:
-        registro = db.session.get(EmpUpload, upload_id)
-    else:
-        registro = EmpUpload.query.order_by(EmpUpload.uploaded_at.desc()).first()
-    if not registro:
-        return jsonify({"error": "Nenhum upload encontrado para cancelar."}), 404
-    set_cancel_flag("emp", registro.id)
-    update_status_fields("emp", registro.id, message="Cancelamento solicitado.")
-    return jsonify({"ok": True, "message": "Cancelamento solicitado.", "job_id": registro.id})
+    return _cancelar_upload("emp", EmpUpload)
 
 
 @home_bp.route("/api/est-emp/upload", methods=["POST"])
@@ -1731,16 +1418,13 @@ def api_est_emp_upload():
         db.session.add(registro)
         db.session.commit()
 
-        total, output_path = run_est_emp(save_path, data_arquivo, user_email, registro.id)
-
-        registro.output_filename = str(output_path.name)
-        db.session.commit()
-
+        write_status("est_emp", registro.id, "em processamento", "Arquivo recebido. Processamento em background.")
+        _start_worker("est_emp", registro.id)
         return jsonify(
             {
                 "ok": True,
-                "message": f"Processado com sucesso. Registros inseridos: {total}.",
-                "output": output_path.name,
+                "message": "Arquivo recebido. O processamento ocorrerá em segundo plano.",
+                "job_id": registro.id,
             }
         )
     except Exception as exc:
@@ -1748,6 +1432,20 @@ def api_est_emp_upload():
         return jsonify({"error": f"Falha ao processar: {exc}"}), 500
 
 
+@home_bp.route("/api/est-emp/reprocess", methods=["POST"])
+@login_required
+@require_feature("atualizar/est-emp")
+def api_est_emp_reprocess():
+    return _reprocessar_upload("est_emp", EstEmpUpload, EST_EMP_UPLOAD_DIR)
+
+
+@home_bp.route("/api/est-emp/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/est-emp")
+def api_est_emp_cancel():
+    return _cancelar_upload("est_emp", EstEmpUpload)
+
+
 @home_bp.route("/api/nob/upload", methods=["POST"])
 @login_required
 @require_feature("atualizar/nob")
@@ -1804,45 +1502,14 @@ def api_nob_upload():
 @login_required
 @require_feature("atualizar/nob")
 def api_nob_reprocess():
-    payload = request.get_json(silent=True) or {}
-    upload_id = payload.get("upload_id")
-    if upload_id:
-        registro = db.session.get(NobUpload, upload_id)
-    else:
-        registro = NobUpload.query.order_by(NobUpload.uploaded_at.desc()).first()
-    if not registro:
-        return jsonify({"error": "Nenhum upload encontrado para reprocessar."}), 404
-    try:
-        file_path = _find_upload_path(NOB_UPLOAD_DIR, registro.stored_filename)
-        if not file_path:
-            return jsonify({"error": "Arquivo do upload nao encontrado."}), 404
-        if file_path.parent.name == "tmp":
-            registro.stored_filename = f"tmp/{file_path.name}"
-        registro.output_filename = None
-        db.session.commit()
-        write_status("nob", registro.id, "em processamento", "Reprocessamento iniciado.")
-        _start_worker("nob", registro.id)
-        return jsonify({"ok": True, "message": "Reprocessamento iniciado.", "job_id": registro.id})
-    except Exception as exc:
-        db.session.rollback()
-        return jsonify({"error": f"Falha ao reprocessar: {exc}"}), 500
+    return _reprocessar_upload("nob", NobUpload, NOB_UPLOAD_DIR)
 
 
 @home_bp.route("/api/nob/cancel", methods=["POST"])
 @login_required
 @require_feature("atualizar/nob")
 def api_nob_cancel():
-    payload = request.get_json(silent=True) or {}
-    upload_id = payload.get("upload_id")
-    if upload_id:
-        registro = db.session.get(NobUpload, upload_id)
-    else:
-        registro = NobUpload.query.order_by(NobUpload.uploaded_at.desc()).first()
-    if not registro:
-        return jsonify({"error": "Nenhum upload encontrado para cancelar."}), 404
-    set_cancel_flag("nob", registro.id)
-    update_status_fields("nob", registro.id, message="Cancelamento solicitado.")
-    return jsonify({"ok": True, "message": "Cancelamento solicitado.", "job_id": registro.id})
+    return _cancelar_upload("nob", NobUpload)
 
 
 @home_bp.route("/api/ped/download/<path:filename>", methods=["GET"])
@@ -1855,6 +1522,162 @@ def api_ped_download(filename):
     return send_file(target, as_attachment=True)
 
 
+PED_RELATORIO_COLUNAS = tuple(c[0] for c in spec_relatorio("ped")["colunas"])
+PED_RELATORIO_FILTROS = ("exercicio", "uo", "ug", "paoe", "fonte")
+# Keyset so em colunas de texto: o cursor sai da linha ja convertida e precisa ser o valor do
+# banco (valor_ped/valor_estorno sao VARCHAR pt-BR; ordena-los como texto nao e numerico).
+# historico e TEXT e nao serve para ordenacao/keyset.
+PED_RELATORIO_ORDENAVEIS = frozenset(
+    campo for campo, _rotulo, tipo in spec_relatorio("ped")["colunas"] if tipo == "texto" and campo != "historico"
+)
+# Filtros por valor exato em qualquer coluna (menos historico) e na chave exibida na tabela.
+# Nas colunas de PED_RELATORIO_FILTROS os valores tambem podem vir separados por virgula.
+PED_RELATORIO_FILTRAVEIS = tuple(c for c in PED_RELATORIO_COLUNAS if c != "historico") + ("chave_display",)
+# Mesma regra de _serie_chave_display (relatorios): exercicio >= 2026 usa chave.
+PED_CHAVE_DISPLAY_SQL = (
+    "CASE WHEN COALESCE(exercicio, '') >= '2026' AND COALESCE(chave, '') <> '' THEN chave "
+    "WHEN COALESCE(chave_planejamento, '') <> '' THEN chave_planejamento ELSE COALESCE(chave, '') END"
+)
+PED_RELATORIO_LIMITE_MAX = 5000
+PED_RELATORIO_STREAM_LOTE = 2000
+PED_RELATORIO_OPCOES_MAX = 5000
+
+
+def _sql_limit(sql: str, limite: int) -> str:
+    # SQL Server nao aceita LIMIT; usa TOP logo apos o SELECT.
+    if db.engine.dialect.name == "mssql":
+        return sql.replace("SELECT", f"SELECT TOP ({int(limite)})", 1)
+    return f"{sql} LIMIT {int(limite)}"
+
+
+def _ped_relatorio_params(args) -> dict:
+    raw_fields = (args.get("fields") or "").strip()
+    if raw_fields:
+        fields = []
+        for f in raw_fields.split(","):
+            f = f.strip()
+            if not f:
+                continue
+            if f not in PED_RELATORIO_COLUNAS:
+                raise ValueError(f"Campo invalido: {f}")
+            if f not in fields:
+                fields.append(f)
+        if not fields:
+            raise ValueError("Nenhum campo valido informado.")
+    else:
+        fields = list(PED_RELATORIO_COLUNAS)
+
+    filtros = {}
+    for campo in PED_RELATORIO_FILTRAVEIS:
+        brutos = args.getlist(campo)
+        if not brutos:
+            continue
+        if campo in PED_RELATORIO_FILTROS:
+            vals = [v.strip() for raw in brutos for v in raw.split(",") if v.strip()]
+        else:
+            # Valor exato; "" seleciona as linhas vazias.
+            vals = list(dict.fromkeys(v.strip() for v in brutos))
+        if vals:
+            filtros[campo] = vals
+    chave = (args.get("chave") or "").strip()
+
+    sort = (args.get("sort") or "").strip()
+    desc = sort.startswith("-")
+    sort_col = sort.lstrip("-") or "id"
+    if sort_col != "id" and sort_col not in PED_RELATORIO_ORDENAVEIS:
+        raise ValueError(f"Ordenacao invalida: {sort_col}")
+
+    limit_raw = args.get("limit")
+    after_id_raw = args.get("after_id")
+    try:
+        limit = int(limit_raw) if limit_raw not in (None, "") else None
+        after_id = int(after_id_raw) if after_id_raw not in (None, "") else None
+    except ValueError as exc:
+        raise ValueError("Parametros de paginacao invalidos.") from exc
+    if limit is not None:
+        limit = max(1, min(limit, PED_RELATORIO_LIMITE_MAX))
+
+    formato = (args.get("formato") or "").strip().lower()
+    if formato and formato not in ("json", "ndjson"):
+        raise ValueError(f"Formato invalido: {formato}")
+
+    return {
+        "fields": fields,
+        "filtros": filtros,
+        "chave": chave,
+        "sort_col": sort_col,
+        "desc": desc,
+        "limit": limit,
+        "after_id": after_id,
+        "after_val": args.get("after_val"),
+        "formato": formato,
+    }
+
+
+def _ped_relatorio_expr(campo: str) -> str:
+    return PED_CHAVE_DISPLAY_SQL if campo == "chave_display" else campo
+
+
+def _ped_relatorio_where(params: dict) -> tuple[list[str], dict]:
+    where = [filtro_ativos("ped")]
+    binds: dict = {}
+    for campo, vals in params["filtros"].items():
+        expr = _ped_relatorio_expr(campo)
+        names = []
+        for idx, val in enumerate(vals):
+            name = f"{campo}_{idx}"
+            binds[name] = val
+            names.append(f":{name}")
+        cond = f"{expr} IN ({', '.join(names)})"
+        if "" in vals:
+            cond = f"({cond} OR {expr} IS NULL)"
+        where.append(cond)
+    if params["chave"]:
+        binds["chave_norm"] = _normalize_chave(params["chave"])
+        where.append("chave_norm = :chave_norm")
+    return where, binds
+
+
+def _ped_relatorio_sql(params: dict, limite: int | None, after_id: int | None, after_val) -> tuple[str, dict]:
+    cols = ["id"] + [c for c in params["fields"] if c != "id"]
+    where, binds = _ped_relatorio_where(params)
+
+    sort_col = params["sort_col"]
+    op = "<" if params["desc"] else ">"
+    direcao = "DESC" if params["desc"] else "ASC"
+    if after_id is not None:
+        binds["after_id"] = after_id
+        if sort_col == "id":
+            where.append(f"id {op} :after_id")
+        else:
+            # Keyset composto (coluna de ordenacao, id) para nao repetir/pular linhas.
+            binds["after_val"] = after_val if after_val is not None else ""
+            sort_expr = f"COALESCE({sort_col}, '')"
+            where.append(
+                f"({sort_expr} {op} :after_val OR ({sort_expr} = :after_val AND id {op} :after_id))"
+            )
+    if sort_col == "id":
+        order = f"id {direcao}"
+    else:
+        order = f"COALESCE({sort_col}, '') {direcao}, id {direcao}"
+
+    sql = f"SELECT {', '.join(cols)} FROM ped WHERE {' AND '.join(where)} ORDER BY {order}"
+    if limite is not None:
+        sql = _sql_limit(sql, limite)
+    return sql, binds
+
+
+def _ped_relatorio_registros(sql: str, binds: dict) -> list[dict]:
+    return registros_json(montar_dataframe(spec_relatorio("ped"), carregar_colunas(sql, binds)))
+
+
+def _cursor_val(row: dict, sort_col: str):
+    if sort_col == "id":
+        return None
+    val = row.get(sort_col)
+    return "" if val is None else str(val)
+
+
 @home_bp.route("/api/relatorios/ped", methods=["GET"])
 @login_required
 @require_feature("relatorios/ped")
@@ -1868,479 +1691,138 @@ def api_relatorio_ped():
             except Exception:
                 return str(value)
         try:
-            from datetime import datetime
-
             return datetime.fromisoformat(str(value)).isoformat()
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
+    try:
+        params = _ped_relatorio_params(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
 
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_ped,
-                        numero_ped_estorno,
-                        numero_emp,
-                        numero_cad,
-                        numero_noblist,
-                        numero_os,
-                        convenio,
-                        numero_processo_orcamentario_pagamento,
-                        valor_ped,
-                        valor_estorno,
-                        indicativo_licitacao_exercicios_anteriores,
-                        data_licitacao,
-                        liberado_fisco_estadual,
-                        situacao,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        data_solicitacao,
-                        data_criacao,
-                        tipo_empenho,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento,
-                        fonte,
-                        iduso,
-                        numero_emenda_ep,
-                        autor_emenda_ep,
-                        numero_cac,
-                        licitacao,
-                        usuario_responsavel,
-                        historico,
-                        credor,
-                        nome_credor,
-                        data_autorizacao,
-                        data_hora_cadastro_autorizacao,
-                        tipo_despesa,
-                        numero_abj,
-                        numero_processo_sequestro_judicial,
-                        indicativo_entrega_imediata,
-                        indicativo_contrato,
-                        codigo_uo_extinta,
-                        devolucao_gcv,
-                        mes_competencia_folha_pagamento,
-                        exercicio_competencia_folha,
-                        obrigacao_patronal,
-                        tipo_obrigacao_patronal,
-                        numero_nla
-                    FROM ped
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
+        last_upload = PedUpload.query.order_by(PedUpload.uploaded_at.desc()).first()
+        meta = {
+            "data_arquivo": _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None,
+            "uploaded_at": _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None,
+            "user_email": last_upload.user_email if last_upload else None,
+        }
+        if params["formato"] == "ndjson":
+            def _gerar():
+                # Primeira linha com metadados; depois uma linha JSON por registro, em lotes por keyset.
+                yield json.dumps({"meta": meta}, default=str) + "\n"
+                after_id, after_val = params["after_id"], params["after_val"]
+                restante = params["limit"]
+                while restante is None or restante > 0:
+                    lote = PED_RELATORIO_STREAM_LOTE if restante is None else min(restante, PED_RELATORIO_STREAM_LOTE)
+                    sql, binds = _ped_relatorio_sql(params, lote, after_id, after_val)
+                    rows = _ped_relatorio_registros(sql, binds)
+                    for r in rows:
+                        yield json.dumps(r, default=str) + "\n"
+                    if len(rows) < lote:
+                        break
+                    after_id = rows[-1].get("id")
+                    after_val = _cursor_val(rows[-1], params["sort_col"])
+                    if restante is not None:
+                        restante -= len(rows)
+
+            return Response(stream_with_context(_gerar()), mimetype="application/x-ndjson")
+
+        paginado = params["limit"] is not None or params["after_id"] is not None
+        limite = (params["limit"] or PED_RELATORIO_LIMITE_MAX) if paginado else None
+        # Busca uma linha a mais para saber se ha proxima pagina.
+        sql, binds = _ped_relatorio_sql(
+            params, limite + 1 if limite else None, params["after_id"], params["after_val"]
         )
+        rows = _ped_relatorio_registros(sql, binds)
+
+        payload = {"ok": True, **meta}
+        if paginado:
+            has_more = len(rows) > limite
+            rows = rows[:limite]
+            payload["has_more"] = has_more
+            payload["next_after_id"] = rows[-1].get("id") if has_more and rows else None
+            payload["next_after_val"] = _cursor_val(rows[-1], params["sort_col"]) if has_more and rows else None
+        payload["data"] = rows
+        return jsonify(payload)
+    except Exception as exc:
+        return jsonify({"error": f"Falha ao buscar dados do PED: {exc}"}), 500
 
-        last_upload = PedUpload.query.order_by(PedUpload.uploaded_at.desc()).first()
-        data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
-        uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
-        user_email = last_upload.user_email if last_upload else None
 
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "chave": r.get("chave"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "exercicio": r.get("exercicio"),
-                    "numero_ped": r.get("numero_ped"),
-                    "numero_ped_estorno": r.get("numero_ped_estorno"),
-                    "numero_emp": r.get("numero_emp"),
-                    "numero_cad": r.get("numero_cad"),
-                    "numero_noblist": r.get("numero_noblist"),
-                    "numero_os": r.get("numero_os"),
-                    "convenio": r.get("convenio"),
-                    "numero_processo_orcamentario_pagamento": r.get("numero_processo_orcamentario_pagamento"),
-                    "valor_ped": _to_float(r.get("valor_ped")),
-                    "valor_estorno": _to_float(r.get("valor_estorno")),
-                    "indicativo_licitacao_exercicios_anteriores": r.get("indicativo_licitacao_exercicios_anteriores"),
-                    "data_licitacao": r.get("data_licitacao"),
-                    "liberado_fisco_estadual": r.get("liberado_fisco_estadual"),
-                    "situacao": r.get("situacao"),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "data_solicitacao": r.get("data_solicitacao"),
-                    "data_criacao": r.get("data_criacao"),
-                    "tipo_empenho": r.get("tipo_empenho"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "nome_elemento": r.get("nome_elemento"),
-                    "fonte": r.get("fonte"),
-                    "iduso": r.get("iduso"),
-                    "numero_emenda_ep": r.get("numero_emenda_ep"),
-                    "autor_emenda_ep": r.get("autor_emenda_ep"),
-                    "numero_cac": r.get("numero_cac"),
-                    "licitacao": r.get("licitacao"),
-                    "usuario_responsavel": r.get("usuario_responsavel"),
-                    "historico": r.get("historico"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "data_autorizacao": r.get("data_autorizacao"),
-                    "data_hora_cadastro_autorizacao": r.get("data_hora_cadastro_autorizacao"),
-                    "tipo_despesa": r.get("tipo_despesa"),
-                    "numero_abj": r.get("numero_abj"),
-                    "numero_processo_sequestro_judicial": r.get("numero_processo_sequestro_judicial"),
-                    "indicativo_entrega_imediata": r.get("indicativo_entrega_imediata"),
-                    "indicativo_contrato": r.get("indicativo_contrato"),
-                    "codigo_uo_extinta": r.get("codigo_uo_extinta"),
-                    "devolucao_gcv": r.get("devolucao_gcv"),
-                    "mes_competencia_folha_pagamento": r.get("mes_competencia_folha_pagamento"),
-                    "exercicio_competencia_folha": r.get("exercicio_competencia_folha"),
-                    "obrigacao_patronal": r.get("obrigacao_patronal"),
-                    "tipo_obrigacao_patronal": r.get("tipo_obrigacao_patronal"),
-                    "numero_nla": r.get("numero_nla"),
-                }
-            )
+@home_bp.route("/api/relatorios/ped/opcoes", methods=["GET"])
+@login_required
+@require_feature("relatorios/ped")
+def api_relatorio_ped_opcoes():
+    """Valores distintos de uma coluna (campo=) nas linhas que atendem aos filtros."""
+    campo = (request.args.get("campo") or "").strip()
+    if campo not in PED_RELATORIO_FILTRAVEIS:
+        return jsonify({"error": f"Campo invalido: {campo}"}), 400
+    try:
+        params = _ped_relatorio_params(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    try:
+        where, binds = _ped_relatorio_where(params)
+        expr = f"COALESCE({_ped_relatorio_expr(campo)}, '')"
+        sql = _sql_limit(
+            # GROUP BY no lugar de DISTINCT: o TOP do SQL Server nao pode vir antes do DISTINCT.
+            f"SELECT {expr} AS valor FROM ped WHERE {' AND '.join(where)} GROUP BY {expr} ORDER BY valor",
+            PED_RELATORIO_OPCOES_MAX + 1,
+        )
+        valores = ["" if v is None else str(v) for v in carregar_colunas(sql, binds)["valor"]]
+        truncado = len(valores) > PED_RELATORIO_OPCOES_MAX
+        return jsonify({"ok": True, "data": valores[:PED_RELATORIO_OPCOES_MAX], "truncado": truncado})
+    except Exception as exc:
+        return jsonify({"error": f"Falha ao buscar opcoes do PED: {exc}"}), 500
+
 
+@home_bp.route("/api/relatorios/ped/resumo", methods=["GET"])
+@login_required
+@require_feature("relatorios/ped")
+def api_relatorio_ped_resumo():
+    """Total de linhas, soma do valor_ped e exercicios das linhas que atendem aos filtros."""
+    try:
+        params = _ped_relatorio_params(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    try:
+        where, binds = _ped_relatorio_where(params)
+        # valor_ped e VARCHAR pt-BR: agrupa no banco e converte so os valores distintos.
+        sql = (
+            f"SELECT exercicio, valor_ped, COUNT(*) AS n FROM ped WHERE {' AND '.join(where)} "
+            "GROUP BY exercicio, valor_ped"
+        )
+        df = montar_dataframe(spec_relatorio("ped"), carregar_colunas(sql, binds))
+        if df.empty:
+            return jsonify({"ok": True, "total": 0, "valor_ped": 0.0, "exercicios": []})
+        contagem = df["n"].astype(int)
+        exercicios = sorted({str(ex) for ex in df["exercicio"] if ex not in (None, "")})
         return jsonify(
             {
                 "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
+                "total": int(contagem.sum()),
+                "valor_ped": round(float((df["valor_ped"] * contagem).sum()), 2),
+                "exercicios": exercicios,
             }
         )
     except Exception as exc:
-        return jsonify({"error": f"Falha ao buscar dados do PED: {exc}"}), 500
+        return jsonify({"error": f"Falha ao resumir o PED: {exc}"}), 500
 
 
 @home_bp.route("/api/relatorios/ped/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/ped")
 def api_relatorio_ped_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_ped,
-                        numero_ped_estorno,
-                        numero_emp,
-                        numero_cad,
-                        numero_noblist,
-                        numero_os,
-                        convenio,
-                        numero_processo_orcamentario_pagamento,
-                        valor_ped,
-                        valor_estorno,
-                        indicativo_licitacao_exercicios_anteriores,
-                        data_licitacao,
-                        liberado_fisco_estadual,
-                        situacao,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        data_solicitacao,
-                        data_criacao,
-                        tipo_empenho,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento,
-                        fonte,
-                        iduso,
-                        numero_emenda_ep,
-                        autor_emenda_ep,
-                        numero_cac,
-                        licitacao,
-                        usuario_responsavel,
-                        historico,
-                        credor,
-                        nome_credor,
-                        data_autorizacao,
-                        data_hora_cadastro_autorizacao,
-                        tipo_despesa,
-                        numero_abj,
-                        numero_processo_sequestro_judicial,
-                        indicativo_entrega_imediata,
-                        indicativo_contrato,
-                        codigo_uo_extinta,
-                        devolucao_gcv,
-                        mes_competencia_folha_pagamento,
-                        exercicio_competencia_folha,
-                        obrigacao_patronal,
-                        tipo_obrigacao_patronal,
-                        numero_nla
-                    FROM ped
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
+        df = carregar_relatorio("ped")
+        if df.empty:
             return jsonify({"error": "Nenhum dado para exportar."}), 404
-
-        df = pd.DataFrame(rows)
-
-        def _chave_display(row):
-            try:
-                ex = int(str(row.get("exercicio") or 0)[:4])
-            except Exception:
-                ex = 0
-            chave = row.get("chave") or ""
-            chave_plan = row.get("chave_planejamento") or ""
-            if ex >= 2026 and chave:
-                return chave
-            return chave_plan or chave
-
-        df["Chave / Chave de Planejamento"] = df.apply(_chave_display, axis=1)
-        df.drop(columns=["chave", "chave_planejamento"], inplace=True, errors="ignore")
-        if "valor_ped" in df.columns:
-            df["valor_ped"] = df["valor_ped"].apply(_to_float)
-        if "valor_estorno" in df.columns:
-            df["valor_estorno"] = df["valor_estorno"].apply(_to_float)
-
-        rename_map = {
-            "regiao": "Região",
-            "subfuncao_ug": "Subfunção + UG",
-            "adj": "ADJ",
-            "macropolitica": "Macropolítica",
-            "pilar": "Pilar",
-            "eixo": "Eixo",
-            "politica_decreto": "Política_Decreto",
-            "exercicio": "Exercício",
-            "numero_ped": "Nº PED",
-            "numero_ped_estorno": "Nº PED Estorno/Estornado",
-            "numero_emp": "Nº EMP",
-            "numero_cad": "Nº CAD",
-            "numero_noblist": "Nº NOBLIST",
-            "numero_os": "Nº OS",
-            "convenio": "Convênio",
-            "numero_processo_orcamentario_pagamento": "Nº Processo Orçamentário de Pagamento",
-            "valor_ped": "Valor PED",
-            "valor_estorno": "Valor do Estorno",
-            "indicativo_licitacao_exercicios_anteriores": "Indicativo de Licitação de Exercícios Anteriores",
-            "data_licitacao": "Data da Licitação",
-            "liberado_fisco_estadual": "Liberado Fisco Estadual",
-            "situacao": "Situação",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orçamentária",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "data_solicitacao": "Data Solicitação",
-            "data_criacao": "Data Criação",
-            "tipo_empenho": "Tipo Empenho",
-            "dotacao_orcamentaria": "Dotação Orçamentária",
-            "funcao": "Função",
-            "subfuncao": "Subfunção",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "nome_elemento": "Nome do Elemento",
-            "fonte": "Fonte",
-            "iduso": "Iduso",
-            "numero_emenda_ep": "Nº Emenda (EP)",
-            "autor_emenda_ep": "Autor da Emenda (EP)",
-            "numero_cac": "Nº CAC",
-            "licitacao": "Licitação",
-            "usuario_responsavel": "Usuário Responsável",
-            "historico": "Histórico",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "data_autorizacao": "Data Autorização",
-            "data_hora_cadastro_autorizacao": "Data/Hora Cadastro Autorização",
-            "tipo_despesa": "Tipo de Despesa",
-            "numero_abj": "Nº ABJ",
-            "numero_processo_sequestro_judicial": "Nº Processo do Sequestro Judicial",
-            "indicativo_entrega_imediata": "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666",
-            "indicativo_contrato": "Indicativo de contrato",
-            "codigo_uo_extinta": "Código UO Extinta",
-            "devolucao_gcv": "Devolução GCV",
-            "mes_competencia_folha_pagamento": "Mês de Competência da Folha de Pagamento",
-            "exercicio_competencia_folha": "Exercício de Competência da Folha de Pagamento",
-            "obrigacao_patronal": "Obrigação Patronal",
-            "tipo_obrigacao_patronal": "Tipo de Obrigação Patronal",
-            "numero_nla": "Nº NLA",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Chave / Chave de Planejamento",
-            "Região",
-            "Subfunção + UG",
-            "ADJ",
-            "Macropolítica",
-            "Pilar",
-            "Eixo",
-            "Política_Decreto",
-            "Exercício",
-            "Nº PED",
-            "Nº PED Estorno/Estornado",
-            "Nº EMP",
-            "Nº CAD",
-            "Nº NOBLIST",
-            "Nº OS",
-            "Convênio",
-            "Nº Processo Orçamentário de Pagamento",
-            "Valor PED",
-            "Valor do Estorno",
-            "Indicativo de Licitação de Exercícios Anteriores",
-            "Data da Licitação",
-            "Liberado Fisco Estadual",
-            "Situação",
-            "UO",
-            "Nome da Unidade Orçamentária",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Data Solicitação",
-            "Data Criação",
-            "Tipo Empenho",
-            "Dotação Orçamentária",
-            "Função",
-            "Subfunção",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Nome do Elemento",
-            "Fonte",
-            "Iduso",
-            "Nº Emenda (EP)",
-            "Autor da Emenda (EP)",
-            "Nº CAC",
-            "Licitação",
-            "Usuário Responsável",
-            "Histórico",
-            "Credor",
-            "Nome do Credor",
-            "Data Autorização",
-            "Data/Hora Cadastro Autorização",
-            "Tipo de Despesa",
-            "Nº ABJ",
-            "Nº Processo do Sequestro Judicial",
-            "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666",
-            "Indicativo de contrato",
-            "Código UO Extinta",
-            "Devolução GCV",
-            "Mês de Competência da Folha de Pagamento",
-            "Exercício de Competência da Folha de Pagamento",
-            "Obrigação Patronal",
-            "Tipo de Obrigação Patronal",
-            "Nº NLA",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="PED", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["PED"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"ped_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        return _enviar_xlsx("ped", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
 
 # Plan20 SEDUC
-PLAN20_UPLOAD_DIR = Path("upload/plan20_seduc")
-PLAN20_OUTPUT_DIR = Path("outputs/plan20_seduc")
 
 
 @home_bp.route("/api/plan20/status", methods=["GET"])
@@ -2379,6 +1861,7 @@ def api_plan20_status():
         "data_arquivo": _as_iso(registro.data_arquivo),
         "original_filename": registro.original_filename,
         "output_filename": registro.output_filename,
+        **_status_job("plan20", registro.id),
     }
     return jsonify({"ok": True, "last": last})
 
@@ -2425,9 +1908,7 @@ def api_plan20_upload():
 
     try:
         PLAN20_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-        PLAN20_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
         (PLAN20_UPLOAD_DIR / "tmp").mkdir(parents=True, exist_ok=True)
-        (PLAN20_OUTPUT_DIR / "tmp").mkdir(parents=True, exist_ok=True)
 
         for f in PLAN20_UPLOAD_DIR.glob("*.xlsx"):
             dest = PLAN20_UPLOAD_DIR / "tmp" / f"{f.stem}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{f.suffix}"
@@ -2435,178 +1916,33 @@ def api_plan20_upload():
                 f.rename(dest)
             except OSError:
                 pass
-        for f in PLAN20_OUTPUT_DIR.glob("*.xlsx"):
-            dest = PLAN20_OUTPUT_DIR / "tmp" / f"{f.stem}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{f.suffix}"
-            try:
-                f.rename(dest)
-            except OSError:
-                pass
-
         stored_name = f"plan20_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
         save_path = PLAN20_UPLOAD_DIR / stored_name
         arquivo.save(save_path)
 
-        output_path = run_plan20(save_path, PLAN20_OUTPUT_DIR)
-
         registro = Plan20Upload(
             user_email=user_email,
             original_filename=arquivo.filename,
             stored_filename=stored_name,
-            output_filename=output_path.name if output_path else None,
             data_arquivo=data_arquivo,
             uploaded_at=datetime.utcnow(),
         )
         db.session.add(registro)
         db.session.commit()
 
-        # Insere dados na tabela plan20_seduc a partir do arquivo processado
-        try:
-            df_out = pd.read_excel(output_path, sheet_name="Plan20_SEDUC")
-            if not df_out.empty:
-                col_map = {
-                    "Exercício": "exercicio",
-                    "Programa": "programa",
-                    "Função": "funcao",
-                    "Unidade Orçamentária": "unidade_orcamentaria",
-                    "Ação (P/A/OE)": "acao_paoe",
-                    "Subfunção": "subfuncao",
-                    "Objetivo Específico": "objetivo_especifico",
-                    "Esfera": "esfera",
-                    "Responsável pela Ação": "responsavel_acao",
-                    "Produto(s) da Ação": "produto_acao",
-                    "Unidade de Medida do Produto": "unid_medida_produto",
-                    "Região do Produto": "regiao_produto",
-                    "Meta do Produto": "meta_produto",
-                    "Saldo Meta do Produto": "saldo_meta_produto",
-                    "Público Transversal": "publico_transversal",
-                    "Subação/entrega": "subacao_entrega",
-                    "Responsável": "responsavel",
-                    "Prazo": "prazo",
-                    "Unid. Gestora": "unid_gestora",
-                    "Unidade Setorial de Planejamento": "unidade_setorial_planejamento",
-                    "Produto da Subação": "produto_subacao",
-                    "Unidade de Medida": "unidade_medida",
-                    "Região da Subação": "regiao_subacao",
-                    "Código": "codigo",
-                    "Município(s) da entrega": "municipios_entrega",
-                    "Meta da Subação": "meta_subacao",
-                    "Detalhamento do produto": "detalhamento_produto",
-                    "Etapa": "etapa",
-                    "Responsável da Etapa": "responsavel_etapa",
-                    "Prazo da Etapa": "prazo_etapa",
-                    "Região da Etapa": "regiao_etapa",
-                    "Natureza": "natureza",
-                    "Fonte": "fonte",
-                    "IDU": "idu",
-                    "Descrição do Item de Despesa": "descricao_item_despesa",
-                    "Unid. Medida": "unid_medida_item",
-                    "Quantidade": "quantidade",
-                    "Valor Unitário": "valor_unitario",
-                    "Valor Total": "valor_total",
-                    "Chave de Planejamento": "chave_planejamento",
-                    "Região": "regiao",
-                    "Subfunção + UG": "subfuncao_ug",
-                    "ADJ": "adj",
-                    "Macropolitica": "macropolitica",
-                    "Pilar": "pilar",
-                    "Eixo": "eixo",
-                    "Politica_Decreto": "politica_decreto",
-                    "Público Transversal (chave)": "publico_transversal_chave",
-                    "Cat.Econ": "cat_econ",
-                    "Grupo": "grupo",
-                    "Modalidade": "modalidade",
-                    "Elemento": "elemento",
-                    "Subelemento": "subelemento",
-                }
-
-                def _norm_col(name: str) -> str:
-                    base = unicodedata.normalize("NFKD", str(name or ""))
-                    ascii_only = "".join(ch for ch in base if not unicodedata.combining(ch))
-                    return ascii_only.lower().replace(" ", "").replace("_", "").replace(".", "").replace("/", "")
-
-                norm_map = {_norm_col(src): dst for src, dst in col_map.items()}
-                rename_dict = {}
-                for col in df_out.columns:
-                    norm = _norm_col(col)
-                    if norm in norm_map:
-                        rename_dict[col] = norm_map[norm]
-                df_out = df_out.rename(columns=rename_dict)
-
-                meta_cols = {
-                    "data_atualizacao",
-                    "ano",
-                    "data_arquivo",
-                    "user_email",
-                    "ativo",
-                }
-                keep_cols = list(col_map.values()) + list(meta_cols)
-                for col in keep_cols:
-                    if col not in df_out.columns:
-                        df_out[col] = None
-                df_out = df_out[[c for c in keep_cols if c in df_out.columns]]
-
-                # Converte colunas numericas para evitar erro de cast (usa formato pt-BR)
-                def _to_numeric_br(series):
-                    return pd.to_numeric(
-                        series.astype(str)
-                        .str.replace(".", "", regex=False)
-                        .str.replace(",", ".", regex=False),
-                        errors="coerce",
-                    )
-
-                # Apenas colunas realmente numéricas no banco
-                numeric_cols = [
-                    "exercicio",
-                    "quantidade",
-                    "valor_unitario",
-                    "valor_total",
-                ]
-                for col in numeric_cols:
-                    if col in df_out.columns:
-                        df_out[col] = _to_numeric_br(df_out[col])
-
-                now = datetime.utcnow()
-                df_out["data_atualizacao"] = now
-                df_out["data_arquivo"] = data_arquivo
-                df_out["user_email"] = user_email
-                df_out["ativo"] = True
-                if "exercicio" in df_out.columns:
-                    df_out["ano"] = pd.to_numeric(df_out["exercicio"], errors="coerce")
-                else:
-                    df_out["ano"] = None
-                # Desativa somente registros do mesmo exercicio+unidade_orcamentaria
-                combos = set()
-                if "unidade_orcamentaria" in df_out.columns and "exercicio" in df_out.columns:
-                    for _, uo, ex in df_out[["unidade_orcamentaria", "exercicio"]].dropna().itertuples():
-                        try:
-                            ex_int = int(ex)
-                        except (TypeError, ValueError):
-                            continue
-                        combos.add((str(uo).strip(), ex_int))
-                for uo, ex in combos:
-                    db.session.execute(
-                        text(
-                            "UPDATE plan20_seduc SET ativo = 0 WHERE unidade_orcamentaria = :uo AND exercicio = :ex"
-                        ),
-                        {"uo": uo, "ex": ex},
-                    )
-                db.session.commit()
-                df_out.to_sql("plan20_seduc", db.engine, if_exists="append", index=False)
-        except Exception as exc:
-            db.session.rollback()
-            return jsonify({"error": f"Plan20 processado, mas falha ao gravar no banco: {exc}"}), 500
-
+        write_status("plan20", registro.id, "em processamento", "Arquivo recebido. Processamento em background.")
+        _start_worker("plan20", registro.id)
         return jsonify(
             {
                 "ok": True,
-                "message": "Plan20 processado com sucesso.",
-                "output": output_path.name,
+                "message": "Arquivo recebido. O processamento ocorrerá em segundo plano.",
+                "job_id": registro.id,
                 "last": {
                     "user_email": user_email,
                     "uploaded_at": _as_iso(registro.uploaded_at),
                     "data_arquivo": _as_iso(data_arquivo),
                     "original_filename": arquivo.filename,
-                    "output_filename": output_path.name,
+                    "output_filename": None,
                 },
             }
         )
@@ -2615,6 +1951,20 @@ def api_plan20_upload():
         return jsonify({"error": f"Falha ao processar: {exc}"}), 500
 
 
+@home_bp.route("/api/plan20/reprocess", methods=["POST"])
+@login_required
+@require_feature("atualizar/plan20-seduc")
+def api_plan20_reprocess():
+    return _reprocessar_upload("plan20", Plan20Upload, PLAN20_UPLOAD_DIR)
+
+
+@home_bp.route("/api/plan20/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/plan20-seduc")
+def api_plan20_cancel():
+    return _cancelar_upload("plan20", Plan20Upload)
+
+
 @home_bp.route("/api/plan20/download/<path:filename>", methods=["GET"])
 @login_required
 @require_feature("atualizar/plan20-seduc")
@@ -2638,160 +1988,20 @@ def api_relatorio_plan20():
             except Exception:
                 return str(value)
         try:
-            from datetime import datetime
-
             return datetime.fromisoformat(str(value)).isoformat()
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        publico_transversal_chave,
-                        programa,
-                        funcao,
-                        unidade_orcamentaria,
-                        acao_paoe,
-                        subfuncao,
-                        objetivo_especifico,
-                        esfera,
-                        responsavel_acao,
-                        produto_acao,
-                        unid_medida_produto,
-                        regiao_produto,
-                        meta_produto,
-                        saldo_meta_produto,
-                        publico_transversal,
-                        subacao_entrega,
-                        responsavel,
-                        prazo,
-                        unid_gestora,
-                        unidade_setorial_planejamento,
-                        produto_subacao,
-                        unidade_medida,
-                        regiao_subacao,
-                        codigo,
-                        municipios_entrega,
-                        meta_subacao,
-                        detalhamento_produto,
-                        etapa,
-                        responsavel_etapa,
-                        prazo_etapa,
-                        regiao_etapa,
-                        natureza,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        subelemento,
-                        fonte,
-                        idu,
-                        descricao_item_despesa,
-                        unid_medida_item,
-                        quantidade,
-                        valor_unitario,
-                        valor_total
-                    FROM plan20_seduc
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-
+        df = carregar_relatorio("plan20")
         last_upload = Plan20Upload.query.order_by(Plan20Upload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "publico_transversal_chave": r.get("publico_transversal_chave"),
-                    "programa": r.get("programa"),
-                    "funcao": r.get("funcao"),
-                    "unidade_orcamentaria": r.get("unidade_orcamentaria"),
-                    "acao_paoe": r.get("acao_paoe"),
-                    "subfuncao": r.get("subfuncao"),
-                    "objetivo_especifico": r.get("objetivo_especifico"),
-                    "esfera": r.get("esfera"),
-                    "responsavel_acao": r.get("responsavel_acao"),
-                    "produto_acao": r.get("produto_acao"),
-                    "unid_medida_produto": r.get("unid_medida_produto"),
-                    "regiao_produto": r.get("regiao_produto"),
-                    "meta_produto": r.get("meta_produto"),
-                    "saldo_meta_produto": r.get("saldo_meta_produto"),
-                    "publico_transversal": r.get("publico_transversal"),
-                    "subacao_entrega": r.get("subacao_entrega"),
-                    "responsavel": r.get("responsavel"),
-                    "prazo": r.get("prazo"),
-                    "unid_gestora": r.get("unid_gestora"),
-                    "unidade_setorial_planejamento": r.get("unidade_setorial_planejamento"),
-                    "produto_subacao": r.get("produto_subacao"),
-                    "unidade_medida": r.get("unidade_medida"),
-                    "regiao_subacao": r.get("regiao_subacao"),
-                    "codigo": r.get("codigo"),
-                    "municipios_entrega": r.get("municipios_entrega"),
-                    "meta_subacao": r.get("meta_subacao"),
-                    "detalhamento_produto": r.get("detalhamento_produto"),
-                    "etapa": r.get("etapa"),
-                    "responsavel_etapa": r.get("responsavel_etapa"),
-                    "prazo_etapa": r.get("prazo_etapa"),
-                    "regiao_etapa": r.get("regiao_etapa"),
-                    "natureza": r.get("natureza"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "subelemento": r.get("subelemento"),
-                    "fonte": r.get("fonte"),
-                    "idu": r.get("idu"),
-                    "descricao_item_despesa": r.get("descricao_item_despesa"),
-                    "unid_medida_item": r.get("unid_medida_item"),
-                    "quantidade": _to_float(r.get("quantidade")),
-                    "valor_unitario": _to_float(r.get("valor_unitario")),
-                    "valor_total": _to_float(r.get("valor_total")),
-                }
-            )
-
         return jsonify(
             {
                 "ok": True,
-                "data": data,
+                "data": registros_json(df),
                 "data_arquivo": data_arquivo,
                 "uploaded_at": uploaded_at,
                 "user_email": user_email,
@@ -2814,148 +2024,24 @@ def api_relatorio_emp():
             except Exception:
                 return str(value)
         try:
-            from datetime import datetime
-
             return datetime.fromisoformat(str(value)).isoformat()
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_emp,
-                        numero_ped,
-                        valor_emp,
-                        devolucao_gcv,
-                        valor_emp_devolucao_gcv,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        fonte,
-                        iduso,
-                        historico,
-                        tipo_despesa,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        categoria_credor,
-                        tipo_empenho,
-                        situacao,
-                        data_emissao,
-                        data_criacao,
-                        numero_contrato,
-                        numero_convenio
-                    FROM emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
+        df = carregar_relatorio("emp")
         last_upload = (
-            EmpRegistro.query.filter_by(ativo=True)
+            EmpRegistro.query.filter(condicao_ativos(EmpRegistro, "emp"))
             .order_by(EmpRegistro.created_at.desc())
             .first()
         )
         data_arquivo = _as_iso(last_upload.data_arquivo) if last_upload else None
         uploaded_at = _as_iso(last_upload.created_at) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "chave": r.get("chave"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "exercicio": r.get("exercicio"),
-                    "numero_emp": r.get("numero_emp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_emp": _to_float(r.get("valor_emp")),
-                    "devolucao_gcv": _to_float(r.get("devolucao_gcv")),
-                    "valor_emp_devolucao_gcv": _to_float(r.get("valor_emp_devolucao_gcv")),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "fonte": r.get("fonte"),
-                    "iduso": r.get("iduso"),
-                    "historico": r.get("historico"),
-                    "tipo_despesa": r.get("tipo_despesa"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "categoria_credor": r.get("categoria_credor"),
-                    "tipo_empenho": r.get("tipo_empenho"),
-                    "situacao": r.get("situacao"),
-                    "data_emissao": _format_date(r.get("data_emissao")),
-                    "data_criacao": _format_date(r.get("data_criacao")),
-                    "numero_contrato": r.get("numero_contrato"),
-                    "numero_convenio": r.get("numero_convenio"),
-                }
-            )
         return jsonify(
             {
                 "ok": True,
-                "data": data,
+                "data": registros_json(df),
                 "data_arquivo": data_arquivo,
                 "uploaded_at": uploaded_at,
                 "user_email": user_email,
@@ -2978,104 +2064,20 @@ def api_relatorio_est_emp():
             except Exception:
                 return str(value)
         try:
-            from datetime import datetime
-
             return datetime.fromisoformat(str(value)).isoformat()
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_est,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_emp,
-                        valor_est_emp_sem_aqs,
-                        valor_est_emp_com_aqs,
-                        valor_emp_liquido,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        historico,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_criacao,
-                        data_emissao,
-                        situacao,
-                        rp
-                    FROM est_emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
+        df = carregar_relatorio("est_emp")
         last_upload = EstEmpUpload.query.order_by(EstEmpUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "numero_est": r.get("numero_est"),
-                    "numero_emp": r.get("numero_emp"),
-                    "empenho_atual": r.get("empenho_atual"),
-                    "empenho_rp": r.get("empenho_rp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_emp": _to_float(r.get("valor_emp")),
-                    "valor_est_emp_sem_aqs": _to_float(r.get("valor_est_emp_sem_aqs")),
-                    "valor_est_emp_com_aqs": _to_float(r.get("valor_est_emp_com_aqs")),
-                    "valor_emp_liquido": _to_float(r.get("valor_emp_liquido")),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "historico": r.get("historico"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "data_criacao": _format_date(r.get("data_criacao")),
-                    "data_emissao": _format_date(r.get("data_emissao")),
-                    "situacao": r.get("situacao"),
-                    "rp": r.get("rp"),
-                }
-            )
         return jsonify(
             {
                 "ok": True,
-                "data": data,
+                "data": registros_json(df),
                 "data_arquivo": data_arquivo,
                 "uploaded_at": uploaded_at,
                 "user_email": user_email,
@@ -3090,7 +2092,7 @@ def api_relatorio_est_emp():
 @require_feature("relatorios/nob")
 def api_relatorio_nob():
     def _as_iso(value):
-        if not value:
+        if value in (None, ""):
             return None
         if isinstance(value, str) and value.startswith("0000-00-00"):
             return None
@@ -3104,131 +2106,16 @@ def api_relatorio_nob():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
-    def _format_datetime(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y %H:%M:%S")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_nob,
-                        numero_nob_estorno,
-                        numero_liq,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_nob,
-                        devolucao_gcv,
-                        valor_nob_gcv,
-                        uo,
-                        ug,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento_despesa,
-                        fonte,
-                        nome_fonte_recurso,
-                        iduso,
-                        historico_liq,
-                        nome_credor_principal,
-                        cpf_cnpj_credor_principal,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_nob,
-                        data_cadastro_nob,
-                        data_hora_cadastro_liq
-                    FROM nob
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
+        df = carregar_relatorio("nob")
         last_upload = NobUpload.query.order_by(NobUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "numero_nob": r.get("numero_nob"),
-                    "numero_nob_estorno": r.get("numero_nob_estorno"),
-                    "numero_liq": r.get("numero_liq"),
-                    "numero_emp": r.get("numero_emp"),
-                    "empenho_atual": r.get("empenho_atual"),
-                    "empenho_rp": r.get("empenho_rp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_nob": _to_float(r.get("valor_nob")),
-                    "devolucao_gcv": _to_float(r.get("devolucao_gcv")),
-                    "valor_nob_gcv": _to_float(r.get("valor_nob_gcv")),
-                    "uo": r.get("uo"),
-                    "ug": r.get("ug"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "nome_elemento_despesa": r.get("nome_elemento_despesa"),
-                    "fonte": r.get("fonte"),
-                    "nome_fonte_recurso": r.get("nome_fonte_recurso"),
-                    "iduso": r.get("iduso"),
-                    "historico_liq": r.get("historico_liq"),
-                    "nome_credor_principal": r.get("nome_credor_principal"),
-                    "cpf_cnpj_credor_principal": r.get("cpf_cnpj_credor_principal"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "data_nob": _format_date(r.get("data_nob")),
-                    "data_cadastro_nob": _format_date(r.get("data_cadastro_nob")),
-                    "data_hora_cadastro_liq": _format_datetime(r.get("data_hora_cadastro_liq")),
-                }
-            )
         return jsonify(
             {
                 "ok": True,
-                "data": data,
+                "data": registros_json(df),
                 "data_arquivo": data_arquivo,
                 "uploaded_at": uploaded_at,
                 "user_email": user_email,
@@ -3242,196 +2129,11 @@ def api_relatorio_nob():
 @login_required
 @require_feature("relatorios/nob")
 def api_relatorio_nob_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
-    def _format_datetime(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y %H:%M:%S")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_nob,
-                        numero_nob_estorno,
-                        numero_liq,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_nob,
-                        devolucao_gcv,
-                        valor_nob_gcv,
-                        uo,
-                        ug,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento_despesa,
-                        fonte,
-                        nome_fonte_recurso,
-                        iduso,
-                        historico_liq,
-                        nome_credor_principal,
-                        cpf_cnpj_credor_principal,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_nob,
-                        data_cadastro_nob,
-                        data_hora_cadastro_liq
-                    FROM nob
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
+        df = carregar_relatorio("nob")
+        if df.empty:
             return jsonify({"error": "Nenhum dado para exportar."}), 404
-
-        df = pd.DataFrame(rows)
-        for col in ("valor_nob", "devolucao_gcv", "valor_nob_gcv"):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_nob", "data_cadastro_nob"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-        if "data_hora_cadastro_liq" in df.columns:
-            df["data_hora_cadastro_liq"] = df["data_hora_cadastro_liq"].apply(_format_datetime)
-
-        rename_map = {
-            "exercicio": "Exercicio",
-            "numero_nob": "Nº NOB",
-            "numero_nob_estorno": "Nº NOB Estorno/Estornado",
-            "numero_liq": "Nº LIQ",
-            "numero_emp": "Nº EMP",
-            "empenho_atual": "Empenho Atual",
-            "empenho_rp": "Empenho RP",
-            "numero_ped": "Nº PED",
-            "valor_nob": "Valor NOB",
-            "devolucao_gcv": "Devolucao GCV",
-            "valor_nob_gcv": "Valor NOB - GCV",
-            "uo": "UO",
-            "ug": "UG",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "funcao": "Funcao",
-            "subfuncao": "Subfuncao",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "nome_elemento_despesa": "Nome do Elemento da Despesa",
-            "fonte": "Fonte",
-            "nome_fonte_recurso": "Nome da Fonte de Recurso",
-            "iduso": "Iduso",
-            "historico_liq": "Historico LIQ",
-            "nome_credor_principal": "Nome do Credor Principal",
-            "cpf_cnpj_credor_principal": "CPF/CNPJ do Credor Principal",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "data_nob": "Data NOB",
-            "data_cadastro_nob": "Data Cadastro NOB",
-            "data_hora_cadastro_liq": "Data/Hora de Cadastro da LIQ",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Exercicio",
-            "Nº NOB",
-            "Nº NOB Estorno/Estornado",
-            "Nº LIQ",
-            "Nº EMP",
-            "Empenho Atual",
-            "Empenho RP",
-            "Nº PED",
-            "Valor NOB",
-            "Devolucao GCV",
-            "Valor NOB - GCV",
-            "UO",
-            "UG",
-            "Dotacao Orcamentaria",
-            "Funcao",
-            "Subfuncao",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Nome do Elemento da Despesa",
-            "Fonte",
-            "Nome da Fonte de Recurso",
-            "Iduso",
-            "Historico LIQ",
-            "Nome do Credor Principal",
-            "CPF/CNPJ do Credor Principal",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Data NOB",
-            "Data Cadastro NOB",
-            "Data/Hora de Cadastro da LIQ",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="NOB", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["NOB"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"nob_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        return _enviar_xlsx("nob", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
@@ -3440,219 +2142,11 @@ def api_relatorio_nob_download():
 @login_required
 @require_feature("relatorios/emp")
 def api_relatorio_emp_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_emp,
-                        numero_ped,
-                        valor_emp,
-                        devolucao_gcv,
-                        valor_emp_devolucao_gcv,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        fonte,
-                        iduso,
-                        historico,
-                        tipo_despesa,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        categoria_credor,
-                        tipo_empenho,
-                        situacao,
-                        data_emissao,
-                        data_criacao,
-                        numero_contrato,
-                        numero_convenio
-                    FROM emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
+        df = carregar_relatorio("emp")
+        if df.empty:
             return jsonify({"error": "Nenhum dado para exportar."}), 404
-
-        df = pd.DataFrame(rows)
-
-        def _chave_display(row):
-            try:
-                ex = int(str(row.get("exercicio") or 0)[:4])
-            except Exception:
-                ex = 0
-            chave = row.get("chave") or ""
-            chave_plan = row.get("chave_planejamento") or ""
-            if ex >= 2026 and chave:
-                return chave
-            return chave_plan or chave
-
-        df["Chave / Chave de Planejamento"] = df.apply(_chave_display, axis=1)
-        df.drop(columns=["chave", "chave_planejamento"], inplace=True, errors="ignore")
-        for col in ("valor_emp", "devolucao_gcv", "valor_emp_devolucao_gcv"):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_emissao", "data_criacao"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-
-        rename_map = {
-            "regiao": "Regiao",
-            "subfuncao_ug": "Subfuncao + UG",
-            "adj": "ADJ",
-            "macropolitica": "Macropolitica",
-            "pilar": "Pilar",
-            "eixo": "Eixo",
-            "politica_decreto": "Politica_Decreto",
-            "exercicio": "Exercicio",
-            "numero_emp": "Nº EMP",
-            "numero_ped": "Nº PED",
-            "valor_emp": "Valor EMP",
-            "devolucao_gcv": "Devolucao GCV",
-            "valor_emp_devolucao_gcv": "Valor EMP-Devolucao GCV",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orcamentaria",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "funcao": "Funcao",
-            "subfuncao": "Subfuncao",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "fonte": "Fonte",
-            "iduso": "Iduso",
-            "historico": "Historico",
-            "tipo_despesa": "Tipo de Despesa",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "categoria_credor": "Categoria do Credor",
-            "tipo_empenho": "Tipo Empenho",
-            "situacao": "Situacao",
-            "data_emissao": "Data emissao",
-            "data_criacao": "Data criacao",
-            "numero_contrato": "Nº Contrato",
-            "numero_convenio": "Nº Convênio",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Chave / Chave de Planejamento",
-            "Regiao",
-            "Subfuncao + UG",
-            "ADJ",
-            "Macropolitica",
-            "Pilar",
-            "Eixo",
-            "Politica_Decreto",
-            "Exercicio",
-            "Nº EMP",
-            "Nº PED",
-            "Valor EMP",
-            "Devolucao GCV",
-            "Valor EMP-Devolucao GCV",
-            "UO",
-            "Nome da Unidade Orcamentaria",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Dotacao Orcamentaria",
-            "Funcao",
-            "Subfuncao",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Fonte",
-            "Iduso",
-            "Historico",
-            "Tipo de Despesa",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Categoria do Credor",
-            "Tipo Empenho",
-            "Situacao",
-            "Data emissao",
-            "Data criacao",
-            "Nº Contrato",
-            "Nº Convênio",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="EMP", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["EMP"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"emp_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        return _enviar_xlsx("emp", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
@@ -3661,153 +2155,11 @@ def api_relatorio_emp_download():
 @login_required
 @require_feature("relatorios/est-emp")
 def api_relatorio_est_emp_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_est,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_emp,
-                        valor_est_emp_sem_aqs,
-                        valor_est_emp_com_aqs,
-                        valor_emp_liquido,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        historico,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_criacao,
-                        data_emissao,
-                        situacao,
-                        rp
-                    FROM est_emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
+        df = carregar_relatorio("est_emp")
+        if df.empty:
             return jsonify({"error": "Nenhum dado para exportar."}), 404
-
-        df = pd.DataFrame(rows)
-        for col in (
-            "valor_emp",
-            "valor_est_emp_sem_aqs",
-            "valor_est_emp_com_aqs",
-            "valor_emp_liquido",
-        ):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_criacao", "data_emissao"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-
-        rename_map = {
-            "exercicio": "Exercicio",
-            "numero_est": "Nº EST",
-            "numero_emp": "Nº EMP",
-            "empenho_atual": "Empenho Atual",
-            "empenho_rp": "Empenho RP",
-            "numero_ped": "Nº PED",
-            "valor_emp": "Valor EMP",
-            "valor_est_emp_sem_aqs": "Valor Est EMP (A LIQ/Em LIQ sem AQS)",
-            "valor_est_emp_com_aqs": "Valor Est EMP (Em LIQ com AQS)",
-            "valor_emp_liquido": "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orcamentaria",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "historico": "Historico",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "data_criacao": "Data Criacao",
-            "data_emissao": "Data Emissao",
-            "situacao": "Situacao",
-            "rp": "RP",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Exercicio",
-            "Nº EST",
-            "Nº EMP",
-            "Empenho Atual",
-            "Empenho RP",
-            "Nº PED",
-            "Valor EMP",
-            "Valor Est EMP (A LIQ/Em LIQ sem AQS)",
-            "Valor Est EMP (Em LIQ com AQS)",
-            "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)",
-            "UO",
-            "Nome da Unidade Orcamentaria",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Dotacao Orcamentaria",
-            "Historico",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Data Criacao",
-            "Data Emissao",
-            "Situacao",
-            "RP",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="EST_EMP", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["EST_EMP"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"est_emp_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        return _enviar_xlsx("est_emp", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
@@ -3816,200 +2168,9 @@ def api_relatorio_est_emp_download():
 @login_required
 @require_feature("relatorios/plan20-seduc")
 def api_relatorio_plan20_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        publico_transversal_chave,
-                        programa,
-                        funcao,
-                        unidade_orcamentaria,
-                        acao_paoe,
-                        subfuncao,
-                        objetivo_especifico,
-                        esfera,
-                        responsavel_acao,
-                        produto_acao,
-                        unid_medida_produto,
-                        regiao_produto,
-                        meta_produto,
-                        saldo_meta_produto,
-                        publico_transversal,
-                        subacao_entrega,
-                        responsavel,
-                        prazo,
-                        unid_gestora,
-                        unidade_setorial_planejamento,
-                        produto_subacao,
-                        unidade_medida,
-                        regiao_subacao,
-                        codigo,
-                        municipios_entrega,
-                        meta_subacao,
-                        detalhamento_produto,
-                        etapa,
-                        responsavel_etapa,
-                        prazo_etapa,
-                        regiao_etapa,
-                        natureza,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        subelemento,
-                        fonte,
-                        idu,
-                        descricao_item_despesa,
-                        unid_medida_item,
-                        quantidade,
-                        valor_unitario,
-                        valor_total
-                    FROM plan20_seduc
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-
-        headers = [
-            ("Exercício", "exercicio"),
-            ("Chave de Planejamento", "chave_planejamento"),
-            ("Região", "regiao"),
-            ("Subfunção + UG", "subfuncao_ug"),
-            ("ADJ", "adj"),
-            ("Macropolitica", "macropolitica"),
-            ("Pilar", "pilar"),
-            ("Eixo", "eixo"),
-            ("Politica_Decreto", "politica_decreto"),
-            ("Público Transversal (chave)", "publico_transversal_chave"),
-            ("Programa", "programa"),
-            ("Função", "funcao"),
-            ("Unidade Orçamentária", "unidade_orcamentaria"),
-            ("Ação (P/A/OE)", "acao_paoe"),
-            ("Subfunção", "subfuncao"),
-            ("Objetivo Específico", "objetivo_especifico"),
-            ("Esfera", "esfera"),
-            ("Responsável pela Ação", "responsavel_acao"),
-            ("Produto(s) da Ação", "produto_acao"),
-            ("Unidade de Medida do Produto", "unid_medida_produto"),
-            ("Região do Produto", "regiao_produto"),
-            ("Meta do Produto", "meta_produto"),
-            ("Saldo Meta do Produto", "saldo_meta_produto"),
-            ("Público Transversal", "publico_transversal"),
-            ("Subação/entrega", "subacao_entrega"),
-            ("Responsável", "responsavel"),
-            ("Prazo", "prazo"),
-            ("Unid. Gestora", "unid_gestora"),
-            ("Unidade Setorial de Planejamento", "unidade_setorial_planejamento"),
-            ("Produto da Subação", "produto_subacao"),
-            ("Unidade de Medida", "unidade_medida"),
-            ("Região da Subação", "regiao_subacao"),
-            ("Código", "codigo"),
-            ("Município(s) da entrega", "municipios_entrega"),
-            ("Meta da Subação", "meta_subacao"),
-            ("Detalhamento do produto", "detalhamento_produto"),
-            ("Etapa", "etapa"),
-            ("Responsável da Etapa", "responsavel_etapa"),
-            ("Prazo da Etapa", "prazo_etapa"),
-            ("Região da Etapa", "regiao_etapa"),
-            ("Natureza", "natureza"),
-            ("Cat.Econ", "cat_econ"),
-            ("Grupo", "grupo"),
-            ("Modalidade", "modalidade"),
-            ("Elemento", "elemento"),
-            ("Subelemento", "subelemento"),
-            ("Fonte", "fonte"),
-            ("IDU", "idu"),
-            ("Descrição do Item de Despesa", "descricao_item_despesa"),
-            ("Unid. Medida", "unid_medida_item"),
-            ("Quantidade", "quantidade"),
-            ("Valor Unitário", "valor_unitario"),
-            ("Valor Total", "valor_total"),
-        ]
-
-        data = []
-        for r in rows:
-            row_dict = {}
-            for label, key in headers:
-                val = r.get(key)
-                if key in {"quantidade", "valor_unitario", "valor_total"}:
-                    val = _to_float(val)
-                row_dict[label] = val
-            data.append(row_dict)
-
-        df = None
-        try:
-            import pandas as pd
-            from io import BytesIO
-            from flask import send_file
-            from openpyxl import load_workbook
-            from openpyxl.styles import Font
-
-            df = pd.DataFrame(data, columns=[h[0] for h in headers])
-            output = BytesIO()
-            df.to_excel(output, index=False)
-            output.seek(0)
-
-            wb = load_workbook(output)
-            ws = wb.active
-            font = Font(name="Helvetica", size=8)
-            idx_map = {label: i + 1 for i, (label, _) in enumerate(headers)}
-            numeric_cols = {
-                idx_map.get("Quantidade"),
-                idx_map.get("Valor Unitário"),
-                idx_map.get("Valor Total"),
-            }
-            numeric_cols = {c for c in numeric_cols if c}
-            number_format = "#,##0.00"
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.font = font
-                    if cell.col_idx in numeric_cols and isinstance(cell.value, (int, float)):
-                        cell.number_format = number_format
-                    if cell.col_idx == idx_map.get("Exercício") and isinstance(cell.value, (int, float, str)):
-                        try:
-                            cell.value = int(str(cell.value).split(".")[0])
-                        except Exception:
-                            pass
-                        cell.number_format = "0"
-
-            styled = BytesIO()
-            wb.save(styled)
-            styled.seek(0)
-
-            filename = f"plan20_seduc_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            return send_file(
-                styled,
-                as_attachment=True,
-                download_name=filename,
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
-        except Exception as exc:
-            return jsonify({"error": f"Falha ao preparar planilha: {exc}"}), 500
+        df = carregar_relatorio("plan20")
+        return _enviar_xlsx("plan20", df)
     except Exception as exc:
         return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
 
@@ -4160,6 +2321,7 @@ def api_perfis():
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "Perfil ja existe."}), 400
+        invalidar_perfis()
         return jsonify({"ok": True, "message": "Perfil ativado.", "id": existing.id}), 200
     try:
         nivel_int = int(nivel)
@@ -4174,6 +2336,7 @@ def api_perfis():
     except IntegrityError:
         db.session.rollback()
         return jsonify({"error": "Perfil ja existe."}), 400
+    invalidar_perfis()
     return jsonify({"ok": True, "message": "Perfil criado.", "id": perfil.id}), 201
 
 
@@ -4190,6 +2353,7 @@ def api_perfil(perfil_id):
             PerfilPermissao.query.filter_by(perfil_id=perfil_id).delete()
             db.session.delete(perfil)
             db.session.commit()
+            invalidar_perfis()
             return jsonify({"ok": True, "message": "Perfil excluido."})
         except IntegrityError:
             db.session.rollback()
@@ -4220,13 +2384,14 @@ def api_perfil(perfil_id):
     except IntegrityError:
         db.session.rollback()
         return jsonify({"error": "Perfil ja existe."}), 400
+    invalidar_perfis()
     return jsonify({"ok": True, "message": "Perfil atualizado."})
     if chave_field == "chave_planejamento":
         ped_rows = [r for r in ped_rows if r]
         ped_rows = (
             PedRegistro.query.with_entities(PedRegistro.valor_ped)
             .filter(
-                PedRegistro.ativo == True,  # noqa: E712
+                condicao_ativos(PedRegistro, "ped"),
                 PedRegistro.exercicio == exercicio,
                 PedRegistro.programa_governo == programa_key,
                 PedRegistro.paoe == acao_paoe_key,
@@ -4243,7 +2408,7 @@ def api_perfil(perfil_id):
         ped_rows = (
             PedRegistro.query.with_entities(PedRegistro.valor_ped)
             .filter(
-                PedRegistro.ativo == True,  # noqa: E712
+                condicao_ativos(PedRegistro, "ped"),
                 PedRegistro.exercicio == exercicio,
                 PedRegistro.programa_governo == programa_key,
                 PedRegistro.paoe == acao_paoe_key,
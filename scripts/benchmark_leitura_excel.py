@@ -0,0 +1,170 @@
+"""Benchmark dos leitores de Excel usados pelos runners.
+
+Gera planilhas sinteticas no formato do FIPLAN (FIP 613) e mede, para cada backend
+instalado (e para o pd.read_excel padrao, como referencia), o tempo de leitura + montagem
+do DataFrame e o pico de memoria (RSS do processo). Cada medicao roda em um processo
+separado para o pico de um backend nao contaminar o outro.
+
+Uso (a partir da raiz do projeto):
+    python -m scripts.benchmark_leitura_excel
+    python -m scripts.benchmark_leitura_excel --linhas 10000,100000 --backends openpyxl
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+import xlsxwriter
+
+from services.leitura_excel import BACKENDS, backends_disponiveis, ler_linhas, montar_dataframe
+
+ABA = "FIPLAN"
+LINHAS_PADRAO = "10000,100000,500000"
+COLUNAS_TEXTO = [
+    "UO",
+    "UG",
+    "Função",
+    "Subfunção",
+    "Programa",
+    "Projeto/Atividade",
+    "Regional",
+    "Natureza de Despesa",
+    "Fonte de Recurso",
+    "Iduso",
+    "Tipo de Recurso",
+]
+COLUNAS_VALOR = [
+    "Dotação Inicial",
+    "Créd. Suplementar",
+    "Créd. Especial",
+    "Créd. Extraordinário",
+    "Redução",
+    "Créd. Autorizado",
+    "Bloqueado/Conting.",
+    "Reserva Empenho",
+    "Saldo de Destaque",
+    "Saldo Dotação",
+    "Empenhado",
+    "Liquidado",
+    "A liquidar",
+    "Valor Pago",
+    "Valor a Pagar",
+]
+# Linhas de titulo antes do cabecalho, como no relatorio exportado do FIPLAN.
+LINHA_CABECALHO = 4
+
+
+def gerar_planilha(caminho: Path, linhas: int, seed: int = 613) -> None:
+    rnd = random.Random(seed)
+    wb = xlsxwriter.Workbook(str(caminho), {"constant_memory": True})
+    ws = wb.add_worksheet(ABA)
+    ws.write_row(0, 0, ["FIP 613 - Demonstrativo de Dotacao"])
+    ws.write_row(1, 0, ["Exercício igual a 2025"])
+    ws.write_row(2, 0, ["UO igual a 14101"])
+    ws.write_row(LINHA_CABECALHO, 0, COLUNAS_TEXTO + COLUNAS_VALOR)
+    for i in range(linhas):
+        texto = [
+            "14101 - SEDUC",
+            f"{140000 + rnd.randint(1, 60)}",
+            "12 - EDUCACAO",
+            f"{rnd.choice((361, 362, 363, 365, 368))} - ENSINO",
+            f"{rnd.randint(100, 600)}",
+            f"{rnd.randint(2000, 4999)}",
+            f"{rnd.randint(1, 15):04d}",
+            f"3.3.90.{rnd.randint(10, 99)}.{rnd.randint(0, 99):02d}",
+            f"{rnd.choice((100, 107, 240, 500))}0000",
+            rnd.randint(0, 9),
+            "1 - ORDINARIO",
+        ]
+        valores = [round(rnd.uniform(0, 2_000_000), 2) if rnd.random() > 0.2 else 0 for _ in COLUNAS_VALOR]
+        ws.write_row(LINHA_CABECALHO + 1 + i, 0, texto + valores)
+    ws.write_row(LINHA_CABECALHO + 1 + linhas, 0, ["Total UO 14101"])
+    wb.close()
+
+
+def _pico_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB; macOS, em bytes.
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def _ler(caminho: Path, backend: str) -> pd.DataFrame:
+    if backend == "read_excel":
+        return pd.read_excel(caminho, sheet_name=ABA, header=LINHA_CABECALHO, dtype=str)
+    linhas = ler_linhas(caminho, sheet_name=ABA, backend=backend)
+    return montar_dataframe(linhas, header=LINHA_CABECALHO, dtype=str)
+
+
+def medir(caminho: Path, backend: str) -> dict:
+    inicio = time.perf_counter()
+    df = _ler(caminho, backend)
+    segundos = time.perf_counter() - inicio
+    pico_mb = _pico_rss_mb()
+    if pico_mb is None:
+        # Sem o modulo resource (Windows): segunda leitura com tracemalloc, so para o pico do heap.
+        del df
+        tracemalloc.start()
+        df = _ler(caminho, backend)
+        pico_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return {"backend": backend, "linhas": len(df), "segundos": round(segundos, 2), "pico_mb": round(pico_mb, 1)}
+
+
+def _medir_em_subprocesso(caminho: Path, backend: str) -> dict:
+    saida = subprocess.run(
+        [sys.executable, "-m", "scripts.benchmark_leitura_excel", "--medir", backend, str(caminho)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", default=LINHAS_PADRAO, help="tamanhos separados por virgula")
+    parser.add_argument("--backends", default="", help="padrao: read_excel + todos os instalados")
+    parser.add_argument("--dir", default="", help="onde gravar as planilhas (padrao: temporario)")
+    parser.add_argument("--medir", nargs=2, metavar=("BACKEND", "ARQUIVO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(Path(args.medir[1]), args.medir[0])))
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if not backends:
+        backends = ["read_excel"] + backends_disponiveis()
+    for backend in backends:
+        if backend != "read_excel" and backend not in BACKENDS:
+            parser.error(f"backend desconhecido: {backend}")
+        if backend != "read_excel" and backend not in backends_disponiveis():
+            parser.error(f"backend nao instalado: {backend}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        destino = Path(args.dir or tmp)
+        destino.mkdir(parents=True, exist_ok=True)
+        print(f"{'linhas':>8} {'backend':<11} {'segundos':>9} {'pico MB':>8}")
+        for total in (int(v) for v in args.linhas.split(",") if v.strip()):
+            caminho = destino / f"fiplan_{total}.xlsx"
+            if not caminho.exists():
+                gerar_planilha(caminho, total)
+            for backend in backends:
+                r = _medir_em_subprocesso(caminho, backend)
+                print(f"{total:>8} {backend:<11} {r['segundos']:>9.2f} {r['pico_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import bindparam, text
+
+from models import HistoricoChaveCache, db
+
+# Limite de entradas mantidas no cache; acima disso saem as menos usadas recentemente.
+CACHE_MAX_ENTRADAS = 200_000
+LOTE_CONSULTA = 1000
+# Incrementar quando a regra de classificacao mudar, para invalidar o cache.
+VERSAO_REGRA = "1"
+
+
+def versao_classificador(origem: str, arquivos: list[Path], *extras: object) -> str:
+    h = hashlib.sha256(f"{origem}:{VERSAO_REGRA}".encode("utf-8"))
+    for extra in extras:
+        h.update(f"|{extra}".encode("utf-8"))
+    for arquivo in arquivos:
+        try:
+            conteudo = Path(arquivo).read_bytes()
+        except OSError:
+            conteudo = b""
+        h.update(b"|" + hashlib.sha256(conteudo).digest())
+    return h.hexdigest()
+
+
+def hash_historico(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def carregar_cache(origem: str, versao: str, hashes: list[str]) -> dict[str, str]:
+    consulta = text(
+        """
+        SELECT historico_hash, chave
+        FROM historico_chave_cache
+        WHERE origem = :origem AND versao = :versao AND historico_hash IN :hashes
+        """
+    ).bindparams(bindparam("hashes", expanding=True))
+    encontrados: dict[str, str] = {}
+    for i in range(0, len(hashes), LOTE_CONSULTA):
+        lote = hashes[i : i + LOTE_CONSULTA]
+        for historico_hash, chave in db.session.execute(
+            consulta, {"origem": origem, "versao": versao, "hashes": lote}
+        ):
+            encontrados[historico_hash] = chave
+    return encontrados
+
+
+def _descartar_antigos(origem: str, versao: str) -> None:
+    # Versoes antigas da mesma origem nunca mais serao consultadas.
+    db.session.execute(
+        text("DELETE FROM historico_chave_cache WHERE origem = :origem AND versao <> :versao"),
+        {"origem": origem, "versao": versao},
+    )
+    corte = (
+        db.session.query(HistoricoChaveCache.usado_em)
+        .order_by(HistoricoChaveCache.usado_em.desc())
+        .offset(CACHE_MAX_ENTRADAS)
+        .limit(1)
+        .scalar()
+    )
+    if corte is not None:
+        # Entradas gravadas/usadas no mesmo lote compartilham usado_em; o lote do corte e mantido.
+        db.session.execute(
+            text("DELETE FROM historico_chave_cache WHERE usado_em < :corte"), {"corte": corte}
+        )
+
+
+def gravar_cache(origem: str, versao: str, novos: dict[str, str], usados: list[str]) -> None:
+    agora = datetime.utcnow()
+    atualizar = text(
+        """
+        UPDATE historico_chave_cache SET usado_em = :agora
+        WHERE origem = :origem AND versao = :versao AND historico_hash IN :hashes
+        """
+    ).bindparams(bindparam("hashes", expanding=True))
+    try:
+        for i in range(0, len(usados), LOTE_CONSULTA):
+            db.session.execute(
+                atualizar,
+                {"agora": agora, "origem": origem, "versao": versao, "hashes": usados[i : i + LOTE_CONSULTA]},
+            )
+        registros = [
+            {"origem": origem, "versao": versao, "historico_hash": h, "chave": chave, "usado_em": agora}
+            for h, chave in novos.items()
+        ]
+        for i in range(0, len(registros), LOTE_CONSULTA):
+            db.session.execute(HistoricoChaveCache.__table__.insert(), registros[i : i + LOTE_CONSULTA])
+        _descartar_antigos(origem, versao)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def classificar_com_cache(
+    origem: str, versao: str, textos: list[str], classificar
+) -> tuple[list[str], dict[str, int]]:
+    """Classifica textos distintos consultando o cache; so os ausentes passam por `classificar`."""
+    unicos = list(dict.fromkeys(textos))
+    hashes = {t: hash_historico(t) for t in unicos}
+    try:
+        em_cache = carregar_cache(origem, versao, list(hashes.values()))
+    except Exception as exc:
+        print(f"Aviso: cache de chaves indisponivel: {exc}")
+        db.session.rollback()
+        em_cache = {}
+
+    faltantes = [t for t in unicos if hashes[t] not in em_cache]
+    novos = dict(zip(faltantes, classificar(faltantes))) if faltantes else {}
+    resultado = {t: em_cache.get(hashes[t]) for t in unicos if hashes[t] in em_cache}
+    resultado.update(novos)
+
+    try:
+        gravar_cache(
+            origem,
+            versao,
+            {hashes[t]: chave for t, chave in novos.items()},
+            [hashes[t] for t in unicos if hashes[t] in em_cache],
+        )
+    except Exception as exc:
+        print(f"Aviso: nao foi possivel gravar o cache de chaves: {exc}")
+
+    estatisticas = {
+        "linhas": len(textos),
+        "distintos": len(unicos),
+        "hits": len(unicos) - len(faltantes),
+        "misses": len(faltantes),
+    }
+    return [resultado[t] for t in textos], estatisticas
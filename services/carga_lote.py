@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Iterable
+
+from sqlalchemy import text
+
+from models import db
+
+# Limites do auto-ajuste do lote (linhas por comando / por executemany).
+LOTE_MINIMO = 50
+LOTE_MAXIMO = 5000
+# Fracao do max_allowed_packet ocupada por um INSERT multi-linha no MySQL.
+FRACAO_PACOTE = 0.5
+PACOTE_PADRAO = 4 * 1024 * 1024
+# fast_executemany monta em memoria um array de parametros por coluna; limita celulas por lote.
+CELULAS_MSSQL = 250_000
+LOTE_GENERICO = 1000
+
+_pacote_mysql: dict[str, int] = {}
+
+
+def _valor(v: Any) -> Any:
+    # NaN do pandas vira NULL; os drivers nao sabem gravar float('nan').
+    if isinstance(v, float) and v != v:
+        return None
+    return v
+
+
+def _tuplas(registros: list[dict[str, Any]], colunas: list[str]) -> list[tuple]:
+    return [tuple(_valor(r.get(c)) for c in colunas) for r in registros]
+
+
+def _bytes_por_linha(linhas: list[tuple], amostra: int = 200) -> int:
+    if not linhas:
+        return 1
+    trecho = linhas[:amostra]
+    total = sum(len(str(v)) + 4 for linha in trecho for v in linha)
+    return max(1, total // len(trecho))
+
+
+def _limite(valor: int) -> int:
+    return max(LOTE_MINIMO, min(LOTE_MAXIMO, valor))
+
+
+def _max_allowed_packet(conn) -> int:
+    chave = str(db.engine.url)
+    if chave not in _pacote_mysql:
+        try:
+            _pacote_mysql[chave] = int(conn.execute(text("SELECT @@max_allowed_packet")).scalar() or PACOTE_PADRAO)
+        except Exception:
+            _pacote_mysql[chave] = PACOTE_PADRAO
+    return _pacote_mysql[chave]
+
+
+def _inserir_mysql(conn, tabela: str, colunas: list[str], linhas: list[tuple]) -> int:
+    # INSERT ... VALUES (...), (...), ... com tantas linhas quanto cabem com folga no pacote.
+    lote = _limite(int(_max_allowed_packet(conn) * FRACAO_PACOTE) // _bytes_por_linha(linhas))
+    marcador = "(" + ", ".join(["%s"] * len(colunas)) + ")"
+    prefixo = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES "
+    cursor = conn.connection.cursor()
+    try:
+        for inicio in range(0, len(linhas), lote):
+            chunk = linhas[inicio : inicio + lote]
+            params = [v for linha in chunk for v in linha]
+            cursor.execute(prefixo + ", ".join([marcador] * len(chunk)), params)
+            print(f" Inseridos {inicio + len(chunk)}/{len(linhas)} registros em {tabela}...")
+    finally:
+        cursor.close()
+    return lote
+
+
+def _inserir_mssql(conn, tabela: str, colunas: list[str], linhas: list[tuple]) -> int:
+    lote = _limite(CELULAS_MSSQL // max(1, len(colunas)))
+    sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join(['?'] * len(colunas))})"
+    cursor = conn.connection.cursor()
+    try:
+        try:
+            cursor.fast_executemany = True
+        except Exception:
+            pass
+        for inicio in range(0, len(linhas), lote):
+            chunk = linhas[inicio : inicio + lote]
+            cursor.executemany(sql, chunk)
+            print(f" Inseridos {inicio + len(chunk)}/{len(linhas)} registros em {tabela}...")
+    finally:
+        cursor.close()
+    return lote
+
+
+def _inserir_generico(conn, tabela: str, colunas: list[str], linhas: list[tuple]) -> int:
+    sql = text(
+        f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join(f':{c}' for c in colunas)})"
+    )
+    for inicio in range(0, len(linhas), LOTE_GENERICO):
+        chunk = [dict(zip(colunas, linha)) for linha in linhas[inicio : inicio + LOTE_GENERICO]]
+        conn.execute(sql, chunk)
+    return LOTE_GENERICO
+
+
+_METODOS = {
+    "mysql": ("insert multi-linha", _inserir_mysql),
+    "mssql": ("fast_executemany", _inserir_mssql),
+}
+
+
+def carregar_em_lote(
+    tabela: str,
+    colunas: list[str],
+    registros: list[dict[str, Any]],
+    antes: Iterable[tuple[str, dict[str, Any]]] = (),
+    depois: Callable[[Any], None] | None = None,
+) -> dict[str, Any]:
+    """Grava os registros em uma unica transacao, pelo caminho mais rapido do dialeto.
+
+    `antes` recebe comandos (sql, params) executados na mesma transacao, como a
+    desativacao da carga anterior; `depois` recebe a conexao ja com as linhas gravadas
+    (ex.: publicar a carga). Se algo falhar, nada e alterado.
+    Devolve estatisticas da carga (linhas, lote, segundos, linhas por segundo).
+    """
+    dialeto = db.engine.dialect.name
+    metodo, inserir = _METODOS.get(dialeto, ("executemany", _inserir_generico))
+    linhas = _tuplas(registros, colunas)
+    inicio = time.perf_counter()
+    try:
+        conn = db.session.connection()
+        for sql, params in antes:
+            conn.execute(text(sql), params or {})
+        lote = inserir(conn, tabela, colunas, linhas) if linhas else 0
+        if depois is not None:
+            depois(conn)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    segundos = time.perf_counter() - inicio
+    por_segundo = round(len(linhas) / segundos) if segundos > 0 else len(linhas)
+    print(f" Gravados {len(linhas)} registros em {tabela} ({metodo}, lote {lote}): {por_segundo} linhas/s.")
+    return {
+        "tabela": tabela,
+        "metodo": metodo,
+        "linhas": len(linhas),
+        "lote": lote,
+        "segundos": round(segundos, 2),
+        "linhas_por_segundo": por_segundo,
+    }
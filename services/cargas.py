@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, text
+
+from models import Carga, CargaAtiva, db
+from services.carga_lote import carregar_em_lote
+
+# Bases carregadas por versao: cada carga grava as linhas com um carga_id novo e so fica
+# visivel quando o ponteiro em carga_ativa passa a apontar para ela.
+DATASETS = ("fip613", "ped", "emp", "est_emp", "nob")
+# Cargas mantidas por base (a ativa + anteriores, para conferencia); o resto e descartado.
+CARGAS_MANTIDAS = max(1, int(os.getenv("CARGAS_MANTIDAS", "2")))
+# "delta" aplica na carga ativa so os documentos novos, alterados e removidos;
+# "completa" grava sempre uma versao nova com todas as linhas do arquivo.
+CARGA_MODO = (os.getenv("CARGA_MODO") or "delta").strip().lower()
+# Numero natural do documento em cada base; o fip613 nao tem um e sempre recarrega completo.
+CHAVES_DOCUMENTO = {"ped": "numero_ped", "emp": "numero_emp", "est_emp": "numero_est", "nob": "numero_nob"}
+# Colunas de controle, que mudam a cada upload sem o documento mudar.
+_FORA_DO_HASH = frozenset(
+    {"upload_id", "carga_id", "hash_conteudo", "data_atualizacao", "data_arquivo", "user_email", "raw_payload", "ativo"}
+)
+LOTE_DOCUMENTOS = 500
+
+
+def filtro_ativos(tabela: str, alias: str = "") -> str:
+    """Condicao SQL das linhas visiveis de `tabela` (linhas da carga ativa)."""
+    prefixo = f"{alias}." if alias else ""
+    if tabela not in DATASETS:
+        return f"{prefixo}ativo = 1"
+    return f"{prefixo}carga_id = (SELECT carga_id FROM carga_ativa WHERE dataset = '{tabela}')"
+
+
+def condicao_ativos(modelo, dataset: str):
+    """Mesmo filtro de filtro_ativos para consultas ORM."""
+    return modelo.carga_id == (
+        select(CargaAtiva.carga_id).where(CargaAtiva.dataset == dataset).scalar_subquery()
+    )
+
+
+def carga_ativa(dataset: str) -> CargaAtiva | None:
+    return CargaAtiva.query.filter_by(dataset=dataset).first()
+
+
+def nova_carga(dataset: str, upload_id: int) -> int:
+    # Reserva o carga_id antes de gravar; ate a publicacao as linhas ficam invisiveis.
+    carga = Carga(dataset=dataset, upload_id=upload_id, criada_em=datetime.utcnow())
+    db.session.add(carga)
+    db.session.commit()
+    return carga.id
+
+
+def publicar_carga(conn, dataset: str, carga_id: int, upload_id: int, linhas: int | None = None) -> None:
+    """Troca a carga ativa da base em um unico UPDATE (executar na transacao da carga)."""
+    agora = datetime.utcnow()
+    params = {"dataset": dataset, "carga_id": carga_id, "upload_id": upload_id, "agora": agora}
+    resultado = conn.execute(
+        text(
+            "UPDATE carga_ativa SET carga_id = :carga_id, upload_id = :upload_id, publicada_em = :agora "
+            "WHERE dataset = :dataset"
+        ),
+        params,
+    )
+    if resultado.rowcount == 0:
+        conn.execute(
+            text(
+                "INSERT INTO carga_ativa (dataset, carga_id, upload_id, publicada_em) "
+                "VALUES (:dataset, :carga_id, :upload_id, :agora)"
+            ),
+            params,
+        )
+    conn.execute(
+        text("UPDATE cargas SET publicada_em = :agora, linhas = :linhas WHERE id = :carga_id"),
+        {"agora": agora, "linhas": linhas, "carga_id": carga_id},
+    )
+
+
+def carregar_versao(dataset: str, colunas: list[str], registros: list[dict], upload_id: int) -> dict:
+    """Grava uma nova carga da base e a publica na mesma transacao.
+
+    Leitores continuam vendo a carga anterior ate o commit; depois, as versoes antigas
+    sao descartadas em background.
+    """
+    carga_id = nova_carga(dataset, upload_id)
+    for registro in registros:
+        registro["carga_id"] = carga_id
+    stats = carregar_em_lote(
+        dataset,
+        colunas,
+        registros,
+        depois=lambda conn: publicar_carga(conn, dataset, carga_id, upload_id, len(registros)),
+    )
+    stats["carga_id"] = carga_id
+    agendar_descarte(dataset)
+    return stats
+
+
+def _texto(valor) -> str:
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return ""
+    return str(valor)
+
+
+def _documento(valor) -> str:
+    return "" if valor is None else str(valor)
+
+
+def marcar_hashes(registros: list[dict], colunas: list[str]) -> None:
+    """Grava em cada registro o hash_conteudo (sha1 das colunas de dados da linha)."""
+    campos = [c for c in colunas if c not in _FORA_DO_HASH]
+    for registro in registros:
+        conteudo = "\x1f".join(_texto(registro.get(c)) for c in campos)
+        registro["hash_conteudo"] = hashlib.sha1(conteudo.encode("utf-8")).hexdigest()
+
+
+def _assinaturas(pares) -> dict[str, str]:
+    # Um documento pode ter varias linhas: a assinatura e o conjunto ordenado dos hashes.
+    por_documento: dict[str, list[str]] = {}
+    for documento, hash_linha in pares:
+        por_documento.setdefault(documento, []).append(hash_linha)
+    return {documento: "".join(sorted(hashes)) for documento, hashes in por_documento.items()}
+
+
+def _carga_para_delta(dataset: str) -> tuple[int, dict[str, str]] | None:
+    # Sem carga ativa, ou com linhas gravadas antes do hash, a carga precisa ser completa.
+    if CARGA_MODO != "delta" or dataset not in CHAVES_DOCUMENTO:
+        return None
+    ativa = carga_ativa(dataset)
+    if ativa is None or ativa.carga_id is None:
+        return None
+    chave = CHAVES_DOCUMENTO[dataset]
+    linhas = db.session.execute(
+        text(f"SELECT {chave}, hash_conteudo FROM {dataset} WHERE carga_id = :carga_id"),
+        {"carga_id": ativa.carga_id},
+    ).all()
+    if any(hash_linha is None for _, hash_linha in linhas):
+        return None
+    return ativa.carga_id, _assinaturas((_documento(doc), hash_linha) for doc, hash_linha in linhas)
+
+
+# Bases que alimentam o saldo_execucao: antes de remover documentos numa carga em delta, as
+# fatias (exercicio, chave_norm) em que eles estavam vao para saldo_execucao_pendente na mesma
+# transacao, e o recalculo seguinte do saldo refaz essas fatias. No EST EMP, as dos empenhos.
+_FATIAS_SALDO = {
+    "ped": "SELECT DISTINCT COALESCE(exercicio, ''), chave_norm, :agora FROM ped WHERE chave_norm <> '' AND {condicao}",
+    "emp": "SELECT DISTINCT COALESCE(exercicio, ''), chave_norm, :agora FROM emp WHERE chave_norm <> '' AND {condicao}",
+    "est_emp": (
+        "SELECT DISTINCT COALESCE(exercicio, ''), chave_norm, :agora FROM emp "
+        "WHERE {ativos_emp} AND chave_norm <> '' AND numero_emp IN (SELECT numero_emp FROM est_emp WHERE {condicao})"
+    ),
+}
+
+
+def _comandos_remocao(dataset: str, carga_id: int, documentos: list[str]) -> list[tuple[str, dict]]:
+    chave = CHAVES_DOCUMENTO[dataset]
+    condicoes: list[tuple[str, dict]] = []
+    if "" in documentos:
+        condicoes.append((f"({chave} IS NULL OR {chave} = '')", {}))
+    numeros = [d for d in documentos if d]
+    for inicio in range(0, len(numeros), LOTE_DOCUMENTOS):
+        trecho = numeros[inicio : inicio + LOTE_DOCUMENTOS]
+        params = {f"d{i}": numero for i, numero in enumerate(trecho)}
+        marcadores = ", ".join(f":d{i}" for i in range(len(trecho)))
+        condicoes.append((f"{chave} IN ({marcadores})", params))
+    fatias = _FATIAS_SALDO.get(dataset)
+    comandos = []
+    for condicao, params in condicoes:
+        condicao = f"carga_id = :carga_id AND {condicao}"
+        params = {**params, "carga_id": carga_id}
+        if fatias:
+            selecao = fatias.format(condicao=condicao, ativos_emp=filtro_ativos("emp"))
+            comandos.append(
+                (
+                    f"INSERT INTO saldo_execucao_pendente (exercicio, chave_norm, criado_em) {selecao}",
+                    {**params, "agora": datetime.utcnow()},
+                )
+            )
+        comandos.append((f"DELETE FROM {dataset} WHERE {condicao}", params))
+    return comandos
+
+
+def carregar_delta(
+    dataset: str,
+    colunas: list[str],
+    registros: list[dict],
+    upload_id: int,
+    carga_id: int,
+    existentes: dict[str, str],
+) -> dict:
+    """Aplica o arquivo sobre a carga ativa, documento a documento, em uma transacao.
+
+    Documentos novos sao inseridos, alterados sao regravados, os que sumiram do arquivo
+    sao removidos e os inalterados nao sao tocados.
+    """
+    chave = CHAVES_DOCUMENTO[dataset]
+    recebidos = _assinaturas((_documento(r.get(chave)), r["hash_conteudo"]) for r in registros)
+    novos = [d for d in recebidos if d not in existentes]
+    alterados = [d for d in recebidos if d in existentes and existentes[d] != recebidos[d]]
+    removidos = [d for d in existentes if d not in recebidos]
+    gravar = set(novos).union(alterados)
+    linhas = [r for r in registros if _documento(r.get(chave)) in gravar]
+    for registro in linhas:
+        registro["carga_id"] = carga_id
+    stats = carregar_em_lote(
+        dataset,
+        colunas,
+        linhas,
+        antes=_comandos_remocao(dataset, carga_id, alterados + removidos),
+        depois=lambda conn: publicar_carga(conn, dataset, carga_id, upload_id, len(registros)),
+    )
+    stats.update(
+        modo="delta",
+        carga_id=carga_id,
+        novos=len(novos),
+        alterados=len(alterados),
+        removidos=len(removidos),
+        inalterados=len(recebidos) - len(novos) - len(alterados),
+    )
+    print(
+        f" Delta {dataset}: {stats['novos']} novos, {stats['alterados']} alterados, "
+        f"{stats['removidos']} removidos, {stats['inalterados']} inalterados."
+    )
+    return stats
+
+
+def carregar_base(dataset: str, colunas: list[str], registros: list[dict], upload_id: int) -> dict:
+    """Grava o upload da base: delta sobre a carga ativa quando possivel, senao versao completa."""
+    marcar_hashes(registros, colunas)
+    atual = _carga_para_delta(dataset)
+    if atual is None:
+        stats = carregar_versao(dataset, colunas, registros, upload_id)
+        stats["modo"] = "completa"
+        return stats
+    stats = carregar_delta(dataset, colunas, registros, upload_id, *atual)
+    agendar_descarte(dataset)
+    return stats
+
+
+def inicializar_cargas_ativas() -> None:
+    """Bases gravadas antes do versionamento: a carga com ativo = 1 vira a carga ativa."""
+    for dataset in DATASETS:
+        if carga_ativa(dataset) is not None:
+            continue
+        upload_id = db.session.execute(
+            text(f"SELECT MAX(upload_id) FROM {dataset} WHERE ativo = 1")
+        ).scalar()
+        if upload_id is None:
+            continue
+        carga_id = nova_carga(dataset, upload_id)
+        try:
+            conn = db.session.connection()
+            conn.execute(
+                text(f"UPDATE {dataset} SET carga_id = :carga_id WHERE ativo = 1 AND carga_id IS NULL"),
+                {"carga_id": carga_id},
+            )
+            publicar_carga(conn, dataset, carga_id, upload_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def descartar_cargas_antigas(dataset: str) -> int:
+    """Apaga as linhas de cargas anteriores a ativa, mantendo CARGAS_MANTIDAS versoes.
+
+    Cargas com id maior que a ativa (em gravacao ou que falharam depois dela) ficam
+    para a proxima limpeza; linhas sem carga_id sao historico anterior ao versionamento.
+    """
+    ativa = carga_ativa(dataset)
+    if ativa is None or ativa.carga_id is None:
+        return 0
+    anteriores = [
+        c.id
+        for c in Carga.query.filter(Carga.dataset == dataset, Carga.id < ativa.carga_id)
+        .order_by(Carga.id.desc())
+        .all()
+    ]
+    descartar = anteriores[CARGAS_MANTIDAS - 1 :]
+    total = 0
+    for carga_id in descartar:
+        try:
+            total += db.session.execute(
+                text(f"DELETE FROM {dataset} WHERE carga_id = :carga_id"), {"carga_id": carga_id}
+            ).rowcount or 0
+            db.session.execute(text("DELETE FROM cargas WHERE id = :carga_id"), {"carga_id": carga_id})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    try:
+        total += db.session.execute(
+            text(f"DELETE FROM {dataset} WHERE carga_id IS NULL AND ativo = 0")
+        ).rowcount or 0
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return total
+
+
+def _descartar_em_background(app, dataset: str) -> None:
+    with app.app_context():
+        try:
+            total = descartar_cargas_antigas(dataset)
+            if total:
+                print(f" Descartadas {total} linhas de cargas antigas de {dataset}.")
+        except Exception as exc:
+            print(f"Aviso: nao foi possivel descartar cargas antigas de {dataset}: {exc}")
+
+
+def agendar_descarte(dataset: str) -> None:
+    # A limpeza nao bloqueia a publicacao: roda em thread propria, com seu contexto de app.
+    app = current_app._get_current_object()
+    threading.Thread(target=_descartar_em_background, args=(app, dataset), name=f"descarte-{dataset}").start()
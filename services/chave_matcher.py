@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+FUZZY_SCORE_CUTOFF = 95
+FUZZY_LOTE = 2000
+# Threads usadas pelo rapidfuzz no fallback fuzzy (-1 = todos os nucleos).
+FUZZY_WORKERS = int(os.getenv("PED_FUZZY_WORKERS", "1"))
+
+_SEM_MATCH = float("inf")
+
+
+class MatcherChaves:
+    """Automato Aho-Corasick sobre as chaves de planejamento e os casos especificos.
+
+    A prioridade segue a busca original: primeiro as chaves, na ordem do JSON, depois
+    os casos especificos. Vence o padrao de menor prioridade presente no texto,
+    independente da posicao em que aparece.
+    """
+
+    def __init__(self, chaves: list[str], casos: dict[str, str]) -> None:
+        self.chaves = list(chaves)
+        padroes = [(chave, chave) for chave in self.chaves]
+        padroes.extend(casos.items())
+        self._resultados = [resultado for _, resultado in padroes]
+
+        self._goto: list[dict[str, int]] = [{}]
+        self._melhor: list[float] = [_SEM_MATCH]
+        for prioridade, (padrao, _) in enumerate(padroes):
+            estado = 0
+            for ch in padrao:
+                prox = self._goto[estado].get(ch)
+                if prox is None:
+                    prox = len(self._goto)
+                    self._goto[estado][ch] = prox
+                    self._goto.append({})
+                    self._melhor.append(_SEM_MATCH)
+                estado = prox
+            if prioridade < self._melhor[estado]:
+                self._melhor[estado] = prioridade
+        self._montar_falhas()
+
+    def _montar_falhas(self) -> None:
+        # BFS: cada estado herda a melhor prioridade do seu sufixo (link de falha).
+        self._falha = [0] * len(self._goto)
+        fila = list(self._goto[0].values())
+        i = 0
+        while i < len(fila):
+            estado = fila[i]
+            i += 1
+            for ch, prox in self._goto[estado].items():
+                fila.append(prox)
+                f = self._falha[estado]
+                while f and ch not in self._goto[f]:
+                    f = self._falha[f]
+                alvo = self._goto[f].get(ch, 0)
+                self._falha[prox] = alvo if alvo != prox else 0
+                if self._melhor[self._falha[prox]] < self._melhor[prox]:
+                    self._melhor[prox] = self._melhor[self._falha[prox]]
+
+    def buscar(self, texto: str) -> str | None:
+        goto, falha, melhor = self._goto, self._falha, self._melhor
+        encontrado = melhor[0]
+        estado = 0
+        for ch in texto:
+            while estado and ch not in goto[estado]:
+                estado = falha[estado]
+            estado = goto[estado].get(ch, 0)
+            if melhor[estado] < encontrado:
+                encontrado = melhor[estado]
+                if encontrado == 0:
+                    break
+        if encontrado == _SEM_MATCH:
+            return None
+        return self._resultados[int(encontrado)]
+
+    def buscar_fuzzy(self, trechos: list[str]) -> list[str | None]:
+        """Melhor chave (WRatio >= corte) para cada trecho, em lotes via rapidfuzz.cdist."""
+        if not trechos or not self.chaves:
+            return [None] * len(trechos)
+        resultado: list[str | None] = []
+        for inicio in range(0, len(trechos), FUZZY_LOTE):
+            lote = trechos[inicio : inicio + FUZZY_LOTE]
+            scores = process.cdist(
+                lote,
+                self.chaves,
+                scorer=fuzz.WRatio,
+                score_cutoff=FUZZY_SCORE_CUTOFF,
+                dtype=np.float64,
+                workers=FUZZY_WORKERS,
+            )
+            # argmax devolve o primeiro maximo, como o extractOne.
+            melhores = scores.argmax(axis=1)
+            for linha, idx in enumerate(melhores):
+                if scores[linha, idx] >= FUZZY_SCORE_CUTOFF:
+                    resultado.append(self.chaves[idx])
+                else:
+                    resultado.append(None)
+        return resultado
@@ -9,18 +9,16 @@ from pathlib import Path
 from typing import Any
 
 import pandas as pd
-from sqlalchemy import text, event
-from sqlalchemy.exc import SQLAlchemyError
 
-from models import db
+from services.cargas import carregar_base
+from services.job_status import update_status_fields, verificar_cancelamento
+from services.leitura_excel import ler_linhas, linhas_do_dataframe, montar_dataframe
+from services.normalizacao import normalizar_ug, normalizar_uo
 
-BATCH_SIZE = 1000
 INPUT_DIR = Path("upload/est_emp")
 OUTPUT_DIR = Path("outputs/td_est_emp")
 HEADER_INICIO = ["exercicio", "n_est", "n_emp", "n_ped", "historico"]
 
-_FAST_EXEC_ENABLED = False
-
 COL_MAP = {
     "exercicio": "exercicio",
     "n_est": "numero_est",
@@ -59,6 +57,8 @@ COL_MAP = {
 
 INSERT_COLS = [
     "upload_id",
+    "carga_id",
+    "hash_conteudo",
     "exercicio",
     "numero_est",
     "numero_emp",
@@ -82,6 +82,8 @@ INSERT_COLS = [
     "data_emissao",
     "situacao",
     "rp",
+    "ug_norm",
+    "uo_norm",
     "raw_payload",
     "data_atualizacao",
     "data_arquivo",
@@ -128,19 +130,19 @@ def _normalize_col(name: Any) -> str:
     return texto
 
 
-def encontrar_linha_cabecalho(df_raw: pd.DataFrame) -> int:
-    for idx in range(min(30, len(df_raw))):
-        linha = df_raw.iloc[idx].tolist()
-        norm = [_normalize_col(val) for val in linha[: len(HEADER_INICIO)]]
+def encontrar_linha_cabecalho(linhas: list[list[Any]]) -> int:
+    for idx, linha in enumerate(linhas[:30]):
+        inicio = list(linha[: len(HEADER_INICIO)])
+        inicio += [""] * (len(HEADER_INICIO) - len(inicio))
+        norm = [_normalize_col(val) for val in inicio]
         if norm == HEADER_INICIO:
             return idx
     raise ValueError("Cabecalho nao encontrado nas 30 primeiras linhas.")
 
 
-def extrair_df_est(xls: pd.ExcelFile, sheet_name: str) -> pd.DataFrame:
-    df_raw = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-    header_idx = encontrar_linha_cabecalho(df_raw)
-    df_est = pd.read_excel(xls, sheet_name=sheet_name, header=header_idx)
+def extrair_df_est(linhas: list[list[Any]]) -> pd.DataFrame:
+    header_idx = encontrar_linha_cabecalho(linhas)
+    df_est = montar_dataframe(linhas, header=header_idx)
     df_est.columns = df_est.columns.str.strip()
     return df_est
 
@@ -307,9 +309,8 @@ def criar_writer_seguro(output_path: Path) -> tuple[pd.ExcelWriter, Path]:
         return pd.ExcelWriter(fallback, engine="xlsxwriter"), fallback
 
 
-def processar_est_emp(file_path: Path) -> Path:
-    xls = pd.ExcelFile(file_path)
-    df_est = extrair_df_est(xls, sheet_name=xls.sheet_names[0])
+def processar_est_emp(file_path: Path) -> tuple[Path, pd.DataFrame]:
+    df_est = extrair_df_est(ler_linhas(file_path))
 
     df_limpo = remover_colunas(df_est)
     df_tratado = tratar_colunas_texto(df_limpo)
@@ -333,7 +334,7 @@ def processar_est_emp(file_path: Path) -> Path:
 
     writer.close()
     print(f"Planilha salva em: {output_file}")
-    return output_file
+    return output_file, df_final
 
 
 def _clean_val(val: Any) -> Any:
@@ -406,6 +407,8 @@ def montar_registros_para_db(
         for col in ("data_emissao", "data_criacao"):
             if col in payload:
                 payload[col] = _parse_data_db(payload[col])
+        payload["ug_norm"] = normalizar_ug(payload.get("ug"))
+        payload["uo_norm"] = normalizar_uo(payload.get("uo"))
 
         safe_row: dict[str, Any] = {}
         for k, v in row.items():
@@ -435,67 +438,14 @@ def montar_registros_para_db(
     return registros
 
 
-def _enable_fast_executemany() -> None:
-    global _FAST_EXEC_ENABLED
-    if _FAST_EXEC_ENABLED:
-        return
-
-    @event.listens_for(db.engine, "before_cursor_execute")
-    def _set_fast_exec(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-redef]
-        if executemany:
-            try:
-                cursor.fast_executemany = True
-            except Exception:
-                pass
-
-    _FAST_EXEC_ENABLED = True
-
-
 def update_database(
     df: pd.DataFrame, data_arquivo: datetime, user_email: str, upload_id: int
 ) -> int:
-    insert_sql = text(
-        """
-        INSERT INTO est_emp (
-            upload_id, exercicio, numero_est, numero_emp, empenho_atual, empenho_rp, numero_ped,
-            valor_emp, valor_est_emp_sem_aqs, valor_est_emp_com_aqs, valor_emp_liquido, uo,
-            nome_unidade_orcamentaria, ug, nome_unidade_gestora, dotacao_orcamentaria, historico,
-            credor, nome_credor, cpf_cnpj_credor, data_criacao, data_emissao, situacao, rp,
-            raw_payload, data_atualizacao, data_arquivo, user_email, ativo
-        )
-        VALUES (
-            :upload_id, :exercicio, :numero_est, :numero_emp, :empenho_atual, :empenho_rp, :numero_ped,
-            :valor_emp, :valor_est_emp_sem_aqs, :valor_est_emp_com_aqs, :valor_emp_liquido, :uo,
-            :nome_unidade_orcamentaria, :ug, :nome_unidade_gestora, :dotacao_orcamentaria, :historico,
-            :credor, :nome_credor, :cpf_cnpj_credor, :data_criacao, :data_emissao, :situacao, :rp,
-            :raw_payload, :data_atualizacao, :data_arquivo, :user_email, :ativo
-        )
-        """
-    )
-
-    try:
-        db.session.execute(text("UPDATE est_emp SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        raise
-
-    _enable_fast_executemany()
     registros = montar_registros_para_db(df, data_arquivo, user_email, upload_id)
-    total_registros = len(registros)
-    print(f" Gravando {total_registros} registros no banco...")
-    total = 0
-    for start in range(0, len(registros), BATCH_SIZE):
-        chunk = registros[start : start + BATCH_SIZE]
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-            print(f" Inseridos {total}/{total_registros} registros...")
-        except SQLAlchemyError:
-            db.session.rollback()
-            raise
-    return total
+    print(f" Gravando {len(registros)} registros no banco...")
+    stats = carregar_base("est_emp", INSERT_COLS, registros, upload_id)
+    update_status_fields("est_emp", upload_id, carga=stats)
+    return len(registros)
 
 
 def run_est_emp(
@@ -503,9 +453,12 @@ def run_est_emp(
 ) -> tuple[int, Path]:
     ensure_dirs()
     move_existing_to_tmp(OUTPUT_DIR)
-    output_path = processar_est_emp(file_path)
+    update_status_fields("est_emp", upload_id, progress=10, message="Lendo e tratando planilha.")
+    output_path, df_final = processar_est_emp(file_path)
+    verificar_cancelamento("est_emp", upload_id)
 
-    df_tratado = pd.read_excel(output_path, sheet_name="est_emp_tratado", dtype=str)
+    # Mesmo conteudo que a releitura da aba est_emp_tratado com dtype=str, sem reabrir o xlsx.
+    df_tratado = montar_dataframe(linhas_do_dataframe(df_final), dtype=str)
     colunas_data = {"data_emissao", "data_criacao", "data_atualizacao", "data_arquivo"}
     for col in df_tratado.columns:
         if _normalize_col(col) in colunas_data:
@@ -514,5 +467,7 @@ def run_est_emp(
                 df_tratado[col] = pd.to_datetime(serie_str, errors="coerce", dayfirst=False)
             else:
                 df_tratado[col] = pd.to_datetime(serie_str, errors="coerce", dayfirst=True)
+    verificar_cancelamento("est_emp", upload_id)
+    update_status_fields("est_emp", upload_id, progress=70, message="Gravando registros no banco.")
     total = update_database(df_tratado, data_arquivo, user_email, upload_id)
     return total, output_path
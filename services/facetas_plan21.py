@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+from sqlalchemy import case, func
+
+from models import Plan21Nger, db
+from services.normalizacao import natureza_prefix
+
+# Campo do formulario de dotacao -> atributo do Plan21Nger.
+CAMPOS = {
+    "exercicio": "exercicio",
+    "chave_planejamento": "chave_planejamento",
+    "uo": "uo",
+    "programa": "programa",
+    "acao_paoe": "acao_paoe",
+    "produto": "produto",
+    "ug": "ug",
+    "regiao": "regiao",
+    "subacao_entrega": "subacao_entrega",
+    "etapa": "etapa",
+    "natureza_despesa": "natureza",
+    "fonte": "fonte",
+    "iduso": "idu",
+}
+# Intervalo minimo entre consultas do carimbo de versao do plan21_nger.
+VERIFICACAO_SEGUNDOS = 10
+
+_lock = threading.Lock()
+# So uma thread monta o indice por vez; as demais seguem com o anterior enquanto isso.
+_montagem = threading.Lock()
+_cache: dict = {"versao": None, "verificado_em": 0.0, "indice": None}
+
+
+def _versao_plan21() -> tuple:
+    # plan21_nger e recarregado por fora da aplicacao; qualquer recarga altera contagem/ids/ativos.
+    return tuple(
+        db.session.query(
+            func.count(Plan21Nger.id),
+            func.min(Plan21Nger.id),
+            func.max(Plan21Nger.id),
+            func.sum(case((Plan21Nger.ativo == True, 1), else_=0)),  # noqa: E712
+        ).one()
+    )
+
+
+def _codificar(valores: list[str | None], ordem=None) -> tuple[list[str], np.ndarray]:
+    # Valores distintos ordenados e o codigo (posicao na lista) de cada linha; -1 para vazio.
+    distintos = sorted({v for v in valores if v is not None}, key=ordem)
+    codigo = {v: i for i, v in enumerate(distintos)}
+    return distintos, np.fromiter((codigo.get(v, -1) for v in valores), dtype=np.int32, count=len(valores))
+
+
+def _montar_indice() -> dict:
+    # Cada campo vira um vetor de codigos por linha; filtros viram mascaras booleanas combinadas com AND.
+    colunas = [getattr(Plan21Nger, attr) for attr in CAMPOS.values()]
+    brutos: dict[str, list[str | None]] = {campo: [] for campo in CAMPOS}
+    for row in db.session.query(*colunas).yield_per(5000):
+        for campo, val in zip(CAMPOS, row):
+            s = None if val is None else str(val).strip()
+            brutos[campo].append(s or None)
+    filtros = {campo: _codificar(valores) for campo, valores in brutos.items()}
+    natureza = brutos["natureza_despesa"]
+    brutos["natureza_despesa"] = [None if v is None else natureza_prefix(v) for v in natureza]
+    opcoes = {
+        campo: _codificar(valores, ordem=lambda v: (v.lower(), v)) for campo, valores in brutos.items()
+    }
+    return {"linhas": len(natureza), "filtros": filtros, "opcoes": opcoes}
+
+
+def _indice_atual() -> dict:
+    agora = time.monotonic()
+    with _lock:
+        indice, versao_cache = _cache["indice"], _cache["versao"]
+        if indice is not None and agora - _cache["verificado_em"] < VERIFICACAO_SEGUNDOS:
+            return indice
+    # A consulta de versao e a montagem rodam fora do _lock; o indice novo so entra pronto.
+    if indice is not None and not _montagem.acquire(blocking=False):
+        return indice
+    if indice is None:
+        _montagem.acquire()
+    try:
+        with _lock:
+            if _cache["indice"] is not None and _cache["indice"] is not indice:
+                return _cache["indice"]
+        versao = _versao_plan21()
+        if indice is None or versao != versao_cache:
+            indice = _montar_indice()
+        with _lock:
+            _cache.update(indice=indice, versao=versao, verificado_em=agora)
+        return indice
+    finally:
+        _montagem.release()
+
+
+def _mascara_filtro(indice: dict, campo: str, valor: str) -> np.ndarray:
+    valores, codigos = indice["filtros"][campo]
+    inicio = bisect_left(valores, valor)
+    if campo == "natureza_despesa":
+        # Equivale ao LIKE 'valor%' da consulta original; na lista ordenada os prefixados sao contiguos.
+        fim = inicio
+        while fim < len(valores) and valores[fim].startswith(valor):
+            fim += 1
+        return (codigos >= inicio) & (codigos < fim)
+    if inicio < len(valores) and valores[inicio] == valor:
+        return codigos == inicio
+    return np.zeros(indice["linhas"], dtype=bool)
+
+
+def opcoes_dotacao(selecionados: dict[str, str]) -> dict[str, list[str]]:
+    """Listas de opcoes de cada campo, aplicando os demais filtros selecionados."""
+    indice = _indice_atual()
+    mascaras = {
+        campo: _mascara_filtro(indice, campo, valor)
+        for campo, valor in selecionados.items()
+        if campo in CAMPOS
+    }
+    options = {}
+    for campo in CAMPOS:
+        valores, codigos = indice["opcoes"][campo]
+        outras = [mascara for outro, mascara in mascaras.items() if outro != campo]
+        if not outras:
+            options[campo] = list(valores)
+            continue
+        presentes = np.unique(codigos[np.logical_and.reduce(outras)])
+        options[campo] = [valores[i] for i in presentes[presentes >= 0]]
+    return options
@@ -92,3 +92,36 @@ def build_parent_map(features=None):
             for child in f["children"]:
                 parent_map[child["id"]] = f["id"]
     return parent_map
+
+
+# Feature tree compiled at import: one bit per feature id (in FEATURES order), the
+# parent bit of each child bit and the mask of locked features.
+FEATURE_BITS = {fid: 1 << pos for pos, fid in enumerate(flatten_features())}
+PARENT_BITS = {FEATURE_BITS[child]: FEATURE_BITS[parent] for child, parent in build_parent_map().items()}
+LOCKED_MASK = sum(FEATURE_BITS[f["id"]] for f in FEATURES if f.get("locked"))
+
+
+def features_mask(feature_ids) -> int:
+    """Return the bitset of the given feature ids (ids outside FEATURES are ignored)."""
+    mask = 0
+    for fid in feature_ids:
+        mask |= FEATURE_BITS.get(fid, 0)
+    return mask
+
+
+def resolve_mask(mask: int) -> int:
+    """Add the parents of every granted child and the locked features to a bitset."""
+    resolved = mask | LOCKED_MASK
+    for child_bit, parent_bit in PARENT_BITS.items():
+        if mask & child_bit:
+            resolved |= parent_bit
+    return resolved
+
+
+def mask_features(mask: int) -> list[str]:
+    """Return the feature ids set in a bitset, in FEATURES order."""
+    return [fid for fid, bit in FEATURE_BITS.items() if mask & bit]
+
+
+def mask_has(mask: int, feature_id: str) -> bool:
+    return bool(mask & FEATURE_BITS.get(feature_id, 0))
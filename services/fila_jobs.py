@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import text
+
+from models import Job, db
+from services.job_status import read_cancel_flag, read_status, update_status_fields, write_status
+from services.jobs import TIPOS, executar_job
+from services.node_servidor import encerrar_servidores
+from services.saldo_execucao import garantir_saldo_execucao
+
+# Jobs rodando ao mesmo tempo no servico (o host inteiro), somando todos os tipos.
+JOBS_WORKERS = max(1, int(os.getenv("JOBS_WORKERS", "2")))
+# Tentativas por job; entre elas a espera dobra a partir de JOBS_BACKOFF_SEGUNDOS.
+JOBS_TENTATIVAS = max(1, int(os.getenv("JOBS_TENTATIVAS", "3")))
+JOBS_BACKOFF_SEGUNDOS = max(1, int(os.getenv("JOBS_BACKOFF_SEGUNDOS", "30")))
+INTERVALO_FILA = max(0.5, float(os.getenv("JOBS_INTERVALO_FILA", "2")))
+# Base gravada por cada tipo: jobs da mesma base rodam um de cada vez, na ordem da fila
+# (cargas em delta e a publicacao da carga ativa nao podem se cruzar). O plan20 grava
+# por UO/exercicio e pode rodar em paralelo.
+DATASET_DO_TIPO = {"emp": "emp", "nob": "nob", "ped": "ped", "est_emp": "est_emp", "fip613": "fip613", "plan20": None}
+ESTADOS_FINAIS = {"finalizado": "concluido", "cancelado": "cancelado", "falha": "falhou"}
+STATUS_DIR = Path("outputs") / "status"
+LOCK_SERVICO = STATUS_DIR / "servico_jobs.lock"
+LOG_SERVICO = STATUS_DIR / "servico_jobs.log"
+WORKER_PATH = Path(__file__).resolve().parents[1] / "worker.py"
+
+
+def _limites_por_tipo() -> dict[str, int]:
+    # JOBS_POR_TIPO="plan20=2,fip613=1": teto de jobs simultaneos de cada tipo (padrao 1).
+    # Para tipos com base propria o teto efetivo e 1, pela serializacao da base.
+    limites = {kind: 1 for kind in TIPOS}
+    for item in (os.getenv("JOBS_POR_TIPO") or "").split(","):
+        kind, _, valor = item.partition("=")
+        kind, valor = kind.strip(), valor.strip()
+        if kind in limites and valor.isdigit():
+            limites[kind] = max(1, int(valor))
+    return limites
+
+
+LIMITES_POR_TIPO = _limites_por_tipo()
+
+
+def _host() -> str:
+    return socket.gethostname()[:60]
+
+
+def _identidade() -> str:
+    return f"{_host()}:{os.getpid()}"
+
+
+def enfileirar(kind: str, upload_id: int) -> int:
+    """Coloca o upload na fila; se ja ha um job pendente para ele, devolve esse job."""
+    pendente = Job.query.filter_by(kind=kind, upload_id=upload_id, estado="pendente").first()
+    if pendente:
+        return pendente.id
+    agora = datetime.utcnow()
+    job = Job(kind=kind, upload_id=upload_id, estado="pendente", tentativas=0, criado_em=agora, proxima_execucao=agora)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def cancelar_pendentes(kind: str, upload_id: int) -> int:
+    """Tira da fila os jobs do upload que ainda nao comecaram; os em execucao usam o flag de cancelamento."""
+    total = db.session.execute(
+        text(
+            "UPDATE jobs SET estado = 'cancelado', finalizado_em = :agora "
+            "WHERE kind = :kind AND upload_id = :upload_id AND estado = 'pendente'"
+        ),
+        {"agora": datetime.utcnow(), "kind": kind, "upload_id": upload_id},
+    ).rowcount or 0
+    db.session.commit()
+    if total:
+        write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario antes de iniciar.")
+    return total
+
+
+def recuperar_jobs() -> int:
+    """Jobs que ficaram em execucao neste host (o servico parou no meio) voltam para a fila.
+
+    Como so um servico roda por host, todo job "executando" com o host no worker e orfao.
+    Quem ja gastou todas as tentativas e marcado como falho.
+    """
+    orfaos = Job.query.filter(Job.estado == "executando", Job.worker.like(f"{_host()}:%")).all()
+    agora = datetime.utcnow()
+    for job in orfaos:
+        job.worker = None
+        if job.tentativas >= JOBS_TENTATIVAS:
+            job.estado = "falhou"
+            job.finalizado_em = agora
+            job.erro = "O servico de jobs parou durante o processamento."
+            write_status(job.kind, job.upload_id, "falha no processamento", job.erro)
+        else:
+            job.estado = "pendente"
+            job.proxima_execucao = agora
+            update_status_fields(
+                job.kind, job.upload_id, state="na fila", message="Retomado apos reinicio do servico de jobs."
+            )
+    db.session.commit()
+    return len(orfaos)
+
+
+def _reservar(job_id: int) -> bool:
+    # UPDATE condicional: se outro servico pegou o job antes, nenhuma linha muda.
+    resultado = db.session.execute(
+        text(
+            "UPDATE jobs SET estado = 'executando', tentativas = tentativas + 1, "
+            "iniciado_em = :agora, worker = :worker WHERE id = :id AND estado = 'pendente'"
+        ),
+        {"agora": datetime.utcnow(), "worker": _identidade(), "id": job_id},
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+
+def _proximos_jobs(rodando: dict[int, str], vagas: int) -> list[tuple[int, str, int, int, float]]:
+    """Reserva ate `vagas` jobs respeitando o teto por tipo e a ordem de cada base.
+
+    Devolve (job_id, kind, upload_id, tentativa, segundos na fila) dos jobs reservados.
+    """
+    agora = datetime.utcnow()
+    ocupados = {DATASET_DO_TIPO.get(kind) for (kind,) in db.session.query(Job.kind).filter(Job.estado == "executando")}
+    ocupados.discard(None)
+    por_tipo: dict[str, int] = {}
+    for kind in rodando.values():
+        por_tipo[kind] = por_tipo.get(kind, 0) + 1
+    reservados = []
+    for job in Job.query.filter(Job.estado == "pendente").order_by(Job.id).all():
+        if len(reservados) >= vagas:
+            break
+        if job.kind not in TIPOS:
+            continue
+        dataset = DATASET_DO_TIPO.get(job.kind)
+        if dataset in ocupados:
+            continue
+        if dataset is not None:
+            # O primeiro pendente da base segura a fila dela, mesmo aguardando nova tentativa.
+            ocupados.add(dataset)
+        if job.proxima_execucao > agora or por_tipo.get(job.kind, 0) >= LIMITES_POR_TIPO[job.kind]:
+            continue
+        espera = round((agora - job.proxima_execucao).total_seconds(), 3)
+        candidato = (job.id, job.kind, job.upload_id, job.tentativas + 1, espera)
+        if _reservar(job.id):
+            por_tipo[job.kind] = por_tipo.get(job.kind, 0) + 1
+            reservados.append(candidato)
+    return reservados
+
+
+def _registrar_resultado(job_id: int, kind: str, upload_id: int, estado: str, tentativa: int) -> None:
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return
+    agora = datetime.utcnow()
+    job.worker = None
+    if estado != "finalizado":
+        job.erro = (read_status(kind, upload_id) or {}).get("message")
+    if estado == "falha" and tentativa < JOBS_TENTATIVAS:
+        espera = JOBS_BACKOFF_SEGUNDOS * 2 ** (tentativa - 1)
+        job.estado = "pendente"
+        job.proxima_execucao = agora + timedelta(seconds=espera)
+        update_status_fields(
+            kind,
+            upload_id,
+            state="na fila",
+            message=f"Falha na tentativa {tentativa}/{JOBS_TENTATIVAS} ({job.erro}). Nova tentativa em {espera}s.",
+        )
+    else:
+        job.estado = ESTADOS_FINAIS.get(estado, "falhou")
+        job.finalizado_em = agora
+    db.session.commit()
+
+
+def _registrar_metricas(job_id: int, kind: str, upload_id: int, estado: str, espera: float, inicio: float) -> None:
+    # Latencia de partida do job: tempo na fila depois de liberado e, nos jobs Node, ate o
+    # Node comecar (com o processo quente, so o envio do pedido).
+    metricas = dict((read_status(kind, upload_id) or {}).get("metricas") or {})
+    metricas.update(espera_fila_s=espera, duracao_s=round(time.perf_counter() - inicio, 3))
+    update_status_fields(kind, upload_id, metricas=metricas)
+    partida = metricas.get("partida_node_s")
+    node = ""
+    if partida is not None:
+        node = f", partida node {partida}s ({'quente' if metricas.get('node_quente') else 'frio'})"
+    print(f" Job {job_id} {kind}/{upload_id}: fila {espera}s{node}, duracao {metricas['duracao_s']}s, {estado}.")
+
+
+def _rodar_job(app, job_id: int, kind: str, upload_id: int, tentativa: int, espera: float) -> None:
+    inicio = time.perf_counter()
+    with app.app_context():
+        try:
+            if read_cancel_flag(kind, upload_id):
+                write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario.")
+                estado = "cancelado"
+            else:
+                estado = executar_job(
+                    kind, upload_id, f"Processamento iniciado (tentativa {tentativa}/{JOBS_TENTATIVAS})."
+                )
+        except Exception as exc:
+            traceback.print_exc()
+            db.session.rollback()
+            write_status(kind, upload_id, "falha no processamento", f"{type(exc).__name__}: {exc}")
+            estado = "falha"
+        try:
+            _registrar_resultado(job_id, kind, upload_id, estado, tentativa)
+            _registrar_metricas(job_id, kind, upload_id, estado, espera, inicio)
+        except Exception as exc:
+            db.session.rollback()
+            print(f"Aviso: nao foi possivel registrar o resultado do job {job_id}: {exc}")
+        finally:
+            db.session.remove()
+
+
+def _travar(handle) -> bool:
+    try:
+        handle.seek(0)
+        if os.name == "nt":
+            import msvcrt
+
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _destravar(handle) -> None:
+    handle.seek(0)
+    if os.name == "nt":
+        import msvcrt
+
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def _abrir_lock():
+    STATUS_DIR.mkdir(parents=True, exist_ok=True)
+    handle = open(LOCK_SERVICO, "a+", encoding="utf-8")
+    if _travar(handle):
+        return handle
+    handle.close()
+    return None
+
+
+def servico_ativo() -> bool:
+    """True se o servico de jobs deste host esta rodando (ele segura o lock enquanto vive)."""
+    handle = _abrir_lock()
+    if handle is None:
+        return True
+    try:
+        _destravar(handle)
+    finally:
+        handle.close()
+    return False
+
+
+def garantir_servico() -> int | None:
+    """Sobe o servico de jobs em segundo plano se nenhum estiver rodando; devolve o pid iniciado."""
+    if servico_ativo():
+        return None
+    creationflags = 0
+    if sys.platform.startswith("win"):
+        creationflags = getattr(subprocess, "DETACHED_PROCESS", 0) | getattr(
+            subprocess, "CREATE_NEW_PROCESS_GROUP", 0
+        )
+    with open(LOG_SERVICO, "a", encoding="utf-8") as log_handle:
+        proc = subprocess.Popen(
+            [sys.executable, str(WORKER_PATH), "--servico"],
+            cwd=str(WORKER_PATH.parent),
+            stdout=log_handle,
+            stderr=subprocess.STDOUT,
+            creationflags=creationflags,
+            start_new_session=not sys.platform.startswith("win"),
+        )
+    return proc.pid
+
+
+def _montar_saldo(app) -> None:
+    with app.app_context():
+        try:
+            garantir_saldo_execucao()
+        except Exception as exc:
+            print(f"Aviso: nao foi possivel montar saldo_execucao: {exc}")
+        finally:
+            db.session.remove()
+
+
+def executar_servico(app) -> None:
+    """Loop do servico de jobs: recupera a fila e roda no maximo JOBS_WORKERS jobs por vez.
+
+    O processo fica de pe entre os jobs com o app, o pool do banco e os servidores Node
+    ja carregados; cada job so paga o proprio processamento.
+    """
+    lock = _abrir_lock()
+    if lock is None:
+        print("Servico de jobs ja em execucao neste host.")
+        return
+    with app.app_context():
+        try:
+            recuperados = recuperar_jobs()
+        finally:
+            db.session.remove()
+    print(
+        f" Servico de jobs iniciado ({_identidade()}): {JOBS_WORKERS} workers, "
+        f"{recuperados} jobs recuperados, limites {LIMITES_POR_TIPO}."
+    )
+    rodando: dict[int, tuple[str, Future]] = {}
+    try:
+        # Primeira montagem do saldo_execucao (ou a refeita apos migracao) fora das requisicoes,
+        # sem ocupar vaga de job.
+        threading.Thread(target=_montar_saldo, args=(app,), name="saldo-execucao", daemon=True).start()
+        with ThreadPoolExecutor(max_workers=JOBS_WORKERS, thread_name_prefix="job") as pool:
+            while True:
+                for job_id in [j for j, (_, futuro) in rodando.items() if futuro.done()]:
+                    del rodando[job_id]
+                vagas = JOBS_WORKERS - len(rodando)
+                if vagas > 0:
+                    try:
+                        with app.app_context():
+                            try:
+                                tipos = {j: kind for j, (kind, _) in rodando.items()}
+                                for job_id, kind, upload_id, tentativa, espera in _proximos_jobs(tipos, vagas):
+                                    futuro = pool.submit(_rodar_job, app, job_id, kind, upload_id, tentativa, espera)
+                                    rodando[job_id] = (kind, futuro)
+                            finally:
+                                db.session.remove()
+                    except Exception as exc:
+                        print(f"Aviso: falha ao consultar a fila de jobs: {exc}")
+                time.sleep(INTERVALO_FILA)
+    finally:
+        encerrar_servidores()
+        _destravar(lock)
+        lock.close()
@@ -4,14 +4,48 @@ import os
 from datetime import datetime
 from pathlib import Path
 import pandas as pd
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
-from models import db
+from services.cargas import carregar_versao
+from services.job_status import update_status_fields, verificar_cancelamento
+from services.leitura_excel import ler_linhas, montar_dataframe
 from openpyxl.styles import Font
 
-BATCH_SIZE = 200
 UPLOAD_DIR = Path("upload") / "fip_613"
 OUTPUT_DIR = Path("outputs") / "fip_613"
+INSERT_COLS = [
+    "upload_id",
+    "carga_id",
+    "uo",
+    "ug",
+    "funcao",
+    "subfuncao",
+    "programa",
+    "projeto_atividade",
+    "regional",
+    "natureza_despesa",
+    "fonte_recurso",
+    "iduso",
+    "tipo_recurso",
+    "dotacao_inicial",
+    "cred_suplementar",
+    "cred_especial",
+    "cred_extraordinario",
+    "reducao",
+    "cred_autorizado",
+    "bloqueado_conting",
+    "reserva_empenho",
+    "saldo_destaque",
+    "saldo_dotacao",
+    "empenhado",
+    "liquidado",
+    "a_liquidar",
+    "valor_pago",
+    "valor_a_pagar",
+    "data_atualizacao",
+    "ano",
+    "data_arquivo",
+    "user_email",
+    "ativo",
+]
 
 
 def ensure_dirs():
@@ -30,30 +64,27 @@ def move_existing_to_tmp(base_dir: Path):
             pass
 
 
-def get_year_from_file(file_path, sheet_name="FIPLAN"):
-    try:
-        raw_data = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
-        for _, row in raw_data.iterrows():
-            for cell in row:
-                if isinstance(cell, str) and "Exercício igual a" in cell:
-                    year = int(cell.split()[-1])
-                    return year
-    except Exception:
-        return None
+def get_year_from_rows(linhas):
+    for linha in linhas:
+        for cell in linha:
+            if isinstance(cell, str) and "Exercício igual a" in cell:
+                try:
+                    return int(cell.split()[-1])
+                except ValueError:
+                    return None
     return None
 
 
-def load_clean_data(file_path, sheet_name="FIPLAN"):
-    raw_data = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
+def load_clean_data(linhas):
     header_row_index = None
-    for i, row in raw_data.iterrows():
-        if "UO" in row.values and "UG" in row.values:
+    for i, linha in enumerate(linhas):
+        if "UO" in linha and "UG" in linha:
             header_row_index = i
             break
     if header_row_index is None:
         return None
 
-    data = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row_index)
+    data = montar_dataframe(linhas, header=header_row_index)
     data = data.dropna(how="all").reset_index(drop=True)
     data = data.dropna(subset=["UO", "UG", "Função", "Subfunção", "Programa", "Projeto/Atividade"])
 
@@ -151,61 +182,34 @@ def save_clean_data(data, output_dir: Path) -> Path:
 
 
 def update_database(data, ano, data_arquivo, user_email, upload_id):
-    insert_sql = text(
-        """
-        INSERT INTO fip613 (
-            upload_id, uo, ug, funcao, subfuncao, programa, projeto_atividade, regional, natureza_despesa,
-            fonte_recurso, iduso, tipo_recurso, dotacao_inicial, cred_suplementar, cred_especial,
-            cred_extraordinario, reducao, cred_autorizado, bloqueado_conting, reserva_empenho,
-            saldo_destaque, saldo_dotacao, empenhado, liquidado, a_liquidar, valor_pago,
-            valor_a_pagar, data_atualizacao, ano, data_arquivo, user_email, ativo
-        )
-        VALUES (
-            :upload_id, :uo, :ug, :funcao, :subfuncao, :programa, :projeto_atividade, :regional, :natureza_despesa,
-            :fonte_recurso, :iduso, :tipo_recurso, :dotacao_inicial, :cred_suplementar, :cred_especial,
-            :cred_extraordinario, :reducao, :cred_autorizado, :bloqueado_conting, :reserva_empenho,
-            :saldo_destaque, :saldo_dotacao, :empenhado, :liquidado, :a_liquidar, :valor_pago,
-            :valor_a_pagar, :data_atualizacao, :ano, :data_arquivo, :user_email, :ativo
-        )
-        """
-    )
-
-    # desativa versões anteriores
-    try:
-        db.session.execute(text("UPDATE fip613 SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        raise
-
     rows = data.to_dict(orient="records")
-    total = 0
-    for start in range(0, len(rows), BATCH_SIZE):
-        chunk = rows[start : start + BATCH_SIZE]
-        for r in chunk:
-            r["data_atualizacao"] = datetime.utcnow()
-            r["ano"] = ano
-            r["data_arquivo"] = data_arquivo
-            r["user_email"] = user_email
-            r["upload_id"] = upload_id
-            r["ativo"] = True
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-        except SQLAlchemyError as exc:
-            db.session.rollback()
-            raise exc
-    return total
+    agora = datetime.utcnow()
+    for r in rows:
+        r["data_atualizacao"] = agora
+        r["ano"] = ano
+        r["data_arquivo"] = data_arquivo
+        r["user_email"] = user_email
+        r["upload_id"] = upload_id
+        r["ativo"] = True
+
+    # nova versao da base, publicada de uma vez (as anteriores seguem visiveis ate o commit)
+    stats = carregar_versao("fip613", INSERT_COLS, rows, upload_id)
+    update_status_fields("fip613", upload_id, carga=stats)
+    return stats["linhas"]
 
 
 def run_fip613(file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int) -> tuple[int, Path]:
     ensure_dirs()
-    ano = get_year_from_file(file_path)
-    data = load_clean_data(file_path)
+    update_status_fields("fip613", upload_id, progress=10, message="Lendo planilha.")
+    # Uma leitura so: ano, cabecalho e dados saem das mesmas linhas.
+    linhas = ler_linhas(file_path, sheet_name="FIPLAN")
+    ano = get_year_from_rows(linhas)
+    data = load_clean_data(linhas)
     if data is None or ano is None:
         raise RuntimeError("Não foi possível ler o arquivo FIP 613 (cabeçalho ou ano ausente).")
 
     output_path = save_clean_data(data, OUTPUT_DIR)
+    verificar_cancelamento("fip613", upload_id)
+    update_status_fields("fip613", upload_id, progress=60, message="Gravando registros no banco.")
     total = update_database(data, ano, data_arquivo, user_email, upload_id)
     return total, output_path
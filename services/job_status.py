@@ -1,17 +1,84 @@
 from __future__ import annotations
 
 import json
+import sqlite3
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 STATUS_DIR = Path("outputs/status")
-_CANCEL_SUFFIX = ".cancel"
+# Status e pedidos de cancelamento dos jobs, compartilhados pela aplicacao e pelo servico
+# de jobs do host. SQLite em WAL: leitores (SSE, endpoints de status) nao bloqueiam a
+# escrita e cada atualizacao e uma transacao.
+STATUS_DB = STATUS_DIR / "jobs_status.db"
+# Estados em que o job terminou; o SSE encerra o stream ao chegar em um deles.
+ESTADOS_FINAIS = ("processamento finalizado", "falha no processamento", "processamento cancelado")
+# verificar_cancelamento consulta o banco no maximo uma vez por intervalo por job.
+INTERVALO_CANCELAMENTO = 1.0
+
+_local = threading.local()
+_ultima_verificacao: dict[tuple[str, int], float] = {}
+
+
+def _kind(kind: str) -> str:
+    return (kind or "").strip().lower()
+
+
+def _conexao() -> sqlite3.Connection:
+    # Uma conexao por thread; isolation_level=None deixa as transacoes explicitas.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        STATUS_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(STATUS_DB), timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_status ("
+            "kind TEXT NOT NULL, upload_id INTEGER NOT NULL, versao INTEGER NOT NULL, dados TEXT NOT NULL, "
+            "PRIMARY KEY (kind, upload_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_cancelamento ("
+            "kind TEXT NOT NULL, upload_id INTEGER NOT NULL, pedido_em TEXT NOT NULL, "
+            "PRIMARY KEY (kind, upload_id))"
+        )
+        _local.conn = conn
+    return conn
+
+
+def _status_legado(kind: str, upload_id: int) -> dict[str, Any] | None:
+    # Uploads anteriores ao banco de status guardavam o status em outputs/status/<kind>_<id>.json.
+    path = STATUS_DIR / f"{_kind(kind)}_{upload_id}.json"
+    if not path.exists():
+        return None
+    try:
+        raw = path.read_text(encoding="utf-8")
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
 
 
-def status_path(kind: str, upload_id: int) -> Path:
-    safe_kind = (kind or "").strip().lower()
-    return STATUS_DIR / f"{safe_kind}_{upload_id}.json"
+def _gravar(kind: str, upload_id: int, montar: Callable[[dict[str, Any]], dict[str, Any]]) -> None:
+    # Leitura e escrita na mesma transacao: atualizacoes concorrentes nao se sobrescrevem.
+    conn = _conexao()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT dados FROM job_status WHERE kind = ? AND upload_id = ?", (_kind(kind), int(upload_id))
+        ).fetchone()
+        payload = montar(json.loads(row[0]) if row else {})
+        payload["updated_at"] = datetime.utcnow().isoformat()
+        conn.execute(
+            "INSERT INTO job_status (kind, upload_id, versao, dados) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT (kind, upload_id) DO UPDATE SET versao = versao + 1, dados = excluded.dados",
+            (_kind(kind), int(upload_id), json.dumps(payload, ensure_ascii=True)),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
 
 
 def write_status(
@@ -23,60 +90,74 @@ def write_status(
     progress: int | None = None,
     pid: int | None = None,
 ) -> None:
-    STATUS_DIR.mkdir(parents=True, exist_ok=True)
     payload: dict[str, Any] = {
-        "kind": (kind or "").strip().lower(),
+        "kind": _kind(kind),
         "upload_id": int(upload_id),
         "state": state,
         "message": message or "",
         "output_filename": output_filename,
         "progress": progress,
         "pid": pid,
-        "updated_at": datetime.utcnow().isoformat(),
     }
-    status_path(kind, upload_id).write_text(json.dumps(payload, ensure_ascii=True), encoding="utf-8")
+    _gravar(kind, upload_id, lambda _atual: payload)
 
 
-def read_status(kind: str, upload_id: int) -> dict[str, Any] | None:
-    path = status_path(kind, upload_id)
-    if not path.exists():
-        return None
+def status_com_versao(kind: str, upload_id: int) -> tuple[int, dict[str, Any] | None]:
+    """Status do job e a versao dele (incrementada a cada gravacao; 0 sem status)."""
+    row = _conexao().execute(
+        "SELECT versao, dados FROM job_status WHERE kind = ? AND upload_id = ?", (_kind(kind), int(upload_id))
+    ).fetchone()
+    if row is None:
+        return 0, _status_legado(kind, upload_id)
     try:
-        raw = path.read_text(encoding="utf-8")
-        return json.loads(raw) if raw else None
-    except Exception:
-        return None
+        return row[0], json.loads(row[1])
+    except ValueError:
+        return row[0], None
 
 
-def update_status_fields(kind: str, upload_id: int, **fields: Any) -> None:
-    current = read_status(kind, upload_id) or {}
-    if not current:
-        current = {
-            "kind": (kind or "").strip().lower(),
-            "upload_id": int(upload_id),
-        }
-    current.update(fields)
-    current["updated_at"] = datetime.utcnow().isoformat()
-    STATUS_DIR.mkdir(parents=True, exist_ok=True)
-    status_path(kind, upload_id).write_text(json.dumps(current, ensure_ascii=True), encoding="utf-8")
+def read_status(kind: str, upload_id: int) -> dict[str, Any] | None:
+    return status_com_versao(kind, upload_id)[1]
 
 
-def cancel_path(kind: str, upload_id: int) -> Path:
-    safe_kind = (kind or "").strip().lower()
-    return STATUS_DIR / f"{safe_kind}_{upload_id}{_CANCEL_SUFFIX}"
+def update_status_fields(kind: str, upload_id: int, **fields: Any) -> None:
+    def _montar(atual: dict[str, Any]) -> dict[str, Any]:
+        if not atual:
+            atual = {"kind": _kind(kind), "upload_id": int(upload_id)}
+        atual.update(fields)
+        return atual
+
+    _gravar(kind, upload_id, _montar)
 
 
 def set_cancel_flag(kind: str, upload_id: int) -> None:
-    STATUS_DIR.mkdir(parents=True, exist_ok=True)
-    cancel_path(kind, upload_id).write_text(datetime.utcnow().isoformat(), encoding="utf-8")
+    _conexao().execute(
+        "INSERT OR REPLACE INTO job_cancelamento (kind, upload_id, pedido_em) VALUES (?, ?, ?)",
+        (_kind(kind), int(upload_id), datetime.utcnow().isoformat()),
+    )
 
 
 def clear_cancel_flag(kind: str, upload_id: int) -> None:
-    try:
-        cancel_path(kind, upload_id).unlink()
-    except FileNotFoundError:
-        pass
+    _conexao().execute(
+        "DELETE FROM job_cancelamento WHERE kind = ? AND upload_id = ?", (_kind(kind), int(upload_id))
+    )
+    _ultima_verificacao.pop((_kind(kind), int(upload_id)), None)
 
 
 def read_cancel_flag(kind: str, upload_id: int) -> bool:
-    return cancel_path(kind, upload_id).exists()
+    row = _conexao().execute(
+        "SELECT 1 FROM job_cancelamento WHERE kind = ? AND upload_id = ?", (_kind(kind), int(upload_id))
+    ).fetchone()
+    return row is not None
+
+
+def verificar_cancelamento(kind: str, upload_id: int) -> None:
+    # Mesmo sinal dos runners Node: o job encerra com "processamento cancelado".
+    # Pode ser chamado por linha: o banco so e consultado a cada INTERVALO_CANCELAMENTO.
+    chave = (_kind(kind), int(upload_id))
+    agora = time.monotonic()
+    ultima = _ultima_verificacao.get(chave)
+    if ultima is not None and agora - ultima < INTERVALO_CANCELAMENTO:
+        return
+    _ultima_verificacao[chave] = agora
+    if read_cancel_flag(kind, upload_id):
+        raise RuntimeError("PROCESSAMENTO_CANCELADO")
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import os
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from models import EmpUpload, EstEmpUpload, Fip613Upload, NobUpload, PedUpload, Plan20Upload, db
+from services.cargas import agendar_descarte
+from services.est_emp_runner import INPUT_DIR as EST_EMP_UPLOAD_DIR, run_est_emp
+from services.fip613_runner import UPLOAD_DIR as FIP613_UPLOAD_DIR, run_fip613
+from services.job_status import (
+    clear_cancel_flag,
+    update_status_fields,
+    verificar_cancelamento,
+    write_status,
+)
+from services.node_servidor import NODE_PERSISTENTE, ServidorNode, servidor_node
+from services.ped_runner import INPUT_DIR as PED_UPLOAD_DIR, run_ped
+from services.plan20_carga import gravar_plan20_seduc
+from services.plan20_runner import run_plan20
+from services.relatorios import gerar_snapshot
+from services.saldo_execucao import atualizar_saldo_execucao_seguro
+
+EMP_UPLOAD_DIR = Path("upload/emp")
+NOB_UPLOAD_DIR = Path("upload/nob")
+PLAN20_UPLOAD_DIR = Path("upload/plan20_seduc")
+PLAN20_OUTPUT_DIR = Path("outputs/plan20_seduc")
+
+# Tipo de job -> (modelo do upload, pasta do arquivo enviado).
+UPLOADS = {
+    "emp": (EmpUpload, EMP_UPLOAD_DIR),
+    "nob": (NobUpload, NOB_UPLOAD_DIR),
+    "ped": (PedUpload, PED_UPLOAD_DIR),
+    "est_emp": (EstEmpUpload, EST_EMP_UPLOAD_DIR),
+    "fip613": (Fip613Upload, FIP613_UPLOAD_DIR),
+    "plan20": (Plan20Upload, PLAN20_UPLOAD_DIR),
+}
+TIPOS = tuple(UPLOADS)
+
+
+def find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
+    if not stored_filename:
+        return None
+    candidate = base_dir / stored_filename
+    if candidate.exists():
+        return candidate
+    tmp_dir = base_dir / "tmp"
+    if not tmp_dir.exists():
+        return None
+    stem = Path(stored_filename).stem
+    matches = sorted(tmp_dir.glob(f"{stem}_*.xlsx"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return matches[0] if matches else None
+
+
+def run_node(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
+    pedido = {
+        "kind": kind,
+        "file": str(file_path),
+        "upload_id": upload_id,
+        "user_email": user_email or "desconhecido",
+    }
+    if data_arquivo:
+        try:
+            pedido["data_arquivo"] = data_arquivo.isoformat()
+        except Exception:
+            pedido["data_arquivo"] = str(data_arquivo)
+    servidor = servidor_node(kind) if NODE_PERSISTENTE else ServidorNode(kind)
+    try:
+        payload, partida, quente = servidor.executar(pedido)
+    finally:
+        if not NODE_PERSISTENTE:
+            servidor.encerrar()
+    payload.update(partida_s=round(partida, 3) if partida is not None else None, node_quente=quente)
+    if not payload.get("ok"):
+        raise RuntimeError(f"Node runner falhou: {payload.get('error')}")
+    return payload
+
+
+def _upload(kind: str, upload_id: int):
+    modelo, pasta = UPLOADS[kind]
+    registro = db.session.get(modelo, upload_id)
+    if not registro:
+        raise RuntimeError(f"Upload {kind.upper()} nao encontrado: {upload_id}")
+    file_path = find_upload_path(pasta, registro.stored_filename)
+    if not file_path:
+        raise RuntimeError(f"Arquivo {kind.upper()} nao encontrado: {pasta / registro.stored_filename}")
+    return registro, file_path
+
+
+def _finalizar(kind: str, upload_id: int, total, output_filename: str | None) -> None:
+    # Snapshot antes do estado final: o relatorio aberto ao fim do job ja le do arquivo.
+    try:
+        gerar_snapshot(kind, upload_id)
+    except Exception as exc:
+        db.session.rollback()
+        print(f"Aviso: snapshot de {kind} nao gerado: {exc}")
+    # Mantem no status o que o runner registrou durante o job (carga, cache_chaves).
+    update_status_fields(
+        kind,
+        upload_id,
+        state="processamento finalizado",
+        message=f"Processado com sucesso. Registros: {total}.",
+        output_filename=output_filename,
+        progress=100,
+    )
+
+
+def _processar_node(kind: str, upload_id: int) -> None:
+    registro, file_path = _upload(kind, upload_id)
+    payload = run_node(kind, file_path, registro.user_email, registro.data_arquivo, registro.id)
+    update_status_fields(
+        kind, upload_id, metricas={"partida_node_s": payload.get("partida_s"), "node_quente": payload.get("node_quente")}
+    )
+    registro.output_filename = str(payload.get("output_filename") or "")
+    db.session.commit()
+    agendar_descarte(kind)
+    if kind == "emp":
+        atualizar_saldo_execucao_seguro(kind, upload_id)
+    _finalizar(kind, upload_id, payload.get("total"), payload.get("output_filename"))
+
+
+def _processar_runner(kind: str, upload_id: int, runner: Callable, saldo: bool) -> None:
+    registro, file_path = _upload(kind, upload_id)
+    total, output_path = runner(file_path, registro.data_arquivo, registro.user_email, registro.id)
+    registro.output_filename = str(output_path.name)
+    db.session.commit()
+    if saldo:
+        atualizar_saldo_execucao_seguro(kind, upload_id)
+    _finalizar(kind, upload_id, total, output_path.name)
+
+
+def _mover_saidas_plan20() -> None:
+    (PLAN20_OUTPUT_DIR / "tmp").mkdir(parents=True, exist_ok=True)
+    for f in [*PLAN20_OUTPUT_DIR.glob("*.xlsx"), *PLAN20_OUTPUT_DIR.glob("plan20_diagnostico_*.zip")]:
+        dest = PLAN20_OUTPUT_DIR / "tmp" / f"{f.stem}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{f.suffix}"
+        try:
+            f.rename(dest)
+        except OSError:
+            pass
+
+
+def _processar_plan20(upload_id: int) -> None:
+    registro, file_path = _upload("plan20", upload_id)
+    PLAN20_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    _mover_saidas_plan20()
+    update_status_fields("plan20", upload_id, progress=10, message="Processando planilha.")
+    output_path, plan20_df = run_plan20(file_path, PLAN20_OUTPUT_DIR, execucao=f"upload{upload_id}")
+    registro.output_filename = output_path.name if output_path else None
+    db.session.commit()
+    verificar_cancelamento("plan20", upload_id)
+    update_status_fields("plan20", upload_id, progress=70, message="Gravando registros no banco.")
+    try:
+        stats = gravar_plan20_seduc(plan20_df, registro.data_arquivo, registro.user_email)
+    except Exception as exc:
+        raise RuntimeError(f"Plan20 processado, mas falha ao gravar no banco: {exc}") from exc
+    if stats:
+        update_status_fields("plan20", upload_id, carga=stats)
+    _finalizar("plan20", upload_id, stats["linhas"] if stats else 0, registro.output_filename)
+
+
+PROCESSADORES: dict[str, Callable[[int], None]] = {
+    "emp": lambda upload_id: _processar_node("emp", upload_id),
+    "nob": lambda upload_id: _processar_node("nob", upload_id),
+    "ped": lambda upload_id: _processar_runner("ped", upload_id, run_ped, saldo=True),
+    "est_emp": lambda upload_id: _processar_runner("est_emp", upload_id, run_est_emp, saldo=True),
+    "fip613": lambda upload_id: _processar_runner("fip613", upload_id, run_fip613, saldo=False),
+    "plan20": _processar_plan20,
+}
+
+
+def executar_job(kind: str, upload_id: int, mensagem: str = "Processamento iniciado.") -> str:
+    """Processa o upload e grava o estado final no status do job.
+
+    Devolve "finalizado", "cancelado" ou "falha" (a fila de jobs decide se tenta de novo).
+    """
+    clear_cancel_flag(kind, upload_id)
+    write_status(kind, upload_id, "em processamento", mensagem, progress=0, pid=os.getpid())
+    try:
+        PROCESSADORES[kind](upload_id)
+    except Exception as exc:
+        db.session.rollback()
+        msg = f"{type(exc).__name__}: {exc}"
+        if "PROCESSAMENTO_CANCELADO" in msg:
+            write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario.")
+            return "cancelado"
+        write_status(kind, upload_id, "falha no processamento", msg)
+        traceback.print_exc()
+        return "falha"
+    return "finalizado"
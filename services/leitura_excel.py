@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import os
+from datetime import date, timedelta
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+# Leitor dos uploads: "auto" usa calamine (Rust, bem mais rapido) quando instalado e
+# cai para openpyxl em modo read_only; "openpyxl" ou "calamine" forcam o backend.
+LEITOR_EXCEL = (os.getenv("EXCEL_READER") or "auto").strip().lower()
+
+
+def _aparar(linhas: list[list[Any]]) -> list[list[Any]]:
+    # Mesmo recorte do leitor do pandas: sem linhas vazias no fim da aba e todas com a mesma largura.
+    ultima = -1
+    for idx, linha in enumerate(linhas):
+        while linha and linha[-1] == "":
+            linha.pop()
+        if linha:
+            ultima = idx
+    linhas = linhas[: ultima + 1]
+    largura = max((len(linha) for linha in linhas), default=0)
+    for linha in linhas:
+        if len(linha) < largura:
+            linha.extend([""] * (largura - len(linha)))
+    return linhas
+
+
+def _celula_openpyxl(cell) -> Any:
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        inteiro = int(cell.value)
+        if inteiro == cell.value:
+            return inteiro
+        return float(cell.value)
+    return cell.value
+
+
+def _celula_calamine(valor: Any) -> Any:
+    if isinstance(valor, float):
+        inteiro = int(valor)
+        return inteiro if inteiro == valor else valor
+    if isinstance(valor, date):
+        return pd.Timestamp(valor)
+    if isinstance(valor, timedelta):
+        return pd.Timedelta(valor)
+    return valor
+
+
+def _ler_openpyxl(file_path: Path, abas: list[str | int] | None) -> dict[str, list[list[Any]]]:
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        nomes = _resolver_abas(wb.sheetnames, abas)
+        resultado = {}
+        for nome in nomes:
+            ws = wb[nome]
+            ws.reset_dimensions()
+            resultado[nome] = [[_celula_openpyxl(cell) for cell in row] for row in ws.rows]
+        return resultado
+    finally:
+        wb.close()
+
+
+def _ler_calamine(file_path: Path, abas: list[str | int] | None) -> dict[str, list[list[Any]]]:
+    from python_calamine import CalamineWorkbook
+
+    wb = CalamineWorkbook.from_path(str(file_path))
+    resultado = {}
+    for nome in _resolver_abas(wb.sheet_names, abas):
+        dados = wb.get_sheet_by_name(nome).to_python(skip_empty_area=False)
+        resultado[nome] = [[_celula_calamine(valor) for valor in linha] for linha in dados]
+    return resultado
+
+
+BACKENDS: dict[str, Callable[[Path, list[str | int] | None], dict[str, list[list[Any]]]]] = {
+    "openpyxl": _ler_openpyxl,
+    "calamine": _ler_calamine,
+}
+_DEPENDENCIAS = {"openpyxl": "openpyxl", "calamine": "python_calamine"}
+
+
+def _resolver_abas(disponiveis: list[str], abas: list[str | int] | None) -> list[str]:
+    if abas is None:
+        return list(disponiveis)
+    nomes = []
+    for aba in abas:
+        if isinstance(aba, int):
+            nomes.append(disponiveis[aba])
+        elif aba in disponiveis:
+            nomes.append(aba)
+        else:
+            raise ValueError(f"Worksheet named '{aba}' not found")
+    return nomes
+
+
+def backends_disponiveis() -> list[str]:
+    return [nome for nome, modulo in _DEPENDENCIAS.items() if find_spec(modulo)]
+
+
+def resolver_backend(preferido: str | None = None) -> str:
+    escolhido = (preferido or LEITOR_EXCEL).strip().lower()
+    disponiveis = backends_disponiveis()
+    if escolhido == "auto":
+        return "calamine" if "calamine" in disponiveis else "openpyxl"
+    if escolhido not in BACKENDS:
+        print(f"Aviso: leitor Excel '{escolhido}' desconhecido; usando openpyxl.")
+        return "openpyxl"
+    if escolhido not in disponiveis:
+        print(f"Aviso: leitor Excel '{escolhido}' nao instalado; usando openpyxl.")
+        return "openpyxl"
+    return escolhido
+
+
+def ler_abas(
+    file_path: Path | str, abas: list[str | int] | None = None, backend: str | None = None
+) -> dict[str, list[list[Any]]]:
+    """Le as abas pedidas (todas, se None) abrindo o arquivo uma unica vez.
+
+    As celulas chegam como o pd.read_excel as veria antes de montar o DataFrame; a busca
+    de cabecalho/ano e o DataFrame final saem da mesma lista, sem reabrir o arquivo.
+    Se o calamine falhar num arquivo, a leitura e refeita com openpyxl.
+    """
+    escolhido = resolver_backend(backend)
+    try:
+        resultado = BACKENDS[escolhido](Path(file_path), abas)
+    except ValueError:
+        raise
+    except Exception as exc:
+        if escolhido == "openpyxl":
+            raise
+        print(f"Aviso: falha ao ler {file_path} com {escolhido} ({exc}); usando openpyxl.")
+        resultado = _ler_openpyxl(Path(file_path), abas)
+    return {nome: _aparar(linhas) for nome, linhas in resultado.items()}
+
+
+def nomes_abas(file_path: Path | str, backend: str | None = None) -> list[str]:
+    """Nomes das abas na ordem do arquivo, sem ler as celulas."""
+    escolhido = resolver_backend(backend)
+    if escolhido == "calamine":
+        try:
+            from python_calamine import CalamineWorkbook
+
+            return list(CalamineWorkbook.from_path(str(file_path)).sheet_names)
+        except Exception as exc:
+            print(f"Aviso: falha ao ler {file_path} com {escolhido} ({exc}); usando openpyxl.")
+    wb = load_workbook(Path(file_path), read_only=True, keep_links=False)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def ler_linhas(
+    file_path: Path | str, sheet_name: str | int | None = None, backend: str | None = None
+) -> list[list[Any]]:
+    """Linhas de uma aba (a primeira, se nao informada); ver ler_abas."""
+    abas = ler_abas(file_path, [0 if sheet_name is None else sheet_name], backend)
+    return next(iter(abas.values()))
+
+
+def montar_dataframe(linhas: list[list[Any]], header: int | None = 0, dtype: Any = None) -> pd.DataFrame:
+    """DataFrame equivalente a pd.read_excel(..., header=header, dtype=dtype) sobre as linhas lidas."""
+    if not linhas:
+        return pd.DataFrame()
+    # O parser altera as listas recebidas; copia para as linhas poderem ser reaproveitadas.
+    parser = TextParser([list(linha) for linha in linhas], header=header, dtype=dtype, skip_blank_lines=False)
+    return parser.read()
+
+
+def _celula_gravada(valor: Any) -> Any:
+    # Valor como voltaria de um xlsx gravado por to_excel: vazio para NA, float inteiro vira int.
+    if valor is None or valor is pd.NaT:
+        return ""
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, float):
+        if np.isnan(valor):
+            return ""
+        if valor.is_integer():
+            return int(valor)
+    if isinstance(valor, pd.Timestamp):
+        return valor.to_pydatetime()
+    return valor
+
+
+def linhas_do_dataframe(df: pd.DataFrame) -> list[list[Any]]:
+    """Linhas (cabecalho + dados) que ler_linhas devolveria para o df gravado com to_excel(index=False)."""
+    linhas = [[str(col) for col in df.columns]]
+    linhas.extend([_celula_gravada(v) for v in registro] for registro in df.itertuples(index=False, name=None))
+    return _aparar(linhas)
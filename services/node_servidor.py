@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from services.job_status import INTERVALO_CANCELAMENTO, read_cancel_flag, update_status_fields, write_status
+
+NODE_SERVER = Path(__file__).resolve().parents[1] / "node_runners" / "server.js"
+NODE_EXE = os.getenv("NODE_EXE", "node")
+# "0" sobe um node server.js por job, encerrado ao fim dele.
+NODE_PERSISTENTE = (os.getenv("NODE_PERSISTENTE") or "1").strip().lower() not in ("0", "false", "nao", "no")
+# Jobs atendidos por processo antes de recicla-lo (limita memoria acumulada pelo Node).
+NODE_JOBS_POR_PROCESSO = max(1, int(os.getenv("NODE_JOBS_POR_PROCESSO", "50")))
+
+
+class ServidorNode:
+    """Processo node server.js mantido entre jobs, falando JSON linha a linha no stdin/stdout."""
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self._proc: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._jobs = 0
+        self._escrita = threading.Lock()
+
+    def _vivo(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _iniciar(self) -> None:
+        self._proc = subprocess.Popen(
+            [NODE_EXE, str(NODE_SERVER)],
+            cwd=str(NODE_SERVER.parent),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self._jobs = 0
+
+    def encerrar(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=10)
+        except Exception:
+            proc.kill()
+
+    def _enviar(self, mensagem: dict) -> None:
+        with self._escrita:
+            self._proc.stdin.write(json.dumps(mensagem) + "\n")
+            self._proc.stdin.flush()
+
+    def _vigiar_cancelamento(self, kind: str, upload_id: int, fim: threading.Event) -> None:
+        # O pedido de cancelamento fica no banco de status; repassa ao Node pelo stdin.
+        while not fim.wait(INTERVALO_CANCELAMENTO):
+            if read_cancel_flag(kind, upload_id):
+                try:
+                    self._enviar({"cancelar": True, "kind": kind, "upload_id": upload_id})
+                except (OSError, ValueError, AttributeError):
+                    pass
+                return
+
+    @staticmethod
+    def _gravar_status(mensagem: dict) -> None:
+        kind, upload_id, campos = mensagem.get("kind"), mensagem.get("upload_id"), mensagem.get("campos") or {}
+        if not kind or not upload_id:
+            return
+        if mensagem.get("substituir"):
+            write_status(
+                kind,
+                upload_id,
+                campos.get("state"),
+                campos.get("message"),
+                campos.get("output_filename"),
+                campos.get("progress"),
+                campos.get("pid"),
+            )
+        else:
+            update_status_fields(kind, upload_id, **campos)
+
+    def executar(self, pedido: dict) -> tuple[dict, float | None, bool]:
+        """Envia o pedido e espera a resposta final, gravando os status que o Node enviar.
+
+        Devolve (resposta, segundos ate o Node comecar o job, se o processo ja estava quente).
+        """
+        with self._lock:
+            if self._vivo() and self._jobs >= NODE_JOBS_POR_PROCESSO:
+                self.encerrar()
+            quente = self._vivo()
+            if not quente:
+                self._iniciar()
+            self._seq += 1
+            self._jobs += 1
+            inicio = time.perf_counter()
+            partida = None
+            fim = threading.Event()
+            vigia = threading.Thread(
+                target=self._vigiar_cancelamento,
+                args=(pedido["kind"], pedido["upload_id"], fim),
+                name=f"cancelamento-{pedido['kind']}",
+                daemon=True,
+            )
+            try:
+                self._enviar({"id": self._seq, **pedido})
+                vigia.start()
+                while True:
+                    linha = self._proc.stdout.readline()
+                    if not linha:
+                        raise RuntimeError("Node runner encerrou durante o job.")
+                    try:
+                        mensagem = json.loads(linha)
+                    except json.JSONDecodeError:
+                        continue
+                    if mensagem.get("id") != self._seq:
+                        continue
+                    evento = mensagem.get("evento")
+                    if evento == "iniciado":
+                        partida = time.perf_counter() - inicio
+                    elif evento == "status":
+                        self._gravar_status(mensagem)
+                    else:
+                        return mensagem, partida, quente
+            except (OSError, RuntimeError):
+                self.encerrar()
+                raise
+            finally:
+                fim.set()
+
+
+_servidores: dict[str, ServidorNode] = {}
+_servidores_lock = threading.Lock()
+
+
+def servidor_node(kind: str) -> ServidorNode:
+    # Um processo por tipo: EMP e NOB gravam bases diferentes e podem rodar em paralelo.
+    with _servidores_lock:
+        if kind not in _servidores:
+            _servidores[kind] = ServidorNode(kind)
+        return _servidores[kind]
+
+
+def encerrar_servidores() -> None:
+    with _servidores_lock:
+        for servidor in _servidores.values():
+            servidor.encerrar()
+        _servidores.clear()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import unicodedata
+from decimal import Decimal
+
+
+def parse_decimal(raw_val):
+    if raw_val is None:
+        return None
+    raw = str(raw_val).strip()
+    if not raw:
+        return None
+    cleaned = raw.replace(".", "").replace(",", ".")
+    try:
+        return Decimal(cleaned)
+    except Exception:
+        return None
+
+
+def dec_or_zero(value):
+    if value is None:
+        return Decimal("0")
+    if isinstance(value, Decimal):
+        return value
+    parsed = parse_decimal(value)
+    return parsed if parsed is not None else Decimal("0")
+
+
+def natureza_prefix(value: str) -> str:
+    if not value:
+        return ""
+    parts = [p for p in str(value).split(".") if p]
+    if len(parts) >= 3:
+        return ".".join(parts[:3])
+    return str(value).strip()
+
+
+def leading_token(value: str) -> str:
+    if not value:
+        return ""
+    return str(value).strip().split(" ", 1)[0]
+
+
+def normalizar_ug(value: str) -> str:
+    token = leading_token(value)
+    if not token:
+        return ""
+    try:
+        return str(int(token))
+    except ValueError:
+        return token
+
+
+def normalizar_uo(value: str) -> str:
+    if not value:
+        return ""
+    token = leading_token(value)
+    digits = "".join(ch for ch in token if ch.isdigit())
+    return digits or token
+
+
+def normalizar_chave(value: str) -> str:
+    if not value:
+        return ""
+    value = str(value)
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return "".join(ch for ch in value if ch.isalnum() or ch == "*").upper()
+
+
+def ano_exercicio(value) -> int | None:
+    try:
+        return int(str(value).split(".")[0])
+    except (TypeError, ValueError):
+        return None
+
+
+def campo_chave(exercicio) -> str:
+    # Ate 2025 a chave de referencia e a chave de planejamento; depois, a chave nova.
+    ano = ano_exercicio(exercicio)
+    return "chave_planejamento" if ano and ano <= 2025 else "chave"
+
+
+def ug_de_subfuncao(subfuncao_ug: str | None) -> str:
+    # "Subfuncao + UG" vem como "<subfuncao>.<ug>"; a UG e o trecho apos o ultimo ponto.
+    if not subfuncao_ug:
+        return ""
+    texto = str(subfuncao_ug).strip()
+    if "." not in texto:
+        return ""
+    return texto.rsplit(".", 1)[1]
+
+
+def colunas_normalizadas(row) -> dict:
+    # Valores canonicos gravados junto com PED/EMP para filtrar por igualdade no banco.
+    return {
+        "chave_norm": normalizar_chave(row.get(campo_chave(row.get("exercicio")))),
+        "ug_norm": ug_de_subfuncao(row.get("subfuncao_ug")),
+        "uo_norm": normalizar_uo(row.get("uo")),
+    }
@@ -10,16 +10,17 @@ from pathlib import Path
 from typing import Any
 
 import pandas as pd
-from rapidfuzz import fuzz, process
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
 
-from models import db
+from services.cache_chaves import classificar_com_cache, versao_classificador
+from services.cargas import carregar_base
+from services.chave_matcher import FUZZY_SCORE_CUTOFF, MatcherChaves
+from services.job_status import update_status_fields, verificar_cancelamento
+from services.leitura_excel import ler_linhas, montar_dataframe
+from services.normalizacao import colunas_normalizadas
 
 # Evita warnings de downcasting silencioso em replace
 pd.set_option("future.no_silent_downcasting", True)
 
-BATCH_SIZE = 200
 
 # Caminhos base
 INPUT_DIR = Path("upload/ped")
@@ -151,50 +152,95 @@ def carregar_forcar_chave(json_path: Path) -> dict[str, str]:
         return {}
 
 
-def extrair_chave_valida_do_historico(hist_limpo: str, chaves_planejamento: list[str]) -> str | None:
-    for chave in chaves_planejamento:
-        if chave in hist_limpo:
-            return chave
-    return None
-
-
-def identificar_chave_planejamento(df: pd.DataFrame, chaves_planejamento: list[str], casos_especificos: dict[str, str]) -> pd.DataFrame:
-    def encontrar_chave(row: pd.Series) -> str:
-        hist = row.get("Histórico", "")
-        ped_estorno = row.get("Nº PED Estorno/Estornado", "").upper()
-        num_emp = row.get("Nº EMP", "").upper()
+_MATCHER_CACHE: dict[tuple, MatcherChaves] = {}
 
-        if ped_estorno != "NÃO INFORMADO" or num_emp != "NÃO INFORMADO":
-            return "IGNORADO"
 
-        if hist == "NÃO INFORMADO":
-            return "NÃO IDENTIFICADO"
-
-        hist_limpo = re.sub(r"\s+", " ", hist).strip()
-        if not hist_limpo.startswith("*"):
-            hist_limpo = "* " + hist_limpo
-        if not hist_limpo.endswith("*"):
-            hist_limpo += " *"
-        hist_limpo = re.sub(r"\s*\*\s*", " * ", hist_limpo)
-
-        chave_direta = extrair_chave_valida_do_historico(hist_limpo, chaves_planejamento)
-        if chave_direta:
-            return chave_direta
+def _mtime(path: Path) -> float | None:
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
 
-        for caso, chave in casos_especificos.items():
-            if caso in hist_limpo:
-                return chave
 
+def obter_matcher_chaves(json_chaves: Path, json_casos: Path) -> MatcherChaves:
+    # Reaproveita o automato enquanto os JSONs nao mudarem (chave inclui o mtime de cada arquivo).
+    cache_key = (str(json_chaves), _mtime(json_chaves), str(json_casos), _mtime(json_casos))
+    matcher = _MATCHER_CACHE.get(cache_key)
+    if matcher is None:
+        matcher = MatcherChaves(carregar_chaves_planejamento(json_chaves), carregar_casos_especificos(json_casos))
+        _MATCHER_CACHE.clear()
+        _MATCHER_CACHE[cache_key] = matcher
+    return matcher
+
+
+def _historico_para_busca(hist: str) -> str:
+    hist_limpo = re.sub(r"\s+", " ", hist).strip()
+    if not hist_limpo.startswith("*"):
+        hist_limpo = "* " + hist_limpo
+    if not hist_limpo.endswith("*"):
+        hist_limpo += " *"
+    return re.sub(r"\s*\*\s*", " * ", hist_limpo)
+
+
+def _classificar_historicos(matcher: MatcherChaves, historicos: list[str]) -> list[str]:
+    chaves: list[str] = []
+    pendentes: list[int] = []
+    trechos: list[str] = []
+    for idx, hist_limpo in enumerate(historicos):
+        chave = matcher.buscar(hist_limpo)
+        if chave:
+            chaves.append(chave)
+            continue
+        chaves.append("NÃO IDENTIFICADO")
         partes = re.findall(r"\*([^*]+)", hist_limpo)
         if len(partes) >= 7:
-            trecho = " * ".join(partes[:7])
-            match = process.extractOne(trecho, chaves_planejamento, scorer=fuzz.WRatio, score_cutoff=95)
-            if match:
-                print(f"Chave aproximada identificada por fuzzy: {match[0]}")
-                return match[0]
-        return "NÃO IDENTIFICADO"
-
-    df["Chave"] = df.apply(encontrar_chave, axis=1)
+            pendentes.append(idx)
+            trechos.append(" * ".join(partes[:7]))
+
+    # Fuzzy so para o que o automato nao resolveu, em lote.
+    for idx, chave in zip(pendentes, matcher.buscar_fuzzy(trechos)):
+        if chave:
+            print(f"Chave aproximada identificada por fuzzy: {chave}")
+            chaves[idx] = chave
+    return chaves
+
+
+def identificar_chave_planejamento(
+    df: pd.DataFrame,
+    matcher: MatcherChaves,
+    versao_cache: str | None = None,
+    estatisticas: dict | None = None,
+) -> pd.DataFrame:
+    n = len(df)
+    historicos = df["Histórico"].tolist() if "Histórico" in df.columns else [""] * n
+    estornos = df["Nº PED Estorno/Estornado"].tolist() if "Nº PED Estorno/Estornado" in df.columns else [""] * n
+    empenhos = df["Nº EMP"].tolist() if "Nº EMP" in df.columns else [""] * n
+
+    chaves: list[str] = []
+    elegiveis: list[int] = []
+    textos: list[str] = []
+    for idx, (hist, ped_estorno, num_emp) in enumerate(zip(historicos, estornos, empenhos)):
+        if str(ped_estorno).upper() != "NÃO INFORMADO" or str(num_emp).upper() != "NÃO INFORMADO":
+            chaves.append("IGNORADO")
+        elif hist == "NÃO INFORMADO":
+            chaves.append("NÃO IDENTIFICADO")
+        else:
+            chaves.append("")
+            elegiveis.append(idx)
+            textos.append(_historico_para_busca(hist))
+
+    if versao_cache:
+        resultados, stats = classificar_com_cache(
+            "ped", versao_cache, textos, lambda pendentes: _classificar_historicos(matcher, pendentes)
+        )
+        if estatisticas is not None:
+            estatisticas.update(stats)
+    else:
+        resultados = _classificar_historicos(matcher, textos)
+    for idx, chave in zip(elegiveis, resultados):
+        chaves[idx] = chave
+
+    df["Chave"] = chaves
     return df
 
 
@@ -422,8 +468,7 @@ def encontrar_linha_cabecalho(df_raw: pd.DataFrame) -> int | None:
 
 def preparar_aba_ped(file_path: Path) -> pd.DataFrame | None:
     try:
-        xls = pd.ExcelFile(file_path)
-        df_raw = pd.read_excel(xls, sheet_name=xls.sheet_names[0], header=None, dtype=str)
+        df_raw = montar_dataframe(ler_linhas(file_path), header=None, dtype=str)
 
         idx_cabecalho = encontrar_linha_cabecalho(df_raw)
         if idx_cabecalho is None:
@@ -442,7 +487,11 @@ def preparar_aba_ped(file_path: Path) -> pd.DataFrame | None:
 
 
 def processar_planilha(
-    df: pd.DataFrame, chaves_planejamento: list[str], casos_especificos: dict[str, str], forcar_map: dict[str, str]
+    df: pd.DataFrame,
+    matcher: MatcherChaves,
+    forcar_map: dict[str, str],
+    versao_cache: str | None = None,
+    estatisticas: dict | None = None,
 ) -> pd.DataFrame | None:
     try:
         ano = None
@@ -458,7 +507,7 @@ def processar_planilha(
         df[cols_obj] = df[cols_obj].apply(lambda col: col.map(corrigir_caracteres))
 
         df = converter_tipos(df)
-        df = identificar_chave_planejamento(df, chaves_planejamento, casos_especificos)
+        df = identificar_chave_planejamento(df, matcher, versao_cache, estatisticas)
         df = forcar_chaves_manualmente(df, forcar_map)
 
         if "Chave" in df.columns:
@@ -583,6 +632,85 @@ DF_TO_DB = {
     "Nº NLA": "numero_nla",
 }
 
+INSERT_COLS = [
+    "upload_id",
+    "carga_id",
+    "hash_conteudo",
+    "chave",
+    "regiao",
+    "subfuncao_ug",
+    "adj",
+    "macropolitica",
+    "pilar",
+    "eixo",
+    "politica_decreto",
+    "exercicio",
+    "historico",
+    "numero_ped",
+    "numero_ped_estorno",
+    "numero_emp",
+    "numero_cad",
+    "numero_noblist",
+    "numero_os",
+    "convenio",
+    "indicativo_licitacao_exercicios_anteriores",
+    "liberado_fisco_estadual",
+    "situacao",
+    "uo",
+    "nome_unidade_orcamentaria",
+    "ug",
+    "nome_unidade_gestora",
+    "numero_processo_orcamentario_pagamento",
+    "valor_ped",
+    "valor_estorno",
+    "dotacao_orcamentaria",
+    "funcao",
+    "subfuncao",
+    "programa_governo",
+    "paoe",
+    "natureza_despesa",
+    "cat_econ",
+    "grupo",
+    "modalidade",
+    "elemento",
+    "nome_elemento",
+    "fonte",
+    "iduso",
+    "numero_emenda_ep",
+    "autor_emenda_ep",
+    "numero_cac",
+    "licitacao",
+    "usuario_responsavel",
+    "data_solicitacao",
+    "data_criacao",
+    "data_autorizacao",
+    "data_licitacao",
+    "data_hora_cadastro_autorizacao",
+    "tipo_empenho",
+    "tipo_despesa",
+    "numero_abj",
+    "numero_processo_sequestro_judicial",
+    "indicativo_entrega_imediata",
+    "indicativo_contrato",
+    "codigo_uo_extinta",
+    "devolucao_gcv",
+    "mes_competencia_folha_pagamento",
+    "exercicio_competencia_folha",
+    "obrigacao_patronal",
+    "tipo_obrigacao_patronal",
+    "numero_nla",
+    "credor",
+    "nome_credor",
+    "chave_planejamento",
+    "chave_norm",
+    "ug_norm",
+    "uo_norm",
+    "data_atualizacao",
+    "data_arquivo",
+    "user_email",
+    "ativo",
+]
+
 
 def _clean_val(val: Any) -> Any:
     try:
@@ -658,6 +786,7 @@ def montar_registros_para_db(df: pd.DataFrame, data_arquivo: datetime, user_emai
         else:
             payload["chave_planejamento"] = _clean_val(row.get("Chave de Planejamento") or row.get("Chave"))
             payload["chave"] = None
+        payload.update(colunas_normalizadas(payload))
         # Campos monetarios em float para evitar erro de conversao no DB
         if "valor_ped" in payload:
             payload["valor_ped"] = _parse_valor_db(payload["valor_ped"])
@@ -682,74 +811,36 @@ def montar_registros_para_db(df: pd.DataFrame, data_arquivo: datetime, user_emai
     return registros
 
 def update_database(df: pd.DataFrame, data_arquivo: datetime, user_email: str, upload_id: int) -> int:
-    insert_sql = text(
-        """
-        INSERT INTO ped (
-            upload_id, chave, regiao, subfuncao_ug, adj, macropolitica, pilar, eixo, politica_decreto,
-            exercicio, historico, numero_ped, numero_ped_estorno, numero_emp, numero_cad, numero_noblist,
-            numero_os, convenio, indicativo_licitacao_exercicios_anteriores, liberado_fisco_estadual, situacao,
-            uo, nome_unidade_orcamentaria, ug, nome_unidade_gestora, numero_processo_orcamentario_pagamento,
-            valor_ped, valor_estorno, dotacao_orcamentaria, funcao, subfuncao, programa_governo, paoe,
-            natureza_despesa, cat_econ, grupo, modalidade, elemento, nome_elemento, fonte, iduso,
-            numero_emenda_ep, autor_emenda_ep, numero_cac, licitacao, usuario_responsavel, data_solicitacao,
-            data_criacao, data_autorizacao, data_licitacao, data_hora_cadastro_autorizacao, tipo_empenho,
-            tipo_despesa, numero_abj, numero_processo_sequestro_judicial, indicativo_entrega_imediata,
-            indicativo_contrato, codigo_uo_extinta, devolucao_gcv, mes_competencia_folha_pagamento,
-            exercicio_competencia_folha, obrigacao_patronal, tipo_obrigacao_patronal, numero_nla, credor,
-            nome_credor, chave_planejamento, data_atualizacao, data_arquivo, user_email, ativo
-        )
-        VALUES (
-            :upload_id, :chave, :regiao, :subfuncao_ug, :adj, :macropolitica, :pilar, :eixo, :politica_decreto,
-            :exercicio, :historico, :numero_ped, :numero_ped_estorno, :numero_emp, :numero_cad, :numero_noblist,
-            :numero_os, :convenio, :indicativo_licitacao_exercicios_anteriores, :liberado_fisco_estadual, :situacao,
-            :uo, :nome_unidade_orcamentaria, :ug, :nome_unidade_gestora, :numero_processo_orcamentario_pagamento,
-            :valor_ped, :valor_estorno, :dotacao_orcamentaria, :funcao, :subfuncao, :programa_governo, :paoe,
-            :natureza_despesa, :cat_econ, :grupo, :modalidade, :elemento, :nome_elemento, :fonte, :iduso,
-            :numero_emenda_ep, :autor_emenda_ep, :numero_cac, :licitacao, :usuario_responsavel, :data_solicitacao,
-            :data_criacao, :data_autorizacao, :data_licitacao, :data_hora_cadastro_autorizacao, :tipo_empenho,
-            :tipo_despesa, :numero_abj, :numero_processo_sequestro_judicial, :indicativo_entrega_imediata,
-            :indicativo_contrato, :codigo_uo_extinta, :devolucao_gcv, :mes_competencia_folha_pagamento,
-            :exercicio_competencia_folha, :obrigacao_patronal, :tipo_obrigacao_patronal, :numero_nla, :credor,
-            :nome_credor, :chave_planejamento, :data_atualizacao, :data_arquivo, :user_email, :ativo
-        )
-        """
-    )
-
-    try:
-        db.session.execute(text("UPDATE ped SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        raise
-
     registros = montar_registros_para_db(df, data_arquivo, user_email, upload_id)
-    total = 0
-    for start in range(0, len(registros), BATCH_SIZE):
-        chunk = registros[start : start + BATCH_SIZE]
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-        except SQLAlchemyError:
-            db.session.rollback()
-            raise
-    return total
+    stats = carregar_base("ped", INSERT_COLS, registros, upload_id)
+    update_status_fields("ped", upload_id, carga=stats)
+    return len(registros)
 
 
 def run_ped(file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int) -> tuple[int, Path]:
     ensure_dirs()
-    chaves_planejamento = carregar_chaves_planejamento(JSON_CHAVES_PLANEJAMENTO)
-    casos_especificos = carregar_casos_especificos(JSON_CASOS_ESPECIFICOS)
+    matcher = obter_matcher_chaves(JSON_CHAVES_PLANEJAMENTO, JSON_CASOS_ESPECIFICOS)
     forcar_map = carregar_forcar_chave(JSON_FORCAR_CHAVE)
 
+    update_status_fields("ped", upload_id, progress=10, message="Lendo planilha.")
     ped_df = preparar_aba_ped(file_path)
     if ped_df is None:
         raise RuntimeError("Falha ao identificar cabeçalho ou ler a aba ped.")
 
-    tratado_df = processar_planilha(ped_df.copy(), chaves_planejamento, casos_especificos, forcar_map)
+    versao_cache = versao_classificador(
+        "ped", [JSON_CHAVES_PLANEJAMENTO, JSON_CASOS_ESPECIFICOS, JSON_FORCAR_CHAVE], FUZZY_SCORE_CUTOFF
+    )
+    estatisticas: dict = {}
+    verificar_cancelamento("ped", upload_id)
+    update_status_fields("ped", upload_id, progress=30, message="Classificando chaves de planejamento.")
+    tratado_df = processar_planilha(ped_df.copy(), matcher, forcar_map, versao_cache, estatisticas)
     if tratado_df is None:
         raise RuntimeError("Falha ao tratar a planilha PED.")
+    if estatisticas:
+        update_status_fields("ped", upload_id, cache_chaves=estatisticas)
 
     output_path = salvar_planilhas(ped_df, tratado_df, file_path)
+    verificar_cancelamento("ped", upload_id)
+    update_status_fields("ped", upload_id, progress=70, message="Gravando registros no banco.")
     total = update_database(tratado_df, data_arquivo, user_email, upload_id)
     return total, output_path
\ No newline at end of file
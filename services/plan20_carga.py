@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import unicodedata
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+from services.carga_lote import carregar_em_lote
+from services.leitura_excel import linhas_do_dataframe, montar_dataframe
+
+
+def gravar_plan20_seduc(
+    origem: pd.DataFrame | Path, data_arquivo: datetime, user_email: str
+) -> dict[str, Any] | None:
+    """Grava a aba Plan20_SEDUC na tabela plan20_seduc.
+
+    origem e o DataFrame devolvido por run_plan20 ou o caminho de um arquivo processado.
+    Substitui apenas os registros dos mesmos exercicio + unidade orcamentaria do arquivo.
+    """
+    if isinstance(origem, pd.DataFrame):
+        # Mesmos valores e tipos que o pd.read_excel da aba gravada daria (ex.: "2025" -> 2025).
+        df_out = montar_dataframe(linhas_do_dataframe(origem))
+    else:
+        df_out = pd.read_excel(origem, sheet_name="Plan20_SEDUC")
+    if df_out.empty:
+        return None
+    col_map = {
+        "Exercício": "exercicio",
+        "Programa": "programa",
+        "Função": "funcao",
+        "Unidade Orçamentária": "unidade_orcamentaria",
+        "Ação (P/A/OE)": "acao_paoe",
+        "Subfunção": "subfuncao",
+        "Objetivo Específico": "objetivo_especifico",
+        "Esfera": "esfera",
+        "Responsável pela Ação": "responsavel_acao",
+        "Produto(s) da Ação": "produto_acao",
+        "Unidade de Medida do Produto": "unid_medida_produto",
+        "Região do Produto": "regiao_produto",
+        "Meta do Produto": "meta_produto",
+        "Saldo Meta do Produto": "saldo_meta_produto",
+        "Público Transversal": "publico_transversal",
+        "Subação/entrega": "subacao_entrega",
+        "Responsável": "responsavel",
+        "Prazo": "prazo",
+        "Unid. Gestora": "unid_gestora",
+        "Unidade Setorial de Planejamento": "unidade_setorial_planejamento",
+        "Produto da Subação": "produto_subacao",
+        "Unidade de Medida": "unidade_medida",
+        "Região da Subação": "regiao_subacao",
+        "Código": "codigo",
+        "Município(s) da entrega": "municipios_entrega",
+        "Meta da Subação": "meta_subacao",
+        "Detalhamento do produto": "detalhamento_produto",
+        "Etapa": "etapa",
+        "Responsável da Etapa": "responsavel_etapa",
+        "Prazo da Etapa": "prazo_etapa",
+        "Região da Etapa": "regiao_etapa",
+        "Natureza": "natureza",
+        "Fonte": "fonte",
+        "IDU": "idu",
+        "Descrição do Item de Despesa": "descricao_item_despesa",
+        "Unid. Medida": "unid_medida_item",
+        "Quantidade": "quantidade",
+        "Valor Unitário": "valor_unitario",
+        "Valor Total": "valor_total",
+        "Chave de Planejamento": "chave_planejamento",
+        "Região": "regiao",
+        "Subfunção + UG": "subfuncao_ug",
+        "ADJ": "adj",
+        "Macropolitica": "macropolitica",
+        "Pilar": "pilar",
+        "Eixo": "eixo",
+        "Politica_Decreto": "politica_decreto",
+        "Público Transversal (chave)": "publico_transversal_chave",
+        "Cat.Econ": "cat_econ",
+        "Grupo": "grupo",
+        "Modalidade": "modalidade",
+        "Elemento": "elemento",
+        "Subelemento": "subelemento",
+    }
+
+    def _norm_col(name: str) -> str:
+        base = unicodedata.normalize("NFKD", str(name or ""))
+        ascii_only = "".join(ch for ch in base if not unicodedata.combining(ch))
+        return ascii_only.lower().replace(" ", "").replace("_", "").replace(".", "").replace("/", "")
+
+    norm_map = {_norm_col(src): dst for src, dst in col_map.items()}
+    rename_dict = {}
+    for col in df_out.columns:
+        norm = _norm_col(col)
+        if norm in norm_map:
+            rename_dict[col] = norm_map[norm]
+    df_out = df_out.rename(columns=rename_dict)
+
+    meta_cols = {
+        "data_atualizacao",
+        "ano",
+        "data_arquivo",
+        "user_email",
+        "ativo",
+    }
+    keep_cols = list(col_map.values()) + list(meta_cols)
+    for col in keep_cols:
+        if col not in df_out.columns:
+            df_out[col] = None
+    df_out = df_out[[c for c in keep_cols if c in df_out.columns]]
+
+    # Converte colunas numericas para evitar erro de cast (usa formato pt-BR)
+    def _to_numeric_br(series):
+        return pd.to_numeric(
+            series.astype(str)
+            .str.replace(".", "", regex=False)
+            .str.replace(",", ".", regex=False),
+            errors="coerce",
+        )
+
+    # Apenas colunas realmente numéricas no banco
+    numeric_cols = [
+        "exercicio",
+        "quantidade",
+        "valor_unitario",
+        "valor_total",
+    ]
+    for col in numeric_cols:
+        if col in df_out.columns:
+            df_out[col] = _to_numeric_br(df_out[col])
+
+    now = datetime.utcnow()
+    df_out["data_atualizacao"] = now
+    df_out["data_arquivo"] = data_arquivo
+    df_out["user_email"] = user_email
+    df_out["ativo"] = True
+    if "exercicio" in df_out.columns:
+        df_out["ano"] = pd.to_numeric(df_out["exercicio"], errors="coerce")
+    else:
+        df_out["ano"] = None
+    # Desativa somente registros do mesmo exercicio+unidade_orcamentaria
+    combos = set()
+    if "unidade_orcamentaria" in df_out.columns and "exercicio" in df_out.columns:
+        for _, uo, ex in df_out[["unidade_orcamentaria", "exercicio"]].dropna().itertuples():
+            try:
+                ex_int = int(ex)
+            except (TypeError, ValueError):
+                continue
+            combos.add((str(uo).strip(), ex_int))
+    desativar = [
+        (
+            "UPDATE plan20_seduc SET ativo = 0 WHERE unidade_orcamentaria = :uo AND exercicio = :ex",
+            {"uo": uo, "ex": ex},
+        )
+        for uo, ex in combos
+    ]
+    return carregar_em_lote(
+        "plan20_seduc", list(df_out.columns), df_out.to_dict(orient="records"), antes=desativar
+    )
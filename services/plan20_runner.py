@@ -3,15 +3,24 @@
 from __future__ import annotations
 
 import csv
+import multiprocessing
+import os
 import re
+import threading
 import time
-from collections import defaultdict
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import pandas as pd
-from openpyxl.styles import Font
+
+from services.leitura_excel import ler_abas, montar_dataframe, nomes_abas
 
 # ----------------------------
 # CONFIG / CONSTANTES
@@ -88,45 +97,198 @@ NORMALIZA_MAP = {
     "ü": "u",
     "ç": "c",
 }
+_TABELA_NORMALIZA = str.maketrans(NORMALIZA_MAP)
+# Pontuacao, tracos e espacos viram um unico espaco.
+_SEPARADORES = re.compile(r"[\s\[\]\(\)\{\}\,;:\"\-–—|/]+")
+
+# Tipo de cada linha da aba, na ordem de prioridade em que processar_arquivo testa as chaves.
+(
+    LINHA_OUTRA,
+    LINHA_VAZIA,
+    LINHA_EXERCICIO,
+    LINHA_PROGRAMA,
+    LINHA_ACAO,
+    LINHA_PRODUTO,
+    LINHA_TOTAL_PRODUTO,
+    LINHA_PUBLICO,
+    LINHA_PLANO,
+    LINHA_SUBACAO,
+    LINHA_ETAPA,
+    LINHA_REGIAO,
+) = range(12)
+
+# Uma unica regex classifica a linha normalizada: cada chave fica num lookahead opcional
+# a partir do inicio da linha, entao todos os grupos nomeados sao avaliados na mesma
+# passada. Chaves ancoradas (todas as alternativas com ^) so sao testadas na posicao 0.
+_PADRAO_LINHA = re.compile(
+    "^"
+    + "".join(
+        f"(?:(?={'' if regex.startswith('^') else '.*?'}(?P<{nome}>{regex}))|)" for nome, regex in KEYS.items()
+    )
+    + r"(?:(?=programa\s+(?P<programa_num>\d+))|)"
+    + r"(?:(?=.*?(?P<total_produto>total por produto))|)"
+    + r"(?:(?=(?P<filtro_b>emitir relatorio))|)"
+)
+_TIPOS_POR_CHAVE = (
+    ("programa_num", LINHA_PROGRAMA),
+    ("Acao", LINHA_ACAO),
+    ("Produto", LINHA_PRODUTO),
+    ("total_produto", LINHA_TOTAL_PRODUTO),
+    ("PublicoTransversal", LINHA_PUBLICO),
+    ("PlanoPorProduto", LINHA_PLANO),
+    ("SubacaoEntrega", LINHA_SUBACAO),
+    ("Etapa", LINHA_ETAPA),
+    ("RegiaoPlanejamento", LINHA_REGIAO),
+)
+
+# Identificador hierarquico gerado por processar_arquivo: A.B.Cx.PAOE.Dn[.En][.Fn.Gn.Hn.In].
+_PADRAO_ID = re.compile(
+    r"^(?P<ab>A\d+\.B\d+)"
+    r"(?:(?P<c>\.C\d+\.\d+)"
+    r"(?:(?P<d>\.D\d+)(?P<e>\.E\d+)?"
+    r"(?:(?P<f>\.F\d+)(?:(?P<g>\.G\d+)(?:(?P<h>\.H\d+)(?P<i>\.I\d+)?)?)?)?"
+    r")?)?$"
+)
+
+# Processos usados para ler e analisar as abas da planilha em paralelo; 1 (padrão)
+# processa as abas em sequência, no próprio processo do job.
+PLAN20_WORKERS = max(1, int(os.getenv("PLAN20_WORKERS") or "1"))
+# Diagnóstico (Identificadores_Raw, Extrair_dados e Debug_Log): "zip" (padrão) grava os
+# CSVs compactados em plan20_diagnostico_<ts>.zip ao lado da planilha, "planilha" grava as
+# abas na própria planilha (saída antiga, com plan20_debug.csv) e "0" não grava.
+PLAN20_DIAGNOSTICO = (os.getenv("PLAN20_DIAGNOSTICO") or "zip").strip().lower()
+XLSX_OPCOES = {"strings_to_formulas": False, "strings_to_urls": False}
+
+# Rastreio de depuração (aba/CSV Debug_Log). PLAN20_DEBUG: "0" (padrão, desligado), "info"
+# ou "debug" (inclui as mensagens por aba). Só as últimas PLAN20_DEBUG_LIMITE mensagens ficam
+# em memória; PLAN20_DEBUG_AMOSTRA=N guarda 1 a cada N mensagens "debug" de cada local e
+# PLAN20_DEBUG_ARQUIVO grava todas as mensagens aceitas em CSV, à medida que chegam: um
+# arquivo por execução, com o id do upload (ou a data e hora) antes da extensão.
+NIVEIS_DEBUG = {"debug": 10, "info": 20, "aviso": 30}
+PLAN20_DEBUG = (os.getenv("PLAN20_DEBUG") or "0").strip().lower()
+PLAN20_DEBUG_LIMITE = max(1, int(os.getenv("PLAN20_DEBUG_LIMITE") or "10000"))
+PLAN20_DEBUG_AMOSTRA = max(1, int(os.getenv("PLAN20_DEBUG_AMOSTRA") or "1"))
+PLAN20_DEBUG_ARQUIVO = (os.getenv("PLAN20_DEBUG_ARQUIVO") or "").strip()
+DEBUG_COLUNAS = ["timestamp", "local", "mensagem"]
+
+
+class RastreioPlan20:
+    """Mensagens de depuração de uma execução do Plan20, em buffer circular."""
+
+    def __init__(
+        self,
+        nivel: str = "info",
+        limite: int = PLAN20_DEBUG_LIMITE,
+        amostragem: int = PLAN20_DEBUG_AMOSTRA,
+        arquivo: Path | str | None = None,
+    ) -> None:
+        self.nome_nivel = nivel if nivel in NIVEIS_DEBUG else "info"
+        self.nivel = NIVEIS_DEBUG[self.nome_nivel]
+        self.amostragem = max(1, amostragem)
+        self.linhas: deque[tuple[str, str, str]] = deque(maxlen=max(1, limite))
+        self.descartadas = 0
+        self._vistas: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._arquivo = None
+        self._csv = None
+        if arquivo:
+            caminho = Path(arquivo)
+            novo = not caminho.exists() or caminho.stat().st_size == 0
+            self._arquivo = open(caminho, "a", newline="", encoding="utf-8", buffering=1)
+            self._csv = csv.writer(self._arquivo, delimiter=";")
+            if novo:
+                self._csv.writerow(DEBUG_COLUNAS)
+
+    @classmethod
+    def do_ambiente(cls, execucao: str | int | None = None) -> RastreioPlan20 | None:
+        """
+        Rastreio configurado por PLAN20_DEBUG*, ou None quando desligado. O CSV de
+        PLAN20_DEBUG_ARQUIVO leva o id da execução no nome (padrão: data e hora), para que
+        jobs simultâneos não escrevam no mesmo arquivo.
+        """
+        if PLAN20_DEBUG not in NIVEIS_DEBUG:
+            return None
+        arquivo = None
+        if PLAN20_DEBUG_ARQUIVO:
+            base = Path(PLAN20_DEBUG_ARQUIVO)
+            sufixo = execucao if execucao is not None else datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            arquivo = base.with_name(f"{base.stem}_{sufixo}{base.suffix}")
+        return cls(PLAN20_DEBUG, arquivo=arquivo)
+
+    def registrar(self, local: str, msg: Any, nivel: str = "info") -> None:
+        valor = NIVEIS_DEBUG[nivel]
+        if valor < self.nivel:
+            return
+        with self._lock:
+            if valor == NIVEIS_DEBUG["debug"] and self.amostragem > 1:
+                vistas = self._vistas[local]
+                self._vistas[local] = vistas + 1
+                if vistas % self.amostragem:
+                    return
+            self._guardar((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), local, str(msg)))
+
+    def _guardar(self, linha: tuple[str, str, str]) -> None:
+        if len(self.linhas) == self.linhas.maxlen:
+            self.descartadas += 1
+        self.linhas.append(linha)
+        if self._csv is not None:
+            self._csv.writerow(linha)
+
+    def para_worker(self) -> tuple[str, int]:
+        """Nível e limite para o rastreio de um processo do pool (ver incorporar)."""
+        return self.nome_nivel, self.linhas.maxlen
+
+    def incorporar(self, linhas: list[tuple[str, str, str, str]], descartadas: int = 0) -> None:
+        """Junta as mensagens (com nível) vindas de um processo do pool, aplicando a amostragem daqui."""
+        with self._lock:
+            self.descartadas += descartadas
+            for timestamp, local, msg, nivel in linhas:
+                if NIVEIS_DEBUG[nivel] == NIVEIS_DEBUG["debug"] and self.amostragem > 1:
+                    vistas = self._vistas[local]
+                    self._vistas[local] = vistas + 1
+                    if vistas % self.amostragem:
+                        continue
+                self._guardar((timestamp, local, msg))
+
+    def fechar(self) -> None:
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+                self._csv = None
+
+
+class _RastreioDoWorker(RastreioPlan20):
+    """Rastreio de uma aba num processo do pool: guarda as mensagens com o nível, sem amostrar."""
+
+    def registrar(self, local: str, msg: Any, nivel: str = "info") -> None:
+        if NIVEIS_DEBUG[nivel] < self.nivel:
+            return
+        if len(self.linhas) == self.linhas.maxlen:
+            self.descartadas += 1
+        self.linhas.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), local, str(msg), nivel))
 
-DEBUG_ROWS: list[tuple[str, str, str]] = []
 
+# Rastreio da execução corrente: cada thread (job) enxerga só o seu.
+_RASTREIO: ContextVar[RastreioPlan20 | None] = ContextVar("plan20_rastreio", default=None)
 
-def dbg(local: str, msg: Any) -> None:
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    DEBUG_ROWS.append((ts, local, str(msg)))
+
+def dbg(local: str, msg: Any, nivel: str = "info") -> None:
+    rastreio = _RASTREIO.get()
+    if rastreio is not None:
+        rastreio.registrar(local, msg, nivel)
 
 
 def normaliza(texto: Any) -> str:
     try:
         if pd.isna(texto):
             return ""
-        s = str(texto).strip().lower()
-        for k, v in NORMALIZA_MAP.items():
-            s = s.replace(k, v)
-        s = re.sub(r"[\[\]\(\)\{\}\,;:\"]", " ", s)
-        s = re.sub(r"[-–—|/]+", " ", s)
-        s = re.sub(r"\s+", " ", s).strip()
-        return s
+        s = str(texto).lower().translate(_TABELA_NORMALIZA)
+        return _SEPARADORES.sub(" ", s).strip()
     except Exception:
         return ""
 
 
-def linha_vazia(row: list[Any]) -> bool:
-    for x in row:
-        if not (pd.isna(x) or str(x).strip() == ""):
-            return False
-    return True
-
-
-def acha(regex: str, row_norm: str) -> bool:
-    return bool(re.search(regex, row_norm))
-
-
-def is_linha_filtro_b(row_norm: str) -> bool:
-    return row_norm.startswith("emitir relatorio")
-
-
 def extrai_paoe(row_norm: str) -> str | None:
     m = re.search(r"p\s*a\s*o\s*e\s*[:\- ]+(\d+)", row_norm)
     if m:
@@ -138,213 +300,182 @@ def extrai_paoe(row_norm: str) -> str | None:
     return None
 
 
-def join_with_pipes_posicional(row: list[Any]) -> tuple[str, str, list[str]]:
-    vals = [("" if pd.isna(x) else str(x)).strip() for x in row]
-    return "||".join(vals), " ".join([v for v in vals if v]), vals
+def normaliza_serie(serie: pd.Series) -> pd.Series:
+    """normaliza() aplicado de uma vez a uma coluna de textos."""
+    s = serie.str.lower().str.translate(_TABELA_NORMALIZA)
+    return s.str.replace(_SEPARADORES, " ", regex=True).str.strip()
 
 
-def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
-    dbg("processar_arquivo", f"inicio: {caminho_arquivo}")
-    xls = pd.ExcelFile(caminho_arquivo)
-    sheets_out: dict[str, pd.DataFrame] = {}
+def classificar_linhas(df: pd.DataFrame) -> tuple[list[int], list[bool], list[bool], list[str], list[Any], np.ndarray]:
+    """Classifica todas as linhas da aba de uma vez, com operacoes vetorizadas.
 
-    # A é único por arquivo
-    A_id = f"A{a_contador_inicial}"
-
-    raw_rows: list[list[Any]] = []
-    max_cols_raw = 0
+    Devolve, por linha: o tipo (LINHA_*), se e filtro do bloco B, se fecha o bloco N
+    (público transversal / plano por produto), o texto normalizado e o número do programa;
+    e a matriz das células como texto ("" nas vazias).
+    """
+    n, mcols = df.shape
+    textos = df.where(df.notna(), "").astype(str)
+    if mcols == 0:
+        vazia = pd.Series(True, index=df.index)
+        juntas = pd.Series("", index=df.index)
+    else:
+        vazia = textos.apply(lambda col: col.str.strip().eq("")).all(axis=1)
+        juntas = textos.iloc[:, 0]
+        for c in range(1, mcols):
+            juntas = juntas + " " + textos.iloc[:, c]
+    normas = normaliza_serie(juntas)
+    chaves = normas.str.extract(_PADRAO_LINHA)
+    achou = {nome: chaves[nome].notna().to_numpy() for nome in chaves.columns}
+
+    condicoes = [vazia.to_numpy(), achou["A_exercicio"]] + [achou[nome] for nome, _ in _TIPOS_POR_CHAVE]
+    tipos = [LINHA_VAZIA, LINHA_EXERCICIO] + [tipo for _, tipo in _TIPOS_POR_CHAVE]
+    tipo = np.select(condicoes, tipos, default=LINHA_OUTRA)
+    fecha_n = achou["PublicoTransversal"] | achou["PlanoPorProduto"]
+    return (
+        tipo.tolist(),
+        achou["filtro_b"].tolist(),
+        fecha_n.tolist(),
+        normas.tolist(),
+        chaves["programa_num"].tolist(),
+        textos.to_numpy(),
+    )
 
-    def extrai_chave_apos_doispontos(row_vals: list[Any]) -> str:
-        for cel in row_vals:
-            if pd.isna(cel):
-                continue
-            s = str(cel)
-            if ":" in s:
-                return s.split(":", 1)[1].strip()
-        return " ".join(str(c).strip() for c in row_vals if not pd.isna(c) and str(c).strip()).strip()
 
-    contador_B = 0  # B por aba
+def _chave_apos_doispontos(row_vals: list[Any]) -> str:
+    for cel in row_vals:
+        if pd.isna(cel):
+            continue
+        s = str(cel)
+        if ":" in s:
+            return s.split(":", 1)[1].strip()
+    return " ".join(str(c).strip() for c in row_vals if not pd.isna(c) and str(c).strip()).strip()
 
-    for sheet_name in xls.sheet_names:
-        contador_B += 1
-        dbg("sheet", f"{sheet_name} (B{contador_B})")
 
-        df = pd.read_excel(xls, sheet_name=sheet_name, header=None, dtype=object)
-        n, mcols = df.shape
-        max_cols_raw = max(max_cols_raw, mcols)
+def _processar_aba(
+    linhas_aba: list[list[Any]], A_id: str, contador_B: int, com_aba: bool = False
+) -> tuple[pd.DataFrame | None, list[list[Any]], int]:
+    """
+    Marca os identificadores de uma aba (bloco B{contador_B} do arquivo A_id).
+    Devolve a aba com Identificador/Sub-Identificador (só com com_aba; senão None),
+    as linhas identificadas (id, sub-id, valores) e a quantidade de colunas da aba.
+    """
+    raw_rows: list[list[Any]] = []
 
-        ident_col = [""] * n
-        subid_col = [""] * n
-
-        B_puro = f"B{contador_B}"
-        B_id = f"{A_id}.{B_puro}"
-        b_ativo = False
-
-        # ---- Controle do "C base" (por programa) e do "C final" (por PAOE) ----
-        contador_C = 0
-        programas_vistos: dict[str, int] = {}
-
-        C_base = None  # Ex.: A1.B1.C1 (base por programa)
-        C_id = None  # Ex.: A1.B1.C1.2009 (por ação/PAOE)
-        c_encerrado = True
-        PAOE_num = None
-
-        # Buffer para linhas C antes de aparecer a "Ação (P/A/OE)"
-        c_pend_indices: list[int] = []
-        c_pend_base = None
-        c_pend_ativo = False
-
-        cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
-        cont_N = 0
-        D_id = E_id = F_id = G_id = H_id = I_id = None
-        N_id = None
-        n_ativo = False
-        sub_count: dict[str, int] = defaultdict(int)
-        chave_G_atual = None
-        chave_H_atual = None
-
-        i = 0
-        while i < n:
-            row = df.iloc[i, :].tolist()
-            _, _, vals = join_with_pipes_posicional(row)
-            row_norm = normaliza(" ".join([("" if pd.isna(x) else str(x)) for x in row]))
-
-            if linha_vazia(row):
-                I_id = None
-                H_id = None
-                chave_H_atual = None
-                n_ativo = False
-                N_id = None
-                b_ativo = False
-                # encerra pendência de C (se houver)
-                c_pend_indices = []
-                c_pend_base = None
-                c_pend_ativo = False
-                i += 1
-                continue
+    df = montar_dataframe(linhas_aba, header=None, dtype=object)
+    n, mcols = df.shape
+    tipos, filtros_b, fecha_n, normas, programas, valores = classificar_linhas(df)
+
+    ident_col = [""] * n
+    subid_col = [""] * n
+
+    B_puro = f"B{contador_B}"
+    B_id = f"{A_id}.{B_puro}"
+    b_ativo = False
+
+    # ---- Controle do "C base" (por programa) e do "C final" (por PAOE) ----
+    contador_C = 0
+    programas_vistos: dict[str, int] = {}
+
+    C_base = None  # Ex.: A1.B1.C1 (base por programa)
+    C_id = None  # Ex.: A1.B1.C1.2009 (por ação/PAOE)
+    c_encerrado = True
+    PAOE_num = None
+
+    # Buffer para linhas C antes de aparecer a "Ação (P/A/OE)"
+    c_pend_indices: list[int] = []
+    c_pend_base = None
+    c_pend_ativo = False
+
+    cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
+    cont_N = 0
+    D_id = E_id = F_id = G_id = H_id = I_id = None
+    N_id = None
+    n_ativo = False
+    sub_count: dict[str, int] = defaultdict(int)
+    chave_G_atual = None
+    chave_H_atual = None
+
+    i = 0
+    while i < n:
+        tipo = tipos[i]
+        row_norm = normas[i]
+
+        if tipo == LINHA_VAZIA:
+            I_id = None
+            H_id = None
+            chave_H_atual = None
+            n_ativo = False
+            N_id = None
+            b_ativo = False
+            # encerra pendência de C (se houver)
+            c_pend_indices = []
+            c_pend_base = None
+            c_pend_ativo = False
+            i += 1
+            continue
 
-            if acha(KEYS["A_exercicio"], row_norm):
-                b_ativo = True
-                sub = sub_count.get(B_id, 0) + 1
-                sub_count[B_id] = sub
-                ident_col[i] = B_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+        if tipo == LINHA_EXERCICIO:
+            b_ativo = True
+            sub = sub_count.get(B_id, 0) + 1
+            sub_count[B_id] = sub
+            ident_col[i] = B_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if b_ativo:
-                if is_linha_filtro_b(row_norm):
-                    i += 1
-                    continue
-                sub = sub_count.get(B_id, 0) + 1
-                sub_count[B_id] = sub
-                ident_col[i] = B_id
-                subid_col[i] = str(sub)
+        if b_ativo:
+            if filtros_b[i]:
                 i += 1
                 continue
+            sub = sub_count.get(B_id, 0) + 1
+            sub_count[B_id] = sub
+            ident_col[i] = B_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            eh_programa = acha(KEYS["Programa"], row_norm)
-            eh_acao = acha(KEYS["Acao"], row_norm)
-            eh_produto = acha(KEYS["Produto"], row_norm)
-            eh_publico = acha(KEYS["PublicoTransversal"], row_norm)
-            eh_plano = acha(KEYS["PlanoPorProduto"], row_norm)
-            eh_subacao = acha(KEYS["SubacaoEntrega"], row_norm)
-            eh_etapa = acha(KEYS["Etapa"], row_norm)
-            eh_regiao = acha(KEYS["RegiaoPlanejamento"], row_norm)
-
-            if n_ativo and (eh_publico or eh_plano):
-                n_ativo = False
-                N_id = None
-
-            # -------------------------
-            # INÍCIO DO BLOCO C (Programa)
-            # -------------------------
-            if eh_programa:
-                m_prog = re.search(r"^programa\s+(\d+)", row_norm)
-                if m_prog:
-                    prog = m_prog.group(1)
-                    if prog not in programas_vistos:
-                        contador_C += 1
-                        programas_vistos[prog] = contador_C
-                    cidx = programas_vistos[prog]
-                    C_base = f"{A_id}.{B_puro}.C{cidx}"
-
-                    # ativa pendência: vamos segurar as linhas do bloco C até achar a Ação
-                    c_pend_ativo = True
-                    c_pend_base = C_base
-                    c_pend_indices = [i]
-
-                    # reseta escopos abaixo de C
-                    C_id = None
-                    c_encerrado = False
-                    D_id = E_id = F_id = G_id = H_id = I_id = None
-                    N_id = None
-                    n_ativo = False
-                    cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
-                    cont_N = 0
-                    PAOE_num = None
-                    chave_G_atual = None
-                    chave_H_atual = None
-
-                    i += 1
-                    continue
-
-            # -------------------------
-            # SE ESTAMOS NO C PENDENTE e ainda NÃO achamos a AÇÃO,
-            # vamos continuar coletando as linhas até chegar na "Ação (P/A/OE)".
-            # -------------------------
-            if c_pend_ativo and C_id is None:
-                if eh_acao:
-                    # cria o C_id definitivo com PAOE
-                    paoe = extrai_paoe(row_norm)
-                    if paoe:
-                        PAOE_num = paoe
-                    else:
-                        nums = re.findall(r"(\d+)", row_norm)
-                        PAOE_num = nums[-1] if nums else "0"
-
-                    base = c_pend_base or C_base
-                    if base is None:
-                        contador_C += 1
-                        base = f"{A_id}.{B_puro}.C{contador_C}"
-                        C_base = base
+        if n_ativo and fecha_n[i]:
+            n_ativo = False
+            N_id = None
+
+        # -------------------------
+        # INÍCIO DO BLOCO C (Programa)
+        # -------------------------
+        if tipo == LINHA_PROGRAMA:
+            prog = programas[i]
+            if prog not in programas_vistos:
+                contador_C += 1
+                programas_vistos[prog] = contador_C
+            cidx = programas_vistos[prog]
+            C_base = f"{A_id}.{B_puro}.C{cidx}"
+
+            # ativa pendência: vamos segurar as linhas do bloco C até achar a Ação
+            c_pend_ativo = True
+            c_pend_base = C_base
+            c_pend_indices = [i]
+
+            # reseta escopos abaixo de C
+            C_id = None
+            c_encerrado = False
+            D_id = E_id = F_id = G_id = H_id = I_id = None
+            N_id = None
+            n_ativo = False
+            cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
+            cont_N = 0
+            PAOE_num = None
+            chave_G_atual = None
+            chave_H_atual = None
 
-                    C_id = f"{base}.{PAOE_num}"
-                    c_encerrado = False
+            i += 1
+            continue
 
-                    # atribui IDs/Sub-IDs em sequência para todas as linhas pendentes + a linha atual (Ação)
-                    sub_count[C_id] = 0
-                    for idx_p in c_pend_indices + [i]:
-                        sub_count[C_id] += 1
-                        ident_col[idx_p] = C_id
-                        subid_col[idx_p] = str(sub_count[C_id])
-
-                    # encerra pendência
-                    c_pend_indices = []
-                    c_pend_base = None
-                    c_pend_ativo = False
-
-                    # reseta escopos abaixo de C (mas mantém C_id)
-                    D_id = E_id = F_id = G_id = H_id = I_id = None
-                    N_id = None
-                    n_ativo = False
-                    cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
-                    cont_N = 0
-                    chave_G_atual = None
-                    chave_H_atual = None
-
-                    i += 1
-                    continue
-                else:
-                    # continua coletando linhas do cabeçalho C (Função, UO, etc.)
-                    c_pend_indices.append(i)
-                    i += 1
-                    continue
-
-            # -------------------------
-            # AÇÃO fora de pendência (fallback)
-            # -------------------------
-            if eh_acao:
+        # -------------------------
+        # SE ESTAMOS NO C PENDENTE e ainda NÃO achamos a AÇÃO,
+        # vamos continuar coletando as linhas até chegar na "Ação (P/A/OE)".
+        # -------------------------
+        if c_pend_ativo and C_id is None:
+            if tipo == LINHA_ACAO:
+                # cria o C_id definitivo com PAOE
                 paoe = extrai_paoe(row_norm)
                 if paoe:
                     PAOE_num = paoe
@@ -352,7 +483,7 @@ def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tup
                     nums = re.findall(r"(\d+)", row_norm)
                     PAOE_num = nums[-1] if nums else "0"
 
-                base = C_base
+                base = c_pend_base or C_base
                 if base is None:
                     contador_C += 1
                     base = f"{A_id}.{B_puro}.C{contador_C}"
@@ -361,13 +492,19 @@ def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tup
                 C_id = f"{base}.{PAOE_num}"
                 c_encerrado = False
 
-                # começa sub-id em 1 para este C_id
-                sub = sub_count.get(C_id, 0) + 1
-                sub_count[C_id] = sub
-                ident_col[i] = C_id
-                subid_col[i] = str(sub)
+                # atribui IDs/Sub-IDs em sequência para todas as linhas pendentes + a linha atual (Ação)
+                sub_count[C_id] = 0
+                for idx_p in c_pend_indices + [i]:
+                    sub_count[C_id] += 1
+                    ident_col[idx_p] = C_id
+                    subid_col[idx_p] = str(sub_count[C_id])
 
-                # reseta escopos abaixo de C
+                # encerra pendência
+                c_pend_indices = []
+                c_pend_base = None
+                c_pend_ativo = False
+
+                # reseta escopos abaixo de C (mas mantém C_id)
                 D_id = E_id = F_id = G_id = H_id = I_id = None
                 N_id = None
                 n_ativo = False
@@ -378,10 +515,111 @@ def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tup
 
                 i += 1
                 continue
+            else:
+                # continua coletando linhas do cabeçalho C (Função, UO, etc.)
+                c_pend_indices.append(i)
+                i += 1
+                continue
 
-            if eh_produto:
+        # -------------------------
+        # AÇÃO fora de pendência (fallback)
+        # -------------------------
+        if tipo == LINHA_ACAO:
+            paoe = extrai_paoe(row_norm)
+            if paoe:
+                PAOE_num = paoe
+            else:
+                nums = re.findall(r"(\d+)", row_norm)
+                PAOE_num = nums[-1] if nums else "0"
+
+            base = C_base
+            if base is None:
+                contador_C += 1
+                base = f"{A_id}.{B_puro}.C{contador_C}"
+                C_base = base
+
+            C_id = f"{base}.{PAOE_num}"
+            c_encerrado = False
+
+            # começa sub-id em 1 para este C_id
+            sub = sub_count.get(C_id, 0) + 1
+            sub_count[C_id] = sub
+            ident_col[i] = C_id
+            subid_col[i] = str(sub)
+
+            # reseta escopos abaixo de C
+            D_id = E_id = F_id = G_id = H_id = I_id = None
+            N_id = None
+            n_ativo = False
+            cont_D = cont_E = cont_F = cont_G = cont_H = cont_I = 0
+            cont_N = 0
+            chave_G_atual = None
+            chave_H_atual = None
+
+            i += 1
+            continue
+
+        if tipo == LINHA_PRODUTO:
+            if C_id is None:
+                # fallback: cria um C_id "genérico" se necessário
+                if C_base is None:
+                    contador_C += 1
+                    C_base = f"{A_id}.{B_puro}.C{contador_C}"
+                if PAOE_num is None:
+                    PAOE_num = "0"
+                C_id = f"{C_base}.{PAOE_num}"
+                c_encerrado = False
+
+            F_id = G_id = H_id = I_id = None
+            cont_F = cont_G = cont_H = cont_I = 0
+            chave_G_atual = None
+            chave_H_atual = None
+            cont_N = 0
+            cont_D += 1
+            # D agora não repete PAOE (pois o C já tem PAOE)
+            D_id = f"{C_id}.D{cont_D}"
+            c_encerrado = True
+            sub = 1
+            sub_count[D_id] = sub
+            ident_col[i] = D_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
+
+        if tipo == LINHA_TOTAL_PRODUTO:
+            n_ativo = True
+            if C_id is None:
+                if C_base is None:
+                    contador_C += 1
+                    C_base = f"{A_id}.{B_puro}.C{contador_C}"
+                if PAOE_num is None:
+                    PAOE_num = "0"
+                C_id = f"{C_base}.{PAOE_num}"
+                c_encerrado = False
+
+            if D_id is None:
+                cont_D += 1
+                D_id = f"{C_id}.D{cont_D}"
+                c_encerrado = True
+                cont_N = 0
+            cont_N += 1
+            N_id = f"{D_id}.N{cont_N}"
+            G_id = H_id = I_id = None
+            cont_G = cont_H = cont_I = 0
+            chave_G_atual = None
+            chave_H_atual = None
+            sub = 1
+            sub_count[N_id] = sub
+            ident_col[i] = N_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
+
+        if tipo == LINHA_PUBLICO:
+            n_ativo = False
+            N_id = None
+            if D_id is None:
                 if C_id is None:
-                    # fallback: cria um C_id "genérico" se necessário
                     if C_base is None:
                         contador_C += 1
                         C_base = f"{A_id}.{B_puro}.C{contador_C}"
@@ -389,25 +627,24 @@ def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tup
                         PAOE_num = "0"
                     C_id = f"{C_base}.{PAOE_num}"
                     c_encerrado = False
-
-                F_id = G_id = H_id = I_id = None
-                cont_F = cont_G = cont_H = cont_I = 0
-                chave_G_atual = None
-                chave_H_atual = None
-                cont_N = 0
                 cont_D += 1
-                # D agora não repete PAOE (pois o C já tem PAOE)
                 D_id = f"{C_id}.D{cont_D}"
                 c_encerrado = True
-                sub = 1
-                sub_count[D_id] = sub
-                ident_col[i] = D_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+            cont_E += 1
+            E_id = f"{D_id}.E{cont_E}"
+            F_id = G_id = H_id = I_id = None
+            cont_F = cont_G = cont_H = cont_I = 0
+            chave_G_atual = None
+            chave_H_atual = None
+            sub = 1
+            sub_count[E_id] = sub
+            ident_col[i] = E_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if "total por produto" in row_norm:
-                n_ativo = True
+        if tipo == LINHA_PLANO:
+            if D_id is None:
                 if C_id is None:
                     if C_base is None:
                         contador_C += 1
@@ -416,187 +653,210 @@ def processar_arquivo(caminho_arquivo: Path, a_contador_inicial: int = 1) -> tup
                         PAOE_num = "0"
                     C_id = f"{C_base}.{PAOE_num}"
                     c_encerrado = False
+                cont_D += 1
+                D_id = f"{C_id}.D{cont_D}"
+                c_encerrado = True
+            base_parent = E_id if E_id else D_id
+            cont_F += 1
+            F_id = f"{base_parent}.F{cont_F}"
+            G_id = H_id = I_id = None
+            cont_G = cont_H = cont_I = 0
+            chave_G_atual = None
+            chave_H_atual = None
+            sub = 1
+            sub_count[F_id] = sub
+            ident_col[i] = F_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-                if D_id is None:
-                    cont_D += 1
-                    D_id = f"{C_id}.D{cont_D}"
-                    c_encerrado = True
-                    cont_N = 0
-                cont_N += 1
-                N_id = f"{D_id}.N{cont_N}"
-                G_id = H_id = I_id = None
-                cont_G = cont_H = cont_I = 0
-                chave_G_atual = None
-                chave_H_atual = None
-                sub = 1
-                sub_count[N_id] = sub
-                ident_col[i] = N_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
-
-            if eh_publico:
-                n_ativo = False
-                N_id = None
-                if D_id is None:
-                    if C_id is None:
-                        if C_base is None:
-                            contador_C += 1
-                            C_base = f"{A_id}.{B_puro}.C{contador_C}"
-                        if PAOE_num is None:
-                            PAOE_num = "0"
-                        C_id = f"{C_base}.{PAOE_num}"
-                        c_encerrado = False
-                    cont_D += 1
-                    D_id = f"{C_id}.D{cont_D}"
-                    c_encerrado = True
-                cont_E += 1
-                E_id = f"{D_id}.E{cont_E}"
-                F_id = G_id = H_id = I_id = None
-                cont_F = cont_G = cont_H = cont_I = 0
-                chave_G_atual = None
+        if tipo == LINHA_SUBACAO and F_id is not None:
+            chave = _chave_apos_doispontos([v.strip() for v in valores[i]])
+            if chave_G_atual is None or chave != chave_G_atual:
+                cont_G += 1
+                G_id = f"{F_id}.G{cont_G}"
+                chave_G_atual = chave
+                H_id = I_id = None
+                cont_H = cont_I = 0
                 chave_H_atual = None
                 sub = 1
-                sub_count[E_id] = sub
-                ident_col[i] = E_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+                sub_count[G_id] = sub
+            else:
+                sub = sub_count.get(G_id, 0) + 1
+                sub_count[G_id] = sub
+            ident_col[i] = G_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if eh_plano:
-                if D_id is None:
-                    if C_id is None:
-                        if C_base is None:
-                            contador_C += 1
-                            C_base = f"{A_id}.{B_puro}.C{contador_C}"
-                        if PAOE_num is None:
-                            PAOE_num = "0"
-                        C_id = f"{C_base}.{PAOE_num}"
-                        c_encerrado = False
-                    cont_D += 1
-                    D_id = f"{C_id}.D{cont_D}"
-                    c_encerrado = True
-                base_parent = E_id if E_id else D_id
-                cont_F += 1
-                F_id = f"{base_parent}.F{cont_F}"
-                G_id = H_id = I_id = None
-                cont_G = cont_H = cont_I = 0
-                chave_G_atual = None
+        if tipo == LINHA_ETAPA and (G_id is not None or F_id is not None):
+            if G_id is None and F_id is not None:
+                cont_G += 1
+                G_id = f"{F_id}.G{cont_G}"
+                chave_G_atual = "<IMPLICITO>"
+                H_id = I_id = None
+                cont_H = cont_I = 0
                 chave_H_atual = None
+                sub_count[G_id] = 1
+            chave = _chave_apos_doispontos([v.strip() for v in valores[i]])
+            if chave_H_atual is None or chave != chave_H_atual:
+                cont_H += 1
+                H_id = f"{G_id}.H{cont_H}"
+                chave_H_atual = chave
+                I_id = None
+                cont_I = 0
                 sub = 1
-                sub_count[F_id] = sub
-                ident_col[i] = F_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
-
-            if eh_subacao and F_id is not None:
-                chave = extrai_chave_apos_doispontos(vals)
-                if chave_G_atual is None or chave != chave_G_atual:
-                    cont_G += 1
-                    G_id = f"{F_id}.G{cont_G}"
-                    chave_G_atual = chave
-                    H_id = I_id = None
-                    cont_H = cont_I = 0
-                    chave_H_atual = None
-                    sub = 1
-                    sub_count[G_id] = sub
-                else:
-                    sub = sub_count.get(G_id, 0) + 1
-                    sub_count[G_id] = sub
-                ident_col[i] = G_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+                sub_count[H_id] = sub
+            else:
+                sub = sub_count.get(H_id, 0) + 1
+                sub_count[H_id] = sub
+            ident_col[i] = H_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if eh_etapa and (G_id is not None or F_id is not None):
+        if tipo == LINHA_REGIAO and (G_id is not None or F_id is not None):
+            if H_id is None:
                 if G_id is None and F_id is not None:
                     cont_G += 1
                     G_id = f"{F_id}.G{cont_G}"
                     chave_G_atual = "<IMPLICITO>"
-                    H_id = I_id = None
-                    cont_H = cont_I = 0
-                    chave_H_atual = None
                     sub_count[G_id] = 1
-                chave = extrai_chave_apos_doispontos(vals)
-                if chave_H_atual is None or chave != chave_H_atual:
-                    cont_H += 1
-                    H_id = f"{G_id}.H{cont_H}"
-                    chave_H_atual = chave
-                    I_id = None
-                    cont_I = 0
-                    sub = 1
-                    sub_count[H_id] = sub
-                else:
-                    sub = sub_count.get(H_id, 0) + 1
-                    sub_count[H_id] = sub
-                ident_col[i] = H_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+                if cont_H == 0:
+                    cont_H = 1
+                H_id = f"{G_id}.H{cont_H}"
+                if chave_H_atual is None:
+                    chave_H_atual = "<IMPLICITO>"
+                if H_id not in sub_count:
+                    sub_count[H_id] = 1
+            cont_I += 1
+            I_id = f"{H_id}.I{cont_I}"
+            sub = 1
+            sub_count[I_id] = sub
+            ident_col[i] = I_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if eh_regiao and (G_id is not None or F_id is not None):
-                if H_id is None:
-                    if G_id is None and F_id is not None:
-                        cont_G += 1
-                        G_id = f"{F_id}.G{cont_G}"
-                        chave_G_atual = "<IMPLICITO>"
-                        sub_count[G_id] = 1
-                    if cont_H == 0:
-                        cont_H = 1
-                    H_id = f"{G_id}.H{cont_H}"
-                    if chave_H_atual is None:
-                        chave_H_atual = "<IMPLICITO>"
-                    if H_id not in sub_count:
-                        sub_count[H_id] = 1
-                cont_I += 1
-                I_id = f"{H_id}.I{cont_I}"
-                sub = 1
-                sub_count[I_id] = sub
-                ident_col[i] = I_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+        if n_ativo and N_id is not None:
+            sub = sub_count.get(N_id, 0) + 1
+            sub_count[N_id] = sub
+            ident_col[i] = N_id
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            if n_ativo and N_id is not None:
-                sub = sub_count.get(N_id, 0) + 1
-                sub_count[N_id] = sub
-                ident_col[i] = N_id
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+        destino = None
+        for cand in (I_id, H_id, G_id, F_id, E_id, D_id):
+            if cand:
+                destino = cand
+                break
+        if destino is None and C_id is not None and not c_encerrado:
+            destino = C_id
+        if destino:
+            sub = sub_count.get(destino, 0) + 1
+            sub_count[destino] = sub
+            ident_col[i] = destino
+            subid_col[i] = str(sub)
+            i += 1
+            continue
 
-            destino = None
-            for cand in (I_id, H_id, G_id, F_id, E_id, D_id):
-                if cand:
-                    destino = cand
-                    break
-            if destino is None and C_id is not None and not c_encerrado:
-                destino = C_id
-            if destino:
-                sub = sub_count.get(destino, 0) + 1
-                sub_count[destino] = sub
-                ident_col[i] = destino
-                subid_col[i] = str(sub)
-                i += 1
-                continue
+        i += 1
+
+    for j in range(n):
+        if ident_col[j]:
+            raw_rows.append([ident_col[j], subid_col[j]] + valores[j].tolist())
+
+    if not com_aba:
+        return None, raw_rows, mcols
+    df_out = df.copy()
+    df_out.insert(0, "Sub-Identificador", subid_col)
+    df_out.insert(0, "Identificador", ident_col)
+    return df_out, raw_rows, mcols
+
+
+def _processar_aba_do_arquivo(
+    caminho_arquivo: Path,
+    sheet_name: str,
+    A_id: str,
+    contador_B: int,
+    com_aba: bool,
+    rastreio: tuple[str, int] | None = None,
+) -> tuple[tuple[pd.DataFrame | None, list[list[Any]], int], tuple[list[tuple[str, ...]], int]]:
+    # Roda nos processos do pool: cada um lê só a sua aba do arquivo. O ContextVar do
+    # rastreio não atravessa o spawn, então as mensagens da aba voltam junto com o resultado.
+    local = _RastreioDoWorker(rastreio[0], limite=rastreio[1], amostragem=1) if rastreio else None
+    token = _RASTREIO.set(local)
+    try:
+        linhas_aba = ler_abas(caminho_arquivo, [sheet_name])[sheet_name]
+        resultado = _processar_aba(linhas_aba, A_id, contador_B, com_aba)
+    finally:
+        _RASTREIO.reset(token)
+    if local is None:
+        return resultado, ([], 0)
+    return resultado, (list(local.linhas), local.descartadas)
+
+
+def processar_arquivo(
+    caminho_arquivo: Path, a_contador_inicial: int = 1, workers: int | None = None, com_abas: bool = False
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """
+    Marca os identificadores de todas as abas do arquivo. Com workers > 1 (padrão
+    PLAN20_WORKERS) as abas são lidas e analisadas em paralelo, em processos separados;
+    os resultados são juntados na ordem das abas, com a mesma saída do modo sequencial;
+    as mensagens de dbg de cada aba entram no rastreio também na ordem das abas.
+    As abas marcadas só são montadas (e voltam do pool) com com_abas; senão o dict vem vazio.
+    """
+    dbg("processar_arquivo", f"inicio: {caminho_arquivo}", "debug")
+    workers = PLAN20_WORKERS if workers is None else max(1, workers)
 
-            i += 1
+    # A é único por arquivo
+    A_id = f"A{a_contador_inicial}"
+
+    nomes = nomes_abas(caminho_arquivo) if workers > 1 else []
+    if len(nomes) > 1:
+        rastreio = _RASTREIO.get()
+        config_rastreio = rastreio.para_worker() if rastreio is not None else None
+        # spawn: o serviço de jobs tem threads rodando, e fork a partir delas não é seguro.
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(nomes)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futuros = [
+                pool.submit(
+                    _processar_aba_do_arquivo, caminho_arquivo, nome, A_id, contador_B, com_abas, config_rastreio
+                )
+                for contador_B, nome in enumerate(nomes, start=1)
+            ]
+            concluidos = [(nome, futuro.result()) for nome, futuro in zip(nomes, futuros)]
 
-        for j in range(n):
-            if ident_col[j]:
-                row_vals = df.iloc[j, :].tolist()
-                vals_str = [("" if pd.isna(x) else str(x)) for x in row_vals]
-                raw_rows.append([ident_col[j], subid_col[j]] + vals_str)
+        def _com_rastreio():
+            # As mensagens de cada aba entram antes do "sheet" dela, como no modo sequencial.
+            for nome, (resultado, (linhas_dbg, descartadas)) in concluidos:
+                if rastreio is not None:
+                    rastreio.incorporar(linhas_dbg, descartadas)
+                yield nome, resultado
 
-        df_out = df.copy()
-        df_out.insert(0, "Sub-Identificador", subid_col)
-        df_out.insert(0, "Identificador", ident_col)
-        sheets_out[sheet_name] = df_out
+        resultados = _com_rastreio()
+    else:
+        abas = ler_abas(caminho_arquivo)
+        resultados = (
+            (nome, _processar_aba(linhas_aba, A_id, contador_B, com_abas))
+            for contador_B, (nome, linhas_aba) in enumerate(abas.items(), start=1)
+        )
+
+    sheets_out: dict[str, pd.DataFrame] = {}
+    raw_rows: list[list[Any]] = []
+    max_cols_raw = 0
+    for contador_B, (sheet_name, (df_out, linhas_raw, mcols)) in enumerate(resultados, start=1):
+        dbg("sheet", f"{sheet_name} (B{contador_B})", "debug")
+        max_cols_raw = max(max_cols_raw, mcols)
+        raw_rows.extend(linhas_raw)
+        if df_out is not None:
+            sheets_out[sheet_name] = df_out
 
     cols_raw = ["id", "sub-id"] + [f"col_{i}" for i in range(1, max_cols_raw + 1)]
     ids_df_raw = pd.DataFrame(raw_rows, columns=cols_raw)
-    dbg("processar_arquivo", "fim ok")
+    dbg("processar_arquivo", "fim ok", "debug")
     return sheets_out, ids_df_raw
 
 def _ab_from_id(c_id: str) -> str | None:
@@ -627,62 +887,79 @@ def _split_produto_unidade(texto: str) -> tuple[str, str]:
     return s, ""
 
 
+def _niveis_ids(ids: pd.Series) -> pd.DataFrame:
+    """Quebra os identificadores (A1.B1.C1.2009.D1.E1.F1.G1.H1.I1) em colunas por nível.
+
+    `nivel` é a letra do último nível do ID ("" quando o ID não segue a hierarquia, ex.: N);
+    cid/fid/gid/hid são os prefixos até C, F, G e H e `d_idx` o número do D.
+    """
+    partes = ids.astype(str).str.extract(_PADRAO_ID)
+    cid = partes["ab"] + partes["c"]
+    fid = cid + partes["d"] + partes["e"].fillna("") + partes["f"]
+    gid = fid + partes["g"]
+    niveis = pd.DataFrame(
+        {
+            "nivel": np.select(
+                [partes[k].notna() for k in ("i", "h", "g", "f", "e", "d", "c", "ab")],
+                ["I", "H", "G", "F", "E", "D", "C", "B"],
+                default="",
+            ),
+            "ab": partes["ab"],
+            "cid": cid,
+            "fid": fid,
+            "gid": gid,
+            "hid": gid + partes["h"],
+            "d_idx": pd.to_numeric(partes["d"].str[2:], errors="coerce"),
+        },
+        index=ids.index,
+    )
+    return niveis
+
+
+def _textos_coluna(df: pd.DataFrame, k: int) -> list[str]:
+    # Mesmo valor de str(row.get("col_k", "")).strip() para todas as linhas.
+    nome = f"col_{k}"
+    if nome not in df.columns:
+        return [""] * len(df)
+    return [str(v).strip() for v in df[nome].tolist()]
+
+
 def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
     if ids_raw.empty:
         return pd.DataFrame(columns=EXTR_HEADERS)
 
-    # 1) Exercício por AB
-    b_mask = ids_raw["id"].str.match(r"A\d+\.B\d+$")
-    b_rows = ids_raw[b_mask].copy()
-    b_rows["sub-id"] = b_rows["sub-id"].astype(str)
-    exercicio_por_ab: dict[str, str] = {}
-    for _, row in b_rows.iterrows():
-        ab = row["id"]
-        subid = row["sub-id"]
-        if subid != "1":
-            continue
-        val = str(row.get("col_1", "")).strip()
-        if not val:
-            continue
-        m = re.search(r"(\d{4})", val)
-        if m:
-            exercicio_por_ab[ab] = m.group(1)
+    # Hierarquia dos IDs e colunas de texto calculadas uma única vez para todas as linhas.
+    base_ids = ids_raw.reset_index(drop=True)
+    niveis = _niveis_ids(base_ids["id"])
+    linhas = pd.DataFrame({f"col_{k}": _textos_coluna(base_ids, k) for k in range(1, 9)})
+    linhas["id"] = base_ids["id"]
+    linhas["sub-id"] = base_ids["sub-id"].astype(str)
+    linhas = pd.concat([linhas, niveis], axis=1)
+    norm = lru_cache(maxsize=None)(normaliza)
+
+    def _nivel(letra: str, ordenar: bool = False) -> pd.DataFrame:
+        # ordenar=True: agrupa por ID mantendo a ordem original dentro de cada ID.
+        rows = linhas[linhas["nivel"] == letra]
+        return rows.sort_values("id", kind="stable") if ordenar else rows
+
+    # 1) Exercício por AB (a última linha 1 com ano de cada AB prevalece)
+    b_rows = _nivel("B")
+    b_rows = b_rows[b_rows["sub-id"] == "1"]
+    anos = b_rows["col_1"].str.extract(r"(\d{4})")[0].dropna()
+    exercicio_por_ab: dict[str, str] = dict(zip(b_rows.loc[anos.index, "id"], anos))
 
     # 2) Campos por C (agora C tem PAOE no ID)
-    c_mask = ids_raw["id"].str.match(r"A\d+\.B\d+\.C\d+\.\d+$")
-    c_rows = ids_raw[c_mask].copy()
-    c_rows["sub-id"] = c_rows["sub-id"].astype(str)
-    c_rows = c_rows.reset_index().sort_values(["id", "index"])
+    c_rows = _nivel("C", ordenar=True)
     c_info: dict[str, dict[str, Any]] = {}
-    current_c_id = None
-    campos: dict[str, str] = {}
-    acoes: dict[str, list[str]] = defaultdict(list)
-
-    def flush_current_c() -> None:
-        nonlocal campos, acoes, current_c_id
-        if not current_c_id:
-            return
-        ab = _ab_from_id(current_c_id)
-        c_info[current_c_id] = {
-            "ab": ab,
-            "campos": dict(campos),
-            "acoes": {k: list(v) for k, v in acoes.items()},
-        }
-        campos.clear()
-        acoes.clear()
-
-    for _, row in c_rows.iterrows():
-        cid = row["id"]
-        if current_c_id is None:
-            current_c_id = cid
-        elif cid != current_c_id:
-            flush_current_c()
-            current_c_id = cid
-        subid = row["sub-id"]
+    for cid, ab, subid, col1, col4 in zip(
+        c_rows["id"], c_rows["ab"], c_rows["sub-id"], c_rows["col_1"], c_rows["col_4"]
+    ):
+        info = c_info.get(cid)
+        if info is None:
+            info = c_info[cid] = {"ab": ab, "campos": {}, "acoes": {}}
+        campos = info["campos"]
         if subid not in {"1", "2", "3", "4", "5", "6", "7", "8"}:
             continue
-        col1 = str(row.get("col_1", "")).strip()
-        col4 = str(row.get("col_4", "")).strip()
         val_or_rot = col4 if col4 else col1
         if subid == "1":
             campos["Programa"] = val_or_rot
@@ -702,7 +979,7 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
                     paoe = digits[-1]
                 if paoe is None:
                     paoe = val_or_rot.strip()
-                acoes[paoe].append(val_or_rot)
+                info["acoes"].setdefault(paoe, []).append(val_or_rot)
         elif subid == "5":
             campos["Subfunção"] = val_or_rot
         elif subid == "6":
@@ -711,35 +988,20 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
             campos["Esfera"] = val_or_rot
         elif subid == "8":
             campos["Responsável pela Ação"] = val_or_rot
-    flush_current_c()
 
     # 3) Produtos D (agora D está em A.B.Cx.PAOE.Dn)
-    d_mask = ids_raw["id"].str.match(r"A\d+\.B\d+\.C\d+\.\d+\.D\d+$")
-    d_rows = ids_raw[d_mask].copy()
-    d_rows["sub-id"] = d_rows["sub-id"].astype(str)
+    d_rows = _nivel("D")
+    d_rows = d_rows[d_rows["sub-id"] != "1"]
     produtos_por_cid: dict[str, list[dict[str, Any]]] = defaultdict(list)
-    for _, row in d_rows.iterrows():
-        if row["sub-id"] == "1":
-            continue
-        id_str = row["id"]
-        m = re.match(r"(A\d+\.B\d+\.C\d+\.\d+)\.D(\d+)$", id_str)
-        if not m:
-            continue
-        cid, d_idx_str = m.group(1), m.group(2)
-        try:
-            d_idx = int(d_idx_str)
-        except Exception:
-            d_idx = None
-        col4 = str(row.get("col_4", "")).strip()
-        col6 = str(row.get("col_6", "")).strip()
-        col7 = str(row.get("col_7", "")).strip()
-        col8 = str(row.get("col_8", "")).strip()
+    for cid, d_idx, col4, col6, col7, col8 in zip(
+        d_rows["cid"], d_rows["d_idx"], d_rows["col_4"], d_rows["col_6"], d_rows["col_7"], d_rows["col_8"]
+    ):
         prod, unidade = _split_produto_unidade(col4)
         if not (prod or unidade or col6 or col7 or col8):
             continue
         produtos_por_cid[cid].append(
             {
-                "D_idx": d_idx,
+                "D_idx": int(d_idx),
                 "Produto(s) da Ação": prod,
                 "Unidade de Medida do Produto": unidade,
                 "Região do Produto": col6,
@@ -749,30 +1011,28 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
             }
         )
 
+    # Índices para casar subação com produto: (cid, D) e (cid, D ou None, produto normalizado).
+    produtos_por_d: dict[tuple[str, int], list[dict[str, Any]]] = defaultdict(list)
+    produtos_por_nome: dict[tuple[str, int | None, str], list[dict[str, Any]]] = defaultdict(list)
+    for cid, produtos in produtos_por_cid.items():
+        for p in produtos:
+            nome_norm = norm(p["Produto(s) da Ação"])
+            produtos_por_d[(cid, p["D_idx"])].append(p)
+            produtos_por_nome[(cid, None, nome_norm)].append(p)
+            produtos_por_nome[(cid, p["D_idx"], nome_norm)].append(p)
+
     # 4) Público Transversal E (chave por CID)
-    e_mask = ids_raw["id"].str.match(r"A\d+\.B\d+\.C\d+\.\d+\.D\d+\.E\d+$")
-    e_rows = ids_raw[e_mask].copy()
-    e_rows["sub-id"] = e_rows["sub-id"].astype(str)
+    e_rows = _nivel("E")
     publicos_por_cid: dict[str, list[str]] = defaultdict(list)
-    for _, row in e_rows.iterrows():
-        id_str = row["id"]
-        m = re.match(r"(A\d+\.B\d+\.C\d+\.\d+)\.D\d+\.E\d+$", id_str)
-        if not m:
-            continue
-        cid = m.group(1)
-        val = str(row.get("col_4", "")).strip()
+    for cid, val in zip(e_rows["cid"], e_rows["col_4"]):
         if not val:
             continue
         lista = publicos_por_cid[cid]
         if val not in lista:
             lista.append(val)
 
-    # 4.1) Produto do F
-    f_mask = ids_raw["id"].str.match(r"A\d+\.B\d+\.C\d+\.\d+\.D\d+(?:\.E\d+)?\.F\d+$")
-    f_rows = ids_raw[f_mask].copy()
-    f_rows["sub-id"] = f_rows["sub-id"].astype(str)
-    f_rows = f_rows.reset_index().sort_values(["id", "index"])
-    produto_por_fid: dict[str, str] = {}
+    # 4.1) Produto do F (primeira coluna 5 preenchida de cada F)
+    f_rows = _nivel("F", ordenar=True)
 
     def _produto_limpo(s: str) -> str:
         s = (s or "").strip()
@@ -781,22 +1041,16 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
         s = re.sub(r'^\s*produto\(s\)?:\s*', '', s, flags=re.IGNORECASE)
         return s
 
-    for _, row in f_rows.iterrows():
-        fid = row["id"]
-        if fid in produto_por_fid:
-            continue
-        c5 = str(row.get("col_5", "")).strip()
-        if c5:
-            produto_por_fid[fid] = _produto_limpo(c5)
+    primeiros = f_rows[f_rows["col_5"] != ""].drop_duplicates("id")
+    produto_por_fid: dict[str, str] = {
+        fid: _produto_limpo(c5) for fid, c5 in zip(primeiros["id"], primeiros["col_5"])
+    }
     for fid in f_rows["id"].unique():
         if fid not in produto_por_fid:
             produto_por_fid[fid] = "Produto exclusivo para ação padronizada"
 
     # 5) Subações G (chave por CID = A.B.Cx.PAOE)
-    g_mask = ids_raw["id"].str.match(r"A\d+\.B\d+\.C\d+\.\d+\.D\d+(?:\.E\d+)?\.F\d+\.G\d+$")
-    g_rows = ids_raw[g_mask].copy()
-    g_rows["sub-id"] = g_rows["sub-id"].astype(str)
-    g_rows = g_rows.reset_index().sort_values(["id", "index"])
+    g_rows = _nivel("G", ordenar=True)
 
     subacoes_por_cid: dict[str, list[dict[str, Any]]] = defaultdict(list)
     current_gid = None
@@ -838,37 +1092,28 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
             "Detalhamento do produto": "",
         }
 
-    for _, row in g_rows.iterrows():
-        gid = row["id"]
-        subid = row["sub-id"]
-
-        m = re.match(r"((A\d+\.B\d+\.C\d+\.\d+)\.(D\d+)(?:\.E\d+)?\.F\d+)\.G\d+$", gid)
-        if not m:
-            continue
-        fid = m.group(1)
-        cid = m.group(2)
-        d_token = m.group(3)
-        try:
-            d_idx = int(d_token[1:])
-        except Exception:
-            d_idx = None
-
+    for gid, subid, fid, cid, d_idx, c1, c2, c4, c5, c7 in zip(
+        g_rows["id"],
+        g_rows["sub-id"],
+        g_rows["fid"],
+        g_rows["cid"],
+        g_rows["d_idx"],
+        g_rows["col_1"],
+        g_rows["col_2"],
+        g_rows["col_4"],
+        g_rows["col_5"],
+        g_rows["col_7"],
+    ):
         produto_F = produto_por_fid.get(fid, "Produto exclusivo para ação padronizada")
 
         if current_gid is None or gid != current_gid:
             if current_gid is not None:
                 fechar_subacao()
             current_gid = gid
-            subacao_info = nova_subacao(gid, fid, cid, d_idx, produto_F)
+            subacao_info = nova_subacao(gid, fid, cid, int(d_idx), produto_F)
 
         if subacao_info is None:
-            subacao_info = nova_subacao(gid, fid, cid, d_idx, produto_F)
-
-        c1 = str(row.get("col_1", "")).strip()
-        c2 = str(row.get("col_2", "")).strip()
-        c4 = str(row.get("col_4", "")).strip()
-        c5 = str(row.get("col_5", "")).strip()
-        c7 = str(row.get("col_7", "")).strip()
+            subacao_info = nova_subacao(gid, fid, cid, int(d_idx), produto_F)
 
         if subid == "1":
             subacao_info["Subação/entrega"] = c1.split(":", 1)[1].strip() if ":" in c1 else c1.strip()
@@ -909,29 +1154,18 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
     fechar_subacao()
 
     # H: Etapa
-    h_mask = ids_raw["id"].str.match(r".*\.F\d+\.G\d+\.H\d+$")
-    h_rows = ids_raw[h_mask].copy()
-    h_rows["sub-id"] = h_rows["sub-id"].astype(str)
-    h_rows = h_rows.reset_index().sort_values(["id", "index"])
+    h_rows = _nivel("H", ordenar=True)
+    cols_h = [h_rows[f"col_{k}"].tolist() for k in range(1, 9)]
+    # Texto de busca da linha: colunas 1 a 8 preenchidas, separadas por espaço.
+    textos_h = [" ".join([p for p in partes if p]) for partes in zip(*cols_h)] if len(h_rows) else []
 
     etapas_por_gid: dict[str, list[dict[str, Any]]] = defaultdict(list)
     current_hid = None
     h_info: dict[str, Any] | None = None
 
-    def _coletar_texto_h(row: pd.Series) -> str:
-        parts = []
-        for k in range(1, 9):
-            parts.append(str(row.get(f"col_{k}", "")).strip())
-        return " ".join([p for p in parts if p])
-
-    for _, row in h_rows.iterrows():
-        hid = row["id"]
-        subid = row["sub-id"]
-        m = re.match(r"(.*\.F\d+\.G\d+)\.H\d+$", hid)
-        if not m:
-            continue
-        gid = m.group(1)
-
+    for hid, subid, gid, col3, col4, col6, texto_linha in zip(
+        h_rows["id"], h_rows["sub-id"], h_rows["gid"], cols_h[2], cols_h[3], cols_h[5], textos_h
+    ):
         if current_hid is None or hid != current_hid:
             if h_info:
                 etapas_por_gid[h_info["_gid"]].append(h_info)
@@ -945,29 +1179,21 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
                 "_texto_busca": "",
             }
 
-        c_all = {f"col_{k}": str(row.get(f"col_{k}", "")).strip() for k in range(1, 9)}
-
         if subid == "1":
-            h_info["Etapa"] = c_all.get("col_4", "").strip()
-            h_info["_texto_busca"] += " " + _coletar_texto_h(row)
+            h_info["Etapa"] = col4
         elif subid == "2":
-            h_info["Responsável da Etapa"] = c_all.get("col_3", "").strip()
-            prazo = c_all.get("col_6", "").strip()
+            h_info["Responsável da Etapa"] = col3
+            prazo = col6
             if ":" in prazo:
                 prazo = prazo.split(":", 1)[1].strip()
             h_info["Prazo da Etapa"] = prazo
-            h_info["_texto_busca"] += " " + _coletar_texto_h(row)
-        else:
-            h_info["_texto_busca"] += " " + _coletar_texto_h(row)
+        h_info["_texto_busca"] += " " + texto_linha
 
     if h_info:
         etapas_por_gid[h_info["_gid"]].append(h_info)
 
     # I: Região da Etapa + Itens
-    i_mask = ids_raw["id"].str.match(r".*\.F\d+\.G\d+\.H\d+\.I\d+$")
-    i_rows = ids_raw[i_mask].copy()
-    i_rows["sub-id"] = i_rows["sub-id"].astype(str)
-    i_rows = i_rows.reset_index().sort_values(["id", "index"])
+    i_rows = _nivel("I", ordenar=True)
 
     itens_por_hid: dict[str, list[dict[str, Any]]] = defaultdict(list)
     regiao_por_hid: dict[str, list[str]] = defaultdict(list)
@@ -975,37 +1201,31 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
     current_iid = None
     regiao_etapa_atual = ""
 
-    for _, row in i_rows.iterrows():
-        iid = row["id"]
-        subid = row["sub-id"]
-        m = re.match(r"(.*\.H\d+)\.I\d+$", iid)
-        if not m:
-            continue
-        hid = m.group(1)
+    for iid, subid, hid, c1, c2, c3, c4, c5, c6, c7, c8 in zip(
+        i_rows["id"], i_rows["sub-id"], i_rows["hid"], *(i_rows[f"col_{k}"] for k in range(1, 9))
+    ):
         if current_iid is None or iid != current_iid:
             current_iid = iid
             regiao_etapa_atual = ""
 
-        c = {f"col_{k}": str(row.get(f"col_{k}", "")).strip() for k in range(1, 9)}
-
         if subid == "1":
-            regiao_etapa_atual = c.get("col_4", "").strip()
+            regiao_etapa_atual = c4
             regiao_por_hid[hid].append(regiao_etapa_atual)
         elif subid == "2":
             pass
         else:
-            if any([c.get(f"col_{k}", "") for k in range(1, 9)]):
+            if any([c1, c2, c3, c4, c5, c6, c7, c8]):
                 itens_por_hid[hid].append(
                     {
                         "Região da Etapa": regiao_etapa_atual,
-                        "Natureza": c.get("col_1", ""),
-                        "Fonte": c.get("col_2", ""),
-                        "IDU": c.get("col_3", ""),
-                        "Descrição do Item de Despesa": c.get("col_4", ""),
-                        "Unid. Medida": c.get("col_5", ""),
-                        "Quantidade": c.get("col_6", ""),
-                        "Valor Unitário": c.get("col_7", ""),
-                        "Valor Total": c.get("col_8", ""),
+                        "Natureza": c1,
+                        "Fonte": c2,
+                        "IDU": c3,
+                        "Descrição do Item de Despesa": c4,
+                        "Unid. Medida": c5,
+                        "Quantidade": c6,
+                        "Valor Unitário": c7,
+                        "Valor Total": c8,
                     }
                 )
 
@@ -1091,19 +1311,21 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
             subacoes = subacoes_por_cid.get(cid, [])
             if subacoes:
                 for sa in subacoes:
-                    prod_F_norm = normaliza(sa.get("_produto_F", ""))
+                    prod_F_norm = norm(sa.get("_produto_F", ""))
                     reg_sub = (sa.get("Região da Subação", "") or "").strip()
 
                     d_candidatos = produtos
+                    d_chave = None
 
                     d_idx_sa = sa.get("_d_idx")
                     if d_idx_sa is not None and d_candidatos:
-                        d_filtrados = [p for p in d_candidatos if p.get("D_idx") == d_idx_sa]
+                        d_filtrados = produtos_por_d.get((cid, d_idx_sa))
                         if d_filtrados:
                             d_candidatos = d_filtrados
+                            d_chave = d_idx_sa
 
                     if prod_F_norm and d_candidatos:
-                        d_filtrados = [p for p in d_candidatos if normaliza(p["Produto(s) da Ação"]) == prod_F_norm]
+                        d_filtrados = produtos_por_nome.get((cid, d_chave, prod_F_norm))
                         if d_filtrados:
                             d_candidatos = d_filtrados
 
@@ -1213,10 +1435,16 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
                 finais.append(dict(r))
             continue
 
+        # Municípios normalizados e códigos de cada linha da subação, calculados uma vez.
+        munis_por_linha = {
+            id(r): [norm(mg) for mg in _split_municipios(r.get("Município(s) da entrega", ""))] for r in linhas_gid
+        }
+        codes_por_linha = {id(r): _codes_from_str(r.get("Código", "")) for r in linhas_gid}
+
         for h in etapas:
             hid = h["_hid"]
             texto_h_raw = h.get("_texto_busca", "") or ""
-            texto_h_norm = normaliza(texto_h_raw)
+            texto_h_norm = norm(texto_h_raw)
             codes_h = _codes_from_str(texto_h_raw)
 
             itens_i = itens_por_hid.get(hid, [])
@@ -1269,26 +1497,14 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
                 candidatos = grupos_por_reg.get(reg_h_key, [])
 
                 if candidatos:
-                    cand_by_muni = []
-                    for r in candidatos:
-                        munis_g = _split_municipios(r.get("Município(s) da entrega", ""))
-                        hit = False
-                        for mg in munis_g:
-                            mg_norm = normaliza(mg)
-                            if mg_norm and mg_norm in texto_h_norm:
-                                hit = True
-                                break
-                        if hit:
-                            cand_by_muni.append(r)
+                    cand_by_muni = [
+                        r for r in candidatos if any(mg and mg in texto_h_norm for mg in munis_por_linha[id(r)])
+                    ]
                     if cand_by_muni:
                         candidatos = cand_by_muni
                     else:
                         if codes_h:
-                            cand_by_code = []
-                            for r in candidatos:
-                                codes_g = _codes_from_str(r.get("Código", ""))
-                                if codes_h.intersection(codes_g):
-                                    cand_by_code.append(r)
+                            cand_by_code = [r for r in candidatos if codes_h.intersection(codes_por_linha[id(r)])]
                             if cand_by_code:
                                 candidatos = cand_by_code
 
@@ -1421,16 +1637,26 @@ def extrair_dados(ids_raw: pd.DataFrame) -> pd.DataFrame:
 
     return extr_df
 
-def salvar_debug_csv(caminho: Path) -> None:
+def salvar_debug_csv(caminho: Path, rastreio: RastreioPlan20 | None) -> None:
     with open(caminho, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f, delimiter=";")
-        writer.writerow(["timestamp", "local", "mensagem"])
-        for ts, loc, msg in DEBUG_ROWS:
-            writer.writerow([ts, loc, msg])
+        writer.writerow(DEBUG_COLUNAS)
+        if rastreio is not None:
+            writer.writerows(rastreio.linhas)
+
 
+def debug_df(rastreio: RastreioPlan20 | None) -> pd.DataFrame:
+    return pd.DataFrame(list(rastreio.linhas) if rastreio else [], columns=DEBUG_COLUNAS)
 
-def debug_df() -> pd.DataFrame:
-    return pd.DataFrame(DEBUG_ROWS, columns=["timestamp", "local", "mensagem"])
+
+def salvar_diagnostico_zip(
+    caminho: Path, ids_df: pd.DataFrame, extr_df: pd.DataFrame, rastreio: RastreioPlan20 | None
+) -> None:
+    with zipfile.ZipFile(caminho, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("Identificadores_Raw.csv", ids_df.to_csv(sep=";", index=False))
+        zf.writestr("Extrair_dados.csv", extr_df.to_csv(sep=";", index=False))
+        if rastreio is not None:
+            zf.writestr("Debug_Log.csv", debug_df(rastreio).to_csv(sep=";", index=False))
 
 
 # -------------------------
@@ -1487,12 +1713,44 @@ def _explode_natureza(s: Any) -> pd.Series:
     )
 
 
-def run_plan20(input_file: Path, output_dir: Path) -> Path:
+def run_plan20(
+    input_file: Path,
+    output_dir: Path,
+    workers: int | None = None,
+    diagnostico: str | None = None,
+    rastreio: RastreioPlan20 | None = None,
+    execucao: str | int | None = None,
+) -> tuple[Path, pd.DataFrame]:
     """
     Processa um único arquivo .xlsx do Plan20 com as mesmas regras do script legado,
-    gerando as abas Identificadores_Raw, Extrair_dados, Plan20_SEDUC e Debug_Log.
+    gerando a aba Plan20_SEDUC. Devolve o arquivo gerado e o DataFrame da aba, que a
+    carga grava no banco sem reler a planilha.
+    workers: processos para as abas (padrão PLAN20_WORKERS; ver processar_arquivo).
+    diagnostico: onde gravar Identificadores_Raw, Extrair_dados e Debug_Log (padrão
+    PLAN20_DIAGNOSTICO).
+    rastreio: destino das mensagens de dbg desta execução (padrão: conforme PLAN20_DEBUG).
+    execucao: id da execução (o upload, nos jobs) no nome do CSV de PLAN20_DEBUG_ARQUIVO.
     """
-    DEBUG_ROWS.clear()
+    proprio = rastreio is None
+    if proprio:
+        rastreio = RastreioPlan20.do_ambiente(execucao)
+    token = _RASTREIO.set(rastreio)
+    try:
+        return _gerar_plan20(Path(input_file), output_dir, workers, diagnostico, rastreio)
+    finally:
+        _RASTREIO.reset(token)
+        if proprio and rastreio is not None:
+            rastreio.fechar()
+
+
+def _gerar_plan20(
+    input_file: Path,
+    output_dir: Path,
+    workers: int | None,
+    diagnostico: str | None,
+    rastreio: RastreioPlan20 | None,
+) -> tuple[Path, pd.DataFrame]:
+    modo = (PLAN20_DIAGNOSTICO if diagnostico is None else diagnostico).strip().lower()
     output_dir.mkdir(parents=True, exist_ok=True)
 
     arquivos = [Path(input_file)]
@@ -1508,7 +1766,7 @@ def run_plan20(input_file: Path, output_dir: Path) -> Path:
         dbg("main", f"Arquivo de entrada: {arquivo}")
         t0 = time.perf_counter()
 
-        _, ids_df_raw = processar_arquivo(arquivo, a_contador_inicial=contador_A_global)
+        _, ids_df_raw = processar_arquivo(arquivo, a_contador_inicial=contador_A_global, workers=workers)
         dbg("main", f"processar_arquivo concluído para: {arquivo.name}")
         dbg("main", f"ids_df_raw linhas ({arquivo.name}): {len(ids_df_raw)}")
 
@@ -1598,22 +1856,23 @@ def run_plan20(input_file: Path, output_dir: Path) -> Path:
     ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     out_path = output_dir / f"plan20_seduc_{ts}.xlsx"
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-        ids_df_all.to_excel(writer, sheet_name="Identificadores_Raw", index=False)
-        extr_df_all.to_excel(writer, sheet_name="Extrair_dados", index=False)
+    with pd.ExcelWriter(out_path, engine="xlsxwriter", engine_kwargs={"options": XLSX_OPCOES}) as writer:
+        if modo == "planilha":
+            ids_df_all.to_excel(writer, sheet_name="Identificadores_Raw", index=False)
+            extr_df_all.to_excel(writer, sheet_name="Extrair_dados", index=False)
         plan20_seduc_df.to_excel(writer, sheet_name="Plan20_SEDUC", index=False)
-        debug_df().to_excel(writer, sheet_name="Debug_Log", index=False)
-
-        wb = writer.book
-        fonte_padrao = Font(name="Helvetica", size=8)
-        for ws in wb.worksheets:
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.font = fonte_padrao
+        if modo == "planilha":
+            debug_df(rastreio).to_excel(writer, sheet_name="Debug_Log", index=False)
 
-    try:
-        salvar_debug_csv(output_dir / "plan20_debug.csv")
-    except Exception:
-        pass
+    if modo == "planilha":
+        try:
+            salvar_debug_csv(output_dir / "plan20_debug.csv", rastreio)
+        except Exception:
+            pass
+    elif modo == "zip":
+        try:
+            salvar_diagnostico_zip(output_dir / f"plan20_diagnostico_{ts}.zip", ids_df_all, extr_df_all, rastreio)
+        except Exception as exc:
+            print(f"Aviso: diagnostico do Plan20 nao gravado: {exc}")
 
-    return out_path
+    return out_path, plan20_seduc_df
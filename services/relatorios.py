@@ -0,0 +1,526 @@
+from __future__ import annotations
+
+import tempfile
+
+import pandas as pd
+import xlsxwriter
+from sqlalchemy import text
+
+from models import db
+from services.cargas import filtro_ativos
+from services.snapshots import gravar_snapshot, ler_snapshot, versao_tabela
+
+# Tamanho do lote lido do cursor (fetchmany) ao montar as colunas.
+LOTE_FETCH = 5000
+
+# Especificacao declarativa dos relatorios.
+# Cada coluna: (campo no banco, rotulo no Excel ou None para nao exportar, tipo).
+# Tipos: "texto" (valor bruto), "str" (str(v or "")), "valor" (float, vazio -> 0.0),
+# "data" (dd/mm/aaaa) e "datahora" (dd/mm/aaaa hh:mm:ss).
+# Opcionais: "formato_valor" (number format das colunas "valor" no Excel),
+# "inverter_excel" (colunas exportadas com sinal trocado) e
+# "inteiros_excel" (colunas exportadas como inteiro, formato "0").
+RELATORIOS: dict[str, dict] = {
+    "fip613": {
+        "tabela": "fip613",
+        "aba": "Sheet1",
+        "arquivo": "fip613",
+        "inverter_excel": ("reducao", "bloqueado_conting", "reserva_empenho", "empenhado"),
+        "formato_valor": "[Blue]#,##0.00;[Red]-#,##0.00;0",
+        "colunas": (
+            ("uo", "UO", "texto"),
+            ("ug", "UG", "texto"),
+            ("funcao", "Função", "texto"),
+            ("subfuncao", "Subfunção", "texto"),
+            ("programa", "Programa", "texto"),
+            ("projeto_atividade", "Projeto/Atividade", "texto"),
+            ("regional", "Regional", "texto"),
+            ("natureza_despesa", "Natureza de Despesa", "str"),
+            ("fonte_recurso", "Fonte de Recurso", "str"),
+            ("iduso", "Iduso", "texto"),
+            ("tipo_recurso", "Tipo de Recurso", "texto"),
+            ("dotacao_inicial", "Dotação Inicial", "valor"),
+            ("cred_suplementar", "Créd. Suplementar", "valor"),
+            ("cred_especial", "Créd. Especial", "valor"),
+            ("cred_extraordinario", "Créd. Extraordinário", "valor"),
+            ("reducao", "Redução", "valor"),
+            ("cred_autorizado", "Créd. Autorizado", "valor"),
+            ("bloqueado_conting", "Bloqueado/Conting.", "valor"),
+            ("reserva_empenho", "Reserva Empenho", "valor"),
+            ("saldo_destaque", "Saldo de Destaque", "valor"),
+            ("saldo_dotacao", "Saldo Dotação", "valor"),
+            ("empenhado", "Empenhado", "valor"),
+            ("liquidado", "Liquidado", "valor"),
+            ("a_liquidar", "A liquidar", "valor"),
+            ("valor_pago", "Valor Pago", "valor"),
+            ("valor_a_pagar", "Valor a Pagar", "valor"),
+        ),
+    },
+    "ped": {
+        "tabela": "ped",
+        "aba": "PED",
+        "arquivo": "ped",
+        "chave_display": True,
+        "colunas": (
+            ("chave", None, "texto"),
+            ("chave_planejamento", None, "texto"),
+            ("regiao", "Região", "texto"),
+            ("subfuncao_ug", "Subfunção + UG", "texto"),
+            ("adj", "ADJ", "texto"),
+            ("macropolitica", "Macropolítica", "texto"),
+            ("pilar", "Pilar", "texto"),
+            ("eixo", "Eixo", "texto"),
+            ("politica_decreto", "Política_Decreto", "texto"),
+            ("exercicio", "Exercício", "texto"),
+            ("numero_ped", "Nº PED", "texto"),
+            ("numero_ped_estorno", "Nº PED Estorno/Estornado", "texto"),
+            ("numero_emp", "Nº EMP", "texto"),
+            ("numero_cad", "Nº CAD", "texto"),
+            ("numero_noblist", "Nº NOBLIST", "texto"),
+            ("numero_os", "Nº OS", "texto"),
+            ("convenio", "Convênio", "texto"),
+            ("numero_processo_orcamentario_pagamento", "Nº Processo Orçamentário de Pagamento", "texto"),
+            ("valor_ped", "Valor PED", "valor"),
+            ("valor_estorno", "Valor do Estorno", "valor"),
+            (
+                "indicativo_licitacao_exercicios_anteriores",
+                "Indicativo de Licitação de Exercícios Anteriores",
+                "texto",
+            ),
+            ("data_licitacao", "Data da Licitação", "texto"),
+            ("liberado_fisco_estadual", "Liberado Fisco Estadual", "texto"),
+            ("situacao", "Situação", "texto"),
+            ("uo", "UO", "texto"),
+            ("nome_unidade_orcamentaria", "Nome da Unidade Orçamentária", "texto"),
+            ("ug", "UG", "texto"),
+            ("nome_unidade_gestora", "Nome da Unidade Gestora", "texto"),
+            ("data_solicitacao", "Data Solicitação", "texto"),
+            ("data_criacao", "Data Criação", "texto"),
+            ("tipo_empenho", "Tipo Empenho", "texto"),
+            ("dotacao_orcamentaria", "Dotação Orçamentária", "texto"),
+            ("funcao", "Função", "texto"),
+            ("subfuncao", "Subfunção", "texto"),
+            ("programa_governo", "Programa de Governo", "texto"),
+            ("paoe", "PAOE", "texto"),
+            ("natureza_despesa", "Natureza de Despesa", "texto"),
+            ("cat_econ", "Cat.Econ", "texto"),
+            ("grupo", "Grupo", "texto"),
+            ("modalidade", "Modalidade", "texto"),
+            ("elemento", "Elemento", "texto"),
+            ("nome_elemento", "Nome do Elemento", "texto"),
+            ("fonte", "Fonte", "texto"),
+            ("iduso", "Iduso", "texto"),
+            ("numero_emenda_ep", "Nº Emenda (EP)", "texto"),
+            ("autor_emenda_ep", "Autor da Emenda (EP)", "texto"),
+            ("numero_cac", "Nº CAC", "texto"),
+            ("licitacao", "Licitação", "texto"),
+            ("usuario_responsavel", "Usuário Responsável", "texto"),
+            ("historico", "Histórico", "texto"),
+            ("credor", "Credor", "texto"),
+            ("nome_credor", "Nome do Credor", "texto"),
+            ("data_autorizacao", "Data Autorização", "texto"),
+            ("data_hora_cadastro_autorizacao", "Data/Hora Cadastro Autorização", "texto"),
+            ("tipo_despesa", "Tipo de Despesa", "texto"),
+            ("numero_abj", "Nº ABJ", "texto"),
+            ("numero_processo_sequestro_judicial", "Nº Processo do Sequestro Judicial", "texto"),
+            (
+                "indicativo_entrega_imediata",
+                "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666",
+                "texto",
+            ),
+            ("indicativo_contrato", "Indicativo de contrato", "texto"),
+            ("codigo_uo_extinta", "Código UO Extinta", "texto"),
+            ("devolucao_gcv", "Devolução GCV", "texto"),
+            ("mes_competencia_folha_pagamento", "Mês de Competência da Folha de Pagamento", "texto"),
+            (
+                "exercicio_competencia_folha",
+                "Exercício de Competência da Folha de Pagamento",
+                "texto",
+            ),
+            ("obrigacao_patronal", "Obrigação Patronal", "texto"),
+            ("tipo_obrigacao_patronal", "Tipo de Obrigação Patronal", "texto"),
+            ("numero_nla", "Nº NLA", "texto"),
+        ),
+    },
+    "emp": {
+        "tabela": "emp",
+        "aba": "EMP",
+        "arquivo": "emp",
+        "chave_display": True,
+        "colunas": (
+            ("chave", None, "texto"),
+            ("chave_planejamento", None, "texto"),
+            ("regiao", "Regiao", "texto"),
+            ("subfuncao_ug", "Subfuncao + UG", "texto"),
+            ("adj", "ADJ", "texto"),
+            ("macropolitica", "Macropolitica", "texto"),
+            ("pilar", "Pilar", "texto"),
+            ("eixo", "Eixo", "texto"),
+            ("politica_decreto", "Politica_Decreto", "texto"),
+            ("exercicio", "Exercicio", "texto"),
+            ("numero_emp", "Nº EMP", "texto"),
+            ("numero_ped", "Nº PED", "texto"),
+            ("valor_emp", "Valor EMP", "valor"),
+            ("devolucao_gcv", "Devolucao GCV", "valor"),
+            ("valor_emp_devolucao_gcv", "Valor EMP-Devolucao GCV", "valor"),
+            ("uo", "UO", "texto"),
+            ("nome_unidade_orcamentaria", "Nome da Unidade Orcamentaria", "texto"),
+            ("ug", "UG", "texto"),
+            ("nome_unidade_gestora", "Nome da Unidade Gestora", "texto"),
+            ("dotacao_orcamentaria", "Dotacao Orcamentaria", "texto"),
+            ("funcao", "Funcao", "texto"),
+            ("subfuncao", "Subfuncao", "texto"),
+            ("programa_governo", "Programa de Governo", "texto"),
+            ("paoe", "PAOE", "texto"),
+            ("natureza_despesa", "Natureza de Despesa", "texto"),
+            ("cat_econ", "Cat.Econ", "texto"),
+            ("grupo", "Grupo", "texto"),
+            ("modalidade", "Modalidade", "texto"),
+            ("elemento", "Elemento", "texto"),
+            ("fonte", "Fonte", "texto"),
+            ("iduso", "Iduso", "texto"),
+            ("historico", "Historico", "texto"),
+            ("tipo_despesa", "Tipo de Despesa", "texto"),
+            ("credor", "Credor", "texto"),
+            ("nome_credor", "Nome do Credor", "texto"),
+            ("cpf_cnpj_credor", "CPF/CNPJ do Credor", "texto"),
+            ("categoria_credor", "Categoria do Credor", "texto"),
+            ("tipo_empenho", "Tipo Empenho", "texto"),
+            ("situacao", "Situacao", "texto"),
+            ("data_emissao", "Data emissao", "data"),
+            ("data_criacao", "Data criacao", "data"),
+            ("numero_contrato", "Nº Contrato", "texto"),
+            ("numero_convenio", "Nº Convênio", "texto"),
+        ),
+    },
+    "est_emp": {
+        "tabela": "est_emp",
+        "aba": "EST_EMP",
+        "arquivo": "est_emp",
+        "colunas": (
+            ("exercicio", "Exercicio", "texto"),
+            ("numero_est", "Nº EST", "texto"),
+            ("numero_emp", "Nº EMP", "texto"),
+            ("empenho_atual", "Empenho Atual", "texto"),
+            ("empenho_rp", "Empenho RP", "texto"),
+            ("numero_ped", "Nº PED", "texto"),
+            ("valor_emp", "Valor EMP", "valor"),
+            ("valor_est_emp_sem_aqs", "Valor Est EMP (A LIQ/Em LIQ sem AQS)", "valor"),
+            ("valor_est_emp_com_aqs", "Valor Est EMP (Em LIQ com AQS)", "valor"),
+            (
+                "valor_emp_liquido",
+                "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)",
+                "valor",
+            ),
+            ("uo", "UO", "texto"),
+            ("nome_unidade_orcamentaria", "Nome da Unidade Orcamentaria", "texto"),
+            ("ug", "UG", "texto"),
+            ("nome_unidade_gestora", "Nome da Unidade Gestora", "texto"),
+            ("dotacao_orcamentaria", "Dotacao Orcamentaria", "texto"),
+            ("historico", "Historico", "texto"),
+            ("credor", "Credor", "texto"),
+            ("nome_credor", "Nome do Credor", "texto"),
+            ("cpf_cnpj_credor", "CPF/CNPJ do Credor", "texto"),
+            ("data_criacao", "Data Criacao", "data"),
+            ("data_emissao", "Data Emissao", "data"),
+            ("situacao", "Situacao", "texto"),
+            ("rp", "RP", "texto"),
+        ),
+    },
+    "nob": {
+        "tabela": "nob",
+        "aba": "NOB",
+        "arquivo": "nob",
+        "colunas": (
+            ("exercicio", "Exercicio", "texto"),
+            ("numero_nob", "Nº NOB", "texto"),
+            ("numero_nob_estorno", "Nº NOB Estorno/Estornado", "texto"),
+            ("numero_liq", "Nº LIQ", "texto"),
+            ("numero_emp", "Nº EMP", "texto"),
+            ("empenho_atual", "Empenho Atual", "texto"),
+            ("empenho_rp", "Empenho RP", "texto"),
+            ("numero_ped", "Nº PED", "texto"),
+            ("valor_nob", "Valor NOB", "valor"),
+            ("devolucao_gcv", "Devolucao GCV", "valor"),
+            ("valor_nob_gcv", "Valor NOB - GCV", "valor"),
+            ("uo", "UO", "texto"),
+            ("ug", "UG", "texto"),
+            ("dotacao_orcamentaria", "Dotacao Orcamentaria", "texto"),
+            ("funcao", "Funcao", "texto"),
+            ("subfuncao", "Subfuncao", "texto"),
+            ("programa_governo", "Programa de Governo", "texto"),
+            ("paoe", "PAOE", "texto"),
+            ("natureza_despesa", "Natureza de Despesa", "texto"),
+            ("cat_econ", "Cat.Econ", "texto"),
+            ("grupo", "Grupo", "texto"),
+            ("modalidade", "Modalidade", "texto"),
+            ("elemento", "Elemento", "texto"),
+            ("nome_elemento_despesa", "Nome do Elemento da Despesa", "texto"),
+            ("fonte", "Fonte", "texto"),
+            ("nome_fonte_recurso", "Nome da Fonte de Recurso", "texto"),
+            ("iduso", "Iduso", "texto"),
+            ("historico_liq", "Historico LIQ", "texto"),
+            ("nome_credor_principal", "Nome do Credor Principal", "texto"),
+            ("cpf_cnpj_credor_principal", "CPF/CNPJ do Credor Principal", "texto"),
+            ("credor", "Credor", "texto"),
+            ("nome_credor", "Nome do Credor", "texto"),
+            ("cpf_cnpj_credor", "CPF/CNPJ do Credor", "texto"),
+            ("data_nob", "Data NOB", "data"),
+            ("data_cadastro_nob", "Data Cadastro NOB", "data"),
+            ("data_hora_cadastro_liq", "Data/Hora de Cadastro da LIQ", "datahora"),
+        ),
+    },
+    "plan20": {
+        "tabela": "plan20_seduc",
+        "aba": "Sheet1",
+        "arquivo": "plan20_seduc",
+        "formato_valor": "#,##0.00",
+        "inteiros_excel": ("exercicio",),
+        "colunas": (
+            ("exercicio", "Exercício", "texto"),
+            ("chave_planejamento", "Chave de Planejamento", "texto"),
+            ("regiao", "Região", "texto"),
+            ("subfuncao_ug", "Subfunção + UG", "texto"),
+            ("adj", "ADJ", "texto"),
+            ("macropolitica", "Macropolitica", "texto"),
+            ("pilar", "Pilar", "texto"),
+            ("eixo", "Eixo", "texto"),
+            ("politica_decreto", "Politica_Decreto", "texto"),
+            ("publico_transversal_chave", "Público Transversal (chave)", "texto"),
+            ("programa", "Programa", "texto"),
+            ("funcao", "Função", "texto"),
+            ("unidade_orcamentaria", "Unidade Orçamentária", "texto"),
+            ("acao_paoe", "Ação (P/A/OE)", "texto"),
+            ("subfuncao", "Subfunção", "texto"),
+            ("objetivo_especifico", "Objetivo Específico", "texto"),
+            ("esfera", "Esfera", "texto"),
+            ("responsavel_acao", "Responsável pela Ação", "texto"),
+            ("produto_acao", "Produto(s) da Ação", "texto"),
+            ("unid_medida_produto", "Unidade de Medida do Produto", "texto"),
+            ("regiao_produto", "Região do Produto", "texto"),
+            ("meta_produto", "Meta do Produto", "texto"),
+            ("saldo_meta_produto", "Saldo Meta do Produto", "texto"),
+            ("publico_transversal", "Público Transversal", "texto"),
+            ("subacao_entrega", "Subação/entrega", "texto"),
+            ("responsavel", "Responsável", "texto"),
+            ("prazo", "Prazo", "texto"),
+            ("unid_gestora", "Unid. Gestora", "texto"),
+            ("unidade_setorial_planejamento", "Unidade Setorial de Planejamento", "texto"),
+            ("produto_subacao", "Produto da Subação", "texto"),
+            ("unidade_medida", "Unidade de Medida", "texto"),
+            ("regiao_subacao", "Região da Subação", "texto"),
+            ("codigo", "Código", "texto"),
+            ("municipios_entrega", "Município(s) da entrega", "texto"),
+            ("meta_subacao", "Meta da Subação", "texto"),
+            ("detalhamento_produto", "Detalhamento do produto", "texto"),
+            ("etapa", "Etapa", "texto"),
+            ("responsavel_etapa", "Responsável da Etapa", "texto"),
+            ("prazo_etapa", "Prazo da Etapa", "texto"),
+            ("regiao_etapa", "Região da Etapa", "texto"),
+            ("natureza", "Natureza", "texto"),
+            ("cat_econ", "Cat.Econ", "texto"),
+            ("grupo", "Grupo", "texto"),
+            ("modalidade", "Modalidade", "texto"),
+            ("elemento", "Elemento", "texto"),
+            ("subelemento", "Subelemento", "texto"),
+            ("fonte", "Fonte", "texto"),
+            ("idu", "IDU", "texto"),
+            ("descricao_item_despesa", "Descrição do Item de Despesa", "texto"),
+            ("unid_medida_item", "Unid. Medida", "texto"),
+            ("quantidade", "Quantidade", "valor"),
+            ("valor_unitario", "Valor Unitário", "valor"),
+            ("valor_total", "Valor Total", "valor"),
+        ),
+    },
+}
+
+CHAVE_DISPLAY_ROTULO = "Chave / Chave de Planejamento"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Linhas convertidas por vez ao escrever o Excel.
+LOTE_EXCEL = 5000
+FORMATO_DATA = "%d/%m/%Y"
+FORMATO_DATAHORA = "%d/%m/%Y %H:%M:%S"
+
+
+def spec_relatorio(nome: str) -> dict:
+    spec = RELATORIOS.get(nome)
+    if spec is None:
+        raise KeyError(f"Relatorio nao configurado: {nome}")
+    return spec
+
+
+def sql_relatorio(spec: dict, where: str | None = None) -> str:
+    campos = ", ".join(c[0] for c in spec["colunas"])
+    if where is None:
+        where = filtro_ativos(spec["tabela"])
+    return f"SELECT {campos} FROM {spec['tabela']} WHERE {where}"
+
+
+def carregar_colunas(sql: str, params: dict | None = None, lote: int = LOTE_FETCH) -> dict[str, list]:
+    """Le o resultado em lotes (fetchmany) direto para listas por coluna."""
+    result = db.session.execute(text(sql), params or {})
+    nomes = list(result.keys())
+    colunas: dict[str, list] = {nome: [] for nome in nomes}
+    destinos = [colunas[nome] for nome in nomes]
+    while True:
+        rows = result.fetchmany(lote)
+        if not rows:
+            break
+        for destino, valores in zip(destinos, zip(*rows)):
+            destino.extend(valores)
+    return colunas
+
+
+def _serie_valor(serie: pd.Series) -> pd.Series:
+    # Strings no formato pt-BR (1.234,56); demais valores numericos (Decimal/float/int).
+    eh_str = serie.map(type).eq(str)
+    numeros = pd.to_numeric(serie.where(~eh_str), errors="coerce")
+    if eh_str.any():
+        textos = serie[eh_str].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        numeros[eh_str] = pd.to_numeric(textos, errors="coerce")
+    return numeros.fillna(0.0).astype(float)
+
+
+def _serie_data(serie: pd.Series, formato: str) -> pd.Series:
+    eh_str = serie.map(type).eq(str)
+    datas = pd.to_datetime(serie.where(~eh_str), errors="coerce")
+    saida = datas.dt.strftime(formato).astype(object).where(datas.notna(), None)
+    if eh_str.any():
+        textos = serie[eh_str]
+        saida[eh_str] = textos.where(textos.ne(""), None)
+    return saida
+
+
+def _serie_str(serie: pd.Series) -> pd.Series:
+    return serie.where(serie.notna() & serie.astype(bool), "").astype(str)
+
+
+CONVERSORES = {
+    "valor": _serie_valor,
+    "data": lambda s: _serie_data(s, FORMATO_DATA),
+    "datahora": lambda s: _serie_data(s, FORMATO_DATAHORA),
+    "str": _serie_str,
+}
+
+
+def montar_dataframe(spec: dict, colunas: dict[str, list]) -> pd.DataFrame:
+    """Converte as colunas lidas em DataFrame aplicando os tipos da spec de forma vetorizada."""
+    df = pd.DataFrame(colunas, dtype=object)
+    for campo, _rotulo, tipo in spec["colunas"]:
+        conversor = CONVERSORES.get(tipo)
+        if conversor is not None and campo in df.columns:
+            df[campo] = conversor(df[campo])
+    return df
+
+
+def carregar_relatorio(nome: str, where: str | None = None, params: dict | None = None) -> pd.DataFrame:
+    spec = spec_relatorio(nome)
+    if where is None:
+        # Linhas ativas: snapshot da carga quando existe, senao leitura do banco.
+        df = ler_snapshot(nome)
+        if df is not None:
+            return df
+    return montar_dataframe(spec, carregar_colunas(sql_relatorio(spec, where), params))
+
+
+def gerar_snapshot(nome: str, upload_id: int) -> None:
+    """Le as linhas ativas do banco uma vez e grava o snapshot do relatorio."""
+    spec = spec_relatorio(nome)
+    # Carimbo antes das linhas: carga gravada no meio da leitura deixa o snapshot ja desatualizado.
+    versao = versao_tabela(nome)
+    gravar_snapshot(nome, upload_id, montar_dataframe(spec, carregar_colunas(sql_relatorio(spec))), versao)
+
+
+def registros_json(df: pd.DataFrame) -> list[dict]:
+    if df.empty:
+        return []
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+
+def _serie_chave_display(df: pd.DataFrame) -> pd.Series:
+    # Exercicio >= 2026 usa "chave"; antes disso prevalece a chave de planejamento.
+    ano = pd.to_numeric(df["exercicio"].fillna("").astype(str).str[:4], errors="coerce").fillna(0)
+    chave = df["chave"].fillna("").astype(str)
+    chave_plan = df["chave_planejamento"].fillna("").astype(str)
+    padrao = chave_plan.where(chave_plan.ne(""), chave)
+    return chave.where((ano >= 2026) & chave.ne(""), padrao)
+
+
+def dataframe_excel(nome: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Aplica colunas derivadas, rotulos e ordem de exportacao da spec."""
+    spec = spec_relatorio(nome)
+    saida = pd.DataFrame(index=df.index)
+    if spec.get("chave_display"):
+        saida[CHAVE_DISPLAY_ROTULO] = _serie_chave_display(df)
+    inverter = set(spec.get("inverter_excel") or ())
+    inteiros = set(spec.get("inteiros_excel") or ())
+    for campo, rotulo, _tipo in spec["colunas"]:
+        if rotulo is None or campo not in df.columns:
+            continue
+        serie = df[campo]
+        if campo in inverter:
+            serie = -serie
+        elif campo in inteiros:
+            serie = _serie_inteiro(serie)
+        saida[rotulo] = serie
+    return saida
+
+
+def _serie_inteiro(serie: pd.Series) -> pd.Series:
+    # "2025" / "2025.0" / 2025 -> 2025; o que nao converte fica como veio.
+    numeros = pd.to_numeric(serie.astype(str).str.split(".").str[0], errors="coerce")
+    saida = serie.astype(object).copy()
+    validos = numeros.notna()
+    saida[validos] = numeros[validos].astype("int64").astype(object)
+    return saida
+
+
+def escrever_xlsx(nome: str, df: pd.DataFrame, destino) -> None:
+    """Grava o DataFrame de exportacao em XLSX com memoria constante (xlsxwriter)."""
+    spec = spec_relatorio(nome)
+    workbook = xlsxwriter.Workbook(
+        destino,
+        {"constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False},
+    )
+    worksheet = workbook.add_worksheet(spec["aba"])
+    base = {"font_name": "Helvetica", "font_size": 8}
+    cell_fmt = workbook.add_format(base)
+
+    # Um formato por tipo de coluna, criado uma unica vez.
+    tipos = {rotulo: tipo for campo, rotulo, tipo in spec["colunas"] if rotulo}
+    campos = {rotulo: campo for campo, rotulo, _tipo in spec["colunas"] if rotulo}
+    inteiros = set(spec.get("inteiros_excel") or ())
+    fmt_valor = workbook.add_format({**base, "num_format": spec["formato_valor"]}) if spec.get("formato_valor") else None
+    fmt_inteiro = workbook.add_format({**base, "num_format": "0"}) if inteiros else None
+
+    worksheet.set_default_row(12)
+    for idx, rotulo in enumerate(df.columns):
+        fmt = cell_fmt
+        if fmt_valor is not None and tipos.get(rotulo) == "valor":
+            fmt = fmt_valor
+        elif fmt_inteiro is not None and campos.get(rotulo) in inteiros:
+            fmt = fmt_inteiro
+        worksheet.set_column(idx, idx, None, fmt)
+
+    worksheet.write_row(0, 0, list(df.columns), cell_fmt)
+    linha = 1
+    for inicio in range(0, len(df), LOTE_EXCEL):
+        bloco = df.iloc[inicio : inicio + LOTE_EXCEL].astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        for valores in bloco.itertuples(index=False, name=None):
+            worksheet.write_row(linha, 0, valores)
+            linha += 1
+    workbook.close()
+
+
+def exportar_xlsx(nome: str, df: pd.DataFrame):
+    """Gera o XLSX em arquivo temporario e devolve o handle posicionado no inicio."""
+    arquivo = tempfile.TemporaryFile(suffix=".xlsx")
+    try:
+        escrever_xlsx(nome, dataframe_excel(nome, df), arquivo)
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
@@ -0,0 +1,425 @@
+from __future__ import annotations
+
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
+
+from models import SaldoExecucao, SaldoExecucaoEmp, db
+from services.cargas import filtro_ativos
+from services.normalizacao import colunas_normalizadas, dec_or_zero, normalizar_ug, normalizar_uo
+
+BATCH_SIZE = 1000
+DIMENSOES = ("exercicio", "chave_norm", "uo", "ug", "paoe", "fonte", "iduso", "programa", "regiao")
+# chave_norm por consulta no recalculo parcial (limite de parametros do SQL Server: 2100).
+LOTE_CHAVES = 500
+# Acima desta fracao de fatias tocadas pela carga, o recalculo refaz a tabela inteira.
+FRACAO_RECALCULO_TOTAL = 0.5
+
+
+# Linhas gravadas antes das colunas normalizadas existirem ficam com NULL; sao preenchidas aqui.
+_PREENCHIMENTO = (
+    ("ped", "chave, chave_planejamento, subfuncao_ug, uo", ("chave_norm", "ug_norm", "uo_norm")),
+    ("emp", "chave, chave_planejamento, subfuncao_ug, uo", ("chave_norm", "ug_norm", "uo_norm")),
+    ("est_emp", "ug, uo", ("ug_norm", "uo_norm")),
+)
+
+
+def _valores_normalizados(tabela: str, row) -> dict:
+    if tabela == "est_emp":
+        return {"ug_norm": normalizar_ug(row.get("ug")), "uo_norm": normalizar_uo(row.get("uo"))}
+    return colunas_normalizadas(row)
+
+
+def preencher_colunas_normalizadas() -> int:
+    total = 0
+    for tabela, origem, destino in _PREENCHIMENTO:
+        rows = db.session.execute(
+            text(
+                f"SELECT id, exercicio, {origem} FROM {tabela} "
+                f"WHERE {filtro_ativos(tabela)} AND {destino[0]} IS NULL"
+            )
+        ).mappings().all()
+        if not rows:
+            continue
+        update_sql = text(
+            f"UPDATE {tabela} SET {', '.join(f'{c} = :{c}' for c in destino)} WHERE id = :id"
+        )
+        params = [{"id": row["id"], **_valores_normalizados(tabela, row)} for row in rows]
+        try:
+            for i in range(0, len(params), BATCH_SIZE):
+                db.session.execute(update_sql, params[i : i + BATCH_SIZE])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(params)
+    return total
+
+
+def _lotes_de_chaves(chaves: list[str] | None):
+    # (condicao, binds) por lote de chave_norm; sem chaves, uma unica consulta sem filtro.
+    if chaves is None:
+        yield "", {}
+        return
+    for i in range(0, len(chaves), LOTE_CHAVES):
+        binds = {f"chave_{j}": chave for j, chave in enumerate(chaves[i : i + LOTE_CHAVES])}
+        yield f" AND chave_norm IN ({', '.join(f':{nome}' for nome in binds)})", binds
+
+
+def _agregar_ped(chaves: list[str] | None = None) -> dict[tuple, list]:
+    # valor_ped e texto com formato variavel; a soma continua em Python via dec_or_zero.
+    totais: dict[tuple, list] = {}
+    for filtro, binds in _lotes_de_chaves(chaves):
+        rows = db.session.execute(
+            text(
+                f"""
+                SELECT exercicio, chave_norm, uo_norm, ug_norm, paoe, fonte, iduso, programa_governo, regiao,
+                       valor_ped
+                FROM ped
+                WHERE {filtro_ativos("ped")} AND chave_norm <> ''{filtro}
+                """
+            ),
+            binds,
+        )
+        for row in rows:
+            chave = tuple("" if v is None else str(v) for v in row[:-1])
+            acc = totais.setdefault(chave, [Decimal("0"), 0])
+            acc[0] += dec_or_zero(row[-1])
+            acc[1] += 1
+    return totais
+
+
+def _sql_empenhos(filtro: str = "") -> str:
+    # Uma linha por empenho e combinacao de dimensoes; o liquido vem somado do EST EMP no proprio
+    # banco (com filtro de chaves, so o dos empenhos dessas chaves).
+    restricao = f" AND numero_emp IN (SELECT numero_emp FROM emp WHERE {filtro_ativos('emp')}{filtro})" if filtro else ""
+    return f"""
+        SELECT k.exercicio, k.chave_norm, k.uo_norm, k.ug_norm, k.paoe, k.fonte, k.iduso,
+               k.programa_governo, k.regiao, k.numero_emp, COALESCE(l.liquido, 0) AS liquido
+        FROM (
+            SELECT DISTINCT COALESCE(exercicio, '') AS exercicio, chave_norm,
+                   COALESCE(uo_norm, '') AS uo_norm, COALESCE(ug_norm, '') AS ug_norm,
+                   COALESCE(paoe, '') AS paoe, COALESCE(fonte, '') AS fonte,
+                   COALESCE(iduso, '') AS iduso, COALESCE(programa_governo, '') AS programa_governo,
+                   COALESCE(regiao, '') AS regiao, numero_emp
+            FROM emp
+            WHERE {filtro_ativos("emp")} AND chave_norm <> '' AND numero_emp IS NOT NULL AND numero_emp <> ''{filtro}
+        ) k
+        LEFT JOIN (
+            SELECT numero_emp, SUM(valor_emp_liquido) AS liquido
+            FROM est_emp
+            WHERE {filtro_ativos("est_emp")} AND numero_emp IS NOT NULL{restricao}
+            GROUP BY numero_emp
+        ) l ON l.numero_emp = k.numero_emp
+    """
+
+
+def _empenhos(chaves: list[str] | None = None) -> dict[tuple, Decimal]:
+    # (dimensoes..., numero_emp) -> liquido do empenho.
+    empenhos: dict[tuple, Decimal] = {}
+    for filtro, binds in _lotes_de_chaves(chaves):
+        for row in db.session.execute(text(_sql_empenhos(filtro)), binds):
+            empenhos[tuple(str(v) for v in row[:10])] = Decimal(str(row[10] or 0))
+    return empenhos
+
+
+# Fatias (exercicio, chave_norm) com linhas gravadas pelo upload; no EST EMP, as dos empenhos afetados.
+# As fatias dos documentos que a carga removeu chegam por saldo_execucao_pendente (ver services/cargas.py).
+_FATIAS_DO_UPLOAD = {
+    "ped": f"""
+        SELECT DISTINCT COALESCE(exercicio, ''), chave_norm FROM ped
+        WHERE {filtro_ativos("ped")} AND chave_norm <> '' AND upload_id = :upload_id
+    """,
+    "emp": f"""
+        SELECT DISTINCT COALESCE(exercicio, ''), chave_norm FROM emp
+        WHERE {filtro_ativos("emp")} AND chave_norm <> '' AND upload_id = :upload_id
+    """,
+    "est_emp": f"""
+        SELECT DISTINCT COALESCE(exercicio, ''), chave_norm FROM emp
+        WHERE {filtro_ativos("emp")} AND chave_norm <> '' AND numero_emp IN (
+            SELECT numero_emp FROM est_emp WHERE {filtro_ativos("est_emp")} AND upload_id = :upload_id
+        )
+    """,
+}
+_TABELAS = (SaldoExecucao.__table__, SaldoExecucaoEmp.__table__)
+
+
+def _fatias_da_carga(dataset: str, upload_id: int) -> set[tuple[str, str]] | None:
+    """Fatias com linhas do upload; None se ele gravou uma versao completa da base."""
+    criadora = db.session.execute(
+        text(
+            "SELECT c.upload_id FROM carga_ativa a JOIN cargas c ON c.id = a.carga_id "
+            "WHERE a.dataset = :dataset"
+        ),
+        {"dataset": dataset},
+    ).scalar()
+    if criadora is not None and int(criadora) == upload_id:
+        return None
+    return {
+        (str(exercicio), str(chave))
+        for exercicio, chave in db.session.execute(text(_FATIAS_DO_UPLOAD[dataset]), {"upload_id": upload_id})
+    }
+
+
+def _pendentes() -> tuple[list[int], set[tuple[str, str]]]:
+    ids, fatias = [], set()
+    for id_, exercicio, chave in db.session.execute(
+        text("SELECT id, exercicio, chave_norm FROM saldo_execucao_pendente")
+    ):
+        ids.append(int(id_))
+        fatias.add((str(exercicio), str(chave)))
+    return ids, fatias
+
+
+def _fatias_divergentes() -> set[tuple[str, str]]:
+    """Fatias cujas contagens/liquido nas bases nao batem com as tabelas do saldo.
+
+    Le as bases inteiras: usada so na conferencia manual, nao apos cada upload.
+    """
+    bases: dict[tuple[str, str], list] = {}
+    ped = db.session.execute(
+        text(
+            f"SELECT COALESCE(exercicio, ''), chave_norm, COUNT(*) FROM ped "
+            f"WHERE {filtro_ativos('ped')} AND chave_norm <> '' GROUP BY COALESCE(exercicio, ''), chave_norm"
+        )
+    )
+    for exercicio, chave, ped_count in ped:
+        bases[(str(exercicio), str(chave))] = [int(ped_count or 0), 0, Decimal("0")]
+    emp = db.session.execute(
+        text(
+            f"SELECT e.exercicio, e.chave_norm, COUNT(*), SUM(e.liquido) FROM ({_sql_empenhos()}) e "
+            f"GROUP BY e.exercicio, e.chave_norm"
+        )
+    )
+    for exercicio, chave, linhas, liquido in emp:
+        acc = bases.setdefault((str(exercicio), str(chave)), [0, 0, Decimal("0")])
+        acc[1] = int(linhas or 0)
+        acc[2] = Decimal(str(liquido or 0))
+
+    gravadas: dict[tuple[str, str], list] = {}
+    for exercicio, chave, ped_count in db.session.execute(
+        text("SELECT exercicio, chave_norm, SUM(ped_count) FROM saldo_execucao GROUP BY exercicio, chave_norm")
+    ):
+        gravadas[(str(exercicio), str(chave))] = [int(ped_count or 0), 0, Decimal("0")]
+    for exercicio, chave, linhas, liquido in db.session.execute(
+        text(
+            "SELECT exercicio, chave_norm, COUNT(*), SUM(valor_emp_liquido) "
+            "FROM saldo_execucao_emp GROUP BY exercicio, chave_norm"
+        )
+    ):
+        acc = gravadas.setdefault((str(exercicio), str(chave)), [0, 0, Decimal("0")])
+        acc[1] = int(linhas or 0)
+        acc[2] = Decimal(str(liquido or 0))
+
+    divergentes = set()
+    vazio = (0, 0, Decimal("0"))
+    for fatia in bases.keys() | gravadas.keys():
+        ped_base, emp_base, liq_base = bases.get(fatia, vazio)
+        ped_gravado, emp_gravado, liq_gravado = gravadas.get(fatia, vazio)
+        # A tabela guarda o liquido arredondado por empenho: tolera meio centavo por linha.
+        if (
+            ped_base != ped_gravado
+            or emp_base != emp_gravado
+            or abs(liq_base - liq_gravado) > Decimal("0.005") * max(emp_base, 1)
+        ):
+            divergentes.add(fatia)
+    return divergentes
+
+
+def _total_fatias() -> int:
+    return int(
+        db.session.execute(
+            text(
+                "SELECT COUNT(*) FROM (SELECT exercicio, chave_norm FROM saldo_execucao "
+                "UNION SELECT exercicio, chave_norm FROM saldo_execucao_emp) f"
+            )
+        ).scalar()
+        or 0
+    )
+
+
+def _travar(origem: str) -> bool:
+    """Bloqueia a linha de controle ate o commit; devolve se o saldo ja foi montado alguma vez."""
+    # Encerra a transacao de leitura anterior: no REPEATABLE READ do MySQL o snapshot seria de antes do bloqueio.
+    db.session.commit()
+    # O UPDATE na linha de controle fica bloqueado ate o commit do recalculo em andamento (em
+    # qualquer processo), e o seguinte so le as bases depois que o anterior gravou.
+    params = {"chave": "saldo_execucao", "origem": origem[:50], "agora": datetime.utcnow()}
+    atualizar = text(
+        "UPDATE saldo_execucao_controle SET origem = :origem, iniciado_em = :agora WHERE chave = :chave"
+    )
+    if not db.session.execute(atualizar, params).rowcount:
+        try:
+            db.session.execute(
+                text(
+                    "INSERT INTO saldo_execucao_controle (chave, origem, iniciado_em) "
+                    "VALUES (:chave, :origem, :agora)"
+                ),
+                params,
+            )
+        except IntegrityError:
+            # Outro processo criou a linha ao mesmo tempo: espera o recalculo dele terminar.
+            db.session.rollback()
+            db.session.execute(atualizar, params)
+    return _concluido_em() is not None
+
+
+def _concluido_em() -> datetime | None:
+    return db.session.execute(
+        text("SELECT concluido_em FROM saldo_execucao_controle WHERE chave = :chave"), {"chave": "saldo_execucao"}
+    ).scalar()
+
+
+def _gravar(fatias: set[tuple[str, str]] | None) -> int:
+    # Refaz as fatias pedidas (todas, com None) nas duas tabelas do saldo.
+    chaves = None if fatias is None else sorted({chave for _, chave in fatias})
+    if chaves == []:
+        return 0
+    ped = _agregar_ped(chaves)
+    empenhos = _empenhos(chaves)
+    agora = datetime.utcnow()
+    registros_ped = [
+        {**dict(zip(DIMENSOES, chave)), "valor_ped": valor, "ped_count": n, "atualizado_em": agora}
+        for chave, (valor, n) in ped.items()
+        if fatias is None or chave[:2] in fatias
+    ]
+    registros_emp = [
+        {**dict(zip(DIMENSOES, chave)), "numero_emp": chave[9], "valor_emp_liquido": liquido, "atualizado_em": agora}
+        for chave, liquido in empenhos.items()
+        if fatias is None or chave[:2] in fatias
+    ]
+    params = [{"exercicio": exercicio, "chave_norm": chave} for exercicio, chave in sorted(fatias or ())]
+    for tabela, registros in zip(_TABELAS, (registros_ped, registros_emp)):
+        if fatias is None:
+            db.session.execute(tabela.delete())
+        else:
+            apagar = text(f"DELETE FROM {tabela.name} WHERE exercicio = :exercicio AND chave_norm = :chave_norm")
+            for i in range(0, len(params), BATCH_SIZE):
+                db.session.execute(apagar, params[i : i + BATCH_SIZE])
+        for i in range(0, len(registros), BATCH_SIZE):
+            db.session.execute(tabela.insert(), registros[i : i + BATCH_SIZE])
+    return len(registros_ped) + len(registros_emp)
+
+
+def _concluir(ids_pendentes: list[int]) -> None:
+    for i in range(0, len(ids_pendentes), LOTE_CHAVES):
+        binds = {f"id_{j}": id_ for j, id_ in enumerate(ids_pendentes[i : i + LOTE_CHAVES])}
+        db.session.execute(
+            text(f"DELETE FROM saldo_execucao_pendente WHERE id IN ({', '.join(f':{nome}' for nome in binds)})"),
+            binds,
+        )
+    db.session.execute(
+        text("UPDATE saldo_execucao_controle SET concluido_em = :agora WHERE chave = :chave"),
+        {"agora": datetime.utcnow(), "chave": "saldo_execucao"},
+    )
+
+
+def atualizar_saldo_execucao(
+    dataset: str | None = None, upload_id: int | None = None, completo: bool = False
+) -> int:
+    """Recalcula saldo_execucao e saldo_execucao_emp a partir das cargas ativas de PED, EMP e EST EMP.
+
+    Depois de um upload (dataset/upload_id) refaz so as fatias (exercicio, chave_norm) com linhas
+    dele e as pendentes de documentos removidos por cargas em delta. Sem upload, confere todas as
+    fatias contra as bases e refaz as divergentes. Tudo e refeito com completo=True, na primeira
+    montagem, apos uma carga completa ou quando a maior parte das fatias mudou.
+    Recalculos simultaneos rodam um de cada vez. Devolve as linhas gravadas.
+    """
+    preencher_colunas_normalizadas()
+    try:
+        montado = _travar(dataset or ("completo" if completo else "conferencia"))
+        ids_pendentes, fatias = _pendentes()
+        if completo or not montado:
+            fatias = None
+        elif dataset in _FATIAS_DO_UPLOAD and upload_id is not None:
+            da_carga = _fatias_da_carga(dataset, upload_id)
+            fatias = None if da_carga is None else fatias | da_carga
+        else:
+            fatias |= _fatias_divergentes()
+        if fatias and len(fatias) > _total_fatias() * FRACAO_RECALCULO_TOTAL:
+            fatias = None
+        linhas = _gravar(fatias)
+        _concluir(ids_pendentes)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return linhas
+
+
+def atualizar_saldo_execucao_seguro(dataset: str | None = None, upload_id: int | None = None) -> None:
+    # Chamado ao fim dos uploads: uma falha aqui nao deve invalidar a carga ja gravada.
+    try:
+        atualizar_saldo_execucao(dataset, upload_id)
+    except Exception as exc:
+        print(f"Aviso: nao foi possivel atualizar saldo_execucao: {exc}")
+
+
+def garantir_saldo_execucao() -> None:
+    # Chamado no inicio do servico de jobs: a primeira montagem (ou a refeita apos a migracao)
+    # roda fora das requisicoes, que ate la somam direto das bases.
+    if _concluido_em() is None:
+        atualizar_saldo_execucao(completo=True)
+
+
+def _consultar_nas_bases(filtros: dict[str, str]) -> dict:
+    # Antes da primeira montagem: soma so a chave consultada, direto das bases e sem gravar nada.
+    posicoes = [(DIMENSOES.index(campo), valor) for campo, valor in filtros.items()]
+
+    def casa(chave: tuple) -> bool:
+        return all(chave[i] == valor for i, valor in posicoes)
+
+    ped = [acc for chave, acc in _agregar_ped([filtros["chave_norm"]]).items() if casa(chave)]
+    liquidos = {chave[9]: liquido for chave, liquido in _empenhos([filtros["chave_norm"]]).items() if casa(chave)}
+    return {
+        "valor_ped": sum((valor for valor, _ in ped), Decimal("0")),
+        "ped_count": sum(n for _, n in ped),
+        "valor_emp_liquido": sum(liquidos.values(), Decimal("0")),
+        "emp_count": len(liquidos),
+    }
+
+
+def consultar_saldo_execucao(
+    exercicio: str,
+    chave_norm: str,
+    uo: str = "",
+    ug: str = "",
+    paoe: str = "",
+    fonte: str = "",
+    iduso: str = "",
+    programa: str = "",
+    regiao: str = "",
+) -> dict:
+    opcionais = {"uo": uo, "ug": ug, "paoe": paoe, "fonte": fonte, "iduso": iduso, "programa": programa, "regiao": regiao}
+    filtros = {"exercicio": exercicio, "chave_norm": chave_norm, **{c: v for c, v in opcionais.items() if v}}
+    if _concluido_em() is None:
+        return _consultar_nas_bases(filtros)
+
+    row = (
+        db.session.query(
+            func.coalesce(func.sum(SaldoExecucao.valor_ped), 0),
+            func.coalesce(func.sum(SaldoExecucao.ped_count), 0),
+        )
+        .filter(*(getattr(SaldoExecucao, campo) == valor for campo, valor in filtros.items()))
+        .one()
+    )
+    # Um empenho pode ter linhas em mais de uma combinacao de dimensoes: conta uma vez por numero_emp.
+    por_empenho = (
+        db.session.query(
+            SaldoExecucaoEmp.numero_emp, func.max(SaldoExecucaoEmp.valor_emp_liquido).label("liquido")
+        )
+        .filter(*(getattr(SaldoExecucaoEmp, campo) == valor for campo, valor in filtros.items()))
+        .group_by(SaldoExecucaoEmp.numero_emp)
+        .subquery()
+    )
+    liquido, emp_count = db.session.query(
+        func.coalesce(func.sum(por_empenho.c.liquido), 0), func.count()
+    ).select_from(por_empenho).one()
+    return {
+        "valor_ped": Decimal(str(row[0] or 0)),
+        "ped_count": int(row[1] or 0),
+        "valor_emp_liquido": Decimal(str(liquido or 0)),
+        "emp_count": int(emp_count or 0),
+    }
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import func
+from sqlalchemy.exc import ProgrammingError
+
+from models import ActiveSession, Perfil, PerfilPermissao, db
+from services.features import FEATURE_BITS, resolve_mask
+
+SESSION_TIMEOUT = timedelta(hours=2)
+# Validade dos perfis/permissoes em cache. A invalidacao explicita so alcanca o processo que fez a
+# alteracao; nos demais processos do IIS a mudanca aparece em ate SESSAO_CACHE_TTL segundos.
+CACHE_TTL = float(os.getenv("SESSAO_CACHE_TTL", "30"))
+# last_activity e gravado no maximo uma vez por intervalo por sessao.
+ATIVIDADE_INTERVALO = timedelta(seconds=int(os.getenv("SESSAO_ATIVIDADE_INTERVALO", "60")))
+
+_AUSENTE = object()
+
+
+class CacheTTL:
+    """Dicionario em memoria com expiracao por entrada, seguro entre threads."""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._itens: dict[Any, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return padrao
+            if item[0] < time.monotonic():
+                del self._itens[chave]
+                return padrao
+            return item[1]
+
+    def set(self, chave, valor) -> None:
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+
+    def pop(self, chave) -> None:
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+
+# ("id", perfil_id) ou ("nome", nome) -> (perfil_id, nivel) ou None
+_perfis = CacheTTL(CACHE_TTL)
+# perfil_id -> (bitset das features concedidas, bitset com pais e locked)
+_permissoes = CacheTTL(CACHE_TTL)
+
+
+def _como_datetime(valor):
+    if isinstance(valor, str):
+        try:
+            return datetime.fromisoformat(valor)
+        except ValueError:
+            return None
+    return valor
+
+
+def sessao_valida(email: str, token: str, agora: datetime) -> bool:
+    """Confere o token da sessao, expira sessoes paradas e registra a atividade.
+
+    O token e conferido no banco a cada requisicao (busca pelo indice unico de session_token),
+    para que logout ou login em outro processo valham na hora; o banco so e gravado quando a
+    ultima atividade tem mais de ATIVIDADE_INTERVALO.
+    """
+    filtro = {"email": email, "session_token": token}
+    row = db.session.query(ActiveSession.last_activity).filter_by(**filtro).first()
+    if row is None:
+        return False
+
+    last_activity = _como_datetime(row[0])
+    if last_activity and last_activity < agora - SESSION_TIMEOUT:
+        ActiveSession.query.filter_by(**filtro).delete()
+        db.session.commit()
+        return False
+    if last_activity is None or agora - last_activity >= ATIVIDADE_INTERVALO:
+        ActiveSession.query.filter_by(**filtro).update({"last_activity": agora})
+        db.session.commit()
+    return True
+
+
+def perfil_do_usuario(user: dict) -> tuple[int, int] | None:
+    """(perfil_id, nivel) do usuario da sessao, pelo perfil_id ou, sem ele, pelo nome."""
+    perfil_id = user.get("perfil_id")
+    perfil_nome = (user.get("perfil") or "").strip()
+    chave = ("id", perfil_id) if perfil_id else ("nome", perfil_nome.lower())
+    resultado = _perfis.get(chave, _AUSENTE)
+    if resultado is not _AUSENTE:
+        return resultado
+    perfil_row = db.session.get(Perfil, perfil_id) if perfil_id else None
+    if not perfil_row and perfil_nome:
+        normalized = func.lower(func.ltrim(func.rtrim(Perfil.nome)))
+        perfil_row = Perfil.query.filter(normalized == perfil_nome.lower()).first()
+        if not perfil_row:
+            perfil_row = Perfil.query.filter(Perfil.nome.ilike(perfil_nome)).first()
+    resultado = (perfil_row.id, perfil_row.nivel) if perfil_row else None
+    _perfis.set(chave, resultado)
+    return resultado
+
+
+def _mascaras_do_banco(perfil_ids: list[int]) -> dict[int, int]:
+    mascaras = {perfil_id: 0 for perfil_id in perfil_ids}
+    consulta = db.session.query(PerfilPermissao.perfil_id, PerfilPermissao.feature).filter(
+        PerfilPermissao.perfil_id.in_(perfil_ids),
+        PerfilPermissao.ativo == True,  # noqa: E712
+        PerfilPermissao.feature.isnot(None),
+    )
+    for perfil_id, feature in consulta:
+        mascaras[perfil_id] |= FEATURE_BITS.get(feature, 0)
+    return mascaras
+
+
+def permissoes_perfis(perfil_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """Bitsets (concedidas, com pais e locked) de cada perfil.
+
+    Os perfis fora do cache sao lidos em uma unica consulta.
+    """
+    resultado: dict[int, tuple[int, int]] = {}
+    faltando = []
+    for perfil_id in perfil_ids:
+        item = _permissoes.get(perfil_id)
+        if item is None:
+            faltando.append(perfil_id)
+        else:
+            resultado[perfil_id] = item
+    if not faltando:
+        return resultado
+    try:
+        mascaras = _mascaras_do_banco(faltando)
+    except ProgrammingError:
+        db.session.rollback()
+        resultado.update({perfil_id: (0, resolve_mask(0)) for perfil_id in faltando})
+        return resultado
+    for perfil_id, mascara in mascaras.items():
+        item = (mascara, resolve_mask(mascara))
+        _permissoes.set(perfil_id, item)
+        resultado[perfil_id] = item
+    return resultado
+
+
+def permissoes_perfil(perfil_id: int) -> tuple[int, int]:
+    return permissoes_perfis([perfil_id])[perfil_id]
+
+
+def recarregar_permissoes(perfil_id: int) -> tuple[int, int]:
+    # Chamado depois de salvar as permissoes do perfil: o bitset novo ja fica em cache.
+    _permissoes.pop(perfil_id)
+    return permissoes_perfil(perfil_id)
+
+
+def invalidar_perfis() -> None:
+    # Chamado ao criar/alterar/excluir perfis ou salvar permissoes.
+    _perfis.clear()
+    _permissoes.clear()
+
+
+def contar_sessoes_ativas() -> int:
+    cutoff = datetime.utcnow() - SESSION_TIMEOUT
+    return ActiveSession.query.filter(ActiveSession.last_activity >= cutoff).count()
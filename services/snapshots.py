@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import text
+
+from models import db
+from services.cargas import DATASETS, carga_ativa
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # sem pyarrow os relatorios continuam lendo do banco
+    pa = None
+    feather = None
+
+# Copia colunar (Arrow IPC/Feather, sem compressao) das linhas ativas de cada relatorio,
+# gravada ao fim de cada carga. O arquivo e aberto por memory-map: as colunas numericas
+# chegam ao DataFrame sem copia e o banco so e consultado para conferir a versao.
+SNAPSHOT_DIR = Path("outputs/snapshots")
+# "0" desliga os snapshots (relatorios sempre pelo banco).
+SNAPSHOTS_ATIVOS = pa is not None and (os.getenv("SNAPSHOTS") or "1").strip().lower() not in ("0", "false", "nao", "no")
+# Relatorios sem carga_ativa: o ponteiro guarda um carimbo da tabela (linhas, ativas, ultima
+# gravacao) e o snapshot so vale enquanto o banco tiver o mesmo carimbo.
+TABELAS_SEM_CARGA = {"plan20": "plan20_seduc"}
+
+
+def _arquivo(nome: str, upload_id: int) -> Path:
+    return SNAPSHOT_DIR / f"{nome}_{upload_id}.arrow"
+
+
+def _ponteiro(nome: str) -> Path:
+    return SNAPSHOT_DIR / f"{nome}.atual"
+
+
+def _ler_ponteiro(nome: str) -> tuple[int | None, str | None]:
+    # Primeira linha: upload do snapshot; segunda (so sem carga_ativa): carimbo da tabela.
+    try:
+        linhas = _ponteiro(nome).read_text(encoding="utf-8").splitlines()
+        return int(linhas[0].strip()), (linhas[1].strip() if len(linhas) > 1 else None)
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+
+def versao_tabela(nome: str) -> str | None:
+    """Carimbo atual da tabela de um relatorio sem carga_ativa (None para as versionadas)."""
+    tabela = TABELAS_SEM_CARGA.get(nome)
+    if tabela is None:
+        return None
+    row = db.session.execute(
+        text(
+            f"SELECT COUNT(*), SUM(CASE WHEN ativo = 1 THEN 1 ELSE 0 END), MAX(data_atualizacao) FROM {tabela}"
+        )
+    ).one()
+    return "|".join("" if v is None else str(v) for v in row)
+
+
+def _upload_ativo(nome: str) -> int | None:
+    # Bases versionadas: vale o upload publicado em carga_ativa (pode ter sido carregado
+    # por um runner Node ou antes do snapshot existir). As demais conferem o carimbo da
+    # tabela: carga posterior sem snapshot, ou snapshot de um job mais antigo que terminou
+    # por ultimo, nao batem com o banco e o relatorio volta a ler do SQL.
+    upload_id, versao = _ler_ponteiro(nome)
+    if nome in DATASETS:
+        ativa = carga_ativa(nome)
+        if ativa is None or ativa.upload_id is None:
+            return None
+        return upload_id if upload_id == int(ativa.upload_id) else None
+    if versao is None or versao != versao_tabela(nome):
+        return None
+    return upload_id
+
+
+def _descartar_antigos(nome: str, manter: Path) -> None:
+    for arquivo in SNAPSHOT_DIR.glob(f"{nome}_*.arrow"):
+        if arquivo == manter:
+            continue
+        try:
+            arquivo.unlink()
+        except OSError:
+            # Ainda aberto por outro processo (Windows); sai na proxima carga.
+            pass
+
+
+def gravar_snapshot(nome: str, upload_id: int, df: pd.DataFrame, versao: str | None = None) -> Path | None:
+    """Grava o snapshot do relatorio e o torna o atual. Falhas so geram aviso.
+
+    versao e o carimbo (versao_tabela) lido antes das linhas, para relatorios sem carga_ativa.
+    """
+    if not SNAPSHOTS_ATIVOS:
+        return None
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    destino = _arquivo(nome, upload_id)
+    tmp = destino.with_suffix(".tmp")
+    try:
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+        feather.write_feather(tabela, str(tmp), compression="uncompressed")
+        os.replace(tmp, destino)
+        tmp_ponteiro = _ponteiro(nome).with_suffix(".tmp")
+        conteudo = str(upload_id) if versao is None else f"{upload_id}\n{versao}"
+        tmp_ponteiro.write_text(conteudo, encoding="utf-8")
+        os.replace(tmp_ponteiro, _ponteiro(nome))
+    except (OSError, pa.ArrowException, TypeError, ValueError) as exc:
+        print(f"Aviso: nao foi possivel gravar o snapshot de {nome}: {exc}")
+        tmp.unlink(missing_ok=True)
+        return None
+    _descartar_antigos(nome, destino)
+    return destino
+
+
+def ler_snapshot(nome: str) -> pd.DataFrame | None:
+    """DataFrame do snapshot da carga ativa, ou None (sem snapshot ou desatualizado)."""
+    if not SNAPSHOTS_ATIVOS:
+        return None
+    upload_id = _upload_ativo(nome)
+    if upload_id is None:
+        return None
+    arquivo = _arquivo(nome, upload_id)
+    if not arquivo.exists():
+        return None
+    try:
+        tabela = feather.read_table(str(arquivo), memory_map=True)
+        return tabela.to_pandas(date_as_object=True, timestamp_as_object=True, integer_object_nulls=True)
+    except (OSError, pa.ArrowException) as exc:
+        print(f"Aviso: snapshot de {nome} ilegivel, lendo do banco: {exc}")
+        return None
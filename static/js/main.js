@@ -715,10 +715,13 @@
         <div><strong>Data do download:</strong> ${dataArquivo}</div>
         <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
         <div><strong>Saída gerada:</strong> ${last.output_filename || "-"}</div>
+        ${renderJobStatus(last)}
       `;
+      return last.status || null;
     } catch (err) {
       target.textContent = "Falha ao carregar status.";
       console.error(err);
+      return null;
     }
   }
 
@@ -747,15 +750,18 @@
         <div><strong>Data do download:</strong> ${dataArquivo}</div>
         <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
         <div><strong>Saída gerada:</strong> ${last.output_filename || "-"}</div>
+        ${renderJobStatus(last)}
       `;
       if (submitBtn && last.output_filename) {
         submitBtn.dataset.mode = "view";
         submitBtn.dataset.output = last.output_filename;
         submitBtn.textContent = viewLabel || "Ver relatório";
       }
+      return last.status || null;
     } catch (err) {
       target.textContent = "Falha ao carregar status.";
       console.error(err);
+      return null;
     }
   }
 
@@ -850,15 +856,18 @@
         <div><strong>Data do download:</strong> ${dataArquivo}</div>
         <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
         <div><strong>Saida gerada:</strong> ${last.output_filename || "-"}</div>
+        ${renderJobStatus(last)}
       `;
       if (submitBtn && last.output_filename) {
         submitBtn.dataset.mode = "view";
         submitBtn.dataset.output = last.output_filename;
         submitBtn.textContent = viewLabel || "Ver relatorio";
       }
+      return last.status || null;
     } catch (err) {
       target.textContent = "Falha ao carregar status.";
       console.error(err);
+      return null;
     }
   }
 
@@ -923,6 +932,16 @@
     }
   }
 
+  function renderJobStatus(last) {
+    if (!last || !last.status) return "";
+    const progress = typeof last.status_progress === "number" ? `${last.status_progress}%` : "-";
+    return `
+        <div><strong>Status:</strong> ${last.status}</div>
+        <div><strong>Progresso:</strong> ${progress}</div>
+        <div><strong>Mensagem:</strong> ${last.status_message || "-"}</div>
+      `;
+  }
+
   function startStatusPolling(loader, attempts = 20, intervalMs = 30000) {
     const tick = async (left) => {
       if (left <= 0) return;
@@ -933,6 +952,43 @@
     setTimeout(() => tick(attempts), intervalMs);
   }
 
+  // Acompanha o job pelos eventos do servidor (SSE): o quadro de status e recarregado a
+  // cada mudanca e a conexao fecha quando o job termina. Sem job_id ou EventSource, polling.
+  function acompanharJob(kind, jobId, loader) {
+    if (!jobId || typeof EventSource === "undefined") {
+      startStatusPolling(loader);
+      return;
+    }
+    const fonte = new EventSource(`/api/jobs/${kind}/${jobId}/events`);
+    let carregando = false;
+    let pendente = false;
+    const recarregar = async () => {
+      if (carregando) {
+        pendente = true;
+        return;
+      }
+      carregando = true;
+      try {
+        await loader();
+      } finally {
+        carregando = false;
+        if (pendente) {
+          pendente = false;
+          recarregar();
+        }
+      }
+    };
+    fonte.addEventListener("status", recarregar);
+    fonte.addEventListener("fim", () => {
+      fonte.close();
+      recarregar();
+    });
+    fonte.onerror = () => {
+      // O EventSource reconecta sozinho; se a conexao foi recusada, volta ao polling.
+      if (fonte.readyState === EventSource.CLOSED) startStatusPolling(loader);
+    };
+  }
+
   function setDefaultAmazonTime(input) {
     if (!input) return;
     const now = new Date();
@@ -1017,11 +1073,8 @@
         }
         form.reset();
         if (inputData) inputData.value = "";
-        loadFipStatus(statusBox);
-        if (submitBtn) {
-          submitBtn.textContent = viewLabel;
-          submitBtn.dataset.mode = "view";
-        }
+        await loadFipStatus(statusBox);
+        acompanharJob("fip613", data.job_id, () => loadFipStatus(statusBox));
       } catch (err) {
         if (msg) {
           msg.textContent = err.message;
@@ -1093,7 +1146,7 @@
           if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
           if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
           await loadPedStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadPedStatus(statusBox, submitBtn, viewLabel));
+          acompanharJob("ped", data.job_id, () => loadPedStatus(statusBox, submitBtn, viewLabel));
         } catch (err) {
           if (msg) {
             msg.textContent = err.message;
@@ -1164,6 +1217,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadPedStatus(statusBox, submitBtn, viewLabel);
+        acompanharJob("ped", data.job_id, () => loadPedStatus(statusBox, submitBtn, viewLabel));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -1240,7 +1294,7 @@
           if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
           if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
           await loadEmpStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadEmpStatus(statusBox, submitBtn, viewLabel));
+          acompanharJob("emp", data.job_id, () => loadEmpStatus(statusBox, submitBtn, viewLabel));
         } catch (err) {
           if (msg) {
             msg.textContent = err.message;
@@ -1311,7 +1365,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadEmpStatus(statusBox, submitBtn, viewLabel);
-        startStatusPolling(() => loadEmpStatus(statusBox, submitBtn, viewLabel));
+        acompanharJob("emp", data.job_id, () => loadEmpStatus(statusBox, submitBtn, viewLabel));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -1404,6 +1458,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadEstEmpStatus(statusBox, submitBtn, viewLabel);
+        acompanharJob("est_emp", data.job_id, () => loadEstEmpStatus(statusBox, submitBtn, viewLabel));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -1480,7 +1535,7 @@
           if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
           if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
           await loadNobStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadNobStatus(statusBox, submitBtn, viewLabel));
+          acompanharJob("nob", data.job_id, () => loadNobStatus(statusBox, submitBtn, viewLabel));
         } catch (err) {
           if (msg) {
             msg.textContent = err.message;
@@ -1550,7 +1605,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadNobStatus(statusBox, submitBtn, viewLabel);
-        startStatusPolling(() => loadNobStatus(statusBox, submitBtn, viewLabel));
+        acompanharJob("nob", data.job_id, () => loadNobStatus(statusBox, submitBtn, viewLabel));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -1611,15 +1666,18 @@
           <div><strong>Data do download:</strong> ${dataArquivo}</div>
           <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
           <div><strong>Saída gerada:</strong> ${last.output_filename || "-"}</div>
+          ${renderJobStatus(last)}
         `;
         if (submitBtn && data.last && data.last.output_filename) {
           submitBtn.dataset.mode = "view";
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.output = data.last.output_filename;
         }
+        return last.status || null;
       } catch (err) {
         statusBox.textContent = "Falha ao carregar status.";
         console.error(err);
+        return null;
       }
     };
 
@@ -1668,6 +1726,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadStatus();
+        acompanharJob("plan20", data.job_id, loadStatus);
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -4004,7 +4063,6 @@
 
     let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
     let currentPage = 1;
-    let filteredRows = [];
 
     const numFmt = new Intl.NumberFormat("pt-BR", {
       minimumFractionDigits: 2,
@@ -4085,7 +4143,8 @@
     ];
 
     const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const allData = { rows: [] };
+    // Linhas ja buscadas no servidor (em ordem) e estado do keyset para a proxima pagina.
+    const allData = { rows: [], total: null, hasMore: true, afterId: null, afterVal: null, seq: 0 };
     const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
     const filterControls = {};
 
@@ -4115,7 +4174,7 @@
       }
     };
 
-    const buildFilter = (container, options, key) => {
+    const buildFilter = (container, options, key, loaded = false, truncated = false) => {
       container.innerHTML = "";
       const wrap = document.createElement("div");
       wrap.className = "mf-wrapper";
@@ -4169,16 +4228,23 @@
         row.className = "mf-option";
         const cb = document.createElement("input");
         cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
+        // Valor exato da coluna: o filtro e aplicado no servidor.
+        const norm = String(opt ?? "");
         cb.dataset.val = norm;
         labelMap[norm] = opt;
         row.appendChild(cb);
         const txt = document.createElement("span");
-        txt.textContent = opt;
+        txt.textContent = opt === "" ? "(Vazio)" : opt;
         row.appendChild(txt);
         list.appendChild(row);
         cbs.push({ cb, txt, row, val: norm });
       });
+      if (truncated) {
+        const note = document.createElement("div");
+        note.className = "mf-option muted";
+        note.textContent = `Mostrando os primeiros ${options.length} valores; use a busca ou outros filtros.`;
+        list.appendChild(note);
+      }
 
       const syncUIFromTemp = () => {
         allCb.checked = tempSelected.size === 0;
@@ -4266,9 +4332,27 @@
         closePanel();
       });
 
-      display.addEventListener("click", () => {
+      display.addEventListener("click", async () => {
         const isOpen = panel.classList.contains("open");
         closeAllPanels();
+        if (!isOpen && !loaded) {
+          // Opcoes buscadas so ao abrir o filtro, ja restritas pelos demais filtros.
+          label.textContent = "Carregando...";
+          try {
+            const params = queryParams();
+            params.set("campo", key);
+            const res = await fetch(`/api/relatorios/ped/opcoes?${params.toString()}`);
+            const data = await res.json();
+            if (!res.ok) throw new Error(data.error || "Falha ao carregar opções.");
+            const opts = (data.data || []).slice().sort((a, b) => a.localeCompare(b, "pt-BR"));
+            buildFilter(container, opts, key, true, Boolean(data.truncado));
+            filterControls[key]?.display.click();
+          } catch (err) {
+            updateDisplay(key);
+            console.error(err);
+          }
+          return;
+        }
         if (!isOpen) {
           panel.style.width = "";
           panel.style.height = "";
@@ -4293,6 +4377,7 @@
 
       filterControls[key] = {
         panel,
+        display,
         label,
         allCb,
         optionCbs: cbs.map((c) => c.cb),
@@ -4301,39 +4386,117 @@
       updateDisplay(key);
     };
 
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          uniques[idx].add((r[k] ?? "").toString());
-        });
+    // historico (TEXT) nao tem filtro no servidor.
+    const filterKeys = colKeys.filter((k) => k !== "historico");
+    // Colunas pedidas ao servidor (fields=); chave_display e montada a partir de chave/chave_planejamento.
+    const pedFields = ["chave", "chave_planejamento"].concat(colKeys.filter((k) => k !== "chave_display"));
+    // Ordenacao no servidor: colunas de texto (valores e historico ficam de fora).
+    const sortableKeys = new Set(
+      colKeys.filter((k) => !["chave_display", "historico", "valor_ped", "valor_estorno"].includes(k))
+    );
+    let sortKey = null;
+    let sortDesc = false;
+
+    const queryParams = () => {
+      const params = new URLSearchParams();
+      filterKeys.forEach((k) => {
+        (filters[k] || new Set()).forEach((v) => params.append(k, v));
       });
+      return params;
+    };
+
+    const setOptions = () => {
+      // Marca as opcoes como desatualizadas; cada filtro busca as suas ao ser aberto.
+      closeAllPanels();
       filterContainers.forEach((container) => {
         const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
+        if (!filterKeys.includes(key)) {
+          container.innerHTML = "";
+          return;
+        }
+        buildFilter(container, [], key);
       });
     };
 
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
+    const fetchPage = async (seq) => {
+      const params = queryParams();
+      const missing = currentPage * pageSize - allData.rows.length;
+      params.set("limit", String(Math.min(5000, Math.max(PED_PAGE_LIMIT, missing))));
+      params.set("fields", pedFields.join(","));
+      if (sortKey) params.set("sort", `${sortDesc ? "-" : ""}${sortKey}`);
+      if (allData.afterId !== null) {
+        params.set("after_id", String(allData.afterId));
+        if (allData.afterVal !== null) params.set("after_val", allData.afterVal);
+      }
+      const res = await fetch(`/api/relatorios/ped?${params.toString()}`);
+      const data = await res.json();
+      if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
+      if (seq !== allData.seq || !table.isConnected) return null;
+      allData.rows = allData.rows.concat((data.data || []).map(mapPedRow));
+      allData.hasMore = Boolean(data.has_more);
+      allData.afterId = data.has_more ? data.next_after_id : null;
+      allData.afterVal = data.has_more ? data.next_after_val : null;
+      return data;
+    };
+
+    // Busca paginas ate cobrir a pagina atual da tabela.
+    const ensureRows = async () => {
+      const seq = allData.seq;
+      let data = null;
+      while (allData.hasMore && allData.rows.length < currentPage * pageSize) {
+        data = (await fetchPage(seq)) || data;
+        if (seq !== allData.seq) return null;
+      }
+      return data;
+    };
+
+    const fetchTotals = async (seq) => {
+      const res = await fetch(`/api/relatorios/ped/resumo?${queryParams().toString()}`);
+      const data = await res.json();
+      if (!res.ok) throw new Error(data.error || "Falha ao carregar totais.");
+      if (seq !== allData.seq) return;
+      allData.total = data.total;
+      updateTotals(data);
+      render();
+    };
+
+    const goToPage = async (page) => {
+      currentPage = page;
+      try {
+        await ensureRows();
+      } catch (err) {
+        if (meta) meta.textContent = err.message;
+        console.error(err);
+      }
       render();
     };
 
+    // Recomeca a leitura no servidor com os filtros e a ordenacao atuais.
+    const reload = async () => {
+      allData.seq += 1;
+      const seq = allData.seq;
+      allData.rows = [];
+      allData.total = null;
+      allData.hasMore = true;
+      allData.afterId = null;
+      allData.afterVal = null;
+      currentPage = 1;
+      const totals = fetchTotals(seq).catch((err) => console.error(err));
+      const data = await ensureRows();
+      if (seq !== allData.seq) return null;
+      render();
+      await totals;
+      return data;
+    };
+
+    const renderFiltered = () => {
+      setOptions();
+      reload().catch((err) => {
+        if (meta) meta.textContent = err.message;
+        console.error(err);
+      });
+    };
+
     const renderPagination = (totalPages) => {
       if (!pager) return;
       pager.innerHTML = "";
@@ -4345,8 +4508,7 @@
         if (active) b.classList.add("active");
         b.addEventListener("click", () => {
           if (disabled || page === currentPage) return;
-          currentPage = page;
-          render();
+          goToPage(page);
         });
         pager.appendChild(b);
       };
@@ -4368,19 +4530,13 @@
       addBtn(">>", totalPages, currentPage === totalPages);
     };
 
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_ped || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
+    const updateTotals = (resumo) => {
+      // Totais calculados no servidor sobre todas as linhas filtradas (/api/relatorios/ped/resumo).
+      const exercicios = resumo.exercicios || [];
+      const totalVal = Number(resumo.valor_ped || 0);
       if (totExercicio) {
-        totExercicio.textContent = exSet.size
-          ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
+        totExercicio.textContent = exercicios.length
+          ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
           : "-";
       }
       if (totValorPed) {
@@ -4392,8 +4548,9 @@
     };
 
     const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
+      const rows = allData.rows;
+      const known = allData.total ?? rows.length + (allData.hasMore ? pageSize : 0);
+      const totalPages = Math.max(1, Math.ceil(known / pageSize));
       if (currentPage > totalPages) currentPage = totalPages;
       const startIdx = (currentPage - 1) * pageSize;
       const pageRows = rows.slice(startIdx, startIdx + pageSize);
@@ -4471,24 +4628,24 @@
         tbody.appendChild(tr);
       });
       renderPagination(totalPages);
-      updateTotals(rows);
+    };
+
+    const PED_PAGE_LIMIT = 200;
+    const mapPedRow = (r) => {
+      const ex = Number(r.exercicio || 0);
+      const chaveDisplay =
+        (ex >= 2026 ? r.chave : r.chave_planejamento) || r.chave_planejamento || r.chave || "";
+      return { ...r, chave_display: chaveDisplay };
     };
 
     const load = async () => {
       if (meta) meta.textContent = "Carregando...";
       try {
-        const res = await fetch("/api/relatorios/ped");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = (data.data || []).map((r) => {
-          const ex = Number(r.exercicio || 0);
-          const chaveDisplay =
-            (ex >= 2026 ? r.chave : r.chave_planejamento) || r.chave_planejamento || r.chave || "";
-          return { ...r, chave_display: chaveDisplay };
-        });
-        filteredRows = allData.rows;
-        setOptions(allData.rows);
-        render();
+        // So a primeira pagina e buscada agora (keyset no servidor); as seguintes vem
+        // quando o usuario navega, com os filtros e a ordenacao aplicados no servidor.
+        setOptions();
+        const data = await reload();
+        if (!data) return;
         if (meta) {
           const dt = data.data_arquivo ? new Date(data.data_arquivo).toLocaleString("pt-BR") : "-";
           const user = data.user_email || "-";
@@ -4513,10 +4670,26 @@
     if (pageSizeSelect) {
       pageSizeSelect.addEventListener("change", () => {
         pageSize = parseInt(pageSizeSelect.value || "20", 10) || 20;
-        render();
+        goToPage(1);
       });
     }
 
+    table.querySelectorAll("thead tr:first-child th").forEach((th, idx) => {
+      const key = colKeys[idx];
+      if (!sortableKeys.has(key)) return;
+      th.style.cursor = "pointer";
+      th.dataset.label = th.textContent;
+      th.addEventListener("click", () => {
+        sortDesc = sortKey === key ? !sortDesc : false;
+        sortKey = key;
+        table.querySelectorAll("thead tr:first-child th[data-label]").forEach((cell) => {
+          cell.textContent = cell.dataset.label;
+        });
+        th.textContent = `${th.dataset.label} ${sortDesc ? "▼" : "▲"}`;
+        renderFiltered();
+      });
+    });
+
     if (btnDownload) {
       btnDownload.addEventListener("click", () => {
         window.open("/api/relatorios/ped/download", "_blank");
@@ -4527,10 +4700,7 @@
       btnReset.addEventListener("click", () => {
         closeAllPanels();
         Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
+        renderFiltered();
       });
     }
 